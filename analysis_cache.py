@@ -0,0 +1,162 @@
+"""分析結果のキャッシュ。古くなりかけた結果はすぐ返し、裏で取り直す。
+
+背景:
+  /api/stock/analyze は毎回、複数の取得元から分析をやり直していた。
+  ところが開かれる銘柄のほとんどは「数週間決算書が変わっていない銘柄の見直し」で、
+  変わっているのは株価まわりだけ。決算書の取得に1銘柄10回前後の上流アクセスを
+  払って、同じ数字を作り直していた。
+
+方針:
+  - キーは分析の条件（銘柄・期間・スキップ指定）。SingleFlight と同じキーを使う
+  - データの種類ごとに寿命を分ける
+      株価まわり: PRICE_TTL_SECONDS は新しいものとしてそのまま返す。
+                  PRICE_STALE_LIMIT_SECONDS までは古い結果を返しつつ裏で取り直す
+      決算書:     次の決算発表まで有効。earnings_queue に発表が積まれたら
+                  invalidate で捨てる（発表前の数字を返さない）
+  - 捨てた・期限切れの結果は返さない（呼び出し側がその場で分析する）
+  - 裏の取り直しはキーごとに1本まで。実行は呼び出し側から渡す関数に任せる
+    （app.py では SingleFlight 経由なので、画面からの分析とも重ならない）
+  - 件数の上限を持ち、古く使われていないものから捨てる
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+# 株価まわりを新しいとみなす秒数
+PRICE_TTL_SECONDS = 15 * 60
+
+# この秒数までは古い株価の結果を返し、裏で取り直す。超えたらその場で分析する
+PRICE_STALE_LIMIT_SECONDS = 24 * 60 * 60
+
+# 決算発表を取りこぼしたときの保険。これより古い決算書は使わない
+STATEMENT_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+# 保持する件数の上限
+MAX_ENTRIES = 512
+
+FRESH = 'fresh'
+STALE = 'stale'
+MISS = 'miss'
+
+
+def _code(symbol):
+    """'7203.T' と '7203' を同じ銘柄として扱う（DB の company_code 形式）"""
+    return (symbol or '').replace('.T', '').strip()
+
+
+class _Entry:
+    def __init__(self, value, stored_at):
+        self.value = value
+        self.stored_at = stored_at
+
+
+class AnalysisCache:
+    """分析結果のキャッシュ。スレッドから同時に使ってよい。"""
+
+    def __init__(self, price_ttl=PRICE_TTL_SECONDS, stale_limit=PRICE_STALE_LIMIT_SECONDS,
+                 statement_max_age=STATEMENT_MAX_AGE_SECONDS, max_entries=MAX_ENTRIES,
+                 clock=time.monotonic):
+        self.price_ttl = price_ttl
+        self.stale_limit = min(stale_limit, statement_max_age)
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._invalidated_at = {}
+        self.counts = {FRESH: 0, STALE: 0, MISS: 0, 'invalidated': 0, 'refreshes': 0}
+
+    def get(self, key):
+        """(結果の複製, 状態, 経過秒) を返す。状態は fresh / stale / miss。
+
+        miss のときの結果は None。key の先頭は銘柄コードであること。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            age = None if entry is None else self._clock() - entry.stored_at
+            if entry is None or age > self.stale_limit:
+                if entry is not None:
+                    del self._entries[key]
+                self.counts[MISS] += 1
+                return None, MISS, None
+            self._entries.move_to_end(key)
+            state = FRESH if age <= self.price_ttl else STALE
+            self.counts[state] += 1
+            value = entry.value
+        return copy.deepcopy(value), state, age
+
+    def now(self):
+        """put(started_at=...) に渡す、分析を始めた時刻"""
+        return self._clock()
+
+    def put(self, key, value, started_at=None):
+        """成功した分析結果を保存する。エラーの結果は保存しない。
+
+        started_at を渡すと、分析中に invalidate された銘柄の結果は保存しない
+        （決算発表の前に取り始めた数字を、発表後の結果として残さないため）。
+        """
+        if not value or value.get('error'):
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            invalidated_at = self._invalidated_at.get(_code(key[0]))
+            if (started_at is not None and invalidated_at is not None
+                    and invalidated_at >= started_at):
+                return
+            self._entries[key] = _Entry(value, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, symbol):
+        """銘柄の結果を条件を問わず全部捨てる（決算発表を検知したとき）。捨てた件数を返す"""
+        code = _code(symbol)
+        with self._lock:
+            self._invalidated_at[code] = self._clock()
+            keys = [k for k in self._entries if _code(k[0]) == code]
+            for k in keys:
+                del self._entries[k]
+            self.counts['invalidated'] += len(keys)
+        return len(keys)
+
+    def refresh_in_background(self, key, refresh):
+        """key の取り直しを裏で1本だけ走らせる。既に走っていれば何もしない。
+
+        refresh は引数なしの関数。結果の保存は refresh の中で put して行う。
+        Returns:
+            新しく走らせたら True
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self.counts['refreshes'] += 1
+
+        def _run():
+            try:
+                refresh()
+            except Exception as e:
+                print(f"分析キャッシュの更新エラー ({key[0]}): {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_run, daemon=True, name='analysis-cache-refresh').start()
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self):
+        """監視用。保持件数・取り直し中の件数・状態ごとの累計"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'refreshing': len(self._refreshing),
+                'counts': dict(self.counts),
+                'price_ttl_seconds': self.price_ttl,
+                'stale_limit_seconds': self.stale_limit,
+            }
@@ -122,3 +122,65 @@ def parse_data_source(value):
         except (TypeError, ValueError):
             return {'primary': value, 'sources': {}}
     return {'primary': None, 'sources': {}}
+
+
+def get_latest_value(val):
+    """配列データから最新値を抽出"""
+    if val is None:
+        return None
+    if isinstance(val, list) and len(val) > 0:
+        sorted_list = sorted(val, key=lambda x: x.get('date', ''), reverse=True)
+        return sorted_list[0].get('value')
+    if isinstance(val, (int, float)):
+        return val
+    return None
+
+
+def get_latest_completed_value(val):
+    """配列データから「まだ終わっていない年度」を除いた最新値を抽出。
+
+    配当(dps)・配当性向は決算年度ごとに合計している。進行中の年度は
+    中間配当までしか入っていないため、そのまま最新値として拾うと
+    年間配当が半分に見える（8月決算の367Aで、確定した2025年度105円では
+    なく、中間だけの2026年度60円が「1株配当」として出ていた）。
+
+    決算年度の行には期末の日付が入っているので、それが未来なら
+    その年度はまだ終わっていない。日付だけで判定でき、銘柄ごとの
+    例外を持たなくてよい。
+
+    売上や利益は実績しか入らない（＝日付が未来にならない）ので、
+    この関数を通すのは配当まわりだけでよい。
+    """
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
+        return val
+    if not isinstance(val, list) or not val:
+        return None
+
+    from datetime import datetime as _dt
+    today = _dt.now().strftime('%Y-%m-%d')
+    completed = [x for x in val if str(x.get('date', '')) <= today]
+    # 全部が未来＝確定した年度がまだ1つも無い。半端な値を出すより
+    # 「無い」を返す（画面は欠損として扱い、理由を出す）。
+    if not completed:
+        return None
+    return sorted(completed, key=lambda x: x.get('date', ''), reverse=True)[0].get('value')
+
+
+def get_yearly_values(data_list, count=4):
+    """配列データから直近N年分の値を取得"""
+    if not data_list or not isinstance(data_list, list):
+        return [None] * count
+    sorted_list = sorted(data_list, key=lambda x: x.get('date', ''), reverse=True)
+    values = [item.get('value') for item in sorted_list[:count]]
+    while len(values) < count:
+        values.append(None)
+    return values
+
+
+def to_oku(val):
+    """億円単位に変換"""
+    if val is None:
+        return None
+    return val / 1e8
@@ -0,0 +1,206 @@
+"""StockAnalyzer.analyze の取得ステージを依存関係つきで並行実行する。
+
+背景:
+  analyze は基本指標・財務・5年推移・業種・日本語ラベル・業績予想・信用残・
+  EDINET補完を1つずつ順番に呼んでいた。実際の待ち時間はほぼ全部ネットワークで、
+  Yahoo日本版HTML・JPX信用残PDF・yfinanceの決算書はお互いに依存しない。
+  gunicorn 1ワーカー(gthread)の本番では、キャッシュの無い /api/stock/analyze が
+  ANALYZE_TIMEOUT(60秒)に近づくことがあった。
+
+方針:
+  - ステージごとに「どのステージの結果を読むか(after)」を宣言し、
+    依存が終わったものから小さなスレッドプールで並行に走らせる
+  - 各ステージは result のコピーに書き込み、終わった時点で変わったキーだけを
+    本体へ戻す。source_status はキー単位で戻すので、並行ステージ同士で潰し合わない
+  - ステージごとに締め切りを持つ。超えたステージは待たずに「timeout」と記録し、
+    後から返ってきても結果は捨てる（途中まで書かれた値が混ざらないようにする）
+  - 失敗・時間切れのステージがあっても後続は動かす。従来の逐次実行でも
+    各ヘルパーは自分の例外を握りつぶして次へ進んでいたので、挙動を揃える
+
+  実行結果は result['source_status']['analysis_stages'] に残す。
+"""
+
+import copy
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# 同時に走らせるステージ数。上流ごとの負荷は各ヘルパー側のガードに任せ、
+# ここでは「1銘柄の分析が同時に何本の通信を持つか」だけを抑える。
+MAX_STAGE_WORKERS = 4
+
+# 締め切りを指定しないステージの既定値（秒）。
+DEFAULT_STAGE_DEADLINE = 20.0
+
+
+class Stage:
+    """分析の1工程。
+
+    func は result（作業用コピー）を1つ受け取り、そこへ書き込む。
+    after は先に終わっている必要があるステージ名。
+    status_key を指定すると、時間切れ・失敗時に source_status[status_key] へも
+    記録する（ヘルパー自身が状態を書けずに終わったときの穴埋め）。
+    """
+
+    def __init__(self, name, func, after=(), deadline=DEFAULT_STAGE_DEADLINE,
+                 status_key=None, source=None):
+        self.name = name
+        self.func = func
+        self.after = tuple(after)
+        self.deadline = deadline
+        self.status_key = status_key
+        self.source = source or name
+
+
+def _run_on_copy(stage, snapshot):
+    """作業用コピーに対してステージを実行し、コピーを返す。"""
+    working = copy.deepcopy(snapshot)
+    working.setdefault('source_status', {})
+    stage.func(working)
+    return working
+
+
+def _same(a, b):
+    """比較できない値（DataFrame等）は「変わった」扱いにして戻し忘れを防ぐ。"""
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
+
+def _merge_changes(result, before, after):
+    """ステージ実行前後の差分だけを result に戻す。"""
+    for key, value in after.items():
+        if key == 'source_status':
+            continue
+        if key not in before or not _same(before[key], value):
+            result[key] = value
+    for key in before:
+        if key != 'source_status' and key not in after:
+            result.pop(key, None)
+
+    old_status = before.get('source_status') or {}
+    status = result.setdefault('source_status', {})
+    for key, value in (after.get('source_status') or {}).items():
+        if not _same(old_status.get(key), value):
+            status[key] = value
+
+
+def _record_failure(result, stage, status, error=None):
+    """ヘルパーが状態を残せなかったステージを source_status に補う。"""
+    if not stage.status_key:
+        return
+    entry = {'status': status, 'source': stage.source}
+    if status == 'timeout':
+        entry['reason'] = f'{stage.deadline:g}秒以内に応答がありませんでした'
+    if error is not None:
+        entry['error'] = str(error)
+    result.setdefault('source_status', {}).setdefault(stage.status_key, entry)
+
+
+def run_stages(stages, result, max_workers=MAX_STAGE_WORKERS, clock=time.monotonic):
+    """依存関係に従ってステージを並行実行し、result に結果をまとめる。
+
+    Returns:
+        {'status', 'elapsed', 'stages': {name: {...}}, 'timed_out', 'failed'}
+        同じ内容を result['source_status']['analysis_stages'] にも書く。
+    """
+    pending = {stage.name: stage for stage in stages}
+    names = set(pending)
+    for stage in stages:
+        unknown = [dep for dep in stage.after if dep not in names]
+        if unknown:
+            raise ValueError(f'ステージ{stage.name}の依存先が見つかりません: {unknown}')
+
+    finished = set()
+    report = {}
+    running = {}   # future -> (stage, before, started_at)
+    orphans = set()  # 見切った後もまだスレッドを占有しているもの
+    started = clock()
+
+    executor = ThreadPoolExecutor(max_workers=max_workers,
+                                  thread_name_prefix='analysis-stage')
+    try:
+        while pending or running:
+            orphans = {future for future in orphans if not future.done()}
+
+            # 依存が揃ったものを空きワーカーの数だけ投入する。
+            # 見切ったステージもスレッドが返るまでは枠を使っている扱いにして、
+            # 投入直後からプール待ちで締め切りを食う状態を作らない。
+            for name in list(pending):
+                if len(running) + len(orphans) >= max_workers:
+                    break
+                stage = pending[name]
+                if not all(dep in finished for dep in stage.after):
+                    continue
+                del pending[name]
+                before = copy.deepcopy(result)
+                future = executor.submit(_run_on_copy, stage, before)
+                running[future] = (stage, before, clock())
+
+            if not running:
+                reason = '依存ステージが循環しています'
+                if orphans:
+                    # 枠が全部、時間切れのステージに取られている。1つ空くまで待つ
+                    longest = max(stage.deadline for stage in pending.values())
+                    done, _ = wait(list(orphans), timeout=longest,
+                                   return_when=FIRST_COMPLETED)
+                    if done:
+                        continue
+                    reason = '時間切れのステージがワーカーを占有したままです'
+                for name in pending:
+                    report[name] = {'status': 'skipped', 'reason': reason}
+                    finished.add(name)
+                pending.clear()
+                break
+
+            now = clock()
+            wait_for = min(stage.deadline - (now - began)
+                           for stage, _, began in running.values())
+            done, _ = wait(list(running) + list(orphans), timeout=max(wait_for, 0),
+                           return_when=FIRST_COMPLETED)
+
+            now = clock()
+            for future in done:
+                if future not in running:
+                    continue
+                stage, before, began = running.pop(future)
+                seconds = round(now - began, 3)
+                try:
+                    working = future.result()
+                except Exception as e:
+                    print(f"分析ステージ失敗: {stage.name}: {e}")
+                    report[stage.name] = {'status': 'error', 'seconds': seconds,
+                                          'error': str(e)}
+                    _record_failure(result, stage, 'error', e)
+                else:
+                    _merge_changes(result, before, working)
+                    report[stage.name] = {'status': 'success', 'seconds': seconds}
+                finished.add(stage.name)
+
+            for future, (stage, _, began) in list(running.items()):
+                if now - began < stage.deadline:
+                    continue
+                # 返ってくるのを待たずに見切る。戻り値は誰にも読まれないので、
+                # 後から書き終わっても result には混ざらない。
+                del running[future]
+                orphans.add(future)
+                print(f"分析ステージ時間切れ: {stage.name} ({stage.deadline:g}秒)")
+                report[stage.name] = {'status': 'timeout',
+                                      'seconds': round(now - began, 3)}
+                _record_failure(result, stage, 'timeout')
+                finished.add(stage.name)
+    finally:
+        executor.shutdown(wait=False)
+
+    timed_out = [name for name, item in report.items() if item['status'] == 'timeout']
+    failed = [name for name, item in report.items() if item['status'] == 'error']
+    summary = {
+        'status': 'partial' if (timed_out or failed) else 'success',
+        'source': '分析ステージ並行実行',
+        'elapsed': round(clock() - started, 3),
+        'stages': report,
+        'timed_out': timed_out,
+        'failed': failed,
+    }
+    result.setdefault('source_status', {})['analysis_stages'] = summary
+    return summary
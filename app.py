@@ -1,7 +1,6 @@
 import os
 import json
-import base64
-from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+import re
 import uuid
 from functools import wraps
 from flask import jsonify, request, session, redirect
@@ -14,10 +13,25 @@ from models.financial_analysis import *
 from models.user import *
 from models.chatbot import *
 from models.business_plan_preparation import *
-from stock_analyzer import StockAnalyzer, batch_analyze
+from lazy_imports import lazy_attr
+import upstream_limiter
+from batch_runner import run_batch
+from single_flight import SingleFlight
+from deadline_executor import (
+    DeadlineExceeded, DeadlineRejected, default_executor as default_deadline_executor,
+)
+from analysis_cache import AnalysisCache, MISS, STALE
+from result_sinks import NullSink, default_sink
+from chart_renderer import renderer as chart_renderer
+
+# 分析まわり（pandas / numpy / yfinance）は最初の分析で読み込む。
+# 起動時に読むと、画面を返せるまでの時間がその分延びる（benchmarks/bench_import_time.py）
+StockAnalyzer = lazy_attr('stock_analyzer', 'StockAnalyzer')
+batch_analyze = lazy_attr('stock_analyzer', 'batch_analyze')
 from analysis_quality import (
     analysis_data_status, derive_fiscal_month, history_json_or_none,
     normalize_analysis_symbol,
+    get_latest_value, get_latest_completed_value, get_yearly_values, to_oku,
 )
 from supabase_client import (
     get_supabase_client,
@@ -621,68 +635,6 @@ def normalize_code(code):
     return code
 
 
-def get_latest_value(val):
-    """配列データから最新値を抽出"""
-    if val is None:
-        return None
-    if isinstance(val, list) and len(val) > 0:
-        sorted_list = sorted(val, key=lambda x: x.get('date', ''), reverse=True)
-        return sorted_list[0].get('value')
-    if isinstance(val, (int, float)):
-        return val
-    return None
-
-
-def get_latest_completed_value(val):
-    """配列データから「まだ終わっていない年度」を除いた最新値を抽出。
-
-    配当(dps)・配当性向は決算年度ごとに合計している。進行中の年度は
-    中間配当までしか入っていないため、そのまま最新値として拾うと
-    年間配当が半分に見える（8月決算の367Aで、確定した2025年度105円では
-    なく、中間だけの2026年度60円が「1株配当」として出ていた）。
-
-    決算年度の行には期末の日付が入っているので、それが未来なら
-    その年度はまだ終わっていない。日付だけで判定でき、銘柄ごとの
-    例外を持たなくてよい。
-
-    売上や利益は実績しか入らない（＝日付が未来にならない）ので、
-    この関数を通すのは配当まわりだけでよい。
-    """
-    if val is None:
-        return None
-    if isinstance(val, (int, float)):
-        return val
-    if not isinstance(val, list) or not val:
-        return None
-
-    from datetime import datetime as _dt
-    today = _dt.now().strftime('%Y-%m-%d')
-    completed = [x for x in val if str(x.get('date', '')) <= today]
-    # 全部が未来＝確定した年度がまだ1つも無い。半端な値を出すより
-    # 「無い」を返す（画面は欠損として扱い、理由を出す）。
-    if not completed:
-        return None
-    return sorted(completed, key=lambda x: x.get('date', ''), reverse=True)[0].get('value')
-
-
-def get_yearly_values(data_list, count=4):
-    """配列データから直近N年分の値を取得"""
-    if not data_list or not isinstance(data_list, list):
-        return [None] * count
-    sorted_list = sorted(data_list, key=lambda x: x.get('date', ''), reverse=True)
-    values = [item.get('value') for item in sorted_list[:count]]
-    while len(values) < count:
-        values.append(None)
-    return values
-
-
-def to_oku(val):
-    """億円単位に変換"""
-    if val is None:
-        return None
-    return val / 1e8
-
-
 def analysis_data_source_name(stock_data):
     """実際に値を補完した取得元をDBの短い識別子にも残す。"""
     edinet = (stock_data.get('source_status') or {}).get('edinet_db') or {}
@@ -997,6 +949,33 @@ def api_update_watchlist():
 # タイムアウト設定（秒）
 ANALYZE_TIMEOUT = 60
 
+# 同じ銘柄・同じ条件の分析が同時に来たら1本にまとめる（決算直後の人気銘柄対策）
+analyze_flights = SingleFlight('analyze')
+
+# 分析結果のキャッシュ。株価は短く、決算書は決算発表（_enqueue_announced）まで持つ
+analysis_cache = AnalysisCache()
+
+
+def _analysis_key(symbol, period):
+    """(銘柄, 期間, skip_chart, skip_extras, safe_sources_only)"""
+    return (symbol, period, False, False, False)
+
+
+def _run_analysis_flight(symbol, period):
+    """画面からの分析1本分。保存とキャッシュへの格納までを1本の中で1回だけ行う"""
+    started_at = analysis_cache.now()
+    analyzer = StockAnalyzer()
+    analyzed = analyzer.analyze(symbol, period=period)
+    if not analyzed.get("error"):
+        # 分析結果をscreened_latestに自動保存（サーバー側）
+        try:
+            _save_analysis_to_screened(symbol, analyzed)
+        except Exception as save_err:
+            print(f"分析結果の自動保存エラー: {save_err}")
+        analysis_cache.put(_analysis_key(symbol, period), analyzed, started_at=started_at)
+    return analyzed
+
+
 @app.route('/api/stock/analyze', methods=['POST'])
 def analyze_stock():
     """
@@ -1016,41 +995,53 @@ def analyze_stock():
         if not symbol or len(symbol) < 1:
             return jsonify({"error": "無効な銘柄コードです"}), 400
 
-        # タイムアウト付きで分析実行
-        def run_analysis():
-            analyzer = StockAnalyzer()
-            return analyzer.analyze(symbol, period=period)
+        # キャッシュがあればすぐ返す。株価が古くなりかけていれば裏で取り直す
+        flight_key = _analysis_key(symbol, period)
 
-        try:
-            with ThreadPoolExecutor(max_workers=1) as executor:
-                future = executor.submit(run_analysis)
-                result = future.result(timeout=ANALYZE_TIMEOUT)
-        except FuturesTimeoutError:
-            print(f"タイムアウト: {symbol}の分析が{ANALYZE_TIMEOUT}秒を超えました")
-            return jsonify({
-                "error": f"データ取得がタイムアウトしました（{ANALYZE_TIMEOUT}秒）。時間をおいて再度お試しください。",
-                "symbol": symbol,
-                "timeout": True
-            }), 504
+        def run_analysis():
+            return _run_analysis_flight(symbol, period)
+
+        result, cache_state, cache_age = analysis_cache.get(flight_key)
+        if cache_state == STALE:
+            analysis_cache.refresh_in_background(
+                flight_key, lambda: analyze_flights.do(flight_key, run_analysis))
+
+        # キャッシュが無ければタイムアウト付きで分析実行。
+        # 同じキーの分析が実行中なら、新しく始めずにその結果を待って受け取る。
+        # screened_latest への保存も1本の中で1回だけ行う
+        if cache_state == MISS:
+            # スレッドはプロセス共通の置き場から借りる。時間切れの分析が
+            # 溜まっているときは、さらに積まずにすぐ断る
+            try:
+                result, shared = default_deadline_executor().run(
+                    lambda: analyze_flights.do(flight_key, run_analysis, ANALYZE_TIMEOUT),
+                    ANALYZE_TIMEOUT, upstream='analyze', name=symbol)
+                if shared:
+                    print(f"分析を相乗り: {symbol}（実行中の分析の結果を共有）")
+            except DeadlineExceeded:
+                print(f"タイムアウト: {symbol}の分析が{ANALYZE_TIMEOUT}秒を超えました")
+                return jsonify({
+                    "error": f"データ取得がタイムアウトしました（{ANALYZE_TIMEOUT}秒）。時間をおいて再度お試しください。",
+                    "symbol": symbol,
+                    "timeout": True
+                }), 504
+            except DeadlineRejected as e:
+                print(f"分析を受け付けませんでした: {symbol}: {e}")
+                return jsonify({
+                    "error": "データ取得が混み合っています。時間をおいて再度お試しください。",
+                    "symbol": symbol,
+                    "timeout": True
+                }), 503
 
         # エラーチェック
         if result.get("error"):
             return jsonify({"error": result["error"]}), 500
 
-        # チャート画像をBase64エンコード（存在する場合）
-        if result.get("chart_png") and os.path.exists(result["chart_png"]):
-            try:
-                with open(result["chart_png"], "rb") as img_file:
-                    chart_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                    result["chart_base64"] = f"data:image/png;base64,{chart_base64}"
-            except:
-                pass
-
-        # 分析結果をscreened_latestに自動保存（サーバー側）
-        try:
-            _save_analysis_to_screened(symbol, result)
-        except Exception as save_err:
-            print(f"分析結果の自動保存エラー: {save_err}")
+        result.setdefault('source_status', {})['analysis_cache'] = {
+            'status': cache_state,
+            'source': '分析キャッシュ',
+            'age_seconds': round(cache_age) if cache_age is not None else None,
+        }
 
         # GC/DC日付を付与（screened_latest永続日付を優先、signal_stocksで補完）
         try:
@@ -1088,6 +1079,15 @@ def analyze_stock():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/admin/stock/analyze/in-flight', methods=['GET'])
+@role_required('admin')
+def admin_analyze_in_flight():
+    """実行中の分析（相乗り待ちを含む）と、相乗りで省けた回数・時間切れの置き去りを返す"""
+    return jsonify({**analyze_flights.snapshot(), 'cache': analysis_cache.snapshot(),
+                    'chart': chart_renderer.snapshot(),
+                    'deadline': default_deadline_executor().snapshot()}), 200
+
+
 @app.route('/api/admin/stock/safe-refresh', methods=['POST'])
 def admin_safe_refresh_stock():
     """有料枠・日本版Yahoo HTML・外部HTMLスクレイピングを使わず1銘柄を更新する。"""
@@ -1145,16 +1145,6 @@ def analyze_stocks_batch():
         # バッチ分析実行
         results = batch_analyze(symbols)
         
-        # チャート画像をBase64エンコード
-        for result in results:
-            if result.get("chart_png") and os.path.exists(result["chart_png"]):
-                try:
-                    with open(result["chart_png"], "rb") as img_file:
-                        chart_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                        result["chart_base64"] = f"data:image/png;base64,{chart_base64}"
-                except:
-                    pass
-                    
         return jsonify({"results": results}), 200
         
     except Exception as e:
@@ -1167,36 +1157,35 @@ def get_cached_analysis(symbol):
     """
     キャッシュされた分析結果を取得（会員限定）。
 
-    output/snapshot_*.json を返す旧分析フローのファイルキャッシュ。全項目を
+    分析結果の書き出し先（result_sinks, RESULT_SINK で選択）から返す。全項目を
     含むため、公開ページからは使っていないが素通しにすると会員限定データの
     抜け道になる。ログイン必須にする。
     """
     try:
-        # ファイル名のサニタイズ
-        safe_symbol = symbol.replace('.', '_')
-        json_file = f"output/snapshot_{safe_symbol}.json"
-        
-        if not os.path.exists(json_file):
+        result = default_sink().read(symbol)
+        if result is None:
             return jsonify({"error": "データが見つかりません"}), 404
-            
-        with open(json_file, 'r', encoding='utf-8') as f:
-            result = json.load(f)
-            
-        # チャート画像をBase64エンコード（存在する場合）
-        if result.get("chart_png") and os.path.exists(result["chart_png"]):
-            try:
-                with open(result["chart_png"], "rb") as img_file:
-                    chart_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-                    result["chart_base64"] = f"data:image/png;base64,{chart_base64}"
-            except:
-                pass
-                
+
         return jsonify(result), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/stock/chart/<key>.png', methods=['GET'])
+def get_stock_chart(key):
+    """分析が返した chart_url の PNG。初めて読まれたときに描き、以後は保持分を返す"""
+    if not re.fullmatch(r'[0-9a-f]{24}', key or ''):
+        return jsonify({"error": "無効なチャートキーです"}), 400
+    data = chart_renderer.png(key)
+    if data is None:
+        return jsonify({"error": "チャートが見つかりません。分析し直してください"}), 404
+    response = app.response_class(data, mimetype='image/png')
+    # キーは入力の内容から決まるので、同じURLの中身は変わらない
+    response.headers['Cache-Control'] = 'public, max-age=86400, immutable'
+    return response
+
+
 # GC銘柄API
 @app.route('/api/gc-stocks', methods=['GET'])
 @member_required_api
@@ -1301,6 +1290,17 @@ def _convert_timestamps(obj):
     return obj
 
 
+def _screen_trend_label(stock_data):
+    """screened_latest.trend_label に入れるラベル。
+
+    列の意味は「直近1年の日足の回帰トレンド」（夜間の trend_stats.calculate_for_all と
+    同じ）なので、分析が1年の日足でトレンドを出したときだけ返す。画面から別の期間で
+    分析した結果は None（保存時に外れ、夜間に付けたラベルを上書きしない）。
+    """
+    trend = stock_data.get('trend') or {}
+    return trend.get('label') if trend.get('period') == '1y' else None
+
+
 def _save_analysis_to_screened(symbol, stock_data):
     """フル分析結果をscreened_latestに保存（サーバー側で確実に保存）"""
     company_code = normalize_code(symbol)
@@ -1413,13 +1413,15 @@ def _save_analysis_to_screened(symbol, stock_data):
         'analyzed_at': now,
         'data_source': analysis_data_source_name(stock_data),
         'source_status': stock_data.get('source_status'),
-        'data_status': analysis_data_status(financial_history, cf_history)
+        'data_status': analysis_data_status(financial_history, cf_history),
+        # 回帰直線の傾きによるラベル（migration_trend_label.sql）
+        'trend_label': _screen_trend_label(stock_data),
     }
 
     # Noneのフィールドを除外（既存データを保護）
     screened_data = {k: v for k, v in screened_data_full.items() if v is not None or k == 'company_code'}
 
-    upsert_screened_data_with_match_rate(screened_data)
+    _save_screened_tolerating_new_columns(screened_data)
     print(f"分析結果をscreened_latestに保存しました: {company_code} ({len(screened_data)}フィールド)")
 
     # signal_stocksにも反映（テクニカル分析タブ用）
@@ -1556,7 +1558,9 @@ def _analyze_stock_and_save(analyzer, company_code):
         'fiscal_month': derive_fiscal_month(financial_history, cf_history),
         'data_source': analysis_data_source_name(stock_data),
         'source_status': stock_data.get('source_status'),
-        'data_status': analysis_data_status(financial_history, cf_history)
+        'data_status': analysis_data_status(financial_history, cf_history),
+        # 回帰直線の傾きによるラベル（migration_trend_label.sql）
+        'trend_label': _screen_trend_label(stock_data),
     }
 
     # デバッグログ: 配当性向データの確認
@@ -1573,7 +1577,8 @@ def _analyze_stock_and_save(analyzer, company_code):
 
 # migrationを適用する前でも分析・保存が止まらないようにするための、
 # 「まだ無い列」の一覧。列が来たら自動でまた書き始める。
-_MIGRATION_PENDING_COLUMNS = {'fiscal_month', 'dps_forecast', 'dividend_yield_forward'}
+_MIGRATION_PENDING_COLUMNS = {'fiscal_month', 'dps_forecast', 'dividend_yield_forward',
+                              'trend_label'}
 
 # 株主・役員のオンデマンド取得に許す最大秒数。
 # チャート（price_history.FETCH_TIMEOUT_SECONDS）より長めにしてよい。
@@ -1603,71 +1608,50 @@ def _save_screened_tolerating_new_columns(screened_data):
         print(f'[migration未適用] {", ".join(sorted(dropped))} 列が無いため'
               f'除外して保存します。supabase/ の該当migrationを適用してください'
               f'（fiscal_month → migration_fiscal_month.sql ／'
-              f' dps_forecast・dividend_yield_forward → migration_forward_dividend.sql）。')
+              f' dps_forecast・dividend_yield_forward → migration_forward_dividend.sql ／'
+              f' trend_label → migration_trend_label.sql）。')
 
     upsert_screened_data_with_match_rate(
         {k: v for k, v in payload.items() if k not in _missing_columns})
 
 
 def _analyze_gc_background(codes):
-    """GC銘柄をバックグラウンドで1銘柄ずつ分析"""
+    """GC銘柄をバックグラウンドで並列分析（送信の速さは upstream_limiter が決める）"""
     global gc_analyze_status
-    analyzer = StockAnalyzer()
+    status = gc_analyze_status
+    analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
 
-    for i, code in enumerate(codes):
-        if gc_analyze_status["stop_requested"]:
-            break
-
-        try:
-            result = _analyze_stock_and_save(analyzer, code)
-            if result:
-                client = get_supabase_client()
-                client.table('signal_stocks').update({
-                    'sector': result.get('sector'),
-                    'market_cap': result.get('market_cap'),
-                    'dividend_yield': result['raw'].get('dividend_yield'),
-                    'match_rate': result.get('match_rate'),
-                    'analyzed_at': result.get('analyzed_at'),
-                }).eq('company_code', code).execute()
-            else:
-                gc_analyze_status["errors"] += 1
-        except Exception as e:
-            print(f"GC分析エラー ({code}): {e}")
-            gc_analyze_status["errors"] += 1
+    def _process(code):
+        result = _analyze_stock_and_save(analyzer, code)
+        if result:
+            client = get_supabase_client()
+            client.table('signal_stocks').update({
+                'sector': result.get('sector'),
+                'market_cap': result.get('market_cap'),
+                'dividend_yield': result['raw'].get('dividend_yield'),
+                'match_rate': result.get('match_rate'),
+                'analyzed_at': result.get('analyzed_at'),
+            }).eq('company_code', code).execute()
+        return result
 
-        gc_analyze_status["done"] += 1
-        if i < len(codes) - 1:
-            import time
-            time.sleep(0.35)
+    run_batch(codes, _process, status=status,
+              should_stop=lambda: status["stop_requested"], label='GC分析')
 
-    gc_analyze_status["running"] = False
-    gc_analyze_status["stop_requested"] = False
+    status["running"] = False
+    status["stop_requested"] = False
 
 
 def _analyze_wl_background(codes):
-    """ウォッチリスト銘柄をバックグラウンドで1銘柄ずつ分析"""
+    """ウォッチリスト銘柄をバックグラウンドで並列分析"""
     global wl_analyze_status
-    analyzer = StockAnalyzer()
+    status = wl_analyze_status
+    analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
 
-    for i, code in enumerate(codes):
-        if wl_analyze_status["stop_requested"]:
-            break
+    run_batch(codes, lambda code: _analyze_stock_and_save(analyzer, code), status=status,
+              should_stop=lambda: status["stop_requested"], label='WL分析')
 
-        try:
-            result = _analyze_stock_and_save(analyzer, code)
-            if not result:
-                wl_analyze_status["errors"] += 1
-        except Exception as e:
-            print(f"WL分析エラー ({code}): {e}")
-            wl_analyze_status["errors"] += 1
-
-        wl_analyze_status["done"] += 1
-        if i < len(codes) - 1:
-            import time
-            time.sleep(0.35)
-
-    wl_analyze_status["running"] = False
-    wl_analyze_status["stop_requested"] = False
+    status["running"] = False
+    status["stop_requested"] = False
 
 
 @app.route('/api/gc-stocks/analyze', methods=['POST'])
@@ -1900,29 +1884,16 @@ div_analyze_status = {"running": False, "done": 0, "total": 0, "errors": 0, "sto
 
 
 def _analyze_div_background(codes):
-    """高配当銘柄をバックグラウンドで1銘柄ずつ分析"""
+    """高配当銘柄をバックグラウンドで並列分析"""
     global div_analyze_status
-    analyzer = StockAnalyzer()
-
-    for i, code in enumerate(codes):
-        if div_analyze_status["stop_requested"]:
-            break
-
-        try:
-            result = _analyze_stock_and_save(analyzer, code)
-            if not result:
-                div_analyze_status["errors"] += 1
-        except Exception as e:
-            print(f"高配当分析エラー ({code}): {e}")
-            div_analyze_status["errors"] += 1
+    status = div_analyze_status
+    analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
 
-        div_analyze_status["done"] += 1
-        if i < len(codes) - 1:
-            import time
-            time.sleep(0.35)
+    run_batch(codes, lambda code: _analyze_stock_and_save(analyzer, code), status=status,
+              should_stop=lambda: status["stop_requested"], label='高配当分析')
 
-    div_analyze_status["running"] = False
-    div_analyze_status["stop_requested"] = False
+    status["running"] = False
+    status["stop_requested"] = False
 
 
 @app.route('/api/dividend-stocks/analyze', methods=['POST'])
@@ -2053,45 +2024,36 @@ tech_analyze_status = {"running": False, "done": 0, "total": 0, "errors": 0, "st
 
 
 def _analyze_tech_background(codes):
-    """テクニカル銘柄をバックグラウンドで1銘柄ずつ分析"""
+    """テクニカル銘柄をバックグラウンドで並列分析"""
     global tech_analyze_status
-    analyzer = StockAnalyzer()
+    status = tech_analyze_status
+    analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
 
-    for i, code in enumerate(codes):
-        if tech_analyze_status["stop_requested"]:
-            break
-
-        try:
-            result = _analyze_stock_and_save(analyzer, code)
-            if result:
-                # signal_stocksも更新
-                try:
-                    client = get_supabase_client()
-                    client.table('signal_stocks').update({
-                        'sector': result.get('sector'),
-                        'market_cap': result.get('market_cap'),
-                        'stock_price': result.get('raw', {}).get('last_price'),
-                        'per': result.get('raw', {}).get('per'),
-                        'pbr': result.get('raw', {}).get('pbr'),
-                        'dividend_yield': result.get('raw', {}).get('dividend_yield'),
-                        'match_rate': result.get('match_rate'),
-                        'analyzed_at': result.get('analyzed_at'),
-                    }).eq('company_code', code).execute()
-                except Exception:
-                    pass
-            else:
-                tech_analyze_status["errors"] += 1
-        except Exception as e:
-            print(f"テクニカル分析エラー ({code}): {e}")
-            tech_analyze_status["errors"] += 1
+    def _process(code):
+        result = _analyze_stock_and_save(analyzer, code)
+        if result:
+            # signal_stocksも更新
+            try:
+                client = get_supabase_client()
+                client.table('signal_stocks').update({
+                    'sector': result.get('sector'),
+                    'market_cap': result.get('market_cap'),
+                    'stock_price': result.get('raw', {}).get('last_price'),
+                    'per': result.get('raw', {}).get('per'),
+                    'pbr': result.get('raw', {}).get('pbr'),
+                    'dividend_yield': result.get('raw', {}).get('dividend_yield'),
+                    'match_rate': result.get('match_rate'),
+                    'analyzed_at': result.get('analyzed_at'),
+                }).eq('company_code', code).execute()
+            except Exception:
+                pass
+        return result
 
-        tech_analyze_status["done"] += 1
-        if i < len(codes) - 1:
-            import time
-            time.sleep(0.35)
+    run_batch(codes, _process, status=status,
+              should_stop=lambda: status["stop_requested"], label='テクニカル分析')
 
-    tech_analyze_status["running"] = False
-    tech_analyze_status["stop_requested"] = False
+    status["running"] = False
+    status["stop_requested"] = False
 
 
 @app.route('/api/technical-stocks/analyze', methods=['POST'])
@@ -2394,6 +2356,9 @@ def _recalc_ma_crosses_background():
         ma_cross_status["saved"] = result["saved"]
         ma_cross_status["total"] = result["total"]
         ma_cross_status["done"] = result["total"]
+        # 頭から計算し直した銘柄数（初回・日足が書き換わった銘柄。普段はごく少ない）
+        ma_cross_status["rebuilt"] = result.get("rebuilt")
+        ma_cross_status["sync"] = result.get("sync")
     except Exception as e:
         print(f'GC/DC再計算エラー: {e}')
         ma_cross_status["error"] = str(e)[:200]
@@ -2412,21 +2377,21 @@ def _update_earnings_background(codes):
 
     財務データは1銘柄10回のAPI呼び出しが必要で全件やり直すと約4.5時間かかるが、
     決算を出した銘柄だけなら平常日は数件〜数十件で済む。
+    決算集中日は数百件になるので、run_batch で並列に回す（速さはバケット任せ）。
     """
     global earnings_status
-    analyzer = StockAnalyzer()
-    import time as _time
+    status = earnings_status
+    analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
 
-    for i, code in enumerate(codes):
-        if earnings_status["stop_requested"]:
-            break
+    def _process(code):
         try:
             result = _analyze_stock_and_save(analyzer, code)
-            if not result:
-                earnings_status["errors"] += 1
+        except upstream_limiter.UpstreamThrottled:
+            # 制限明けに run_batch がやり直す。やり直しきれなければ次回に残す
+            raise
         except Exception as e:
             print(f'決算更新エラー ({code}): {e}')
-            earnings_status["errors"] += 1
+            result = None
         # 1件ずつ処理済みにする。途中で止まっても、成功した分は再処理されない
         try:
             from datetime import datetime, timezone
@@ -2436,14 +2401,14 @@ def _update_earnings_background(codes):
             }).eq('company_code', code).execute()
         except Exception as e:
             print(f'決算キューの更新エラー ({code}): {e}')
+        return result
 
-        earnings_status["done"] = i + 1
-        if i < len(codes) - 1:
-            _time.sleep(0.35)   # yfinanceのレート制限対策
+    run_batch(codes, _process, status=status,
+              should_stop=lambda: status["stop_requested"], label='決算更新')
 
     from datetime import datetime, timezone
-    earnings_status["running"] = False
-    earnings_status["finished_at"] = datetime.now(timezone.utc).isoformat()
+    status["running"] = False
+    status["finished_at"] = datetime.now(timezone.utc).isoformat()
 
 
 def _enqueue_announced():
@@ -2508,6 +2473,10 @@ def _enqueue_announced():
         except Exception as e:
             print(f'決算キューの記録エラー: {e}')
 
+    # 発表のあった銘柄は決算書が変わる。キャッシュの分析結果を捨てて、次に開いたときに取り直す
+    for code in codes:
+        analysis_cache.invalidate(code)
+
     # 未処理を古い順に取り出す（押し忘れた過去分もここで拾える）
     res = (client.table('earnings_queue')
            .select('company_code, company_name, announced_date')
@@ -2570,15 +2539,15 @@ daily_update_status = {"running": False, "phase": "", "done": 0, "total": 0,
                        "saved": 0, "stop_requested": False, "finished_at": None, "error": None}
 
 
-def _update_daily_and_recalc_background():
+def _update_daily_and_recalc_background(incremental=True):
     """日足を更新し、続けてGC/DCを再計算する。
 
     日足を更新してもGC/DCを計算し直さないと結果が変わらないため、
     2つを別々に押させず1本の処理として通す。
+    incremental=False なら全銘柄の1年分を取り直す（差分の継ぎ足しを疑うとき用）。
     """
     global daily_update_status, ma_cross_status
     import price_history as ph
-    from datetime import datetime, timezone
 
     try:
         client = get_supabase_client()
@@ -2599,26 +2568,30 @@ def _update_daily_and_recalc_background():
 
         daily_update_status.update({"phase": "日足を取得中", "total": len(codes), "done": 0})
 
-        # まとめて取得し、まとめて保存する
+        # まとめて取得し、まとめて保存する。
+        # 保存済みの足がある銘柄は後ろだけを取って継ぎ足す（price_history.refresh_daily_chunk）
         CHUNK = 100
         saved = 0
+        totals = {'incremental': 0, 'full': 0, 'bars_fetched': 0}
         for i in range(0, len(codes), CHUNK):
             if daily_update_status["stop_requested"]:
                 break
-            chunk = codes[i:i + CHUNK]
-            fetched = ph.fetch_ohlc_batch(chunk, period='1y', chunk_size=CHUNK)
-            now = datetime.now(timezone.utc).isoformat()
-            payload = [{'company_code': c, 'daily_1y': rows,
-                        'daily_updated_at': now, 'updated_at': now}
-                       for c, rows in fetched.items()]
-            if payload:
-                try:
-                    client.table('stock_price_history').upsert(payload).execute()
-                    saved += len(payload)
-                except Exception as e:
-                    print(f'日足の保存エラー: {e}')
+            counts = ph.refresh_daily_chunk(client, codes[i:i + CHUNK], incremental=incremental)
+            saved += counts['saved']
+            for k in totals:
+                totals[k] += counts[k]
             daily_update_status["done"] = min(i + CHUNK, len(codes))
             daily_update_status["saved"] = saved
+            daily_update_status["fetch"] = dict(totals)
+        print(f"[日足更新] 差分{totals['incremental']}件 / 1年分{totals['full']}件 / "
+              f"取得した足 {totals['bars_fetched']}本")
+
+        # 取り直した日足をローカルの置き場（memmap のファイル）にも書き出す
+        try:
+            from price_store import default_store
+            default_store().flush()
+        except Exception as e:
+            print(f'株価のローカル置き場の書き出しエラー: {e}')
 
         if saved == 0 and codes:
             raise RuntimeError('日足を1件も保存できませんでした')
@@ -2629,6 +2602,32 @@ def _update_daily_and_recalc_background():
                                 "stop_requested": False, "error": None})
         _recalc_ma_crosses_background()
 
+        # 保存したばかりの日足からトレンドのラベルも付け直す（外部アクセスなし）
+        daily_update_status["phase"] = "トレンドを再計算中"
+        try:
+            import trend_stats
+            daily_update_status["trend"] = trend_stats.calculate_for_all(
+                should_stop=lambda: daily_update_status["stop_requested"])
+            print(f"[トレンド] {daily_update_status['trend']}")
+        except Exception as e:
+            print(f'トレンド再計算エラー: {e}')
+
+        # 長期足（週足・月足）を先回りで作る。閲覧時のその場の取得（最大20秒）を
+        # 待たせないため。無い銘柄・古い銘柄から1晩 LONG_TERM_NIGHTLY_LIMIT 件まで
+        daily_update_status["phase"] = "長期足を作成中"
+        try:
+            def long_term_progress(done, total):
+                daily_update_status["long_term_progress"] = {"done": done, "total": total}
+
+            daily_update_status["long_term"] = ph.pregenerate_long_term(
+                client, codes, should_stop=lambda: daily_update_status["stop_requested"],
+                on_progress=long_term_progress)
+            print(f"[長期足] {daily_update_status['long_term']}")
+            from price_store import default_store
+            default_store().flush()
+        except Exception as e:
+            print(f'長期足の作成エラー: {e}')
+
         # かぶたんとのすり合わせ。
         # 日付の一致は求めない（かぶたんの日付は発生日ではなく取得日）。
         # 「かぶたんは検知しているのに自前が古いまま」＝日足が壊れている銘柄を洗い出す。
@@ -2662,9 +2661,12 @@ def api_update_daily_prices():
     if daily_update_status["running"] or ma_cross_status["running"]:
         return jsonify({"error": "すでに実行中です"}), 409
 
+    # ?full=1 で全銘柄の1年分を取り直す（既定は保存済みの後ろだけを継ぎ足す）
+    incremental = request.args.get('full') not in ('1', 'true')
     daily_update_status = {"running": True, "phase": "準備中", "done": 0, "total": 0,
                            "saved": 0, "stop_requested": False, "finished_at": None, "error": None}
-    threading.Thread(target=_update_daily_and_recalc_background, daemon=True).start()
+    threading.Thread(target=_update_daily_and_recalc_background,
+                     kwargs={'incremental': incremental}, daemon=True).start()
     return jsonify({"started": True}), 202
 
 
@@ -2673,6 +2675,16 @@ def api_update_daily_status():
     return jsonify({**daily_update_status, "ma": ma_cross_status}), 200
 
 
+@app.route('/api/admin/price-store', methods=['GET'])
+@role_required('admin')
+def admin_price_store():
+    """株価のローカル置き場（price_store）の件数・当たり外れと、裏の取り直しの待ち行列"""
+    import price_history
+    from price_store import default_store
+    return jsonify({**default_store().snapshot(),
+                    'refresh': price_history.refresh_snapshot()}), 200
+
+
 @app.route('/api/price-history/update/stop', methods=['POST'])
 def api_stop_daily_update():
     daily_update_status["stop_requested"] = True
@@ -2815,6 +2827,18 @@ ROE_MIN_EQUITY_RATIO = 5
 # 東証の市場区分。プルダウンの並びは規模の大きい順に固定する
 MARKET_SEGMENTS = ['プライム', 'スタンダード', 'グロース']
 
+# トレンドの絞り込み（?trend=up|down|flat → screened_latest.trend_label）。
+# 列は migration_trend_label.sql で足す。SCREEN_COLUMNS には入れていないので、
+# migration前でも絞り込みを使わない限り一覧は壊れない
+SCREEN_TRENDS = {'up': 'Up', 'down': 'Down', 'flat': 'Flat'}
+
+# 移動平均の交差での絞り込み
+# （?cross=gc|dc&cross_pair=d25_75&cross_days=30 → screened_latest.ma_pairs）。
+# cross_pair は ma_cross.MA_PAIRS のキー（省略時は 5日/25日）。直近の交差が
+# cross の種類で、cross_days があればその交差が N 日以内の銘柄に絞る。
+# 列は migration_ma_pairs.sql で足す（trend_label と同じく SCREEN_COLUMNS には入れない）
+SCREEN_CROSSES = ('gc', 'dc')
+
 _sector_cache = {'values': None, 'fetched_at': 0}
 
 
@@ -3354,6 +3378,24 @@ def api_screen_stocks():
         if market in MARKET_SEGMENTS:
             query = query.eq('market_segment', market)
 
+        # トレンド（日足更新のたびに trend_stats.calculate_for_all が付け直す）
+        trend = (request.args.get('trend') or '').strip().lower()
+        if trend in SCREEN_TRENDS:
+            query = query.eq('trend_label', SCREEN_TRENDS[trend])
+
+        # 移動平均の交差（夜間の ma_cross.calculate_for_all と場中の見直しが同期する）
+        cross = (request.args.get('cross') or '').strip().lower()
+        if cross in SCREEN_CROSSES:
+            import ma_cross
+            pair = (request.args.get('cross_pair') or ma_cross.PRIMARY_PAIR).strip()
+            if pair in {key for key, _, _, _ in ma_cross.MA_PAIRS}:
+                query = query.eq(f'ma_pairs->{pair}->>state', cross)
+                cross_days = request.args.get('cross_days', type=int)
+                if cross_days and cross_days > 0:
+                    from datetime import date, timedelta
+                    since = (date.today() - timedelta(days=cross_days)).isoformat()
+                    query = query.gte(f'ma_pairs->{pair}->>{cross}_date', since)
+
         # テーマ／カテゴリでの絞り込み。
         # カテゴリ指定では、そのカテゴリのテーマを1つでも持つ銘柄を拾う
         # （銘柄に「金融」のような大枠タグを別途付ける必要はない）。
@@ -3457,7 +3499,7 @@ def api_price_history(company_code):
 
         crosses = None
         if granularity == 'daily':
-            rows = ph.get_daily(code)
+            rows = ph.get_daily(code, priority=_refresh_priority())
             # 日足はここで最新化されるので、同じデータからGC/DCも計算し直す。
             # これをやらないと、チャートには出ているクロスがトレンド表示に
             # 反映されない（一括再計算を手で押すまでズレ続ける）。
@@ -3467,7 +3509,7 @@ def api_price_history(company_code):
             except Exception as e:
                 print(f'GC/DCの再計算エラー {code}: {e}')
         else:
-            rows = ph.get_long_term(code, granularity)
+            rows = ph.get_long_term(code, granularity, priority=_refresh_priority())
 
         return jsonify({
             'company_code': code,
@@ -3482,6 +3524,17 @@ def api_price_history(company_code):
         return jsonify({"error": "株価履歴を取得できませんでした"}), 500
 
 
+def _refresh_priority():
+    """このリクエストで古い足を裏で取り直すときの優先度。
+
+    ログイン中は人。未ログインは User-Agent でクローラーかを見る。
+    """
+    from refresh_executor import PRIORITY_USER, priority_for_user_agent
+    if session.get('user_id'):
+        return PRIORITY_USER
+    return priority_for_user_agent(request.headers.get('User-Agent'))
+
+
 @app.route('/api/market/indices', methods=['GET'])
 def api_market_indices():
     """マーケットページの一覧カード用。全指数の最新値と前日比を返す。"""
@@ -3791,7 +3844,7 @@ def fetch_and_store_holders_officers(company_code):
     timed_out = False
     try:
         from price_history import call_with_deadline
-        if call_with_deadline(_fetch, HOLDERS_FETCH_TIMEOUT_SECONDS) is None:
+        if call_with_deadline(_fetch, HOLDERS_FETCH_TIMEOUT_SECONDS, upstream='holders') is None:
             timed_out = True
             print(f'株主・役員の取得が{HOLDERS_FETCH_TIMEOUT_SECONDS}秒を超えたため'
                   f'打ち切りました {code}（取れた分だけ保存します）')
@@ -3900,10 +3953,11 @@ def api_valuation_history(company_code):
 
     try:
         if range_key == '1y':
-            points = price_history.get_daily(code)
+            points = price_history.get_daily(code, priority=_refresh_priority())
         else:
             granularity = price_history.granularity_for_range(range_key)
-            points = price_history.get_long_term(code, granularity)
+            points = price_history.get_long_term(code, granularity,
+                                                 priority=_refresh_priority())
     except Exception as e:
         print(f'株価履歴の取得エラー {code}: {e}')
         points = []
@@ -4059,7 +4113,6 @@ def api_simulate():
     外部アクセスはしない。stock_price_history に入っている調整後の株価
     （日足1年・月足10年）だけで計算するので速い。
     """
-    import json as _json
     from datetime import date, timedelta
 
     import simulator
@@ -4088,28 +4141,24 @@ def api_simulate():
         if amount > 1_000_000_000:
             return jsonify({"error": "金額が大きすぎます（10億円まで）"}), 400
 
-        client = get_supabase_client()
-        row = (client.table('stock_price_history')
-               .select('company_code, daily_1y, monthly_10y')
-               .eq('company_code', code).limit(1).execute().data or [None])[0]
-        if not row:
-            return jsonify({"error": "この銘柄の株価履歴がありません"}), 404
-
+        import price_history
+        # 週足は使わないので読まない（列ごとの読み出し）。列のまま simulator に渡す
         history = {}
         for key in ('daily_1y', 'monthly_10y'):
-            v = row.get(key)
-            history[key] = _json.loads(v) if isinstance(v, str) else v
-
-        # 月足は「閲覧されたときに取得してキャッシュする」設計なので、
-        # ほとんどの銘柄でまだ空（実測 1,200件中1件しか持っていなかった）。
-        # 日足は1年ぶんしか無いため、それより前を指定されたらここで取りに行く。
-        # チャートと同じ get_long_term() を使うので、取得したぶんは保存され
-        # 次回以降は即返る。全銘柄を先回りで持つとDBが重くなるため増やさない。
+            got = price_history.get_series(code, key)
+            if got is None:
+                return jsonify({"error": "この銘柄の株価履歴がありません"}), 404
+            history[key] = got[0]
+
+        # 月足は当初「閲覧されたときに取得してキャッシュする」設計で、
+        # ほとんどの銘柄で空だった（実測 1,200件中1件しか持っていなかった）。
+        # いまは夜間の日足更新が全銘柄ぶんを先回りで作る（price_history.pregenerate_long_term）。
+        # まだ作られていない銘柄だけ、日足の1年より前を指定されたらここで取りに行く。
+        # チャートと同じ get_long_term() を使うので、取得したぶんは保存され次回以降は即返る。
         needs_long = str(start) < str(date.today() - timedelta(days=330))
         long_fetch_failed = False
-        if needs_long and not history.get('monthly_10y'):
+        if needs_long and not len(history['monthly_10y']['time']):
             try:
-                import price_history
                 history['monthly_10y'] = price_history.get_long_term(code, 'monthly') or []
                 long_fetch_failed = not history['monthly_10y']
             except Exception as e:
@@ -4121,6 +4170,8 @@ def api_simulate():
         if buy_mode not in simulator.BUY_MODES:
             buy_mode = 'carry'
 
+        # 系列の並べ替えはここで1回だけ（一括・積立のどちらでも使い回す）
+        history = simulator.prepare(history)
         if mode == 'monthly':
             result = simulator.simulate_monthly(
                 history, start, end, amount,
@@ -4541,12 +4592,15 @@ def scheduled_fetch_gc_dc():
     except Exception as e:
         print(f"[Scheduler] DCエラー: {e}")
 
-def fetch_prices_batch(codes, chunk_size=200):
+def fetch_prices_batch(codes, chunk_size=200, with_times=False):
     """複数銘柄の最新終値をまとめて取得する。{code: price} を返す。
 
     1銘柄ずつ叩くと3,875件で約23分かかるうえ、リクエスト数もそのまま
     銘柄数になりレート制限に当たりやすい。yfinanceのバッチ取得なら
     実測で1銘柄あたり0.065秒（従来比 約1/11）で済む。
+
+    with_times=True なら {code: (その足のUNIX秒, price)} を返す
+    （ma_cross.refresh_intraday が「その日の足」として使う）。
     """
     import yfinance as yf
     import warnings
@@ -4567,7 +4621,9 @@ def fetch_prices_batch(codes, chunk_size=200):
             try:
                 series = df['Close'][sym].dropna() if len(symbols) > 1 else df['Close'].dropna()
                 if len(series):
-                    prices[code] = float(series.iloc[-1])
+                    price = float(series.iloc[-1])
+                    prices[code] = ((int(series.index[-1].timestamp()), price)
+                                    if with_times else price)
             except Exception:
                 continue
     return prices
@@ -4717,7 +4773,8 @@ def scheduled_update_stock_prices():
             page += 1
 
         print(f"[Scheduler] 対象銘柄数: {len(codes)}件")
-        prices = fetch_prices_batch(codes)
+        quotes = fetch_prices_batch(codes, with_times=True)
+        prices = {code: price for code, (_, price) in quotes.items()}
 
         # 取得できた分だけ更新する
         success_count = 0
@@ -4734,6 +4791,16 @@ def scheduled_update_stock_prices():
         print(f"[Scheduler] 株価バッチ更新完了: 成功{success_count}件, 失敗{fail_count}件")
     except Exception as e:
         print(f"[Scheduler] 株価バッチ更新エラー: {e}")
+        return
+
+    # 取った株価をその日の足として、GC/DCを見直す（保存済みの状態から進めるだけで、
+    # 日足の取り直しも1年分の再計算もしない）
+    try:
+        import ma_cross
+        counts = ma_cross.refresh_intraday(client, quotes)
+        print(f"[Scheduler] GC/DC見直し: {counts['checked']}件中 {counts['changed']}件が変化")
+    except Exception as e:
+        print(f"[Scheduler] GC/DC見直しエラー: {e}")
 
 
 def scheduled_update_daily_and_crosses():
@@ -4804,7 +4871,7 @@ def scheduled_backfill_yahoo_profile():
         print("[Scheduler] Yahoo項目バックフィル: 対象なし（すべて取得済み）")
         return
 
-    analyzer = StockAnalyzer()
+    analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
     ok = fail = 0
     for i, code in enumerate(targets):
         if yahoo_jp_guard.status_snapshot().get('tripped'):
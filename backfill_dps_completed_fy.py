@@ -26,15 +26,14 @@
 
 import argparse
 import json
-import os
-
-os.environ.setdefault('ENABLE_SCHEDULER', 'false')
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from app import get_latest_completed_value
+# app.py は import するだけで Flask アプリとスケジューラを組み立てるので、
+# 関数の置き場所（analysis_quality）から直接読む
+from analysis_quality import get_latest_completed_value
 from supabase_client import get_supabase_client
 
 PAGE_SIZE = 500
@@ -32,8 +32,9 @@ def main():
         page += 1
 
     print(f'対象 {len(rows)}件を screened_latest に反映します...')
-    synced = ma_cross.sync_gc_to_screened(client, rows)
-    print(f'完了: {synced}件を同期しました')
+    counts = ma_cross.sync_gc_to_screened(client, rows)
+    print(f"完了: 更新{counts['changed']}件 / 変化なし{counts['unchanged']}件 / "
+          f"失敗{counts['failed']}件 / screened_latest に無い{counts['missing']}件")
 
 
 if __name__ == '__main__':
@@ -46,6 +46,9 @@ from collections import Counter
 from dotenv import load_dotenv
 load_dotenv()
 
+# app.py を import するとAPSchedulerが起動してcronが動き出すため、先に無効化する
+os.environ.setdefault('ENABLE_SCHEDULER', 'false')
+
 import app as appmod
 from stock_analyzer import StockAnalyzer
 import supabase_client as sc
@@ -0,0 +1,115 @@
+"""stock_price_history の足を、行の配列から列ごとの配列へ書き換える。
+
+daily_1y / weekly_10y / monthly_10y は [{time, open, high, low, close}, ...] で
+保存していた。price_history.encode_ohlc の形
+{"v": 1, "t": [...], "o": [...], "h": [...], "l": [...], "c": [...]} にすると
+キー名の繰り返しが無くなり、読む側（ma_cross.calculate_for_all・
+/api/simulate・valuation-history）のパースも軽くなる。
+
+読み出しはどちらの形も読める（price_history.decode_ohlc）ので、
+このスクリプトは急がなくてよい。日足の更新・長期足の取り直しでも
+順次新しい形に置き換わる。中身は変えないので *_updated_at には触らない
+（触ると「取り直し済み」に見えて、本来の更新が遅れる）。
+**Yahooには一切アクセスしない。**
+
+使い方:
+    python backfill_price_history_columnar.py            # 対象とサイズを数えるだけ
+    python backfill_price_history_columnar.py --apply    # 書き込む
+"""
+
+import argparse
+import json
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from price_history import encode_ohlc, is_columnar, to_rows
+from supabase_client import get_supabase_client
+
+PAGE_SIZE = 200
+
+COLUMNS = ('daily_1y', 'weekly_10y', 'monthly_10y')
+
+
+def _size(value):
+    return len(json.dumps(value, separators=(',', ':'))) if value else 0
+
+
+def convert(row):
+    """行の配列で入っている列だけ、列の形にした patch を返す"""
+    patch = {}
+    for column in COLUMNS:
+        value = row.get(column)
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                continue
+        if not value or is_columnar(value) or not isinstance(value, list):
+            continue
+        encoded = encode_ohlc(value)
+        # 並べ替え以外で中身が変わらないことを確かめてから書く
+        if len(to_rows(encoded)) != sum(1 for r in value if r and r.get('time') is not None):
+            print(f"  {row['company_code']} {column}: 変換後の本数が合わないので飛ばします")
+            continue
+        patch[column] = encoded
+    return patch
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--apply', action='store_true',
+                        help='実際に書き込む（付けなければ対象を出すだけ）')
+    parser.add_argument('--limit', type=int, default=0,
+                        help='先頭N件だけ処理する（動作確認用）')
+    args = parser.parse_args()
+
+    client = get_supabase_client()
+    offset = 0
+    seen = converted = failed = 0
+    before_bytes = after_bytes = 0
+
+    while True:
+        # 全列を一度に抱えるとメモリが重いので、ページごとに変換して書く
+        page = (client.table('stock_price_history')
+                .select('company_code, ' + ', '.join(COLUMNS))
+                .order('company_code')
+                .range(offset, offset + PAGE_SIZE - 1)
+                .execute())
+        rows = page.data or []
+        for row in rows:
+            seen += 1
+            patch = convert(row)
+            if not patch:
+                continue
+            before_bytes += sum(_size(row.get(c)) for c in patch)
+            after_bytes += sum(_size(v) for v in patch.values())
+            converted += 1
+            if args.apply:
+                try:
+                    (client.table('stock_price_history')
+                     .update(patch)
+                     .eq('company_code', row['company_code'])
+                     .execute())
+                except Exception as e:
+                    failed += 1
+                    print(f"  失敗 {row['company_code']}: {e}")
+            if args.limit and converted >= args.limit:
+                break
+        if len(rows) < PAGE_SIZE or (args.limit and converted >= args.limit):
+            break
+        offset += PAGE_SIZE
+
+    print(f'読み込み: {seen}件 / 変換対象: {converted}件')
+    if before_bytes:
+        print(f'サイズ: {before_bytes / 1e6:.1f}MB → {after_bytes / 1e6:.1f}MB '
+              f'({after_bytes / before_bytes:.0%})')
+    if not args.apply:
+        print('\n--apply を付けると書き込みます（いまは何も変えていません）')
+        return
+    print(f'\n更新: {converted - failed}件 / 失敗: {failed}件')
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,7 @@ load_dotenv()
 import yfinance as yf
 
 from stock_analyzer import StockAnalyzer
+from statement_bundle import StatementBundle
 from supabase_client import get_supabase_client
 from yfinance_guard import RateLimitExhausted, RateLimitGuard
 
@@ -136,7 +137,8 @@ def main():
 
     def _fetch(code, history):
         """1銘柄分の取得。レート制限時はguardがここごと再実行する。"""
-        ticker = yf.Ticker(f'{code}.T')
+        # 決算書は _fill_missing_eps と _build_bps_series の両方が読むので1回にまとめる
+        ticker = StatementBundle(yf.Ticker(f'{code}.T'))
         result = {
             'eps': [dict(d) for d in (history.get('eps') or [])],
             'bps': [],
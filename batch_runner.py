@@ -0,0 +1,124 @@
+"""銘柄リストを複数スレッドで処理するバッチ実行。
+
+背景:
+  batch_analyze と app.py の _analyze_*_background は同じ形のループを
+  それぞれ持っていた（1銘柄ずつ → 0.35秒待つ → 次へ）。1銘柄の分析は
+  ほぼ通信待ちなので、直列だと上流の制限よりずっと手前で頭打ちになる。
+
+方針:
+  - N本のワーカーが銘柄を1つずつ取り出して処理する
+  - 送信の速さは upstream_limiter のホスト別バケットが決める。ここでは待たない
+  - レート制限の例外は RateLimitGuard と同じく同じ銘柄をやり直す。
+    その前にバケットを止め、他のワーカーもまとめて待たせる。
+    UpstreamThrottled（制限中で欠けた分析）は、制限明けを待ってやり直すだけ
+  - 進捗は従来の status 辞書（done / errors / stop_requested）をそのまま更新し、
+    throughput（件/分）を足す
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import upstream_limiter
+from yfinance_guard import MAX_RETRIES_PER_ITEM, is_rate_limit_error
+
+# 既定のワーカー数。1にすると従来通りの直列処理になる
+BATCH_WORKERS = int(os.getenv('ANALYZE_BATCH_WORKERS', '4'))
+
+
+def run_batch(items, process, workers=None, status=None, should_stop=None,
+              hosts=('yfinance',), clock=time.monotonic, label='バッチ'):
+    """items を workers 本で処理する。
+
+    Args:
+        process: 1件を処理する関数。偽を返したら errors に数える。例外も errors
+        status: 進捗を書き込む辞書（done / errors / per_minute / elapsed_seconds）
+        should_stop: 真を返したら新しい銘柄を取り出さない
+        hosts: 銘柄の切れ目で制限明けを待つホスト
+
+    Returns:
+        (入力順の結果リスト, サマリー辞書)。処理しなかった銘柄の結果は None
+    """
+    items = list(items)
+    workers = max(1, min(workers or BATCH_WORKERS, len(items) or 1))
+    status = status if status is not None else {}
+    should_stop = should_stop or (lambda: False)
+    results = [None] * len(items)
+    lock = threading.Lock()
+    cursor = {'next': 0}
+    counters = {'done': 0, 'errors': 0, 'retried': 0}
+    started = clock()
+
+    def _report():
+        elapsed = clock() - started
+        status['done'] = counters['done']
+        status['errors'] = counters['errors']
+        status['elapsed_seconds'] = round(elapsed, 1)
+        status['per_minute'] = (round(counters['done'] / elapsed * 60, 1)
+                                if elapsed > 0 else None)
+
+    def _take():
+        with lock:
+            if should_stop() or cursor['next'] >= len(items):
+                return None
+            index = cursor['next']
+            cursor['next'] += 1
+            return index
+
+    def _run_one(item):
+        for attempt in range(1, MAX_RETRIES_PER_ITEM + 1):
+            for host in hosts:
+                upstream_limiter.bucket(host).wait_until_open()
+            try:
+                return process(item)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == MAX_RETRIES_PER_ITEM:
+                    raise
+                with lock:
+                    counters['retried'] += 1
+                # UpstreamThrottled は止めている最中に諦めたもの。止める時間は延ばさない
+                if not isinstance(e, upstream_limiter.UpstreamThrottled):
+                    for host in hosts:
+                        upstream_limiter.penalize(host)
+
+    def _worker():
+        while True:
+            index = _take()
+            if index is None:
+                return
+            ok = False
+            try:
+                results[index] = _run_one(items[index])
+                ok = bool(results[index])
+            except Exception as e:
+                print(f"{label}エラー ({items[index]}): {e}")
+            with lock:
+                counters['done'] += 1
+                if not ok:
+                    counters['errors'] += 1
+                _report()
+
+    if workers == 1:
+        _worker()
+    else:
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='batch-worker') as pool:
+            for _ in range(workers):
+                pool.submit(_worker)
+
+    _report()
+    summary = {
+        'total': len(items),
+        'done': counters['done'],
+        'errors': counters['errors'],
+        'retried': counters['retried'],
+        'workers': workers,
+        'elapsed_seconds': status['elapsed_seconds'],
+        'per_minute': status['per_minute'],
+        'upstream': upstream_limiter.status_snapshot(),
+    }
+    print(f"{label}完了: {summary['done']}/{summary['total']}件 "
+          f"(エラー{summary['errors']}件, {summary['per_minute'] or 0}件/分, "
+          f"ワーカー{workers}本)")
+    return results, summary
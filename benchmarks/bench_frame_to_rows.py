@@ -0,0 +1,127 @@
+"""yfinance の DataFrame → 行の変換を、iterrows の旧実装と比べる。
+
+    python benchmarks/bench_frame_to_rows.py [--stocks 100] [--bars 250] [--repeat 5]
+    python benchmarks/bench_frame_to_rows.py --record frame.pkl   # 実データを1回取って保存
+    python benchmarks/bench_frame_to_rows.py --frame frame.pkl    # 保存したものを使う
+
+既定では yf.download(group_by='ticker') と同じ形（列が (銘柄, 列名) の2段・
+index が Asia/Tokyo の日付）の DataFrame を乱数で作る。欠損の穴・上場前で
+全部 NaN の銘柄も混ぜる。--record は Yahoo にアクセスするので、
+夜間バッチと重ならないときに使うこと。
+
+旧実装と結果が一致することも確かめてから時間を出す。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+from price_history import batch_frame_to_rows, to_symbol
+
+
+def make_frame(stocks, bars, seed=0):
+    """yf.download(group_by='ticker') と同じ形の DataFrame を作る"""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2025-01-06', periods=bars, freq='B', tz='Asia/Tokyo', name='Date')
+    symbols = [to_symbol(str(1300 + i)) for i in range(stocks)]
+    frames = {}
+    for j, sym in enumerate(symbols):
+        close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+        data = {
+            'Open': close * (1 + rng.normal(0, 0.005, bars)),
+            'High': close * 1.01,
+            'Low': close * 0.99,
+            'Close': close,
+            'Adj Close': close,
+            'Volume': rng.integers(1_000, 1_000_000, bars).astype(float),
+        }
+        frame = pd.DataFrame(data, index=index)
+        # 売買停止日のような穴と、始値だけ欠けた足
+        frame.iloc[rng.integers(0, bars, 3), :] = np.nan
+        frame.iloc[rng.integers(0, bars, 2), 0] = np.nan
+        if j == stocks - 1:
+            frame.loc[:, :] = np.nan   # 上場前・廃止などで何も返らない銘柄
+        frames[sym] = frame
+    return pd.concat(frames, axis=1), symbols
+
+
+def legacy_rows(df, symbols):
+    """置き換え前の fetch_ohlc_batch の変換（iterrows と pd.notna）"""
+    result = {}
+    for sym in symbols:
+        sub = df[sym] if len(symbols) > 1 else df
+        rows = []
+        for idx, row in sub.iterrows():
+            if pd.isna(row.get('Close')):
+                continue
+            rows.append({
+                'time': int(idx.timestamp()),
+                'open': float(row['Open']) if pd.notna(row['Open']) else None,
+                'high': float(row['High']) if pd.notna(row['High']) else None,
+                'low': float(row['Low']) if pd.notna(row['Low']) else None,
+                'close': float(row['Close']),
+            })
+        if rows:
+            result[sym] = rows
+    return result
+
+
+def record(path, stocks):
+    import yfinance as yf
+    symbols = [to_symbol(str(c)) for c in range(1301, 10000)][:stocks]
+    df = yf.download(' '.join(symbols), period='1y', progress=False,
+                     threads=True, auto_adjust=False, group_by='ticker')
+    df.to_pickle(path)
+    print(f'保存: {path} ({df.shape[0]}本 × {len(symbols)}銘柄)')
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stocks', type=int, default=100)
+    parser.add_argument('--bars', type=int, default=250)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--frame', help='--record で保存した DataFrame')
+    parser.add_argument('--record', help='Yahoo から取って保存する先')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.stocks)
+        return
+
+    if args.frame:
+        df = pd.read_pickle(args.frame)
+        symbols = list(dict.fromkeys(df.columns.get_level_values(0)))
+    else:
+        df, symbols = make_frame(args.stocks, args.bars)
+
+    old = legacy_rows(df, symbols)
+    new = batch_frame_to_rows(df, symbols)
+    if old != new:
+        raise SystemExit('旧実装と結果が一致しません')
+
+    old_s = best_of(lambda: legacy_rows(df, symbols), args.repeat)
+    new_s = best_of(lambda: batch_frame_to_rows(df, symbols), args.repeat)
+    bars = sum(len(rows) for rows in new.values())
+    print(f'{len(symbols)}銘柄 × {len(df)}本（変換後 {bars}本、{len(new)}銘柄）')
+    print(f'  iterrows            {old_s * 1000:8.1f}ms')
+    print(f'  batch_frame_to_rows {new_s * 1000:8.1f}ms  ({old_s / new_s:.0f}倍)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""起動時の import にかかる時間を `python -X importtime` で計る。
+
+    python benchmarks/bench_import_time.py [--module app] [--top 25] [--save]
+
+別プロセスで `import <module>` だけを実行し、-X importtime の出力から
+合計時間と、累積時間の大きいモジュール上位を出す。スケジューラは起動させない
+（ENABLE_SCHEDULER=false）。重い依存（pandas / yfinance / matplotlib / openai）が
+起動時に読み込まれていないかも確認する。
+
+--save を付けると benchmarks/importtime_<module>.txt に結果を書く
+（変更の前後を比べるための記録。数値はマシンで変わるので比率を見る）。
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# 起動時には読み込まれていてほしくないもの
+HEAVY = ('pandas', 'numpy', 'yfinance', 'yahooquery', 'matplotlib', 'openai')
+
+
+def measure(module):
+    """[(自身のμ秒, 累積のμ秒, 深さ, モジュール名)] と、終了までの総μ秒を返す"""
+    env = dict(os.environ, ENABLE_SCHEDULER='false', PYTHONDONTWRITEBYTECODE='1')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=False)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        # "import time:      1594 |       1594 |     apscheduler.triggers"
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    if proc.returncode != 0:
+        raise SystemExit(f'import {module} に失敗しました:\n{proc.stderr[-2000:]}')
+    total = next((c for _, c, d, n in reversed(rows) if n == module), 0)
+    return rows, total
+
+
+def report(module, rows, total, top):
+    loaded = {name for *_, name in rows}
+    lines = [f'import {module}: {total / 1e6:.2f}秒 (-X importtime, {len(rows)}モジュール)', '']
+    lines.append('累積時間の上位:')
+    for self_us, cumulative_us, depth, name in sorted(rows, key=lambda r: -r[1])[:top]:
+        lines.append(f'  {cumulative_us / 1000:8.1f}ms  {"  " * depth}{name}')
+    lines.append('')
+    lines.append('重い依存の読み込み:')
+    for name in HEAVY:
+        lines.append(f'  {name:<12} {"読み込まれる" if name in loaded else "読み込まれない"}')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--module', default='app')
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--save', action='store_true')
+    args = parser.parse_args()
+
+    rows, total = measure(args.module)
+    text = report(args.module, rows, total, args.top)
+    print(text)
+    if args.save:
+        path = os.path.join(ROOT, 'benchmarks', f'importtime_{args.module}.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f'保存: {os.path.relpath(path, ROOT)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""全銘柄のGC/DC検出を、1銘柄ずつの detect_crosses と比べる。
+
+    python benchmarks/bench_ma_cross.py [--stocks 4000] [--bars 245]
+
+夜間の ma_cross.calculate_for_all（約4,000銘柄 × 日足1年）を想定した計測。
+calculate_for_all と同じ道（build_pair_states で行列にまとめて状態を作り、
+pair_results で結果を出す）を、BATCH_SIZE 銘柄ずつ計る。
+保存形式（encode_ohlc）の日足から計るものと、decode 済みの列から計るもの
+（calculate_for_all は読んだときに decode する）の両方を出す。
+本数の違う銘柄（新規上場）・欠損も混ぜ、結果が一致することも確かめる。
+あわせて、保存した状態（ma_state）から1本だけ進める普段の夜間の処理
+（advance_pair_states）と、MA_PAIRS の組をまとめて作る場合（組ごとに別々に
+作る場合との比較）も計る。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import ma_cross
+import price_history as ph
+
+DAY = 86400
+
+# 5/25日の組だけ（detect_crosses と比べる）
+PAIR = (('d5_25', 'daily', ma_cross.SHORT_WINDOW, ma_cross.LONG_WINDOW),)
+EMPTY = {'crosses': [], 'latest_gc_date': None, 'latest_dc_date': None, 'cross_count': 0}
+
+
+def make_series(stocks, bars, seed=0):
+    rng = np.random.default_rng(seed)
+    start = 1735776000
+    out = []
+    for i in range(stocks):
+        n = bars if i % 20 else int(rng.integers(10, bars))
+        closes = np.round(1000 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 1).tolist()
+        if i % 50 == 0:
+            closes[int(rng.integers(0, n))] = None
+        rows = [{'time': start + j * DAY, 'open': c, 'high': c, 'low': c, 'close': c}
+                for j, c in enumerate(closes)]
+        out.append(ph.encode_ohlc(rows))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stocks', type=int, default=4000)
+    parser.add_argument('--bars', type=int, default=245)
+    args = parser.parse_args()
+
+    series = make_series(args.stocks, args.bars)
+    decoded = [ph.decode_ohlc(s) for s in series]
+
+    def per_stock(inputs):
+        return [ma_cross.detect_crosses(s) for s in inputs]
+
+    def batched(inputs):
+        out = []
+        for i in range(0, len(inputs), ma_cross.BATCH_SIZE):
+            built = ma_cross.build_pair_states(inputs[i:i + ma_cross.BATCH_SIZE], PAIR)
+            out.extend(ma_cross.pair_results(states, pairs=PAIR)['d5_25'] if states else EMPTY
+                       for states in built)
+        return out
+
+    timings = {}
+    for label, inputs in (('保存形式から', series), ('decode 済みから', decoded)):
+        for name, fn in (('detect_crosses（1銘柄ずつ）', per_stock),
+                         ('build_pair_states', batched)):
+            started = time.perf_counter()
+            result = fn(inputs)
+            timings[label, name] = (time.perf_counter() - started, result)
+
+    results = [r for _, r in timings.values()]
+    if any(r != results[0] for r in results):
+        raise SystemExit('detect_crosses と結果が一致しません')
+
+    crosses = sum(r['cross_count'] for r in results[0])
+    print(f'{args.stocks}銘柄 × {args.bars}本（交差 {crosses}件）')
+    for label in ('保存形式から', 'decode 済みから'):
+        old_s = timings[label, 'detect_crosses（1銘柄ずつ）'][0]
+        new_s = timings[label, 'build_pair_states'][0]
+        print(f'  {label}')
+        print(f'    detect_crosses（1銘柄ずつ） {old_s:6.2f}秒')
+        print(f'    build_pair_states           {new_s:6.2f}秒  （{old_s / new_s:.1f}倍）')
+
+    # 前の晩までの状態（最後の1本を除いた日足から作ったもの）を、今晩の日足で進める
+    previous = ma_cross.build_pair_states(
+        [{'time': d['time'][:-1], 'close': d['close'][:-1]} for d in decoded])
+    started = time.perf_counter()
+    rebuilt = ma_cross.build_pair_states(decoded)
+    rebuild_s = time.perf_counter() - started
+    started = time.perf_counter()
+    advanced = [ma_cross.advance_pair_states(s, d) if s else None
+                for s, d in zip(previous, decoded)]
+    advance_s = time.perf_counter() - started
+    if [a or r for a, r in zip(advanced, rebuilt)] != rebuilt:
+        raise SystemExit('1本進めた状態が、頭から作った状態と一致しません')
+    print(f'  状態（ma_state。MA_PAIRS の{len(ma_cross.MA_PAIRS)}組）')
+    print(f'    build_pair_states（作り直し）     {rebuild_s:6.2f}秒')
+    print(f'    advance_pair_states（1本進める）  {advance_s:6.2f}秒')
+
+    # MA_PAIRS: 組ごとに保存形式から読み直して作る場合と、まとめて作る場合
+    started = time.perf_counter()
+    for pair in ma_cross.MA_PAIRS:
+        ma_cross.build_pair_states([ph.decode_ohlc(s) for s in series], (pair,))
+    separate_s = time.perf_counter() - started
+    started = time.perf_counter()
+    ma_cross.build_pair_states([ph.decode_ohlc(s) for s in series])
+    together_s = time.perf_counter() - started
+    print(f'  MA_PAIRS（{len(ma_cross.MA_PAIRS)}組）を保存形式から作る')
+    print(f'    組ごとに別々                   {separate_s:6.2f}秒')
+    print(f'    build_pair_states（まとめて）  {together_s:6.2f}秒  （{separate_s / together_s:.1f}倍）')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""日足10年分の週足・月足への集約を、Python の旧実装と比べる。
+
+    python benchmarks/bench_resample.py [--stocks 200] [--bars 2500]
+
+全銘柄の長期足を先に作っておく処理（10年 ≒ 2,500本 × 約4,000銘柄）を
+想定した計測。新しい側は _fetch_and_save_long_term と同じく、yfinance の
+DataFrame から列のまま受け取った10年分（fetch_ohlc(columns=True)）から
+週足・月足の両方を作り、保存用の行にするところまでを計る。
+旧実装と結果が一致することも確かめる。
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import price_history as ph
+
+DAY = 86400
+
+
+def make_rows(bars, seed):
+    rng = np.random.default_rng(seed)
+    closes = 1000 * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+    start = 1104505200   # 2005-01-01 00:00 JST
+    times = start + (np.arange(bars) * 7 // 5) * DAY   # 週5本のつもり
+    return [{'time': int(t), 'open': float(c), 'high': float(c) * 1.01,
+             'low': float(c) * 0.99, 'close': float(c)} for t, c in zip(times, closes)]
+
+
+def legacy_downsample(rows, granularity):
+    """置き換え前の price_history.downsample"""
+    buckets, order = {}, []
+    for r in rows:
+        d = datetime.fromtimestamp(r['time'] + ph._LOCAL_DATE_OFFSET, tz=timezone.utc)
+        if granularity == 'weekly':
+            iso = d.isocalendar()
+            key = (iso[0], iso[1])
+        else:
+            key = (d.year, d.month)
+        if key not in buckets:
+            buckets[key] = {'time': r['time'], 'open': r['open'], 'high': r['high'],
+                            'low': r['low'], 'close': r['close']}
+            order.append(key)
+            continue
+        b = buckets[key]
+        if r['high'] is not None:
+            b['high'] = r['high'] if b['high'] is None else max(b['high'], r['high'])
+        if r['low'] is not None:
+            b['low'] = r['low'] if b['low'] is None else min(b['low'], r['low'])
+        b['close'] = r['close']
+    return [buckets[k] for k in order]
+
+
+def legacy(all_rows):
+    return [(legacy_downsample(r, 'weekly'), legacy_downsample(r, 'monthly')) for r in all_rows]
+
+
+def vectorized(all_columns):
+    out = []
+    for bars in all_columns:
+        out.append((ph.columns_to_rows(ph.resample_ohlc(bars, 'weekly')),
+                    ph.columns_to_rows(ph.resample_ohlc(bars, 'monthly'))))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stocks', type=int, default=200)
+    parser.add_argument('--bars', type=int, default=2500)
+    args = parser.parse_args()
+
+    all_rows = [make_rows(args.bars, seed) for seed in range(args.stocks)]
+    all_columns = [ph.decode_ohlc(rows) for rows in all_rows]
+
+    started = time.perf_counter()
+    old = legacy(all_rows)
+    old_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    new = vectorized(all_columns)
+    new_s = time.perf_counter() - started
+
+    if old != new:
+        raise SystemExit('旧実装と結果が一致しません')
+
+    # 行を作らず、保存形式（encode_ohlc）に直接詰める場合
+    started = time.perf_counter()
+    for bars in all_columns:
+        ph.encode_ohlc(ph.resample_ohlc(bars, 'weekly'))
+        ph.encode_ohlc(ph.resample_ohlc(bars, 'monthly'))
+    encode_s = time.perf_counter() - started
+    per_4000 = 4000 / args.stocks
+    print(f'{args.stocks}銘柄 × {args.bars}本 → 週足・月足')
+    print(f'  Python（旧）   {old_s:7.2f}秒  （4,000銘柄なら約{old_s * per_4000:.0f}秒）')
+    print(f'  resample_ohlc  {new_s:7.2f}秒  （4,000銘柄なら約{new_s * per_4000:.0f}秒、'
+          f'{old_s / new_s:.0f}倍）')
+    print(f'  保存形式へ直接 {encode_s:7.2f}秒  （4,000銘柄なら約{encode_s * per_4000:.0f}秒、'
+          f'{old_s / encode_s:.0f}倍）')
+
+
+if __name__ == '__main__':
+    main()
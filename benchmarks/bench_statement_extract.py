@@ -0,0 +1,111 @@
+"""5年推移の抽出（表引き）と旧ループ実装の速度比較。
+
+    python benchmarks/bench_statement_extract.py [--repeat 2000]
+
+tests/fixtures/statements_7203.json の決算書3表を使い、1銘柄分の抽出を
+repeat 回くり返した時間を比べる。全銘柄バックフィル(約3,900銘柄)で
+この部分にかかるCPU時間の目安も出す。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pandas as pd
+
+from statement_extract import (
+    BALANCE_SERIES, CASHFLOW_SERIES, DEDUPE_SERIES, INCOME_SERIES,
+    extract_equity_ratio, extract_series, label_variations,
+)
+from tests.test_statement_extract import load_fixture
+
+UNIVERSE = 3900
+
+
+def legacy_extract(frames):
+    """表引き化する前のループ実装（列 × 候補ラベル、スカラーアクセス）"""
+    result = {name: [] for table in (INCOME_SERIES, CASHFLOW_SERIES, BALANCE_SERIES)
+              for name, _ in table}
+    result['equity_ratio_list'] = []
+    for frame, table in ((frames['financials'], INCOME_SERIES),
+                         (frames['cashflow'], CASHFLOW_SERIES),
+                         (frames['balance_sheet'], BALANCE_SERIES)):
+        for i in range(min(5, len(frame.columns))):
+            col = frame.columns[i]
+            date_str = col.strftime('%Y-%m-%d')
+            for name, keys in table:
+                for key in keys:
+                    if key in frame.index:
+                        value = frame.loc[key, col]
+                        if pd.notna(value) and not (
+                                name in DEDUPE_SERIES
+                                and any(d['date'] == date_str for d in result[name])):
+                            result[name].append({'date': date_str, 'value': float(value)})
+                            break
+
+    balance_sheet = frames['balance_sheet']
+    for i in range(min(5, len(balance_sheet.columns))):
+        col = balance_sheet.columns[i]
+
+        def _get(labels):
+            for variant in label_variations(labels):
+                if variant in balance_sheet.index:
+                    value = balance_sheet.loc[variant, col]
+                    if pd.notna(value):
+                        return float(value)
+            return None
+
+        equity = _get(['Total Stockholder Equity', 'Total Stockholders Equity',
+                       'Total Equity', "Total shareholders' equity", 'Stockholder Equity'])
+        assets = _get(['Total Assets', 'Total Asset'])
+        liab = _get(['Total Liabilities', 'Total Liab', 'Total Debt'])
+        if assets is None and equity is not None and liab is not None:
+            assets = equity + liab
+        if equity and assets:
+            result['equity_ratio_list'].append({
+                'date': col.strftime('%Y-%m-%d'),
+                'value': round((equity / assets) * 100, 2)})
+    return result
+
+
+def table_extract(frames):
+    result = {}
+    result.update(extract_series(frames['financials'], INCOME_SERIES, dedupe=DEDUPE_SERIES))
+    result.update(extract_series(frames['cashflow'], CASHFLOW_SERIES))
+    result.update(extract_series(frames['balance_sheet'], BALANCE_SERIES))
+    result['equity_ratio_list'] = extract_equity_ratio(frames['balance_sheet'])
+    return result
+
+
+def _time(func, frames, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(frames)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    frames, _ = load_fixture()
+    if legacy_extract(frames) != table_extract(frames):
+        print('旧実装と結果が一致しません')
+        return 1
+
+    legacy = _time(legacy_extract, frames, args.repeat)
+    table = _time(table_extract, frames, args.repeat)
+    print(f'旧ループ実装: {legacy * 1000:.3f} ms/銘柄'
+          f'（全{UNIVERSE}銘柄で {legacy * UNIVERSE:.1f} 秒）')
+    print(f'表引き抽出  : {table * 1000:.3f} ms/銘柄'
+          f'（全{UNIVERSE}銘柄で {table * UNIVERSE:.1f} 秒）')
+    print(f'速度比: {legacy / table:.1f}倍')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""株価チャート（PNG）の描画。分析とは切り離し、入力の内容で引けるキャッシュを持つ。
+
+背景:
+  _analyze_trend_and_create_chart は分析の途中で matplotlib の図を同期で作り、
+  polyfit を2回回して PNG を書き、ルート側でそれを base64 にしていた。
+  図の生成は1リクエストで最も重いCPU処理の1つで、gunicorn の8スレッドの
+  1本を描画の間ずっと塞ぐ。しかも画面のチャートは price_history から
+  Lightweight Charts で描いており、PNG を使うのは API の利用者だけ。
+
+方針:
+  - 分析では描画しない。描画に要る入力（日付・終値・トレンド）を register し、
+    入力のハッシュをキーにした URL（/api/stock/chart/<key>.png）だけを返す
+  - PNG は URL が初めて読まれたときに描く。同じキーの同時描画は SingleFlight で1本にする
+  - 描いた PNG はキーごとに保持する。入力が同じなら同じキーなので、描き直さない
+  - 図は pyplot を使わず Agg の Figure を使い回す（プールから借りて clf して返す）。
+    pyplot のグローバル状態をスレッド間で共有しないため
+  - 入力・PNG とも件数に上限を持ち、古いものから捨てる
+"""
+
+import hashlib
+import io
+import json
+import queue
+import threading
+from collections import OrderedDict
+
+from lazy_imports import LazyModule
+from single_flight import SingleFlight
+from trend_stats import trend_stats
+
+
+def _configure_fonts(matplotlib):
+    # 日本語フォント設定
+    matplotlib.rcParams['font.sans-serif'] = ['Yu Gothic', 'Meiryo', 'Hiragino Sans', 'MS Gothic']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+
+
+# numpy は入力を預かるとき、matplotlib は初めて描くときに読み込む（起動では読まない）
+np = LazyModule('numpy')
+_matplotlib = LazyModule('matplotlib', on_load=_configure_fonts)
+_agg = LazyModule('matplotlib.backends.backend_agg')
+_figure = LazyModule('matplotlib.figure')
+mdates = LazyModule('matplotlib.dates')
+
+# 使い回す Figure の数（= 同時に描ける数）
+FIGURE_POOL_SIZE = 2
+
+# 保持する入力と PNG の件数
+MAX_SPECS = 1024
+MAX_PNGS = 256
+
+FIGSIZE = (12, 6)
+DPI = 100
+
+URL_TEMPLATE = '/api/stock/chart/{key}.png'
+
+
+def chart_key(symbol, period, times, closes, trend_label=None):
+    """描画の入力から決まるキー（sha256 の先頭24桁）"""
+    payload = json.dumps([symbol, period, trend_label, list(times),
+                          [None if c is None else round(float(c), 6) for c in closes]],
+                         separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:24]
+
+
+class _FigurePool:
+    """Agg の Figure を作り置きして貸し出す"""
+
+    def __init__(self, size):
+        self._pool = queue.LifoQueue()
+        _matplotlib.rcParams   # フォント設定を先に済ませる
+        for _ in range(size):
+            fig = _figure.Figure(figsize=FIGSIZE, dpi=DPI)
+            _agg.FigureCanvasAgg(fig)
+            self._pool.put(fig)
+
+    def borrow(self):
+        return self._pool.get()
+
+    def give_back(self, fig):
+        fig.clf()
+        self._pool.put(fig)
+
+
+class ChartRenderer:
+    """チャートの入力を預かり、URL が読まれたら描く"""
+
+    def __init__(self, pool_size=FIGURE_POOL_SIZE, max_specs=MAX_SPECS, max_pngs=MAX_PNGS):
+        self._pool_size = pool_size
+        self._figures = None
+        self._lock = threading.Lock()
+        self._specs = OrderedDict()
+        self._pngs = OrderedDict()
+        self._max_specs = max_specs
+        self._max_pngs = max_pngs
+        self._flights = SingleFlight('chart')
+        self.rendered = 0
+        self.hits = 0
+
+    def register(self, symbol, period, times, closes, trend_label=None):
+        """描画の入力を預け、キーを返す。ここでは描かない
+
+        Args:
+            times: 各足の UNIX 秒
+            closes: 各足の終値（欠損は None / NaN）
+            trend_label: トレンド線を引くときのラベル（Up / Down / Flat）。None なら引かない
+        """
+        key = chart_key(symbol, period, times, closes, trend_label)
+        spec = {
+            'symbol': symbol,
+            'period': period,
+            'times': np.asarray(times, dtype='int64'),
+            'closes': np.asarray([np.nan if c is None else c for c in closes], dtype=float),
+            'trend_label': trend_label,
+        }
+        with self._lock:
+            self._specs[key] = spec
+            self._specs.move_to_end(key)
+            while len(self._specs) > self._max_specs:
+                self._specs.popitem(last=False)
+        return key
+
+    def png(self, key):
+        """キーの PNG（bytes）。入力を預かっていなければ None"""
+        with self._lock:
+            data = self._pngs.get(key)
+            if data is not None:
+                self._pngs.move_to_end(key)
+                self.hits += 1
+                return data
+            spec = self._specs.get(key)
+        if spec is None:
+            return None
+        data, _ = self._flights.do(key, lambda: self._render_and_store(key, spec))
+        return data
+
+    def _render_and_store(self, key, spec):
+        data = self.render(spec)
+        with self._lock:
+            self._pngs[key] = data
+            self._pngs.move_to_end(key)
+            while len(self._pngs) > self._max_pngs:
+                self._pngs.popitem(last=False)
+            self.rendered += 1
+        return data
+
+    def _pool(self):
+        with self._lock:
+            if self._figures is None:
+                self._figures = _FigurePool(self._pool_size)
+            return self._figures
+
+    def render(self, spec):
+        """入力から PNG を描く（旧 _analyze_trend_and_create_chart と同じ見た目）"""
+        pool = self._pool()
+        fig = pool.borrow()
+        try:
+            # UNIX 秒 → matplotlib の日付数値
+            dates = spec['times'] / 86400.0 + mdates.date2num(np.datetime64('1970-01-01T00:00:00'))
+            closes = spec['closes']
+            ax = fig.add_subplot(1, 1, 1)
+            ax.plot(dates, closes, label='終値', color='#1f77b4', linewidth=1.5)
+
+            mask = ~np.isnan(closes)
+            line = trend_stats(closes, x=dates) if spec['trend_label'] else None
+            if line:
+                ax.plot(dates[mask], line['slope'] * dates[mask] + line['intercept'],
+                        label=f"トレンド ({spec['trend_label']})",
+                        color='red', linestyle='--', alpha=0.6)
+
+            ax.set_title(f"{spec['symbol']} - {spec['period']}の株価推移", fontsize=14, fontweight='bold')
+            ax.set_xlabel('日付', fontsize=11)
+            ax.set_ylabel('株価', fontsize=11)
+            ax.grid(True, alpha=0.3)
+            ax.legend(loc='best')
+            ax.xaxis_date()
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+            ax.xaxis.set_major_locator(mdates.MonthLocator(interval=3))
+            for tick in ax.get_xticklabels():
+                tick.set_rotation(45)
+            fig.tight_layout()
+
+            buf = io.BytesIO()
+            fig.savefig(buf, format='png', dpi=DPI, bbox_inches='tight', facecolor='white')
+            return buf.getvalue()
+        finally:
+            pool.give_back(fig)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'specs': len(self._specs),
+                'pngs': len(self._pngs),
+                'rendered': self.rendered,
+                'hits': self.hits,
+            }
+
+
+# プロセスで1つ
+renderer = ChartRenderer()
+
+
+def chart_url(key):
+    return URL_TEMPLATE.format(key=key)
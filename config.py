@@ -1,5 +1,5 @@
 import os
-import openai
+from lazy_imports import LazyModule
 from urllib.parse import quote_plus
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
@@ -111,7 +111,8 @@ GOOGLE_API = os.getenv('GOOGLE_API_KEY', '')
 
 # GPT API
 GPT_API = os.getenv('OPENAI_API_KEY', '')
-openai.api_key = GPT_API
+# openai は読み込みが重い（起動時間の1割強）。初めて使うときに読み込んでキーを設定する
+openai = LazyModule('openai', on_load=lambda module: setattr(module, 'api_key', GPT_API))
 
 # LINE
 LINE_SEND_URL = 'https://api.line.me/v2/bot/message/push'
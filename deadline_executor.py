@@ -0,0 +1,185 @@
+"""画面のリクエストの中で外部を待つ処理に上限時間を付ける、プロセス共通のスレッド置き場。
+
+背景:
+  price_history.call_with_deadline は呼ぶたびに ThreadPoolExecutor を作っては
+  捨てていた。時間切れになったスレッドは止められないので裏で走り続けるが、
+  何本残っているかを誰も数えていない。Yahoo が詰まっている間に画面が
+  開かれ続けると、時間切れのスレッドが同じ相手に向かって積み上がる。
+  分析（/api/stock/analyze）は with ThreadPoolExecutor で待っていたため、
+  時間切れでも with を抜けるところで分析の完了まで待たされていた。
+
+方針:
+  - スレッドはプロセスで1つの置き場（本数固定）から借りる
+  - 時間切れで呼び出し側が諦めたあとも走り続けている処理を「置き去り」として
+    相手（upstream）ごとに数え、どれだけ超過しているかを出す
+  - 同じ相手への置き去りが上限（ORPHAN_LIMITS）まで溜まっていたら、
+    新しい処理は受け付けない（DeadlineRejected）。詰まっている相手に
+    さらに積んでも、時間切れの置き去りが増えるだけなので
+  - 上限時間は処理が始まってから数える。置き場の空き待ちで上限を食われると、
+    始まってもいない処理が時間切れになる。空き待ちは別に同じ秒数まで待ち、
+    それでも始まらなければ取り消す（置き去りにしない）
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as _FuturesTimeout
+
+# 相手ごとの置き去りの上限
+ORPHAN_LIMITS = {
+    'yfinance': 3,   # チャートの足の取得（price_history）
+    'holders': 2,    # 株主・役員のオンデマンド取得
+    'analyze': 2,    # 画面からの分析
+}
+DEFAULT_ORPHAN_LIMIT = 2
+
+# gunicorn のスレッド数（render.yaml の --threads）。1リクエストが同時に借りるのは1本
+REQUEST_THREADS = 8
+
+# 置き場のスレッド数。置き去りが上限まで溜まっていても、全リクエストが
+# 同時に1本ずつ借りられるだけ残す（SingleFlight の相乗りも1本使う）
+MAX_WORKERS = REQUEST_THREADS + sum(ORPHAN_LIMITS.values())
+
+
+class DeadlineExceeded(TimeoutError):
+    """上限時間までに終わらなかった（処理は裏で走り続けることがある）"""
+
+
+class DeadlineRejected(Exception):
+    """同じ相手への置き去りが上限まで溜まっているので受け付けなかった"""
+
+
+class _Orphan:
+    __slots__ = ('upstream', 'name', 'deadline_at')
+
+    def __init__(self, upstream, name, deadline_at):
+        self.upstream = upstream
+        self.name = name
+        self.deadline_at = deadline_at
+
+
+class DeadlineExecutor:
+    """上限時間つきで処理を走らせる。スレッドから同時に使ってよい。
+
+    Args:
+        max_workers: 置き場のスレッド数
+        orphan_limits: {相手: 置き去りの上限}。無い相手は default_orphan_limit
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, orphan_limits=None,
+                 default_orphan_limit=DEFAULT_ORPHAN_LIMIT, name='deadline',
+                 clock=time.monotonic):
+        self.name = name
+        self.max_workers = max_workers
+        self.orphan_limits = dict(ORPHAN_LIMITS if orphan_limits is None else orphan_limits)
+        self.default_orphan_limit = default_orphan_limit
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pool = None
+        self._orphans = {}   # {future: _Orphan}
+        self.completed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.rejected = {}
+
+    def _executor(self):
+        # import 時にスレッドの置き場を作らない（使われるまで作らない）
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix=self.name)
+            return self._pool
+
+    def orphan_count(self, upstream):
+        with self._lock:
+            return sum(1 for o in self._orphans.values() if o.upstream == upstream)
+
+    def run(self, func, seconds, upstream='default', name=None):
+        """func を seconds 以内に終わらせ、その戻り値を返す。
+
+        Raises:
+            DeadlineRejected: upstream への置き去りが上限まで溜まっている
+            DeadlineExceeded: 始まってから seconds 以内に終わらなかった。
+                空きを seconds 待っても始まらなかったときも
+            func が投げた例外はそのまま
+        """
+        limit = self.orphan_limits.get(upstream, self.default_orphan_limit)
+        if self.orphan_count(upstream) >= limit:
+            with self._lock:
+                self.rejected[upstream] = self.rejected.get(upstream, 0) + 1
+            raise DeadlineRejected(
+                f'{upstream} への処理が{limit}件、時間切れのまま走り続けています')
+
+        started = threading.Event()
+        began = {}
+
+        def task():
+            began['at'] = self._clock()
+            started.set()
+            return func()
+
+        future = self._executor().submit(task)
+        if not started.wait(seconds) and future.cancel():
+            # 置き場が埋まっていて始まってもいなかった
+            with self._lock:
+                self.cancelled += 1
+            raise DeadlineExceeded(f'{upstream}: {seconds}秒待っても始まりませんでした')
+        started.wait()
+        try:
+            # 上限は始まってから数える
+            value = future.result(timeout=max(0.0, began['at'] + seconds - self._clock()))
+        except _FuturesTimeout:
+            self._orphan(future, upstream, name or getattr(func, '__name__', ''),
+                         self._clock())
+            raise DeadlineExceeded(f'{upstream}: {seconds}秒を超えました') from None
+        with self._lock:
+            self.completed += 1
+        return value
+
+    def _orphan(self, future, upstream, name, deadline_at):
+        with self._lock:
+            self.timed_out += 1
+            self._orphans[future] = _Orphan(upstream, name, deadline_at)
+
+        def done(f):
+            with self._lock:
+                orphan = self._orphans.pop(f, None)
+            if orphan is not None:
+                print(f'{self.name}: 時間切れの処理が終わりました {orphan.upstream} {orphan.name}'
+                      f'（上限から{self._clock() - orphan.deadline_at:.1f}秒超過）')
+
+        # 既に終わっていればその場で呼ばれる
+        future.add_done_callback(done)
+
+    def snapshot(self):
+        """管理画面・ログ用。置き去りは相手ごとの件数と、上限からの最大超過秒数"""
+        now = self._clock()
+        with self._lock:
+            orphans = {}
+            for o in self._orphans.values():
+                entry = orphans.setdefault(o.upstream, {'count': 0, 'max_overrun_seconds': 0.0})
+                entry['count'] += 1
+                entry['max_overrun_seconds'] = round(
+                    max(entry['max_overrun_seconds'], now - o.deadline_at), 1)
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'orphan_limits': dict(self.orphan_limits),
+                'orphans': orphans,
+                'completed': self.completed,
+                'timed_out': self.timed_out,
+                'cancelled': self.cancelled,
+                'rejected': dict(self.rejected),
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_executor():
+    """アプリ既定の置き場（プロセスで1つ）"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = DeadlineExecutor()
+        return _default
@@ -22,6 +22,8 @@ import time
 import requests
 from bs4 import BeautifulSoup
 
+import upstream_limiter
+
 HEADERS = {
     'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
                    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'),
@@ -42,6 +44,7 @@ def _scrape_mode(mode):
     """1ページ分の銘柄コードと社名を取り出す"""
     url = BASE + mode
     try:
+        upstream_limiter.acquire('kabutan', max_wait=None)
         response = requests.get(url, headers=HEADERS, timeout=15)
         response.encoding = response.apparent_encoding
         if response.status_code != 200:
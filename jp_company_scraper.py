@@ -6,6 +6,8 @@ from bs4 import BeautifulSoup
 import re
 import time
 
+import upstream_limiter
+
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -31,12 +33,15 @@ def get_officers_from_jlic(stock_code: str, with_status: bool = False):
         url = f'https://j-lic.com/companies/{code}/directors'
         print(f'役員データ取得中: {url}')
 
+        upstream_limiter.acquire('jlic')
         response = requests.get(url, headers=HEADERS, timeout=15)
         status['http_status'] = response.status_code
         response.encoding = 'utf-8'
 
         if response.status_code != 200:
             print(f'役員データ取得失敗: HTTP {response.status_code}')
+            if response.status_code in (403, 429):
+                upstream_limiter.penalize('jlic')
             status['status'] = ('rate_limited' if response.status_code in (403, 429)
                                 else 'no_data' if response.status_code == 404
                                 else 'source_error')
@@ -84,6 +89,9 @@ def get_officers_from_jlic(stock_code: str, with_status: bool = False):
         print(f'役員データ取得成功: {len(officers)}名')
         status['status'] = 'success' if officers else 'no_data'
 
+    except upstream_limiter.UpstreamThrottled as e:
+        status['status'] = 'rate_limited'
+        status['error'] = str(e)
     except requests.exceptions.Timeout:
         print('役員データ取得タイムアウト')
         status['status'] = 'timeout'
@@ -150,12 +158,15 @@ def get_shareholders_from_strainer(stock_code: str, with_status: bool = False):
         url = f'https://strainer.jp/companies/JP-{code}/ownership'
         print(f'大株主データ取得中: {url}')
 
+        upstream_limiter.acquire('strainer')
         response = requests.get(url, headers=HEADERS, timeout=15)
         status['http_status'] = response.status_code
         response.encoding = 'utf-8'
 
         if response.status_code != 200:
             print(f'大株主データ取得失敗: HTTP {response.status_code}')
+            if response.status_code in (403, 429):
+                upstream_limiter.penalize('strainer')
             status['status'] = ('rate_limited' if response.status_code in (403, 429)
                                 else 'no_data' if response.status_code == 404
                                 else 'source_error')
@@ -229,6 +240,9 @@ def get_shareholders_from_strainer(stock_code: str, with_status: bool = False):
         print(f'大株主データ取得成功: {len(shareholders)}名')
         status['status'] = 'success' if shareholders else 'no_data'
 
+    except upstream_limiter.UpstreamThrottled as e:
+        status['status'] = 'rate_limited'
+        status['error'] = str(e)
     except requests.exceptions.Timeout:
         print('大株主データ取得タイムアウト')
         status['status'] = 'timeout'
@@ -0,0 +1,96 @@
+"""重い依存（pandas / yfinance / matplotlib / openai）を初めて使うときに読み込む。
+
+背景:
+  app.py は StockAnalyzer をモジュールの先頭で import しており、それだけで
+  pandas・numpy・yfinance・matplotlib まで読み込まれる。config.py の openai、
+  models/financial_analysis.py の Excel 読み込みも同じで、gunicorn の起動は
+  画面を1枚も返さないうちに数秒かかっていた。worker が1本なので、
+  その間はデプロイのたびにサービスが止まる。backfill_*.py も app.py の
+  ヘルパーを使うために同じ分を払っている。
+
+方針:
+  - LazyModule: モジュールの代わりに置き、属性を初めて読んだときに import する
+  - lazy_attr: モジュールの中の1つ（クラス・関数・オブジェクト）の代わりに置き、
+    呼ぶ・属性を読むときに import する。`from x import Y` を置き換える用
+  - 一度読み込んだら本体をそのまま返す（2回目以降の負担は属性参照1回分）
+  - 計測は benchmarks/bench_import_time.py（python -X importtime の集計）
+"""
+
+import importlib
+import threading
+
+_lock = threading.RLock()
+
+
+class LazyModule:
+    """属性を初めて読んだときに import するモジュールの代役
+
+    Args:
+        name: モジュール名
+        on_load: 読み込んだ直後にモジュールを渡して呼ぶ関数（api_key の設定など）
+    """
+
+    def __init__(self, name, on_load=None):
+        self.__dict__['_name'] = name
+        self.__dict__['_on_load'] = on_load
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with _lock:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    on_load = self.__dict__['_on_load']
+                    if on_load is not None:
+                        on_load(module)
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<LazyModule {self.__dict__['_name']!r} ({state})>"
+
+
+class _LazyAttr:
+    """モジュールの中の1つを、呼ぶ・属性を読むときに取り出す代役"""
+
+    def __init__(self, module, attr):
+        self._module = LazyModule(module) if isinstance(module, str) else module
+        self._attr = attr
+        self._target = None
+
+    def _resolve(self):
+        if self._target is None:
+            self._target = getattr(self._module, self._attr)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self._resolve(), attr)
+
+    def __repr__(self):
+        return f"<lazy {self._attr}>"
+
+
+def lazy_attr(module, attr):
+    """`from module import attr` の代わり。初めて使うときに import する"""
+    return _LazyAttr(module, attr)
+
+
+def is_loaded(proxy):
+    """代役の中身が読み込み済みか（テスト・計測用）"""
+    if isinstance(proxy, _LazyAttr):
+        return proxy._target is not None
+    return proxy.__dict__.get('_module') is not None
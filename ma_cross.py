@@ -20,6 +20,19 @@ from datetime import datetime, timezone
 SHORT_WINDOW = 5
 LONG_WINDOW = 25
 
+# 夜間にまとめて計算する移動平均の組。(キー, 足, 短期, 長期)
+# キーは d=日足・w=週足 ＋ 日数（週数）。ma_crosses.pairs と
+# screened_latest.ma_pairs のキーになり、スクリーナーの cross_pair でも使う。
+# 週足は日足1年分から集約する（長期線が引けるのは直近の約半年）。
+MA_PAIRS = (
+    ('d5_25', 'daily', SHORT_WINDOW, LONG_WINDOW),
+    ('d25_75', 'daily', 25, 75),
+    ('w13_26', 'weekly', 13, 26),
+)
+
+# 従来の列（latest_gc_date / latest_dc_date / crosses）に入れる組
+PRIMARY_PAIR = 'd5_25'
+
 # 取引所ローカルの日付に正規化するオフセット（price_history と同じ考え方）
 _LOCAL_DATE_OFFSET = 12 * 3600
 
@@ -28,6 +41,16 @@ def _to_date(unix_sec):
     return datetime.fromtimestamp(unix_sec + _LOCAL_DATE_OFFSET, tz=timezone.utc).date().isoformat()
 
 
+def _day_of(unix_sec):
+    """UNIX秒を日の番号にする（_to_date と同じ区切り）。
+
+    日足の time は取り方で違う。fetch_ohlc（Ticker.history）は JST 0時
+    （前日15時UTC）、fetch_prices_batch（yf.download）は UTC 0時になる。
+    同じ日の足かどうかは、秒のままではなくこの番号で比べる。
+    """
+    return (int(unix_sec) + _LOCAL_DATE_OFFSET) // 86400
+
+
 def _sma(values, window):
     """単純移動平均。window未満の位置は None を入れて長さを揃える。"""
     out = []
@@ -44,28 +67,33 @@ def detect_crosses(rows, short_window=SHORT_WINDOW, long_window=LONG_WINDOW):
     """日足から交差を検出する。
 
     Args:
-        rows: [{time: UNIX秒, close: 終値}, ...] を古い順で
+        rows: 保存済みの日足（列の形・[{time: UNIX秒, close: 終値}, ...] のどちらでも。
+              price_history.decode_ohlc で読む）
     Returns:
         {'crosses': [{'date': 'YYYY-MM-DD', 'type': 'gc'|'dc'}, ...],
          'latest_gc_date': str|None, 'latest_dc_date': str|None, 'cross_count': int}
     """
+    import numpy as np
+    import price_history as ph
+
     empty = {'crosses': [], 'latest_gc_date': None, 'latest_dc_date': None, 'cross_count': 0}
-    if not rows:
+    if rows is None or len(rows) == 0:
         return empty
 
-    data = [r for r in rows if r and r.get('close') is not None and r.get('time') is not None]
-    data.sort(key=lambda r: r['time'])
-    if len(data) < long_window + 1:
+    bars = ph.decode_ohlc(rows)
+    keep = ~np.isnan(bars['close'])
+    times = bars['time'][keep].tolist()
+    if len(times) < long_window + 1:
         # 長期線が引けるだけの本数が無い（新規上場銘柄など）
         return empty
 
-    closes = [float(r['close']) for r in data]
+    closes = bars['close'][keep].tolist()
     short_ma = _sma(closes, short_window)
     long_ma = _sma(closes, long_window)
 
     crosses = []
     prev_diff = None
-    for i in range(len(data)):
+    for i in range(len(times)):
         s, l = short_ma[i], long_ma[i]
         if s is None or l is None:
             continue
@@ -73,9 +101,9 @@ def detect_crosses(rows, short_window=SHORT_WINDOW, long_window=LONG_WINDOW):
         if prev_diff is not None and diff != 0:
             # 符号が入れ替わった日を交差日とする
             if prev_diff <= 0 < diff:
-                crosses.append({'date': _to_date(data[i]['time']), 'type': 'gc'})
+                crosses.append({'date': _to_date(times[i]), 'type': 'gc'})
             elif prev_diff >= 0 > diff:
-                crosses.append({'date': _to_date(data[i]['time']), 'type': 'dc'})
+                crosses.append({'date': _to_date(times[i]), 'type': 'dc'})
         if diff != 0:
             prev_diff = diff
 
@@ -89,7 +117,553 @@ def detect_crosses(rows, short_window=SHORT_WINDOW, long_window=LONG_WINDOW):
     }
 
 
-def calculate_for_code(company_code, short_window=SHORT_WINDOW, long_window=LONG_WINDOW):
+# ---------------------------------------------------------------
+# 全銘柄まとめての検出
+# ---------------------------------------------------------------
+#
+# detect_crosses を銘柄ごとに呼ぶと、約4,000銘柄 × 250本で移動平均と交差の
+# 判定が Python のループになる。全銘柄の終値を (銘柄数, 本数) の行列に詰め
+# （短い銘柄は後ろを NaN で埋める）、行列ごとに計算する。ここの関数は、状態を
+# 頭から作るとき（_states_from_decoded → build_pair_states）に使う。
+#
+# 移動平均の窓の合計は、np.cumsum の差（cs[j] - cs[j-w]）ではなく、
+# _sma と同じ「足して・引く」の順で本数の方向に進めて作る。足し算の順番が
+# 変わると丸めが変わり、短期線と長期線がちょうど等しい日（値の動かない銘柄など）の
+# 符号が入れ替わって、detect_crosses と違う交差が出るため。
+# 本数の方向は約250回のループだが、1回ごとに全銘柄ぶんを NumPy で処理する。
+# 計測は benchmarks/bench_ma_cross.py。
+
+# 一度に行列に詰める銘柄数（calculate_for_all が1ページに読む銘柄数で、
+# 進み具合の報告と中断の単位にもなる）
+BATCH_SIZE = 500
+
+
+def _window_means(closes, window, totals_at=None):
+    """(銘柄数, 本数) の終値から単純移動平均の行列を作る。window 未満の位置は NaN
+
+    totals_at（銘柄ごとの位置）を渡すと、その位置での窓の合計も返す（状態を作るとき用）。
+    """
+    import numpy as np
+
+    n, width = closes.shape
+    out = np.full((n, width), np.nan)
+    total = np.zeros(n)
+    captured = np.zeros(n)
+    for i in range(width):
+        total += closes[:, i]
+        if i >= window:
+            total -= closes[:, i - window]
+        if i >= window - 1:
+            out[:, i] = total / window
+        if totals_at is not None:
+            hit = totals_at == i
+            captured[hit] = total[hit]
+    return out if totals_at is None else (out, captured)
+
+
+def _decode_closes(series):
+    """銘柄ごとの日足を (times, closes) の配列にする（終値の欠損は除く。無ければ None）"""
+    import numpy as np
+    import price_history as ph
+
+    decoded = []
+    for rows in series:
+        if rows is None or len(rows) == 0:
+            decoded.append(None)
+            continue
+        bars = ph.decode_ohlc(rows)
+        keep = ~np.isnan(bars['close'])
+        decoded.append((bars['time'][keep], bars['close'][keep]))
+    return decoded
+
+
+def _pack(decoded, usable):
+    """usable の銘柄を (銘柄数, 本数) の行列に詰める（短い銘柄の後ろは NaN）"""
+    import numpy as np
+
+    width = max(len(decoded[j][0]) for j in usable)
+    closes = np.full((len(usable), width), np.nan)
+    times = np.zeros((len(usable), width), dtype=np.int64)
+    for k, j in enumerate(usable):
+        t, c = decoded[j]
+        closes[k, :len(c)] = c
+        times[k, :len(t)] = t
+    return times, closes
+
+
+def _sign_changes(diff):
+    """短期線−長期線の行列から (符号, 各位置までで最後に符号があった位置, 交差した位置) を返す"""
+    import numpy as np
+
+    # 符号。NaN（長期線が引けない・詰め物）と 0 は「符号なし」として飛ばす
+    sign = np.sign(np.nan_to_num(diff, nan=0.0))
+    n, width = diff.shape
+    cols = np.arange(width)
+    # 各位置まで（その位置を含む）で、最後に符号があった位置（無ければ -1）
+    last = np.maximum.accumulate(np.where(sign != 0, cols, -1), axis=1)
+    prev_at = np.concatenate([np.full((n, 1), -1), last[:, :-1]], axis=1)
+    prev_sign = np.where(prev_at >= 0,
+                         np.take_along_axis(sign, np.maximum(prev_at, 0), axis=1), 0)
+    crossed = (sign != 0) & (prev_sign != 0) & (sign != prev_sign)
+    return sign, last, crossed
+
+
+def _cross_dates(times, sign, crossed):
+    """交差した位置ごとに (行, 列, 日付, 種類)。日付は _to_date と同じく取引所ローカル"""
+    import numpy as np
+
+    rows_hit, cols_hit = np.nonzero(crossed)
+    dates = ((times[rows_hit, cols_hit] + _LOCAL_DATE_OFFSET)
+             .astype('datetime64[s]').astype('datetime64[D]').astype(str))
+    kinds = np.where(sign[rows_hit, cols_hit] > 0, 'gc', 'dc')
+    return zip(rows_hit.tolist(), cols_hit.tolist(), dates.tolist(), kinds.tolist())
+
+
+# ---------------------------------------------------------------
+# 銘柄ごとの途中状態（ma_crosses.ma_state）
+# ---------------------------------------------------------------
+#
+# 夜間の再計算は、新しく増えた足が1本でも1年分を頭から計算し直していた。
+# 移動平均は「窓の合計」と「窓に入っている終値」さえあれば1本ずつ進められるので、
+# 銘柄ごとに途中の状態を ma_crosses.ma_state（JSONB）に残し、次からは
+# 増えた足の分だけ進める（1本あたり O(1)）。
+#
+# 状態に持つもの:
+#   tail       … 直近 long_window 本の終値（窓から抜ける値を引くのに要る）
+#   short_sum / long_sum … 窓の合計。_sma と同じ「足して・引く」の順で進めるので、
+#                 頭から計算した場合と丸めまで一致する
+#   prev_sign  … 直前の「短期線 − 長期線」の符号（0 は符号なし）
+#   crosses    … これまでの交差（1年より古いものは落とす）
+#   pending    … 保存済みの最後の1本 [UNIX秒, 終値]
+#
+# 状態が進めるのは「最後の1本を除いた足」まで。最後の1本は場中に取った値の
+# ことがあり、次の取り直しで書き換わるため、確定していない足として pending に
+# 置いておき、結果を出すときだけ仮に進める。
+#
+# 保存済みの日足が書き換わった（分割の調整などで過去の終値が変わった）ときは、
+# 状態の最後の足と日足が食い違うので、そのときだけ頭から作り直す。
+
+STATE_VERSION = 1
+
+# 交差の履歴を残す期間（日足の保存期間と揃える）
+CROSS_HISTORY_SECONDS = 366 * 86400
+
+
+def _closes_of(rows):
+    """日足（detect_crosses が受け取る形のどれでも）から (times, closes) の配列を取り出す"""
+    import numpy as np
+
+    decoded = _decode_closes([rows])[0]
+    if decoded is None:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    return decoded
+
+
+def new_state(short_window=SHORT_WINDOW, long_window=LONG_WINDOW):
+    """足を1本も読んでいない状態"""
+    return {
+        'v': STATE_VERSION,
+        'short_window': short_window,
+        'long_window': long_window,
+        'last_time': None,
+        'count': 0,
+        'tail': [],
+        'short_sum': 0.0,
+        'long_sum': 0.0,
+        'prev_sign': 0,
+        'crosses': [],
+        'pending': None,
+    }
+
+
+def advance_state(state, times, closes):
+    """状態を足の分だけ進めた新しい状態を返す（渡した state は変えない）。
+
+    last_time 以前の足は読み飛ばす。交差の判定は detect_crosses と同じ。
+    """
+    short_window, long_window = state['short_window'], state['long_window']
+    st = dict(state, tail=list(state['tail']), crosses=list(state['crosses']))
+    tail = st['tail']
+    for t, c in zip(times, closes):
+        if st['last_time'] is not None and t <= st['last_time']:
+            continue
+        n = st['count']
+        st['short_sum'] += c
+        if n >= short_window:
+            st['short_sum'] -= tail[-short_window]
+        st['long_sum'] += c
+        if n >= long_window:
+            st['long_sum'] -= tail[-long_window]
+        tail.append(c)
+        if len(tail) > long_window:
+            del tail[0]
+        st['count'] = n + 1
+        st['last_time'] = t
+
+        if n >= long_window - 1:
+            diff = st['short_sum'] / short_window - st['long_sum'] / long_window
+            if diff != 0:
+                sign = 1 if diff > 0 else -1
+                if st['prev_sign'] and sign != st['prev_sign']:
+                    st['crosses'].append({'date': _to_date(t), 'type': 'gc' if sign > 0 else 'dc'})
+                st['prev_sign'] = sign
+
+    st['crosses'] = _trim_crosses(st['crosses'], st['last_time'])
+    return st
+
+
+def _trim_crosses(crosses, last_time):
+    """CROSS_HISTORY_SECONDS より古い交差を落とす"""
+    if not crosses or last_time is None:
+        return crosses
+    oldest = _to_date(last_time - CROSS_HISTORY_SECONDS)
+    return [c for c in crosses if c['date'] >= oldest]
+
+
+def _state_from(times, closes, short_window, long_window):
+    state = advance_state(new_state(short_window, long_window), times[:-1], closes[:-1])
+    state['pending'] = [times[-1], closes[-1]] if times else None
+    return state
+
+
+def _states_from_decoded(decoded, windows):
+    """_decode_closes の結果から、(短期, 長期) の組ごとの状態を頭から作る。
+
+    Returns: 銘柄ごとに、windows と同じ並びの状態の list（足が無い銘柄は None）
+    """
+    import numpy as np
+
+    lengths = np.array([len(d[0]) if d else 0 for d in decoded], dtype=np.int64)
+    out = [[None] * len(windows) if n else None for n in lengths.tolist()]
+    # 確定分だけでは長期線が引けない短い銘柄は、1本ずつ進めても安いので
+    # _state_from で作る
+    for j in np.flatnonzero(lengths).tolist():
+        for w, (short_window, long_window) in enumerate(windows):
+            if lengths[j] < long_window + 2:
+                t, c = decoded[j]
+                out[j][w] = _state_from(t.tolist(), c.tolist(), short_window, long_window)
+
+    usable = np.flatnonzero(lengths >= min(long for _, long in windows) + 2)
+    if not len(usable):
+        return out
+
+    times, closes = _pack(decoded, usable)
+    # 確定した最後の足の位置（最後の1本は pending に置く）
+    ends = lengths[usable] - 2
+    at = np.arange(len(usable))
+    # 窓の合計は日数ごとに1回だけ作り、組どうしで使い回す（5/25 と 25/75 の 25 など）
+    means = {window: _window_means(closes, window, ends)
+             for window in sorted({w for pair in windows for w in pair})}
+
+    for w, (short_window, long_window) in enumerate(windows):
+        (short_ma, short_sums), (long_ma, long_sums) = means[short_window], means[long_window]
+        sign, last, crossed = _sign_changes(short_ma - long_ma)
+        crossed &= np.arange(closes.shape[1]) <= ends[:, None]
+
+        crosses = [[] for _ in usable]
+        for k, _, d, kind in _cross_dates(times, sign, crossed):
+            crosses[k].append({'date': d, 'type': kind})
+        last_at = last[at, ends]
+        prev_sign = np.where(last_at >= 0, sign[at, np.maximum(last_at, 0)], 0)
+
+        for k, j in enumerate(usable.tolist()):
+            if lengths[j] < long_window + 2:
+                continue   # 上で作った短い銘柄
+            end = int(ends[k])
+            t, c = decoded[j]
+            state = new_state(short_window, long_window)
+            state.update(
+                last_time=int(t[end]),
+                count=end + 1,
+                tail=c[end + 1 - long_window:end + 1].tolist(),
+                short_sum=float(short_sums[k]),
+                long_sum=float(long_sums[k]),
+                prev_sign=int(prev_sign[k]),
+                crosses=_trim_crosses(crosses[k], int(t[end])),
+                pending=[int(t[-1]), float(c[-1])],
+            )
+            out[j][w] = state
+    return out
+
+
+def _matches(state, short_window, long_window):
+    """この窓の日数で進められる状態か（足を1本以上読んでいること）"""
+    return bool(state and state.get('v') == STATE_VERSION
+                and state.get('short_window') == short_window
+                and state.get('long_window') == long_window
+                and state.get('last_time') is not None)
+
+
+def _advance_from(state, times, closes, short_window, long_window):
+    """状態を (times, closes) の配列に合わせて進める。作り直しが要るときは None。
+
+    状態が無い・窓の日数が違う・状態の最後の足が日足と食い違う（日足が書き換わった）
+    ときが作り直し。
+    """
+    import numpy as np
+
+    if not _matches(state, short_window, long_window):
+        return None
+    i = int(np.searchsorted(times, state['last_time']))
+    if not (i < len(times) and times[i] == state['last_time']
+            and closes[i] == state['tail'][-1]):
+        return None
+
+    # 状態の最後の足より後ろだけを読む（日足全体を list にすると、1本進めるだけでも
+    # 1年分の変換がかかる）
+    new_times, new_closes = times[i + 1:].tolist(), closes[i + 1:].tolist()
+    state = advance_state(state, new_times[:-1], new_closes[:-1])
+    state['pending'] = [int(times[-1]), float(closes[-1])]
+    return state
+
+
+def state_result(state, quote=None):
+    """状態から detect_crosses と同じ形の結果を出す。
+
+    pending（保存済みの最後の1本）を仮に進めて判定する。quote=(UNIX秒, 価格) を
+    渡すと、場中の株価を「その日の足」として扱う（pending と同じ日なら置き換える）。
+    同じ日かどうかは秒ではなく日付で比べる（_day_of）。
+    """
+    bars = []
+    pending = state.get('pending')
+    if quote is not None and pending and _day_of(quote[0]) < _day_of(pending[0]):
+        quote = None   # 保存済みの足より古い株価は使わない
+    if pending and (quote is None or _day_of(pending[0]) < _day_of(quote[0])):
+        bars.append(pending)
+    if quote is not None:
+        bars.append(quote)
+    crosses = advance_state(state, [b[0] for b in bars], [b[1] for b in bars])['crosses']
+    if state['count'] + len(bars) < state['long_window'] + 1:
+        # detect_crosses と同じく、長期線が引けない銘柄は空
+        crosses = []
+    return {
+        'crosses': crosses,
+        'latest_gc_date': next((c['date'] for c in reversed(crosses) if c['type'] == 'gc'), None),
+        'latest_dc_date': next((c['date'] for c in reversed(crosses) if c['type'] == 'dc'), None),
+        'cross_count': len(crosses),
+    }
+
+
+# ---------------------------------------------------------------
+# 移動平均の組（MA_PAIRS）
+# ---------------------------------------------------------------
+#
+# 組ごとに別のジョブで日足を読み直すのではなく、銘柄の日足を1回 decode して、
+# 日足の組・週足の組をまとめて計算する。窓の合計も日数が同じなら使い回す
+# （_states_from_decoded）。状態は ma_state に {キー: 状態} で持つ。
+
+
+def _week_keys(times):
+    """UNIX秒から週の番号を作る（price_history.resample_ohlc と同じ月曜始まりの区切り）"""
+    return ((times + _LOCAL_DATE_OFFSET) // 86400 + 3) // 7
+
+
+def _weekly(times, closes):
+    """日足の (times, closes) を週足にする。time は週の最初の足、close は週の最後の終値"""
+    import numpy as np
+
+    if not len(times):
+        return times, closes
+    keys = _week_keys(times)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    return times[starts], closes[ends]
+
+
+def _bars_for(times, closes, pairs):
+    """組が使う足を {'daily': (times, closes), 'weekly': (times, closes)} で作る"""
+    bars = {'daily': (times, closes)}
+    if any(kind == 'weekly' for _, kind, _, _ in pairs):
+        bars['weekly'] = _weekly(times, closes)
+    return bars
+
+
+def stored_pair_states(value):
+    """ma_state の中身を {キー: 状態} にする（組が1つだった頃の形も読む）"""
+    if not value:
+        return {}
+    if 'v' in value:
+        return {PRIMARY_PAIR: value}
+    return value
+
+
+def build_pair_states(series, pairs=MA_PAIRS):
+    """複数銘柄の、組ごとの状態を頭からまとめて作る。
+
+    Returns: 銘柄ごとの {キー: 状態} の list（日足が無い銘柄は None）
+    """
+    decoded = _decode_closes(series)
+    out = [{} if d is not None and len(d[0]) else None for d in decoded]
+    for kind in sorted({kind for _, kind, _, _ in pairs}):
+        group = [p for p in pairs if p[1] == kind]
+        bars = [_bars_for(*d, group)[kind] if d is not None else None for d in decoded]
+        built = _states_from_decoded(bars, [(short, long) for _, _, short, long in group])
+        for j, states in enumerate(built):
+            if states:
+                out[j].update({key: state for (key, _, _, _), state in zip(group, states)})
+    return out
+
+
+def advance_pair_states(states, rows, pairs=MA_PAIRS):
+    """保存済みの日足に合わせて組ごとの状態を進める。1つでも作り直しが要れば None"""
+    times, closes = _closes_of(rows)
+    if not len(times):
+        return None
+    bars = _bars_for(times, closes, pairs)
+    out = {}
+    for key, kind, short_window, long_window in pairs:
+        advanced = _advance_from(states.get(key), *bars[kind], short_window, long_window)
+        if advanced is None:
+            return None
+        out[key] = advanced
+    return out
+
+
+def sync_pair_states(states, rows, pairs=MA_PAIRS):
+    """組ごとの状態を進める。進められなければ頭から作り直す。
+
+    Returns: (新しい {キー: 状態}, 作り直したか)
+    """
+    advanced = advance_pair_states(states, rows, pairs)
+    if advanced is not None:
+        return advanced, False
+    return build_pair_states([rows], pairs)[0], True
+
+
+def _weekly_quote(state, quote):
+    """日足の株価を週足の足にする。pending と同じ週なら、その週の足の終値を置き換える"""
+    pending = state.get('pending')
+    if pending and _week_keys(quote[0]) == _week_keys(pending[0]):
+        return (pending[0], quote[1])
+    return quote
+
+
+def pair_results(states, quote=None, pairs=MA_PAIRS):
+    """組ごとの結果 {キー: state_result の形}。
+
+    quote=(UNIX秒, 価格) は日足の「その日の足」。週足の組では、その週の足として扱う。
+    """
+    out = {}
+    for key, kind, _, _ in pairs:
+        state = states[key]
+        if quote is not None and kind == 'weekly':
+            out[key] = state_result(state, _weekly_quote(state, quote))
+        else:
+            out[key] = state_result(state, quote)
+    return out
+
+
+# migration が未適用の間は、その列を読み書きしない（コードが migration より先に
+# 出る期間があるため）。ma_state が無ければ従来どおり毎回頭から計算し、
+# pairs が無ければ従来の列（PRIMARY_PAIR）だけを保存する。
+_MIGRATION_PENDING_COLUMNS = {
+    'ma_state': 'migration_ma_state.sql',
+    'pairs': 'migration_ma_pairs.sql',
+}
+_missing_columns = set()
+
+
+def _note_missing_columns(error):
+    """新しい列が無いことによるエラーなら、その列を覚えて True を返す"""
+    message = str(error)
+    dropped = {c for c in _MIGRATION_PENDING_COLUMNS
+               if c in message and c not in _missing_columns}
+    if not dropped:
+        return False
+    _missing_columns.update(dropped)
+    for column in sorted(dropped):
+        print(f'[migration未適用] ma_crosses.{column} 列が無いため除外して扱います。'
+              f'supabase/{_MIGRATION_PENDING_COLUMNS[column]} を適用してください。')
+    return True
+
+
+def _state_columns(pairs):
+    columns = 'company_code, latest_gc_date, latest_dc_date'
+    if 'ma_state' not in _missing_columns:
+        columns += ', ma_state'
+    if 'pairs' not in _missing_columns:
+        # 組ごとの直近の日付だけを取り出す（crosses まで読むと重い）
+        for key, _, _, _ in pairs:
+            if key != PRIMARY_PAIR:
+                columns += (f', {key}_gc:pairs->{key}->>latest_gc_date'
+                            f', {key}_dc:pairs->{key}->>latest_dc_date')
+    return columns
+
+
+def load_states(client, codes, pairs=MA_PAIRS):
+    """codes の銘柄の、ma_crosses の状態と組ごとの直近のGC/DC日を読む。{code: 行}
+
+    全件を一度に読むことはしない（夜間はページごと、場中は株価のある銘柄だけ）。
+    行の状態は stored_pair_states で、日付は _stored_dates で取り出す。
+    """
+    columns = _state_columns(pairs)
+    try:
+        rows = []
+        for i in range(0, len(codes), 100):
+            res = (client.table('ma_crosses').select(columns)
+                   .in_('company_code', codes[i:i + 100])
+                   .execute())
+            rows.extend(res.data or [])
+    except Exception as e:
+        if not _note_missing_columns(e):
+            raise
+        return load_states(client, codes, pairs)
+    return {r['company_code']: r for r in rows}
+
+
+def _upsert_crosses(client, payloads):
+    """ma_crosses に保存する。新しい列が無ければ外して保存し直す"""
+    if _missing_columns:
+        payloads = [{k: v for k, v in p.items() if k not in _missing_columns}
+                    for p in payloads]
+    try:
+        client.table('ma_crosses').upsert(payloads).execute()
+    except Exception as e:
+        if not _note_missing_columns(e):
+            raise
+        _upsert_crosses(client, payloads)
+
+
+def _stored_dates(prev, key):
+    if key == PRIMARY_PAIR:
+        gc, dc = prev.get('latest_gc_date'), prev.get('latest_dc_date')
+    else:
+        gc, dc = prev.get(f'{key}_gc'), prev.get(f'{key}_dc')
+    return str(gc or '')[:10], str(dc or '')[:10]
+
+
+def _dates_changed(prev, results):
+    """保存済みの日付から、どれかの組の直近のGC/DC日が変わったか"""
+    for key, result in results.items():
+        if key != PRIMARY_PAIR and 'pairs' in _missing_columns:
+            continue   # 保存できないので比べない
+        if _stored_dates(prev, key) != (result['latest_gc_date'] or '',
+                                        result['latest_dc_date'] or ''):
+            return True
+    return False
+
+
+def _crosses_payload(company_code, states, results, now, pairs):
+    """ma_crosses の1行。従来の列には PRIMARY_PAIR の結果を入れる"""
+    primary = results[PRIMARY_PAIR]
+    _, _, short_window, long_window = next(p for p in pairs if p[0] == PRIMARY_PAIR)
+    payload = {
+        'company_code': company_code,
+        'latest_gc_date': primary['latest_gc_date'],
+        'latest_dc_date': primary['latest_dc_date'],
+        'cross_count': primary['cross_count'],
+        'crosses': primary['crosses'],
+        'short_window': short_window,
+        'long_window': long_window,
+        'pairs': results,
+        'calculated_at': now,
+    }
+    if states is not None:
+        payload['ma_state'] = states
+    return payload
+
+
+def calculate_for_code(company_code, pairs=MA_PAIRS):
     """1銘柄だけ、保存済みの日足から交差を計算して保存する。
 
     銘柄ページを開いたときに呼ぶ。日足は閲覧時に自動で取り直される
@@ -109,42 +683,28 @@ def calculate_for_code(company_code, short_window=SHORT_WINDOW, long_window=LONG
     if not res.data:
         return None
 
-    daily = res.data[0].get('daily_1y')
-    if isinstance(daily, str):
-        import json
-        try:
-            daily = json.loads(daily)
-        except Exception:
-            daily = None
-    if not daily:
+    import price_history as ph
+    daily = ph.decode_ohlc(res.data[0].get('daily_1y'))
+    if not len(daily['time']):
         return None
 
-    result = detect_crosses(daily, short_window, long_window)
-
-    stored = (client.table('ma_crosses')
-              .select('latest_gc_date, latest_dc_date')
-              .eq('company_code', company_code)
-              .execute())
-    prev = stored.data[0] if stored.data else {}
-    changed = (str(prev.get('latest_gc_date') or '')[:10] != (result['latest_gc_date'] or '') or
-               str(prev.get('latest_dc_date') or '')[:10] != (result['latest_dc_date'] or ''))
+    prev = load_states(client, [company_code], pairs).get(company_code, {})
+    stored = stored_pair_states(prev.get('ma_state'))
+    states, _ = sync_pair_states(stored, daily, pairs)
+    if not states:
+        return None   # 終値が1本も無い
+    results = pair_results(states, pairs=pairs)
+    result = results[PRIMARY_PAIR]
+    changed = _dates_changed(prev, results)
 
-    # 変わっていなければ書かない（ページを開くたびに2テーブル更新するのは無駄）
-    if changed:
+    # 日付も状態も変わっていなければ書かない（ページを開くたびに2テーブル更新するのは無駄）
+    if changed or (states != stored and 'ma_state' not in _missing_columns):
         now = datetime.now(timezone.utc).isoformat()
-        payload = {
-            'company_code': company_code,
-            'latest_gc_date': result['latest_gc_date'],
-            'latest_dc_date': result['latest_dc_date'],
-            'cross_count': result['cross_count'],
-            'crosses': result['crosses'],
-            'short_window': short_window,
-            'long_window': long_window,
-            'calculated_at': now,
-        }
+        payload = _crosses_payload(company_code, states, results, now, pairs)
         try:
-            client.table('ma_crosses').upsert(payload).execute()
-            sync_gc_to_screened(client, [payload])
+            _upsert_crosses(client, [payload])
+            if changed:
+                sync_gc_to_screened(client, [payload])
         except Exception as e:
             print(f'GC/DCの保存エラー ({company_code}): {e}')
 
@@ -206,117 +766,287 @@ def compare_with_signals(client=None, recent_days=10, limit_samples=10):
     }
 
 
-def calculate_for_all(progress=None, should_stop=None,
-                      short_window=SHORT_WINDOW, long_window=LONG_WINDOW):
+def calculate_for_all(progress=None, should_stop=None, pairs=MA_PAIRS, client=None):
     """保存済みの日足から全銘柄の交差を計算し ma_crosses に保存する。
 
     ネットワークアクセスは一切しない（DBに入っている日足だけを使う）ため、
     外部サイトのレート制限とは無関係に何度でも実行できる。
+    前回の状態（ma_state）がある銘柄は増えた足の分だけ進め、頭からの計算は
+    状態が無い・日足が書き換わった銘柄だけにする。
+    MA_PAIRS の組はまとめて計算する（日足の decode は銘柄ごとに1回）。
+
+    日足は BATCH_SIZE 銘柄ずつ読み（price_history.iter_pages）、ページごとに
+    計算・保存・screened_latest への同期まで済ませる。次のページは計算中に
+    裏で読むので、手元に持つのは2ページ分まで。銘柄数の上限も無い。
 
     Args:
-        progress: done, total, saved を受け取るコールバック
-        should_stop: True を返すと中断する
+        progress: done, total, saved を受け取るコールバック（ページごと）
+        should_stop: True を返すと中断する（ページの切れ目で見る）
     """
-    from supabase_client import get_supabase_client
-    client = get_supabase_client()
+    import price_history as ph
+    if client is None:
+        from supabase_client import get_supabase_client
+        client = get_supabase_client()
 
-    # 日足を一括で読む
-    rows = []
-    page = 0
-    while page < 20:
-        res = (client.table('stock_price_history')
-               .select('company_code, daily_1y')
-               .range(page * 500, page * 500 + 499)
-               .execute())
-        chunk = res.data or []
-        if not chunk:
-            break
-        rows.extend(chunk)
-        if len(chunk) < 500:
-            break
-        page += 1
-
-    total = len(rows)
+    total = ph.count_rows(client)
     now = datetime.now(timezone.utc).isoformat()
-    payloads = []
-    skipped = 0
-
-    for i, r in enumerate(rows):
-        if should_stop and should_stop():
-            break
-        daily = r.get('daily_1y')
-        if isinstance(daily, str):
-            import json
-            try:
-                daily = json.loads(daily)
-            except Exception:
-                daily = None
-        if not daily:
-            skipped += 1
-        else:
-            result = detect_crosses(daily, short_window, long_window)
-            if result['cross_count'] or result['latest_gc_date'] or result['latest_dc_date']:
-                payloads.append({
-                    'company_code': r['company_code'],
-                    'latest_gc_date': result['latest_gc_date'],
-                    'latest_dc_date': result['latest_dc_date'],
-                    'cross_count': result['cross_count'],
-                    'crosses': result['crosses'],
-                    'short_window': short_window,
-                    'long_window': long_window,
-                    'calculated_at': now,
-                })
-            else:
-                skipped += 1
-
-        if progress and (i % 50 == 0 or i == total - 1):
-            progress(done=i + 1, total=total, saved=len(payloads))
-
-    # まとめて保存（1件ずつupsertすると件数分の往復が発生して遅い）
-    saved = 0
+    counts = {'done': 0, 'computed': 0, 'saved': 0, 'skipped': 0, 'rebuilt': 0}
+    sync = {'changed': 0, 'unchanged': 0, 'failed': 0, 'missing': 0}
     first_error = None
-    for i in range(0, len(payloads), 200):
-        batch = payloads[i:i + 200]
-        try:
-            client.table('ma_crosses').upsert(batch).execute()
-            saved += len(batch)
-        except Exception as e:
-            print(f'ma_crosses 保存エラー: {e}')
-            if first_error is None:
-                first_error = str(e)
-        if progress:
-            progress(done=total, total=total, saved=saved)
+
+    # ページの銘柄の計算済みの状態も、日足と一緒に裏で読んでおく
+    pages = ph.iter_pages(
+        client, page_size=BATCH_SIZE,
+        prepare=lambda rows: load_states(client, [r['company_code'] for r in rows], pairs))
+    try:
+        for rows, stored in pages:
+            if should_stop and should_stop():
+                break
+            payloads, page_counts = _compute_page(rows, stored, now, pairs)
+            for key, value in page_counts.items():
+                counts[key] += value
+            counts['done'] += len(rows)
+            counts['computed'] += len(payloads)
+
+            # まとめて保存（1件ずつupsertすると件数分の往復が発生して遅い）
+            saved = []
+            for i in range(0, len(payloads), 200):
+                batch = payloads[i:i + 200]
+                try:
+                    _upsert_crosses(client, batch)
+                    saved.extend(batch)
+                except Exception as e:
+                    print(f'ma_crosses 保存エラー: {e}')
+                    if first_error is None:
+                        first_error = str(e)
+            counts['saved'] += len(saved)
+
+            # スクリーナーで並べ替えられるよう、GC/DC日を screened_latest にも複製する
+            # （値の変わった銘柄だけが書かれる。交差が期間外へ抜けた銘柄は空に戻る）
+            for key, value in sync_gc_to_screened(client, saved).items():
+                sync[key] += value
+
+            if progress:
+                # 数えられなかった・数えた後に増えたときは、読んだ分を分母にする
+                progress(done=counts['done'], total=max(total or 0, counts['done']),
+                         saved=counts['saved'])
+    finally:
+        pages.close()
 
     # 保存が1件も通らなかった場合は失敗として扱う。
     # ログに出すだけだと画面上は「完了」と表示され、
     # テーブル未作成などの原因に気づけないため。
-    if payloads and saved == 0:
+    if counts['computed'] and counts['saved'] == 0:
         raise RuntimeError(
-            f'計算は{len(payloads)}件成功しましたが、保存が1件も通りませんでした。'
+            f'計算は{counts["computed"]}件成功しましたが、保存が1件も通りませんでした。'
             f'migration_ma_crosses.sql を適用済みか確認してください。原因: {first_error}'
         )
 
-    # スクリーナーで並べ替えられるよう、GC/DC日を screened_latest にも複製する
-    synced = sync_gc_to_screened(client, payloads)
+    return {'total': counts['done'], 'saved': counts['saved'], 'skipped': counts['skipped'],
+            'sync': sync, 'rebuilt': counts['rebuilt']}
+
 
-    return {'total': total, 'saved': saved, 'skipped': skipped, 'synced': synced}
+def _compute_page(rows, stored, now, pairs):
+    """1ページ分の日足から、保存する ma_crosses の行を作る。
+
+    状態がある銘柄は増えた足の分だけ進める（advance_pair_states）。状態が無い・日足が
+    書き換わった銘柄は、まとめて行列に詰めて頭から作り直す（build_pair_states）。
+    Returns: (payloads, {'skipped', 'rebuilt'})
+    """
+    import price_history as ph
+
+    dailies = [ph.decode_ohlc(r.get('daily_1y')) for r in rows]
+    page_states = [None] * len(rows)
+    stale = []
+    for k, (r, daily) in enumerate(zip(rows, dailies)):
+        prev = stored_pair_states(stored.get(r['company_code'], {}).get('ma_state'))
+        page_states[k] = advance_pair_states(prev, daily, pairs) if prev else None
+        if page_states[k] is None:
+            stale.append(k)
+    for k, states in zip(stale, build_pair_states([dailies[k] for k in stale], pairs)):
+        page_states[k] = states
+
+    payloads = []
+    skipped = 0
+    for r, states in zip(rows, page_states):
+        if not states:
+            skipped += 1
+            continue
+        results = pair_results(states, pairs=pairs)
+        prev = stored.get(r['company_code'], {})
+        has_cross = any(res['cross_count'] for res in results.values())
+        # 交差の無い銘柄も、状態を残すために保存する（ma_state 列がある場合）
+        if not has_cross and ('ma_state' in _missing_columns
+                              or states == stored_pair_states(prev.get('ma_state'))):
+            skipped += 1
+            continue
+        payloads.append(_crosses_payload(r['company_code'], states, results, now, pairs))
+    return payloads, {'skipped': skipped, 'rebuilt': len(stale)}
+
+
+def refresh_intraday(client, quotes, pairs=MA_PAIRS):
+    """場中・引け後の株価で、GC/DCを見直す（scheduled_update_stock_prices のあと）。
+
+    ma_crosses の状態に「その日の足」として株価を仮に足して判定する（週足の組は
+    その週の足として）。日足も状態も書き換えない（確定した足で進めるのは夜間の
+    calculate_for_all）。直近のGC/DC日が変わった銘柄だけ ma_crosses と
+    screened_latest を更新する。
+
+    Args:
+        quotes: {code: (その日の足のUNIX秒, 株価)}
+    Returns: {'checked', 'changed', 'sync'}（sync は sync_gc_to_screened の件数）
+    """
+    if 'ma_state' in _missing_columns:
+        return {'checked': 0, 'changed': 0, 'sync': None}
+    stored = load_states(client, list(quotes), pairs)
+    now = datetime.now(timezone.utc).isoformat()
+    payloads = []
+    checked = 0
+    for code, quote in quotes.items():
+        prev = stored.get(code)
+        states = stored_pair_states(prev and prev.get('ma_state'))
+        # 夜間にまだ作られていない組がある銘柄は飛ばす（次の夜間に作り直される）
+        if not all(_matches(states.get(key), short, long) for key, _, short, long in pairs):
+            continue
+        checked += 1
+        results = pair_results(states, quote, pairs)
+        if not _dates_changed(prev, results):
+            continue
+        payloads.append(_crosses_payload(code, None, results, now, pairs))
+
+    for i in range(0, len(payloads), 200):
+        try:
+            _upsert_crosses(client, payloads[i:i + 200])
+        except Exception as e:
+            print(f'ma_crosses 保存エラー: {e}')
+    sync = sync_gc_to_screened(client, payloads)
+    return {'checked': checked, 'changed': len(payloads), 'sync': sync}
+
+
+# 1回の sync_gc_dates に渡す銘柄数（JSON で約60KB）
+SYNC_CHUNK = 1000
+
+# migration_sync_gc_dates.sql が未適用なら、差分だけを1件ずつ更新する道に戻る
+_sync_function_missing = False
+
+# migration_ma_pairs.sql が未適用なら、screened_latest.ma_pairs は書かない
+_screened_pairs_missing = False
+
+
+def pair_summary(results):
+    """組ごとの結果を、スクリーナーで絞り込む形にする（screened_latest.ma_pairs）。
+
+    {キー: {'state': 直近の交差 'gc'|'dc'|None, 'gc_date', 'dc_date'}}
+    """
+    return {key: {'state': r['crosses'][-1]['type'] if r['crosses'] else None,
+                  'gc_date': r['latest_gc_date'],
+                  'dc_date': r['latest_dc_date']}
+            for key, r in results.items()}
+
+
+def _gc_tuple(code, gc_date, dc_date, ma_pairs=None):
+    row = {'company_code': code,
+           'gc_date': str(gc_date or '')[:10] or None,
+           'dc_date': str(dc_date or '')[:10] or None}
+    if ma_pairs is not None:
+        row['ma_pairs'] = ma_pairs
+    return row
+
+
+def _sync_by_function(client, tuples, counts):
+    """sync_gc_dates で SYNC_CHUNK 件ずつ反映する。関数が無ければ False を返す"""
+    global _sync_function_missing
+    for i in range(0, len(tuples), SYNC_CHUNK):
+        chunk = tuples[i:i + SYNC_CHUNK]
+        try:
+            res = client.rpc('sync_gc_dates', {'p_rows': chunk}).execute()
+        except Exception as e:
+            if i == 0 and 'sync_gc_dates' in str(e):
+                print('[migration未適用] sync_gc_dates が無いため、GC/DC日を1件ずつ同期します。'
+                      'supabase/migration_sync_gc_dates.sql を適用してください。')
+                _sync_function_missing = True
+                return False
+            print(f'GC同期エラー ({i}-{i + len(chunk)}): {e}')
+            counts['failed'] += len(chunk)
+            continue
+        result = res.data or {}
+        matched, changed = int(result.get('matched') or 0), int(result.get('changed') or 0)
+        counts['changed'] += changed
+        counts['unchanged'] += matched - changed
+        counts['missing'] += len(chunk) - matched
+    return True
+
+
+def _sync_one_by_one(client, tuples, counts):
+    """今の値を読んで、変わった銘柄だけ1件ずつ更新する"""
+    global _screened_pairs_missing
+    with_pairs = any('ma_pairs' in t for t in tuples)
+    columns = 'company_code, gc_date, dc_date' + (', ma_pairs' if with_pairs else '')
+    current = {}
+    for i in range(0, len(tuples), 100):
+        codes = [t['company_code'] for t in tuples[i:i + 100]]
+        try:
+            res = (client.table('screened_latest')
+                   .select(columns)
+                   .in_('company_code', codes)
+                   .execute())
+        except Exception as e:
+            if with_pairs and 'ma_pairs' in str(e):
+                print('[migration未適用] screened_latest.ma_pairs 列が無いため除外して同期します。'
+                      'supabase/migration_ma_pairs.sql を適用してください。')
+                _screened_pairs_missing = True
+                stripped = [{k: v for k, v in t.items() if k != 'ma_pairs'} for t in tuples]
+                return _sync_one_by_one(client, stripped, counts)
+            # 読めなければ全件書く（従来と同じ）
+            print(f'GC同期の読み込みエラー: {e}')
+            current.update({c: None for c in codes})
+            continue
+        for r in res.data or []:
+            current[r['company_code']] = _gc_tuple(
+                r['company_code'], r.get('gc_date'), r.get('dc_date'),
+                r.get('ma_pairs') if with_pairs else None)
+
+    for t in tuples:
+        code = t['company_code']
+        if code not in current:
+            counts['missing'] += 1
+            continue
+        if current[code] == t:
+            counts['unchanged'] += 1
+            continue
+        try:
+            client.table('screened_latest').update(
+                {k: v for k, v in t.items() if k != 'company_code'}
+            ).eq('company_code', code).execute()
+            counts['changed'] += 1
+        except Exception as e:
+            print(f"GC同期エラー ({code}): {e}")
+            counts['failed'] += 1
 
 
 def sync_gc_to_screened(client, payloads):
     """ma_crosses の結果を screened_latest.gc_date / dc_date に反映する。
 
     スクリーナーは screened_latest を並べ替えるため、GC日をこちらへ持たせる。
-    日付は銘柄ごとにばらばらなので、同じ値でまとめる余地が少なく、
-    1件ずつ更新する。定期的に走る計算処理の一部なので許容範囲。
+    組ごとの結果（payload の pairs）があれば、pair_summary にして ma_pairs にも入れる。
+    以前は1件ずつ update していたが、約4,000銘柄で4,000往復になり、夜間の
+    再計算はほぼこの待ちだった。Postgres 関数 sync_gc_dates に
+    (company_code, gc_date, dc_date) を SYNC_CHUNK 件ずつ渡し、1回の UPDATE で
+    値の変わった行だけ書く。関数が無い（migration 未適用）間は、今の値を読んで
+    変わった銘柄だけ1件ずつ更新する。
+
+    Returns:
+        {'changed', 'unchanged', 'failed', 'missing'}
+        missing は screened_latest に行が無い銘柄（スクリーニング対象外）
     """
-    synced = 0
-    for p in payloads:
-        try:
-            client.table('screened_latest').update({
-                'gc_date': p.get('latest_gc_date'),
-                'dc_date': p.get('latest_dc_date'),
-            }).eq('company_code', p['company_code']).execute()
-            synced += 1
-        except Exception as e:
-            print(f"GC同期エラー ({p['company_code']}): {e}")
-    return synced
+    counts = {'changed': 0, 'unchanged': 0, 'failed': 0, 'missing': 0}
+    # 同じ銘柄が重なったら後のものを使う
+    tuples = list({p['company_code']: _gc_tuple(
+        p['company_code'], p.get('latest_gc_date'), p.get('latest_dc_date'),
+        pair_summary(p['pairs']) if p.get('pairs') and not _screened_pairs_missing else None)
+        for p in payloads}.values())
+    if not tuples:
+        return counts
+    if _sync_function_missing or not _sync_by_function(client, tuples, counts):
+        _sync_one_by_one(client, tuples, counts)
+    return counts
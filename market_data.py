@@ -176,14 +176,14 @@ def get_long_term(key, granularity):
         return []
 
     try:
-        daily = ph.fetch_ohlc(idx['symbol'], period='10y')
+        bars = ph.fetch_ohlc(idx['symbol'], period='10y', columns=True)
     except Exception as e:
         print(f"指数の長期足取得エラー {idx['symbol']}: {e}")
-        daily = []
+        bars = ph.decode_ohlc(None)
 
-    if daily:
-        weekly = ph.downsample(daily, 'weekly')
-        monthly = ph.downsample(daily, 'monthly')
+    if len(bars['time']):
+        weekly = ph.columns_to_rows(ph.resample_ohlc(bars, 'weekly'))
+        monthly = ph.columns_to_rows(ph.resample_ohlc(bars, 'monthly'))
         _set_cached(f'long:{key}:weekly', weekly)
         _set_cached(f'long:{key}:monthly', monthly)
         return weekly if granularity == 'weekly' else monthly
@@ -9,12 +9,16 @@ from math import ceil
 from sqlalchemy.orm import joinedload
 import time
 from sqlalchemy import cast, Integer, func
-import pandas as pd
+from functools import lru_cache
+
+from lazy_imports import LazyModule
+
+# pandas と Excel の読み込みは重いので、この画面が初めて開かれたときに行う
+pd = LazyModule('pandas')
 
 # Excelファイルの読み込みとカラムのリネーム
 file_path = 'tools/基準値.xlsx'
-df = pd.read_excel(file_path)
-df = df.rename(columns={
+CRITERIA_COLUMNS = {
     '大分類': 'large_category', 
     '小分類': 'small_category', 
     '事業規模': 'business_scale',
@@ -54,7 +58,14 @@ df = df.rename(columns={
     '自己資本比率_ⅲ': 'equity_ratio_iii',
     '自己資本比率_ⅱ': 'equity_ratio_ii',
     '自己資本比率_ⅰ': 'equity_ratio_i'
-})
+}
+
+
+@lru_cache(maxsize=1)
+def load_criteria():
+    """基準値のExcelを読み込む（初回のみ。以後は同じ DataFrame を返す）"""
+    return pd.read_excel(file_path).rename(columns=CRITERIA_COLUMNS)
+
 
 def get_median_value(df, indicators, median_column_name):
     matching_row = df[
@@ -215,7 +226,8 @@ def financial_analysis():
     indicators_list = []
 
     if latest_settlements:
-        # Excelファイルは既に読み込み済み（ファイルの先頭で）
+        # 基準値のExcel（初回のみ読み込み）
+        df = load_criteria()
 
         for settlement in latest_settlements:
             # 前期の決算情報を取得
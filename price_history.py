@@ -12,11 +12,27 @@
       〜1年   日足   (約244本)
       2〜5年  週足   (約104〜260本)
       10年    月足   (約120本)
+
+保存形式:
+  daily_1y / weekly_10y / monthly_10y は当初 [{time, open, high, low, close}, ...]
+  の配列で持っていた。1年で約244個の小さなオブジェクトになり、読むたびに全部を
+  パースし、行ごとにキー名を繰り返す。いまは列ごとの配列
+  {"v": 1, "t": [...], "o": [...], "h": [...], "l": [...], "c": [...]} で保存する
+  （encode_ohlc）。読み出しの decode_ohlc はどちらの形も読むので、
+  移行（backfill_price_history_columnar.py）が終わる前の行もそのまま使える。
+
+読み出しの経路:
+  get_series / get_many はまずローカルの置き場（price_store。memmap のファイル）を
+  見て、無ければ Supabase から要る系列の列だけを読む。複数銘柄は in_ で
+  まとめて読む。保存・取り直しの結果は置き場にも入れる。
 """
 
-import threading
+import json
+
 from datetime import datetime, timezone
 
+from refresh_executor import PRIORITY_USER, RefreshExecutor
+
 # 取引所ローカルの日付に正規化するためのオフセット。
 # price_history の time は「取引所ローカル0時」のUNIX秒で、
 # そのままUTC解釈すると日付が1日ずれる（フロント側の toBusinessDay と同じ補正）。
@@ -49,10 +65,12 @@ def granularity_for_range(range_key):
 FETCH_TIMEOUT_SECONDS = 20
 
 
-def fetch_ohlc(symbol, period='1y', timeout=FETCH_TIMEOUT_SECONDS):
-    """yfinanceからOHLCを取得する。失敗・時間切れは空リスト。"""
+def fetch_ohlc(symbol, period='1y', timeout=FETCH_TIMEOUT_SECONDS, columns=False):
+    """yfinanceからOHLCを取得する。失敗・時間切れは空リスト。
+
+    columns=True なら行にせず decode_ohlc と同じ列で返す（集約に回すとき用）。
+    """
     import yfinance as yf
-    import pandas as pd
 
     ticker = yf.Ticker(symbol)
     try:
@@ -63,21 +81,7 @@ def fetch_ohlc(symbol, period='1y', timeout=FETCH_TIMEOUT_SECONDS):
     except TypeError:
         # timeout を受け取らない版のための保険
         hist = ticker.history(period=period)
-    if hist is None or hist.empty:
-        return []
-
-    rows = []
-    for idx, row in hist.iterrows():
-        if pd.isna(row.get('Close')):
-            continue
-        rows.append({
-            'time': int(idx.timestamp()),
-            'open': float(row['Open']) if pd.notna(row['Open']) else None,
-            'high': float(row['High']) if pd.notna(row['High']) else None,
-            'low': float(row['Low']) if pd.notna(row['Low']) else None,
-            'close': float(row['Close']),
-        })
-    return rows
+    return frame_to_columns(hist) if columns else frame_to_rows(hist)
 
 
 def fetch_ohlc_batch(codes, period='1y', chunk_size=100):
@@ -87,7 +91,6 @@ def fetch_ohlc_batch(codes, period='1y', chunk_size=100):
     リクエスト数が銘柄数分の1になり、大幅に短縮できる。
     """
     import yfinance as yf
-    import pandas as pd
     import warnings
     warnings.filterwarnings('ignore')
 
@@ -102,103 +105,771 @@ def fetch_ohlc_batch(codes, period='1y', chunk_size=100):
             print(f'日足のバッチ取得エラー ({i}-{i + len(chunk)}): {e}')
             continue
 
+        try:
+            by_symbol = batch_frame_to_rows(df, symbols)
+        except Exception as e:
+            print(f'日足のバッチ変換エラー ({i}-{i + len(chunk)}): {e}')
+            continue
         for code, sym in zip(chunk, symbols):
-            try:
-                sub = df[sym] if len(symbols) > 1 else df
-                rows = []
-                for idx, row in sub.iterrows():
-                    if pd.isna(row.get('Close')):
-                        continue
-                    rows.append({
-                        'time': int(idx.timestamp()),
-                        'open': float(row['Open']) if pd.notna(row['Open']) else None,
-                        'high': float(row['High']) if pd.notna(row['High']) else None,
-                        'low': float(row['Low']) if pd.notna(row['Low']) else None,
-                        'close': float(row['Close']),
-                    })
-                if rows:
-                    result[code] = rows
-            except Exception:
-                continue
+            if by_symbol.get(sym):
+                result[code] = by_symbol[sym]
     return result
 
 
+# ---------------------------------------------------------------
+# yfinance の DataFrame → 行
+# ---------------------------------------------------------------
+#
+# iterrows は1行ごとに Series を作り、さらにセルごとに pd.notna を呼ぶので、
+# 100銘柄×250本のバッチで数十万回の Python 呼び出しになる。
+# 列を NumPy の配列で取り出し、欠損は isnan のマスクでまとめて扱う。
+# 計測は benchmarks/bench_frame_to_rows.py。
+
+# (行のキー, yfinance の列名)
+_FRAME_FIELDS = (('open', 'Open'), ('high', 'High'), ('low', 'Low'), ('close', 'Close'))
+
+
+def _epoch_seconds(index):
+    """DatetimeIndex を UNIX 秒の配列にする（Timestamp.timestamp() と同じ値）"""
+    import pandas as pd
+    return pd.DatetimeIndex(index).as_unit('ns').asi8 // 1_000_000_000
+
+
+def _nullable(values):
+    """float の配列を、NaN を None にした object 配列にする（2次元でもよい）"""
+    import numpy as np
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    return out
+
+
+def _nullable_int(values):
+    import numpy as np
+    missing = np.isnan(values)
+    out = np.where(missing, 0, values).astype(np.int64).astype(object)
+    out[missing] = None
+    return out
+
+
+def _assemble(times, columns):
+    """time の list と {キー: object 配列} から [{time, ...}] を作る"""
+    names = ('time',) + tuple(columns)
+    return [dict(zip(names, bar))
+            for bar in zip(times, *(col.tolist() for col in columns.values()))]
+
+
+def frame_to_columns(frame, keep_missing_close=False, volume=False):
+    """yfinance の1銘柄分の DataFrame（Open/High/Low/Close 列）を decode_ohlc と同じ列にする。
+
+    Args:
+        keep_missing_close: 終値の無い足も残す（分析の price_history 用）
+        volume: 出来高の列も付ける
+    """
+    import numpy as np
+
+    if frame is None or frame.empty or 'Close' not in frame.columns:
+        return decode_ohlc(None)
+    n = len(frame)
+    fields = _FRAME_FIELDS + ((('volume', 'Volume'),) if volume else ())
+    values = {name: (frame[col].to_numpy(dtype=float) if col in frame.columns
+                     else np.full(n, np.nan))
+              for name, col in fields}
+    keep = (np.ones(n, dtype=bool) if keep_missing_close
+            else ~np.isnan(values['close']))
+    columns = {'time': _epoch_seconds(frame.index)[keep]}
+    columns.update((name, v[keep]) for name, v in values.items())
+    return columns
+
+
+def frame_to_rows(frame, keep_missing_close=False, volume=False):
+    """yfinance の1銘柄分の DataFrame を行の形にする。
+
+    Args:
+        keep_missing_close: 終値の無い足も残す（分析の price_history 用）
+        volume: 出来高も入れる（int。欠損は None）
+    Returns:
+        [{time, open, high, low, close(, volume)}]。欠損は None
+    """
+    if frame is None or frame.empty or 'Close' not in frame.columns:
+        return []
+    return columns_to_rows(frame_to_columns(frame, keep_missing_close, volume))
+
+
+def _batch_matrices(frame, symbols):
+    """yf.download の複数銘柄分の DataFrame から (times, {列: 行列}, 終値のある足) を取り出す。
+
+    行列は (本数, 銘柄数) で、銘柄の並びは symbols。列が1段の DataFrame は None。
+    """
+    import numpy as np
+    import pandas as pd
+
+    # group_by='ticker' なら (銘柄, 列名)。指定なしの版は (列名, 銘柄)
+    field_level = 0 if 'Close' in frame.columns.get_level_values(0) else 1
+    matrices = {}
+    for name, col in _FRAME_FIELDS:
+        try:
+            sub = frame.xs(col, axis=1, level=field_level)
+        except KeyError:
+            sub = pd.DataFrame(index=frame.index)
+        matrices[name] = sub.reindex(columns=symbols).to_numpy(dtype=float)
+    return _epoch_seconds(frame.index), matrices, ~np.isnan(matrices['close'])
+
+
+def batch_frame_to_rows(frame, symbols):
+    """yf.download(group_by='ticker') の複数銘柄分の DataFrame を {symbol: rows} にする。
+
+    全銘柄の同じ列（Close など）を1枚の行列として取り出し、欠損の判定と
+    None への置き換えを行列ごと1回で済ませる。終値の無い足は捨てる。
+    1銘柄だけのときに列が1段になる版の yfinance でも読む。
+    """
+    import pandas as pd
+
+    if frame is None or frame.empty:
+        return {}
+    if not isinstance(frame.columns, pd.MultiIndex):
+        rows = frame_to_rows(frame)
+        return {symbols[0]: rows} if rows and len(symbols) == 1 else {}
+
+    times, matrices, keep = _batch_matrices(frame, symbols)
+    nullable = {name: _nullable(m) for name, m in matrices.items()}
+
+    result = {}
+    for j, sym in enumerate(symbols):
+        mask = keep[:, j]
+        if not mask.any():
+            continue
+        result[sym] = _assemble(times[mask].tolist(),
+                                {name: m[mask, j] for name, m in nullable.items()})
+    return result
+
+
+def batch_frame_to_columns(frame, symbols):
+    """batch_frame_to_rows の列版。{symbol: decode_ohlc と同じ列} を返す（集約に回すとき用）"""
+    import pandas as pd
+
+    if frame is None or frame.empty:
+        return {}
+    if not isinstance(frame.columns, pd.MultiIndex):
+        columns = frame_to_columns(frame)
+        return {symbols[0]: columns} if len(columns['time']) and len(symbols) == 1 else {}
+
+    times, matrices, keep = _batch_matrices(frame, symbols)
+    result = {}
+    for j, sym in enumerate(symbols):
+        mask = keep[:, j]
+        if not mask.any():
+            continue
+        result[sym] = {'time': times[mask]}
+        result[sym].update((name, m[mask, j]) for name, m in matrices.items())
+    return result
+
+
+# 足の集約の単位。'Nd'（例 '10d'）は最初の足の日から数えた N 暦日ごと
+RESAMPLE_RULES = ('daily', 'weekly', 'monthly', 'quarterly')
+
+# 1970-01-01 は木曜。+3 すると月曜始まりの週番号になる（ISO 週と同じ区切り）
+_EPOCH_WEEKDAY_SHIFT = 3
+
+
+def _bucket_keys(days, rule):
+    """取引所ローカルの通し日数から、足をまとめる単位の番号を作る"""
+    import numpy as np
+
+    if rule == 'weekly':
+        return (days + _EPOCH_WEEKDAY_SHIFT) // 7
+    if rule in ('monthly', 'quarterly'):
+        months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+        return months // 3 if rule == 'quarterly' else months
+    if rule.endswith('d') and rule[:-1].isdigit() and int(rule[:-1]) > 0:
+        return (days - days[0]) // int(rule[:-1])
+    raise ValueError(f'未対応の集約単位です: {rule}')
+
+
+def resample_ohlc(value, rule):
+    """日足を週足・月足・四半期足・N日足に集約する（NumPy でまとめて計算する）。
+
+    open=期間最初の始値 / high=期間最高値 / low=期間最安値 / close=期間最後の終値 /
+    volume=期間の合計（入力に出来高があるときだけ）。time は期間最初の足の time。
+
+    Args:
+        value: decode_ohlc が読めるもの（行の配列・列の形・decode 済み）
+        rule: 'weekly' / 'monthly' / 'quarterly' / 'Nd'
+    Returns:
+        decode_ohlc と同じ形の列（欠損は NaN）
+    """
+    import numpy as np
+
+    bars = decode_ohlc(value)
+    times = bars['time']
+    if rule == 'daily' or not len(times):
+        return bars
+
+    days = (times + _LOCAL_DATE_OFFSET) // 86400
+    keys = _bucket_keys(days, rule)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+
+    out = {
+        'time': times[starts],
+        'open': bars['open'][starts],
+        # fmax / fmin は NaN を無視する（全部 NaN の期間だけ NaN になる）
+        'high': np.fmax.reduceat(bars['high'], starts),
+        'low': np.fmin.reduceat(bars['low'], starts),
+        'close': bars['close'][ends],
+    }
+    if 'volume' in bars:
+        out['volume'] = np.add.reduceat(np.nan_to_num(bars['volume']), starts)
+    return out
+
+
+def columns_to_rows(columns):
+    """decode_ohlc / resample_ohlc の列を [{time, open, high, low, close(, volume)}] にする"""
+    names = [name for name, _ in _FRAME_FIELDS]
+    converted = {name: _nullable(columns[name]) for name in names}
+    if 'volume' in columns:
+        converted['volume'] = _nullable_int(columns['volume'])
+    return _assemble(columns['time'].tolist(), converted)
+
+
 def downsample(rows, granularity):
-    """日足を週足/月足に集約する。
+    """日足を週足/月足などに集約して行の形で返す（resample_ohlc の薄い包み）。
     open=期間最初の始値 / high=期間最高値 / low=期間最安値 / close=期間最後の終値
     """
     if granularity == 'daily' or not rows:
         return rows
+    return columns_to_rows(resample_ohlc(rows, granularity))
+
+
+# ---------------------------------------------------------------
+# 保存形式（列ごとの配列）
+# ---------------------------------------------------------------
+
+OHLC_FORMAT_VERSION = 1
+
+# (行の形のキー, 列の形のキー)
+_OHLC_KEYS = (('time', 't'), ('open', 'o'), ('high', 'h'), ('low', 'l'), ('close', 'c'))
+
+
+def is_columnar(value):
+    return isinstance(value, dict) and value.get('v') == OHLC_FORMAT_VERSION
+
+
+def encode_ohlc(rows):
+    """[{time, open, high, low, close}] を保存用の列ごとの配列にする。
+
+    decode_ohlc / resample_ohlc の列も受け取る。time の無い行は捨て、古い順に並べる。欠けた値は null のまま残す
+    （列の長さがずれると足の対応が崩れるため）。すでに列の形ならそのまま返す。
+    """
+    if is_columnar(rows):
+        return rows
+    if isinstance(rows, dict) and 'time' in rows:
+        # decode_ohlc / resample_ohlc の列。行を経由せずにそのまま詰める
+        encoded = {'v': OHLC_FORMAT_VERSION, 't': rows['time'].tolist()}
+        for name, short in _OHLC_KEYS[1:]:
+            encoded[short] = _nullable(rows[name]).tolist()
+        return encoded
+    bars = sorted((r for r in rows or [] if isinstance(r, dict) and r.get('time') is not None),
+                  key=lambda r: r['time'])
+    encoded = {'v': OHLC_FORMAT_VERSION}
+    for name, short in _OHLC_KEYS:
+        encoded[short] = [r.get(name) for r in bars]
+    encoded['t'] = [int(t) for t in encoded['t']]
+    return encoded
+
+
+def decode_ohlc(value):
+    """保存済みの足を NumPy の列にして返す。
+
+    列の形・行の配列（移行前）・それぞれの JSON 文字列のどれでも読む。
+    Returns:
+        {'time': int64[], 'open'/'high'/'low'/'close': float64[]}（欠損は NaN、古い順）。
+        行に出来高があれば 'volume' も付く
+    """
+    import numpy as np
 
-    buckets = {}
-    order = []
-    for r in rows:
-        d = datetime.fromtimestamp(r['time'] + _LOCAL_DATE_OFFSET, tz=timezone.utc)
-        if granularity == 'weekly':
-            iso = d.isocalendar()
-            key = (iso[0], iso[1])
+    if isinstance(value, dict) and 'time' in value and 'close' in value:
+        return value   # decode_ohlc 済み
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = None
+
+    if is_columnar(value):
+        columns = {name: value.get(short) or [] for name, short in _OHLC_KEYS}
+    elif isinstance(value, list):
+        bars = [r for r in value if isinstance(r, dict) and r.get('time') is not None]
+        columns = {name: [r.get(name) for r in bars] for name, _ in _OHLC_KEYS}
+        if any('volume' in r for r in bars):
+            # 出来高は保存しないが、分析の price_history などの行には入っている
+            columns['volume'] = [r.get('volume') for r in bars]
+    else:
+        columns = {name: [] for name, _ in _OHLC_KEYS}
+
+    n = min(len(v) for v in columns.values())
+    decoded = {'time': np.asarray(columns['time'][:n], dtype=np.int64)}
+    for name in list(columns)[1:]:
+        # None は float にすると NaN になる
+        decoded[name] = np.asarray(columns[name][:n], dtype=float)
+
+    if n and np.any(np.diff(decoded['time']) < 0):
+        order = np.argsort(decoded['time'], kind='stable')
+        decoded = {name: col[order] for name, col in decoded.items()}
+    return decoded
+
+
+def to_rows(value):
+    """保存済みの足を画面に返す行の形 [{time, open, high, low, close}] にする"""
+    if isinstance(value, dict) and 'time' in value:
+        return columns_to_rows(value)   # decode 済み（ローカルの置き場から読んだもの）
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    if not is_columnar(value):
+        return value if isinstance(value, list) else []
+    columns = [value.get(short) or [] for _, short in _OHLC_KEYS]
+    return [dict(zip(('time', 'open', 'high', 'low', 'close'), bar))
+            for bar in zip(*columns)]
+
+
+# ---------------------------------------------------------------
+# 日足の差分更新
+# ---------------------------------------------------------------
+#
+# 夜間の日足更新は、全銘柄について1年分（約244本）を毎晩取り直していた。
+# 増えるのは1日1本なので、保存済みの最後の足から後ろだけを短い期間で取り、
+# 継ぎ足して1年に切り詰める。
+#
+# 継ぎ目の確認:
+#   保存済みの「最後から2本目」を重ねて取り、終値が一致するかを見る。
+#   最後の1本は場中に保存された途中の値のことがあるので、確認には使わず
+#   新しい値で上書きする。一致しなければ分割・併合などで過去の足ごと
+#   調整し直されているので、その銘柄だけ1年分を取り直す。
+
+DAY_SECONDS = 86400
+
+# 日足として保存する長さ（yfinance の period='1y' と同じくらい）
+DAILY_WINDOW_SECONDS = 366 * DAY_SECONDS
+
+# 継ぎ目の終値の食い違いをどこまで許すか（相対）。
+# 分割・併合は数十%単位で動くので、丸め誤差だけを見逃せばよい
+OVERLAP_TOLERANCE = 0.001
+
+# 継ぎ目から今日までの暦日数 → 取得する期間（yfinance の period）。
+# period は営業日ではなく暦の期間なので、少し余裕を持たせる
+_INCREMENTAL_PERIODS = ((4, '5d'), (25, '1mo'), (80, '3mo'), (170, '6mo'))
+
+
+def incremental_period(overlap_time, now_ts):
+    """継ぎ目の足から今日までを賄う最短の period。長すぎれば None（全期間を取る）"""
+    days = (now_ts - overlap_time) / DAY_SECONDS
+    for max_days, period in _INCREMENTAL_PERIODS:
+        if days <= max_days:
+            return period
+    return None
+
+
+def overlap_time(stored):
+    """継ぎ目の確認に使う足の time。2本未満なら None（差分では更新しない）"""
+    times = decode_ohlc(stored)['time']
+    return int(times[-2]) if len(times) >= 2 else None
+
+
+def _local_day(unix_sec):
+    """UNIX秒を取引所ローカルの日の番号にする（resample_ohlc と同じ区切り）"""
+    return (int(unix_sec) + _LOCAL_DATE_OFFSET) // DAY_SECONDS
+
+
+def merge_daily(stored, fresh, window_seconds=DAILY_WINDOW_SECONDS):
+    """保存済みの日足に新しく取った足を継ぎ足し、window に切り詰めて返す。
+
+    継ぎ目の足が新しい側に無い・終値が食い違うときは None
+    （呼び出し側で全期間を取り直す）。
+
+    足は time の秒ではなく日付で突き合わせる。画面から取った日足（fetch_ohlc）は
+    JST 0時、夜間のバッチ（fetch_ohlc_batch）は UTC 0時の time になるので、
+    秒で比べると同じ日の足が見つからず、毎晩1年分を取り直すことになる。
+    同じ日の足は新しく取った側で置き換える。
+    """
+    stored_rows = to_rows(stored)
+    check = overlap_time(stored)
+    if check is None or not fresh:
+        return None
+
+    fresh_by_day = {_local_day(r['time']): r for r in fresh}
+    old_bar = next((r for r in stored_rows if r['time'] == check), None)
+    new_bar = fresh_by_day.get(_local_day(check))
+    if old_bar is None or new_bar is None:
+        return None
+    old_close, new_close = old_bar.get('close'), new_bar.get('close')
+    if not old_close or not new_close:
+        return None
+    if abs(new_close - old_close) > abs(old_close) * OVERLAP_TOLERANCE:
+        return None
+
+    merged = {_local_day(r['time']): r for r in stored_rows}
+    merged.update(fresh_by_day)
+    rows = [merged[d] for d in sorted(merged)]
+    newest = rows[-1]['time']
+    return [r for r in rows if r['time'] > newest - window_seconds]
+
+
+def refresh_daily_chunk(client, codes, incremental=True, now_ts=None):
+    """銘柄の日足を取り直して stock_price_history に保存する。
+
+    incremental のときは保存済みの最後から後ろだけを取り、継ぎ目が合わない銘柄・
+    保存が無い銘柄だけ1年分を取る。
+    Returns:
+        {'saved', 'incremental', 'full', 'bars_fetched'}
+    """
+    import time
+
+    now_ts = now_ts or time.time()
+    stored = {}
+    if incremental:
+        res = (client.table('stock_price_history')
+               .select('company_code, daily_1y')
+               .in_('company_code', list(codes))
+               .execute())
+        stored = {r['company_code']: r.get('daily_1y') for r in res.data or []}
+
+    # 取得する期間ごとにまとめる（バッチ取得は1回につき1つの period）
+    groups = {}
+    for code in codes:
+        check = overlap_time(stored.get(code)) if code in stored else None
+        period = incremental_period(check, now_ts) if check is not None else None
+        groups.setdefault(period or '1y', []).append(code)
+
+    rows_by_code = {}
+    counts = {'saved': 0, 'incremental': 0, 'full': 0, 'bars_fetched': 0}
+    retry = []
+    for period, group in groups.items():
+        fetched = fetch_ohlc_batch(group, period=period, chunk_size=len(group))
+        for code, fresh in fetched.items():
+            counts['bars_fetched'] += len(fresh)
+            if period == '1y':
+                rows_by_code[code] = fresh
+                counts['full'] += 1
+                continue
+            merged = merge_daily(stored.get(code), fresh)
+            if merged is None:
+                retry.append(code)
+            else:
+                rows_by_code[code] = merged
+                counts['incremental'] += 1
+
+    if retry:
+        print(f'日足の継ぎ目が合わないため1年分を取り直します: {len(retry)}件')
+        for code, fresh in fetch_ohlc_batch(retry, period='1y', chunk_size=len(retry)).items():
+            counts['bars_fetched'] += len(fresh)
+            rows_by_code[code] = fresh
+            counts['full'] += 1
+
+    now = datetime.now(timezone.utc).isoformat()
+    payload = [{'company_code': c, 'daily_1y': encode_ohlc(rows),
+                'daily_updated_at': now, 'updated_at': now}
+               for c, rows in rows_by_code.items()]
+    if payload:
+        try:
+            client.table('stock_price_history').upsert(payload).execute()
+            counts['saved'] = len(payload)
+        except Exception as e:
+            print(f'日足の保存エラー: {e}')
         else:
-            key = (d.year, d.month)
-
-        if key not in buckets:
-            buckets[key] = {
-                'time': r['time'],
-                'open': r['open'],
-                'high': r['high'],
-                'low': r['low'],
-                'close': r['close'],
-            }
-            order.append(key)
-            continue
+            # ファイルへの書き出しは呼び出し側が最後にまとめて行う（price_store.flush）
+            from price_store import default_store
+            store = default_store()
+            for p in payload:
+                store.put(p['company_code'], 'daily_1y', p['daily_1y'], now)
+    return counts
 
-        b = buckets[key]
-        if r['high'] is not None:
-            b['high'] = r['high'] if b['high'] is None else max(b['high'], r['high'])
-        if r['low'] is not None:
-            b['low'] = r['low'] if b['low'] is None else min(b['low'], r['low'])
-        b['close'] = r['close']
 
-    return [buckets[k] for k in order]
+# ---------------------------------------------------------------
+# 長期足（週足・月足）の先回り作成
+# ---------------------------------------------------------------
+#
+# 長期足は閲覧されたときに get_long_term が10年分を取って作っていたので、
+# 持っている銘柄はごく一部（実測 1,200件中1件）だった。2年以上のチャートと
+# 1年より前からの積立シミュレーションは、初回にその場の取得（最大20秒）を待つ。
+# 夜間に全銘柄の10年分をまとめて取り、週足・月足にして保存しておく。
+#
+# 続きから進める:
+#   長期足が無い銘柄を先に、次に更新の古い銘柄から取る。保存した銘柄は
+#   long_term_updated_at が新しくなって次の対象から外れるので、途中で止まっても
+#   次の晩は続きから進む。Render のディスクは消えるので、進み具合はファイルでなく
+#   DB の更新時刻で持つ。
+
+# これより新しい長期足は取り直さない（get_long_term が裏で取り直す目安と同じ）
+LONG_TERM_MAX_AGE_DAYS = 7
+
+# 1回のバッチ取得に入れる銘柄数。10年分は1銘柄約2,500本なので日足より少なくする
+LONG_TERM_CHUNK = 50
+
+# 1晩に取り直す上限。約4,000銘柄が LONG_TERM_MAX_AGE_DAYS のうちに一巡する
+LONG_TERM_NIGHTLY_LIMIT = 1200
+
+
+def long_term_targets(client, codes, max_age_days=LONG_TERM_MAX_AGE_DAYS, limit=None):
+    """長期足を取り直す銘柄を、取る順に並べて返す。(銘柄, 長期足が無い銘柄の数)
+
+    長期足が無い銘柄（codes の順）→ 更新の古い順。max_age_days より新しい銘柄は入れない。
+    """
+    stamps = {}
+    for i in range(0, len(codes), GET_MANY_CHUNK):
+        res = (client.table('stock_price_history')
+               .select('company_code, long_term_updated_at')
+               .in_('company_code', list(codes[i:i + GET_MANY_CHUNK]))
+               .execute())
+        stamps.update((r['company_code'], r.get('long_term_updated_at'))
+                      for r in res.data or [])
+
+    missing = [c for c in codes if not stamps.get(c)]
+    stale = sorted((stamps[c], c) for c in dict.fromkeys(codes)
+                   if stamps.get(c) and _is_stale(stamps[c], max_age_days))
+    targets = list(dict.fromkeys(missing)) + [c for _, c in stale]
+    return (targets[:limit] if limit is not None else targets), len(missing)
+
+
+def refresh_long_term_chunk(client, codes):
+    """銘柄の10年分をまとめて取り、週足・月足にして stock_price_history に保存する。
+
+    Returns:
+        {'saved', 'no_data', 'bars_fetched'}
+    """
+    import yfinance as yf
+
+    counts = {'saved': 0, 'no_data': 0, 'bars_fetched': 0}
+    symbols = [to_symbol(c) for c in codes]
+    try:
+        df = yf.download(' '.join(symbols), period='10y', progress=False,
+                         threads=True, auto_adjust=True, group_by='ticker')
+        by_symbol = batch_frame_to_columns(df, symbols)
+    except Exception as e:
+        print(f'長期足のバッチ取得エラー ({len(codes)}件): {e}')
+        return counts
+
+    now = datetime.now(timezone.utc).isoformat()
+    payload = []
+    no_data = []
+    for code, sym in zip(codes, symbols):
+        bars = by_symbol.get(sym)
+        if bars is None:
+            no_data.append(code)
+            continue
+        counts['bars_fetched'] += len(bars['time'])
+        payload.append({'company_code': code,
+                        'weekly_10y': encode_ohlc(resample_ohlc(bars, 'weekly')),
+                        'monthly_10y': encode_ohlc(resample_ohlc(bars, 'monthly')),
+                        'long_term_updated_at': now, 'updated_at': now})
+    if not payload:
+        # 1銘柄も返らないのは取得側の不調（制限など）。取れなかった印は付けない
+        return counts
+
+    # 他の銘柄は取れたのに返らなかった銘柄（上場廃止など）は、更新時刻だけ進めて
+    # 毎晩の先頭に居座らないようにする。閲覧されれば get_long_term が取りに行く
+    marks = [{'company_code': c, 'long_term_updated_at': now, 'updated_at': now}
+             for c in no_data]
+    try:
+        client.table('stock_price_history').upsert(payload).execute()
+        counts['saved'] = len(payload)
+        if marks:
+            client.table('stock_price_history').upsert(marks).execute()
+            counts['no_data'] = len(marks)
+    except Exception as e:
+        print(f'長期足の保存エラー: {e}')
+        return counts
+
+    # ファイルへの書き出しは呼び出し側が最後にまとめて行う（price_store.flush）
+    from price_store import default_store
+    store = default_store()
+    for p in payload:
+        for series in ('weekly_10y', 'monthly_10y'):
+            store.put(p['company_code'], series, p[series], now)
+    return counts
+
+
+def pregenerate_long_term(client, codes, limit=LONG_TERM_NIGHTLY_LIMIT,
+                          should_stop=None, on_progress=None):
+    """長期足が無い・古い銘柄から順に、limit 件まで週足・月足を作って保存する。
+
+    Args:
+        should_stop: 引数なしで True を返したら、次の塊に進まずに終える
+        on_progress: (済んだ件数, 対象の件数) を受け取る
+    Returns:
+        {'targets', 'missing_before', 'saved', 'no_data', 'bars_fetched'}
+    """
+    targets, missing = long_term_targets(client, codes, limit=limit)
+    counts = {'targets': len(targets), 'missing_before': missing,
+              'saved': 0, 'no_data': 0, 'bars_fetched': 0}
+    for i in range(0, len(targets), LONG_TERM_CHUNK):
+        if should_stop and should_stop():
+            break
+        chunk_counts = refresh_long_term_chunk(client, targets[i:i + LONG_TERM_CHUNK])
+        for key, value in chunk_counts.items():
+            counts[key] += value
+        if on_progress:
+            on_progress(min(i + LONG_TERM_CHUNK, len(targets)), len(targets))
+    return counts
 
 
 # ---------------------------------------------------------------
 # DB入出力
 # ---------------------------------------------------------------
 
-def get_stored(company_code):
-    """保存済みの株価履歴レコードを返す。無ければ None。"""
+# 閲覧で Supabase から読んだ分がこれだけ溜まったら、裏でファイルに書き出す
+STORE_FLUSH_PENDING = 50
+
+
+# get_many で1回の in_ 問い合わせに入れる銘柄数。日足1年分の列の形は1銘柄あたり
+# 数KBなので、100銘柄でも応答は1MBに収まる
+GET_MANY_CHUNK = 100
+
+
+def _series_column(series):
+    """系列名と、その更新時刻の列名。知らない系列は ValueError"""
+    from price_store import SERIES
+    if series not in SERIES:
+        raise ValueError(f'unknown series: {series}')
+    return SERIES[series]
+
+
+def get_series(company_code, series):
+    """保存済みの1系列を (列, 更新時刻) で返す。銘柄の行が無ければ None。
+
+    Supabase からは指定した系列とその更新時刻の列だけを読む（日足のチャートで
+    週足・月足まで受け取らない）。列は decode_ohlc の形で、系列が未保存（null）なら
+    空の列になる。
+    """
+    found = get_many([company_code], series)
+    return found.get(company_code)
+
+
+def get_many(codes, series, chunk_size=GET_MANY_CHUNK):
+    """複数銘柄の1系列をまとめて読む。{code: (列, 更新時刻)} を返す。
+
+    ローカルの置き場に無い銘柄だけを、chunk_size 件ずつの in_ 問い合わせで
+    Supabase から読む（銘柄ごとに1往復しない）。行が無い銘柄は結果に入らない。
+    """
+    from price_store import default_store
     from supabase_client import get_supabase_client
+
+    updated_column = _series_column(series)
+    store = default_store()
+    found = {}
+    missing = []
+    for code in dict.fromkeys(codes):
+        got = store.get(code, series)
+        if got is None:
+            missing.append(code)
+        else:
+            found[code] = got
+    if not missing:
+        return found
+
     client = get_supabase_client()
-    res = (client.table('stock_price_history')
-           .select('*')
-           .eq('company_code', company_code)
-           .execute())
-    return res.data[0] if res.data else None
+    for i in range(0, len(missing), chunk_size):
+        res = (client.table('stock_price_history')
+               .select(f'company_code, {series}, {updated_column}')
+               .in_('company_code', missing[i:i + chunk_size])
+               .execute())
+        for row in res.data or []:
+            code = row.get('company_code')
+            found[code] = (decode_ohlc(row.get(series)), row.get(updated_column))
+            store.put(code, series, found[code][0], found[code][1])
+    store.flush_in_background(STORE_FLUSH_PENDING)
+    store.rebuild_in_background(get_supabase_client)
+    return found
+
+
+# iter_pages で1ページに読む行数。日足1年分の列の形は1銘柄あたり数KBなので、
+# 500行でも応答は数MBに収まる（PostgREST の既定の上限1000行より少なくする）
+PAGE_SIZE = 500
+
+
+def iter_pages(client, columns='company_code, daily_1y', page_size=PAGE_SIZE, prepare=None):
+    """stock_price_history を company_code 順に1ページずつ返すジェネレーター。
+
+    全銘柄を処理する夜間のバッチ向け。従来は range(offset) で最大20ページまでを
+    先に全部読んでいたため、銘柄数に比例してメモリを使い、1万銘柄を超えると
+    黙って切り捨てていた。
+
+    - 次のページは「前のページの最後の company_code より後」で取る（keyset）。
+      ページ数の上限は無く、途中で行が増減しても読み飛ばし・重複が起きない
+    - 次のページは、呼び出し側が今のページを処理している間に裏のスレッドで取る。
+      手元に持つのは処理中のページと取得中のページの2つまで
+    - prepare(rows) を渡すと、ページの行と一緒に裏のスレッドで済ませておく
+      （ページの銘柄の計算済みの状態を読んでおく、など）
+
+    Yields:
+        rows（prepare を渡したときは (rows, prepare の結果)）
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def _fetch(after):
+        query = client.table('stock_price_history').select(columns).order('company_code')
+        if after is not None:
+            query = query.gt('company_code', after)
+        rows = query.limit(page_size).execute().data or []
+        return rows, (prepare(rows) if prepare and rows else None)
+
+    # 途中で止められた（ジェネレーターを閉じられた）ときは、取得中の1ページを待って抜ける
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='price-page') as pool:
+        pending = pool.submit(_fetch, None)
+        while pending is not None:
+            rows, prepared = pending.result()
+            if not rows:
+                return
+            # 今のページを返す前に、次のページを頼んでおく
+            pending = (pool.submit(_fetch, rows[-1]['company_code'])
+                       if len(rows) == page_size else None)
+            yield (rows, prepared) if prepare else rows
+
+
+def count_rows(client):
+    """stock_price_history の行数（進み具合の分母）。数えられなければ None"""
+    try:
+        res = (client.table('stock_price_history')
+               .select('company_code', count='exact')
+               .limit(1)
+               .execute())
+        return res.count
+    except Exception as e:
+        print(f'株価履歴の件数取得エラー: {e}')
+        return None
 
 
 def save_daily(company_code, rows):
+    from price_store import default_store
     from supabase_client import get_supabase_client
     client = get_supabase_client()
     now = datetime.now(timezone.utc).isoformat()
+    encoded = encode_ohlc(rows)
     client.table('stock_price_history').upsert({
         'company_code': company_code,
-        'daily_1y': rows,
+        'daily_1y': encoded,
         'daily_updated_at': now,
         'updated_at': now,
     }).execute()
+    default_store().put(company_code, 'daily_1y', encoded, now)
 
 
 def save_long_term(company_code, weekly, monthly):
+    from price_store import default_store
     from supabase_client import get_supabase_client
     client = get_supabase_client()
     now = datetime.now(timezone.utc).isoformat()
+    encoded = {'weekly_10y': encode_ohlc(weekly), 'monthly_10y': encode_ohlc(monthly)}
     client.table('stock_price_history').upsert({
         'company_code': company_code,
-        'weekly_10y': weekly,
-        'monthly_10y': monthly,
+        **encoded,
         'long_term_updated_at': now,
         'updated_at': now,
     }).execute()
+    store = default_store()
+    for series, value in encoded.items():
+        store.put(company_code, series, value, now)
 
 
 def _is_stale(timestamp_str, max_age_days):
@@ -222,53 +893,49 @@ def to_symbol(company_code):
     return f'{code}.T' if len(code) == 4 and code[0].isdigit() else code
 
 
-_refreshing = set()
-_refreshing_lock = threading.Lock()
+# 裏の取り直しを同時に走らせる本数と、待たせておける件数。
+# Yahoo の枠（upstream_limiter）を画面の分析と分け合うので多くしない
+REFRESH_WORKERS = 4
+REFRESH_QUEUE_SIZE = 64
 
+_refresher = RefreshExecutor(REFRESH_WORKERS, REFRESH_QUEUE_SIZE, name='price-refresh')
 
-def _refresh_in_background(key, work):
+
+def _refresh_in_background(key, work, priority=PRIORITY_USER):
     """保存済みを返した後ろで取り直す。同じ銘柄の多重起動はしない。
 
     画面を待たせないための仕組み。ユーザーには古い足がすぐ出て、
-    次に開いたときには新しくなっている。
+    次に開いたときには新しくなっている。取り直しは決まった本数のスレッドで
+    回し（refresh_executor）、溢れた分は捨てる。クローラーの分は後回し。
     """
-    with _refreshing_lock:
-        if key in _refreshing:
-            return
-        _refreshing.add(key)
+    return _refresher.submit(key, work, priority)
 
-    def run():
-        try:
-            work()
-        except Exception as e:
-            print(f'株価履歴の裏更新エラー {key}: {e}')
-        finally:
-            with _refreshing_lock:
-                _refreshing.discard(key)
 
-    threading.Thread(target=run, daemon=True, name=f'price-refresh-{key}').start()
+def refresh_snapshot():
+    """裏の取り直しの待ち行列の長さ・捨てた数（管理画面用）"""
+    return _refresher.snapshot()
 
 
-def call_with_deadline(func, seconds):
+def call_with_deadline(func, seconds, upstream='yfinance'):
     """funcをseconds以内に終わらせる。超えたら諦めて None を返す。
 
     スレッドは止められないので走り続けるが、**リクエストは返る**。
     worker が gunicorn のタイムアウトで殺されるのを防ぐのが目的。
+    スレッドはプロセス共通の置き場（deadline_executor）から借りる。
+    同じ相手（upstream）への時間切れの処理が溜まっているときは、
+    待たずにすぐ None を返す。
     """
-    from concurrent.futures import ThreadPoolExecutor, TimeoutError as _Timeout
-    executor = ThreadPoolExecutor(max_workers=1)
+    from deadline_executor import DeadlineExceeded, DeadlineRejected, default_executor
     try:
-        future = executor.submit(func)
-        try:
-            return future.result(timeout=seconds)
-        except _Timeout:
-            return None
-    finally:
-        # 走り続けているスレッドの完了は待たない（待つと意味が無い）
-        executor.shutdown(wait=False)
+        return default_executor().run(func, seconds, upstream=upstream)
+    except DeadlineRejected as e:
+        print(f'上限つきの処理を受け付けませんでした: {e}')
+        return None
+    except DeadlineExceeded:
+        return None
 
 
-def get_daily(company_code, max_age_days=2):
+def get_daily(company_code, max_age_days=2, priority=PRIORITY_USER):
     """日足を返す。
 
     保存済みがあれば**古くてもすぐ返し**、取り直しは裏で行う。
@@ -277,14 +944,16 @@ def get_daily(company_code, max_age_days=2):
     以前は古いというだけでその場で取りに行っており、Yahooが遅いと
     リクエストが何十秒も返らなかった。本番は worker 1本なので、
     それが120秒を超えると worker ごと落ちてアプリ全体が 503 になる。
+
+    priority は裏の取り直しの優先度（refresh_executor.PRIORITY_USER / PRIORITY_CRAWLER）。
     """
-    stored = get_stored(company_code)
-    cached = (stored or {}).get('daily_1y')
+    columns, updated_at = get_series(company_code, 'daily_1y') or (None, None)
+    cached = to_rows(columns)
 
     if cached:
-        if _is_stale((stored or {}).get('daily_updated_at'), max_age_days):
+        if _is_stale(updated_at, max_age_days):
             _refresh_in_background(f'daily:{company_code}',
-                                   lambda: _fetch_and_save_daily(company_code))
+                                   lambda: _fetch_and_save_daily(company_code), priority)
         return cached
 
     # 保存が無い＝出すものが何も無いので、ここだけ待つ（上限つき）
@@ -303,7 +972,8 @@ def _fetch_and_save_daily(company_code):
     return rows
 
 
-def get_long_term(company_code, granularity, max_age_days=7):
+def get_long_term(company_code, granularity, max_age_days=LONG_TERM_MAX_AGE_DAYS,
+                  priority=PRIORITY_USER):
     """週足/月足を返す。日足と同じく、保存済みを優先して裏で取り直す。
 
     長期足は10年分を取ってから週足・月足に間引くので、日足より重い。
@@ -311,13 +981,13 @@ def get_long_term(company_code, granularity, max_age_days=7):
     """
     column = 'weekly_10y' if granularity == 'weekly' else 'monthly_10y'
 
-    stored = get_stored(company_code)
-    cached = (stored or {}).get(column)
+    columns, updated_at = get_series(company_code, column) or (None, None)
+    cached = to_rows(columns)
 
     if cached:
-        if _is_stale((stored or {}).get('long_term_updated_at'), max_age_days):
+        if _is_stale(updated_at, max_age_days):
             _refresh_in_background(f'long:{company_code}',
-                                   lambda: _fetch_and_save_long_term(company_code))
+                                   lambda: _fetch_and_save_long_term(company_code), priority)
         return cached
 
     result = call_with_deadline(
@@ -329,11 +999,12 @@ def get_long_term(company_code, granularity, max_age_days=7):
 
 def _fetch_and_save_long_term(company_code):
     """10年分を取って週足・月足に間引き保存する。(weekly, monthly) を返す。"""
-    daily = fetch_ohlc(to_symbol(company_code), period='10y')
-    if not daily:
+    # 行にせず列のまま受け取り、2つの粒度の集約で使い回す
+    bars = fetch_ohlc(to_symbol(company_code), period='10y', columns=True)
+    if not len(bars['time']):
         return None
-    weekly = downsample(daily, 'weekly')
-    monthly = downsample(daily, 'monthly')
+    weekly = columns_to_rows(resample_ohlc(bars, 'weekly'))
+    monthly = columns_to_rows(resample_ohlc(bars, 'monthly'))
     try:
         save_long_term(company_code, weekly, monthly)
     except Exception as e:
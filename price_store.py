@@ -0,0 +1,353 @@
+"""株価履歴のローカル置き場（stock_price_history の手前に置く2段目のキャッシュ）。
+
+背景:
+  チャート・積立シミュレーション・PER/PBR推移は、開くたびに Supabase へ1往復し、
+  日足・週足・月足の3系列が入った行を丸ごと受け取っていた。足は夜に1回しか
+  変わらないのに、閲覧のたびにネットワーク越しに同じものを読む。
+  いまは price_history.get_series / get_many がまずここを見る。
+
+方針:
+  - 系列（daily_1y / weekly_10y / monthly_10y）ごとに、全銘柄の足を1本に
+    詰めたファイルを持つ。time は int64、OHLC は float64 の (本数, 4)。
+    どの銘柄が何本目から何本あるかは索引（JSON）に書く
+  - 読むときは np.memmap で開き、銘柄の範囲を切り出すだけ（コピーしない）
+  - 書き込みは夜間の日足更新・閲覧時の取り直しで put したものを溜め、
+    flush でファイルを作り直す。世代番号つきのファイルを書いてから
+    索引を os.replace で差し替えるので、読み途中に半端な中身は見えない
+  - 正は Supabase。ここに無い・読めないときは Supabase から読み、
+    その結果を put しておく。Render のディスクは再起動で消えるので、
+    ファイルが1つも無ければ裏で全銘柄を読み直して作る（rebuild_in_background）
+  - PRICE_STORE=off で使わない
+"""
+
+import json
+import os
+import threading
+
+# off / false / 0 で使わない
+PRICE_STORE = os.getenv('PRICE_STORE', 'on').strip().lower()
+
+DEFAULT_DIR = os.getenv('PRICE_STORE_DIR', os.path.join('output', 'price_store'))
+
+# 系列と、その更新時刻の列
+SERIES = {
+    'daily_1y': 'daily_updated_at',
+    'weekly_10y': 'long_term_updated_at',
+    'monthly_10y': 'long_term_updated_at',
+}
+
+# 作り直しで Supabase から一度に読む行数と、ファイルに書き出す間隔（行数）。
+# 全銘柄を抱えてから書くとメモリが重いので、途中でも書き出す
+REBUILD_PAGE_SIZE = 200
+REBUILD_FLUSH_EVERY = 1000
+
+_OHLC = ('open', 'high', 'low', 'close')
+
+
+def _enabled():
+    return PRICE_STORE not in ('off', 'false', '0', 'no')
+
+
+class _Packed:
+    """1系列ぶんのファイル（memmap）と索引"""
+
+    __slots__ = ('stamp', 'generation', 'index', 'times', 'ohlc')
+
+    def __init__(self, stamp=None, generation=0, index=None, times=None, ohlc=None):
+        self.stamp = stamp   # 索引ファイルの (inode, 更新時刻)。変わったら開き直す
+        self.generation = generation
+        self.index = index or {}   # {code: [先頭, 本数, 更新時刻]}
+        self.times = times
+        self.ohlc = ohlc
+
+
+class PriceStore:
+    """系列ごとに全銘柄の足を詰めたファイルを memmap で読む
+
+    Args:
+        directory: 置き場。無ければ作る
+    """
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()   # 世代番号がぶつからないよう flush は1本ずつ
+        self._packed = {}
+        self._pending = {series: {} for series in SERIES}   # {series: {code: (列, 更新時刻)}}
+        self._rebuilding = False
+        self.hits = 0
+        self.misses = 0
+
+    # ---------------- 読み出し ----------------
+
+    def get(self, code, series):
+        """(列, 更新時刻) を返す。この銘柄のこの系列を知らなければ None。
+
+        列は decode_ohlc と同じ形。ファイルから読んだものは memmap の切り出しで、
+        書き換えてはいけない。本数0（保存済みだが空）のときは列が空になる。
+        """
+        if not _enabled():
+            return None
+        with self._lock:
+            pending = self._pending[series].get(code)
+            if pending is not None:
+                self.hits += 1
+                return pending
+            packed = self._load(series)
+            entry = packed.index.get(code)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        start, length, updated_at = entry
+        if not length:
+            from price_history import decode_ohlc
+            return decode_ohlc(None), updated_at
+        ohlc = packed.ohlc[start:start + length]
+        columns = {'time': packed.times[start:start + length]}
+        for i, name in enumerate(_OHLC):
+            columns[name] = ohlc[:, i]
+        return columns, updated_at
+
+    def _load(self, series):
+        """索引が差し替わっていれば開き直す。呼び出し側で lock を持つこと"""
+        import numpy as np
+
+        meta_path = self._meta_path(series)
+        current = self._packed.get(series)
+        try:
+            st = os.stat(meta_path)
+        except OSError:
+            if current is None or current.stamp is not None:
+                current = self._packed[series] = _Packed()
+            return current
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if current is not None and current.stamp == stamp:
+            return current
+
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f'株価のローカル置き場の索引を読めません ({series}): {e}')
+            packed = self._packed[series] = _Packed(stamp)
+            return packed
+
+        generation = meta.get('generation', 0)
+        total = int(meta.get('total', 0))
+        times = ohlc = None
+        if total:
+            try:
+                times = np.memmap(self._data_path(series, generation, 'time'),
+                                  dtype=np.int64, mode='r', shape=(total,))
+                ohlc = np.memmap(self._data_path(series, generation, 'ohlc'),
+                                 dtype=np.float64, mode='r', shape=(total, len(_OHLC)))
+            except (OSError, ValueError) as e:
+                print(f'株価のローカル置き場を開けません ({series}): {e}')
+                packed = self._packed[series] = _Packed(stamp)
+                return packed
+        packed = _Packed(stamp, generation, meta.get('index') or {}, times, ohlc)
+        self._packed[series] = packed
+        return packed
+
+    # ---------------- 書き込み ----------------
+
+    def put(self, code, series, value, updated_at=None):
+        """1銘柄1系列を溜める（flush までファイルには書かない）。value は decode_ohlc が読めるもの"""
+        if not _enabled() or series not in SERIES:
+            return
+        import numpy as np
+        from price_history import decode_ohlc
+
+        bars = decode_ohlc(value)
+        columns = {'time': np.array(bars['time'], dtype=np.int64)}
+        for name in _OHLC:
+            columns[name] = np.array(bars[name], dtype=np.float64)
+        with self._lock:
+            self._pending[series][code] = (columns, updated_at)
+
+    def put_row(self, row):
+        """stock_price_history の1行（select('*') の結果）を溜める"""
+        code = (row or {}).get('company_code')
+        if not code:
+            return
+        for series, updated_column in SERIES.items():
+            self.put(code, series, row.get(series), row.get(updated_column))
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def flush(self):
+        """溜めた分を既存のファイルと合わせて書き直す。書いた銘柄数を返す"""
+        if not _enabled():
+            return 0
+        with self._flush_lock:
+            return self._flush_locked()
+
+    def flush_in_background(self, min_pending=1):
+        """溜めた分が min_pending 以上なら裏で flush する（閲覧を待たせない）"""
+        if not _enabled() or self.pending_count() < min_pending or self._flush_lock.locked():
+            return False
+        threading.Thread(target=self.flush, daemon=True, name='price-store-flush').start()
+        return True
+
+    def _flush_locked(self):
+        written = 0
+        for series in SERIES:
+            with self._lock:
+                pending = dict(self._pending[series])
+                if not pending:
+                    continue
+                packed = self._load(series)
+            try:
+                self._write(series, packed, pending)
+            except OSError as e:
+                # 溜めた分はそのまま残る（読み出しはメモリから続けられる）
+                print(f'株価のローカル置き場に書けません ({series}): {e}')
+                continue
+            written += len(pending)
+            with self._lock:
+                # 書いている間に put し直されたものは次の flush に回す
+                current = self._pending[series]
+                for code, item in pending.items():
+                    if current.get(code) is item:
+                        del current[code]
+        return written
+
+    def _write(self, series, packed, pending):
+        import numpy as np
+
+        os.makedirs(self.directory, exist_ok=True)
+        codes = [c for c in packed.index if c not in pending] + list(pending)
+        lengths = []
+        for code in codes:
+            lengths.append(len(pending[code][0]['time']) if code in pending
+                           else packed.index[code][1])
+        total = int(sum(lengths))
+        generation = packed.generation + 1
+
+        time_path = self._data_path(series, generation, 'time')
+        ohlc_path = self._data_path(series, generation, 'ohlc')
+        times = np.memmap(time_path, dtype=np.int64, mode='w+', shape=(max(total, 1),))
+        ohlc = np.memmap(ohlc_path, dtype=np.float64, mode='w+',
+                         shape=(max(total, 1), len(_OHLC)))
+        index = {}
+        offset = 0
+        for code, length in zip(codes, lengths):
+            if code in pending:
+                columns, updated_at = pending[code]
+                times[offset:offset + length] = columns['time']
+                for i, name in enumerate(_OHLC):
+                    ohlc[offset:offset + length, i] = columns[name]
+            elif length:
+                start, _, updated_at = packed.index[code]
+                times[offset:offset + length] = packed.times[start:start + length]
+                ohlc[offset:offset + length] = packed.ohlc[start:start + length]
+            else:
+                updated_at = packed.index[code][2]
+            index[code] = [offset, length, updated_at]
+            offset += length
+        times.flush()
+        ohlc.flush()
+        del times, ohlc
+
+        meta_path = self._meta_path(series)
+        tmp = f'{meta_path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'generation': generation, 'total': total, 'index': index}, f,
+                      separators=(',', ':'))
+        os.replace(tmp, meta_path)
+
+        # 古い世代は消す（開いている memmap は Linux では消しても読める）
+        for kind in ('time', 'ohlc'):
+            try:
+                os.remove(self._data_path(series, packed.generation, kind))
+            except OSError:
+                pass
+        with self._lock:
+            self._load(series)
+
+    # ---------------- 作り直し ----------------
+
+    def is_empty(self):
+        return not any(os.path.exists(self._meta_path(s)) for s in SERIES)
+
+    def rebuild(self, client):
+        """Supabase の stock_price_history を全件読み直して置き場を作る。件数を返す"""
+        columns = ['company_code', *SERIES, *sorted(set(SERIES.values()))]
+        offset = 0
+        loaded = 0
+        while True:
+            res = (client.table('stock_price_history')
+                   .select(', '.join(columns))
+                   .order('company_code')
+                   .range(offset, offset + REBUILD_PAGE_SIZE - 1)
+                   .execute())
+            rows = res.data or []
+            for row in rows:
+                self.put_row(row)
+            loaded += len(rows)
+            if loaded and loaded % REBUILD_FLUSH_EVERY < REBUILD_PAGE_SIZE:
+                self.flush()
+            if len(rows) < REBUILD_PAGE_SIZE:
+                break
+            offset += REBUILD_PAGE_SIZE
+        self.flush()
+        return loaded
+
+    def rebuild_in_background(self, client_factory):
+        """置き場が空なら、裏で1回だけ作り直す（プロセスで1本まで）"""
+        if not _enabled():
+            return False
+        with self._lock:
+            if self._rebuilding or not self.is_empty():
+                return False
+            self._rebuilding = True
+
+        def run():
+            try:
+                loaded = self.rebuild(client_factory())
+                print(f'株価のローカル置き場を作り直しました: {loaded}銘柄')
+            except Exception as e:
+                print(f'株価のローカル置き場の作り直しエラー: {e}')
+            finally:
+                with self._lock:
+                    self._rebuilding = False
+
+        threading.Thread(target=run, daemon=True, name='price-store-rebuild').start()
+        return True
+
+    # ---------------- その他 ----------------
+
+    def _meta_path(self, series):
+        return os.path.join(self.directory, f'{series}.json')
+
+    def _data_path(self, series, generation, kind):
+        return os.path.join(self.directory, f'{series}.{generation}.{kind}')
+
+    def snapshot(self):
+        """管理画面・ログ用"""
+        with self._lock:
+            return {
+                'enabled': _enabled(),
+                'directory': self.directory,
+                'hits': self.hits,     # 系列ごとに数える
+                'misses': self.misses,
+                'rebuilding': self._rebuilding,
+                'pending': {s: len(p) for s, p in self._pending.items()},
+                'stocks': {s: len(self._load(s).index) for s in SERIES},
+            }
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_store():
+    """アプリ既定の置き場（プロセスで1つ）"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = PriceStore()
+        return _default
@@ -0,0 +1,154 @@
+"""裏での取り直しを、決まった本数のスレッドと優先度つきの待ち行列で回す。
+
+背景:
+  price_history の get_daily / get_long_term は、保存済みの足が古いと
+  裏で取り直す（_refresh_in_background）。以前は1件ごとにスレッドを
+  起こしており、重複を銘柄で弾くだけだった。クローラーが /stock/<code> を
+  順に開くと、worker 1本の中で Yahoo への取得が何百本も同時に走り、
+  Yahoo の枠もスレッドも食い潰す。
+
+方針:
+  - 取り直しは max_workers 本のスレッドだけで回し、残りは待ち行列に置く
+  - 待ち行列は優先度順。人が開いた画面（PRIORITY_USER）をクローラー
+    （PRIORITY_CRAWLER）より先に取り直す
+  - 待ち行列が一杯なら捨てる。より優先度の高いものが来たら、いちばん
+    後回しのものを押し出す。捨てても画面には古い足が出ているだけで、
+    次に開かれたときにまた積まれる
+  - 同じキーは待ち中・実行中なら積まない
+  - 待ち行列の長さ・捨てた数を監視用に出す
+"""
+
+import heapq
+import itertools
+import re
+import threading
+
+PRIORITY_USER = 0
+PRIORITY_CRAWLER = 1
+
+_PRIORITY_NAMES = {PRIORITY_USER: 'user', PRIORITY_CRAWLER: 'crawler'}
+
+# 検索エンジン・SNS のプレビュー取得など、人が見ていないアクセスの User-Agent
+_CRAWLER_PATTERN = re.compile(
+    r'bot|crawl|spider|slurp|preview|facebookexternalhit|embedly|headless|python-requests|curl',
+    re.IGNORECASE)
+
+
+def priority_for_user_agent(user_agent):
+    """User-Agent から取り直しの優先度を決める。空（ブラウザでない）もクローラー扱い"""
+    if not user_agent or _CRAWLER_PATTERN.search(user_agent):
+        return PRIORITY_CRAWLER
+    return PRIORITY_USER
+
+
+class RefreshExecutor:
+    """優先度つきの待ち行列と、決まった本数のスレッド。スレッドから同時に使ってよい。
+
+    Args:
+        max_workers: 同時に走らせる本数
+        max_queue: 実行を待たせておける件数。超えたら捨てる
+    """
+
+    def __init__(self, max_workers=4, max_queue=64, name='refresh'):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._queue = []   # heap of (優先度, 積んだ順, key, work)
+        self._seq = itertools.count()
+        self._workers = 0
+        self._idle = 0
+        # 待ち中・実行中のキー。同じキーを二重に積まないために使う
+        self.active = set()
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.dropped = {name: 0 for name in _PRIORITY_NAMES.values()}
+        self.max_depth = 0
+
+    def submit(self, key, work, priority=PRIORITY_USER):
+        """work を積む。'queued' / 'duplicate' / 'dropped' のどれかを返す"""
+        with self._cond:
+            if key in self.active:
+                self.duplicates += 1
+                return 'duplicate'
+            if len(self._queue) >= self.max_queue:
+                # いちばん後回しのもの（優先度が低く、後から来たもの）と比べる
+                worst = max(self._queue)
+                if worst[0] <= priority:
+                    self._count_drop(priority)
+                    return 'dropped'
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                self.active.discard(worst[2])
+                self._count_drop(worst[0])
+            heapq.heappush(self._queue, (priority, next(self._seq), key, work))
+            self.active.add(key)
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, len(self._queue))
+            # 待っているスレッドは、起こしてもこのロックを取り直すまで _idle から
+            # 減らない。まとめて積まれたときに「空きが1本ある」だけを見ると
+            # 1本で順に回すことになるので、待ち行列が空きの本数を超えたら増やす
+            if len(self._queue) > self._idle and self._workers < self.max_workers:
+                self._workers += 1
+                threading.Thread(target=self._run, daemon=True,
+                                 name=f'{self.name}-{self._workers}').start()
+            self._cond.notify()
+            return 'queued'
+
+    def _count_drop(self, priority):
+        name = _PRIORITY_NAMES.get(priority, str(priority))
+        self.dropped[name] = self.dropped.get(name, 0) + 1
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue:
+                        self._idle += 1
+                        self._cond.wait()
+                        self._idle -= 1
+                    _, _, key, work = heapq.heappop(self._queue)
+                    self.running += 1
+                ok = False
+                try:
+                    work()
+                    ok = True
+                except Exception as e:
+                    print(f'{self.name}: 裏の取り直しエラー {key}: {e}')
+                finally:
+                    with self._cond:
+                        self.running -= 1
+                        self.active.discard(key)
+                        if ok:
+                            self.completed += 1
+                        else:
+                            self.failed += 1
+        finally:
+            # Exception 以外で抜けたスレッドの分は、次の submit で作り直せるよう戻す
+            with self._cond:
+                self._workers -= 1
+
+    def snapshot(self):
+        """管理画面・ログ用"""
+        with self._cond:
+            waiting = {name: 0 for name in _PRIORITY_NAMES.values()}
+            for item in self._queue:
+                name = _PRIORITY_NAMES.get(item[0], str(item[0]))
+                waiting[name] = waiting.get(name, 0) + 1
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'running': self.running,
+                'queued': len(self._queue),
+                'queued_by_priority': waiting,
+                'max_depth': self.max_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'duplicates': self.duplicates,
+                'dropped': dict(self.dropped),
+            }
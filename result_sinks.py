@@ -0,0 +1,160 @@
+"""分析結果の書き出し先（シンク）。
+
+背景:
+  StockAnalyzer.analyze は毎回、結果を丸ごと json.dump(indent=2) で
+  output/snapshot_*.json に書いていた。price_history（数百行のOHLC）まで
+  字下げ付きで書くので、全銘柄バッチでは1銘柄ごとに整形のCPUとディスク書き込みを
+  払う。Render のディスクは再起動で消えるうえ、ホットパスで読み返す処理も無い。
+  読むのは会員向けの /api/stock/cache/<symbol> だけ。
+
+方針:
+  - 書き出し先を ResultSink として差し替えられるようにする
+      NullSink:      何も書かない。バッチ・バックフィルはこれで回す
+      CompactSink:   1銘柄1ファイル。字下げなしの JSON を gzip（level 1）で書く
+      RotatingSink:  CompactSink に件数の上限を付けたもの。古いものから消す
+  - 書き込みは一時ファイル → os.replace で差し替える（読み途中に半端な中身を見せない）
+  - アプリ既定の書き出し先は環境変数 RESULT_SINK で選ぶ（null / compact / rotating）
+  - 読み出しは旧形式の output/snapshot_*.json も読める（切り替え直後の互換）
+"""
+
+import gzip
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+
+# 既定の書き出し先。null / compact / rotating
+RESULT_SINK = os.getenv('RESULT_SINK', 'rotating')
+
+# RotatingSink が残すファイル数の上限
+RESULT_SINK_MAX_FILES = int(os.getenv('RESULT_SINK_MAX_FILES', '500'))
+
+DEFAULT_DIR = 'output'
+
+
+def _safe_name(symbol):
+    """'7203.T' → '7203_T'。パス区切りは受け付けない"""
+    return (symbol or '').replace('.', '_').replace('/', '_').replace('\\', '_')
+
+
+class ResultSink(ABC):
+    """分析結果の書き出し先。write と read を持つ"""
+
+    name = 'base'
+
+    @abstractmethod
+    def write(self, symbol, result):
+        """結果を書く"""
+
+    @abstractmethod
+    def read(self, symbol):
+        """保存済みの結果。無ければ None"""
+
+
+class NullSink(ResultSink):
+    """何も書かない。バッチ処理用"""
+
+    name = 'null'
+
+    def write(self, symbol, result):
+        return None
+
+    def read(self, symbol):
+        return None
+
+
+class CompactSink(ResultSink):
+    """1銘柄1ファイルの gzip 圧縮 JSON"""
+
+    name = 'compact'
+
+    def __init__(self, directory=DEFAULT_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, symbol):
+        return os.path.join(self.directory, f"snapshot_{_safe_name(symbol)}.json.gz")
+
+    def legacy_path_for(self, symbol):
+        return os.path.join(self.directory, f"snapshot_{_safe_name(symbol)}.json")
+
+    def write(self, symbol, result):
+        path = self.path_for(symbol)
+        payload = json.dumps(result, ensure_ascii=False, separators=(',', ':'),
+                             default=str).encode('utf-8')
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, 'wb', compresslevel=1) as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        return path
+
+    def read(self, symbol):
+        path = self.path_for(symbol)
+        if os.path.exists(path):
+            with gzip.open(path, 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        legacy = self.legacy_path_for(symbol)
+        if os.path.exists(legacy):
+            with open(legacy, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+
+class RotatingSink(CompactSink):
+    """件数に上限のある CompactSink。超えたら更新の古いファイルから消す"""
+
+    name = 'rotating'
+
+    def __init__(self, directory=DEFAULT_DIR, max_files=RESULT_SINK_MAX_FILES):
+        super().__init__(directory)
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def write(self, symbol, result):
+        path = super().write(symbol, result)
+        self._rotate()
+        return path
+
+    def _rotate(self):
+        with self._lock:
+            try:
+                entries = [e for e in os.scandir(self.directory)
+                           if e.name.startswith('snapshot_') and e.name.endswith('.json.gz')]
+            except FileNotFoundError:
+                return
+            if len(entries) <= self.max_files:
+                return
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for e in entries[:len(entries) - self.max_files]:
+                try:
+                    os.remove(e.path)
+                except OSError:
+                    pass
+
+
+_SINKS = {
+    'null': NullSink,
+    'compact': CompactSink,
+    'rotating': RotatingSink,
+}
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def make_sink(kind):
+    """名前から書き出し先を作る。知らない名前は rotating にする"""
+    factory = _SINKS.get((kind or '').strip().lower())
+    if factory is None:
+        print(f"RESULT_SINK={kind!r} は不明なため rotating を使います")
+        factory = RotatingSink
+    return factory()
+
+
+def default_sink():
+    """アプリ既定の書き出し先（プロセスで1つ）"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = make_sink(RESULT_SINK)
+        return _default
@@ -15,6 +15,7 @@
 テストしやすくするためと、同じ計算をAPIとバッチの両方から使えるようにするため。
 """
 
+from bisect import bisect_right
 from datetime import date, datetime, timedelta, timezone
 
 # 取引が無い日にさかのぼって価格を探す上限。
@@ -35,20 +36,103 @@ def _to_date(value):
     return date.fromisoformat(str(value)[:10])
 
 
+# date.fromordinal で UNIX 秒の日数を日付にするための起点（1970-01-01）
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class PreparedSeries:
+    """日付の昇順に並べた (date, close) の系列。日付は二分探索で引く。
+
+    以前は [(date, close)] のリストを price_on が頭から舐めていたので、
+    積立は「買付日の数 × 本数」になっていた。並べ替えは作るときの1回だけ。
+    リストと同じく、len・添字（(date, close) を返す）・for で読める。
+    """
+
+    __slots__ = ('dates', 'closes')
+
+    def __init__(self, dates=(), closes=()):
+        self.dates = list(dates)
+        self.closes = list(closes)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        return zip(self.dates, self.closes)
+
+    def __getitem__(self, i):
+        return self.dates[i], self.closes[i]
+
+    def __eq__(self, other):
+        if isinstance(other, PreparedSeries):
+            return self.dates == other.dates and self.closes == other.closes
+        return list(self) == list(other) if isinstance(other, list) else NotImplemented
+
+    def price_on(self, target, max_lookback_days=MAX_LOOKBACK_DAYS):
+        """指定日の (date, close)。取引が無ければ直近の過去へさかのぼる（price_on と同じ）"""
+        target = _to_date(target)
+        i = bisect_right(self.dates, target)
+        if not i:
+            return None
+        d = self.dates[i - 1]
+        if (target - d).days > max_lookback_days:
+            return None
+        return d, self.closes[i - 1]
+
+
 def normalize_series(bars):
-    """[{time, close, ...}] を [(date, close)] の昇順に整える。
+    """[{time, close, ...}] を日付の昇順の PreparedSeries に整える。
 
     time は epoch秒。close が無い/0以下の行は捨てる（分割直後などに混ざる）。
+    列の形で保存された足（price_history.encode_ohlc）や decode 済みの列
+    （price_history.get_series）もそのまま受け取る。
     """
+    import numpy as np
+    import price_history as ph
+
+    if isinstance(bars, PreparedSeries):
+        return bars
+    if ph.is_columnar(bars) or (isinstance(bars, dict) and 'time' in bars):
+        columns = ph.decode_ohlc(bars)
+        # NaN（列の形の欠損）も「0より大きい」を満たさないので捨てる
+        keep = np.asarray(columns['close']) > 0
+        times = np.asarray(columns['time'])[keep]
+        closes = np.asarray(columns['close'], dtype=float)[keep]
+        order = np.argsort(times, kind='stable')
+        days = (times[order] // 86400).tolist()
+        return PreparedSeries((date.fromordinal(_EPOCH_ORDINAL + d) for d in days),
+                              closes[order].tolist())
+
     out = []
     for b in bars or []:
-        close = b.get('close')
-        t = b.get('time')
-        if not close or close <= 0 or t is None:
+        t, close = b.get('time'), b.get('close')
+        if close is None or not close > 0 or t is None:
             continue
         out.append((_to_date(t), float(close)))
     out.sort(key=lambda x: x[0])
-    return out
+    return PreparedSeries((d for d, _ in out), (c for _, c in out))
+
+
+class PreparedHistory:
+    """履歴（{'daily_1y': ..., 'monthly_10y': ...}）の系列を、使うときに1回だけ整える。
+
+    1回のリクエストで一括・積立や複数の条件を続けて計算しても、
+    系列の並べ替えは最初の1回で済む。
+    """
+
+    def __init__(self, history=None):
+        self._raw = history or {}
+        self._series = {}
+
+    def series(self, key):
+        if key not in self._series:
+            self._series[key] = normalize_series(self._raw.get(key))
+        return self._series[key]
+
+
+def prepare(history):
+    """履歴を PreparedHistory にする（すでにそうならそのまま返す）"""
+    return history if isinstance(history, PreparedHistory) else PreparedHistory(history)
 
 
 def pick_series(history, start, end):
@@ -58,9 +142,10 @@ def pick_series(history, start, end):
     週足も持っているが、月足で足りる用途に3系列を出し分けても
     読み手が得をしないので使わない。
     """
+    history = prepare(history)
     start, end = _to_date(start), _to_date(end)
-    daily = normalize_series((history or {}).get('daily_1y'))
-    monthly = normalize_series((history or {}).get('monthly_10y'))
+    daily = history.series('daily_1y')
+    monthly = history.series('monthly_10y')
 
     if daily and start >= daily[0][0]:
         return daily, 'daily'
@@ -73,19 +158,12 @@ def price_on(series, target, max_lookback_days=MAX_LOOKBACK_DAYS):
     """指定日の価格。取引が無ければ直近の過去へさかのぼる。
 
     月足を使うときは1か月さかのぼる必要があるので、呼び出し側が
-    max_lookback_days を広げること。
+    max_lookback_days を広げること。[(date, close)] のリストも受け取る
+    （昇順であること）。
     """
-    target = _to_date(target)
-    best = None
-    for d, close in series:
-        if d > target:
-            break
-        best = (d, close)
-    if not best:
-        return None
-    if (target - best[0]).days > max_lookback_days:
-        return None
-    return best
+    if not isinstance(series, PreparedSeries):
+        series = PreparedSeries((d for d, _ in series), (c for _, c in series))
+    return series.price_on(target, max_lookback_days)
 
 
 def purchase_dates(start, end, interval_months=1, day_of_month=1):
@@ -131,17 +209,17 @@ def evaluation_price(history, end):
     いちばん新しいバーに寄せる。エラーで止めるより、いつ時点で評価したかを
     返して画面に出すほうが読み手の役に立つ。
     """
+    history = prepare(history)
     end = _to_date(end)
     for key, lookback in (('daily_1y', MAX_LOOKBACK_DAYS), ('monthly_10y', 40)):
-        series = normalize_series((history or {}).get(key))
-        got = price_on(series, end, lookback)
+        got = history.series(key).price_on(end, lookback)
         if got:
             return got
 
     # どの系列でも指定日に届かない場合は、持っている中で最も新しいバー
     latest = None
     for key in ('daily_1y', 'monthly_10y'):
-        series = normalize_series((history or {}).get(key))
+        series = history.series(key)
         if series and (latest is None or series[-1][0] > latest[0]):
             latest = series[-1]
     return latest
@@ -172,12 +250,13 @@ def simulate_lump(history, start, end, amount, buy_mode='carry'):
     一括なので carry と floor に差は出ない（次回が無い）。買えなかった
     端数は現金として残し、総資産に含める。
     """
+    history = prepare(history)
     series, grain = pick_series(history, start, end)
     lookback = 40 if grain == 'monthly' else MAX_LOOKBACK_DAYS
     if not series:
         return {'ok': False, 'reason': 'この銘柄の株価履歴がありません'}
 
-    buy = price_on(series, start, lookback)
+    buy = series.price_on(start, lookback)
     sell = evaluation_price(history, end)
     if not buy:
         return {'ok': False, 'reason': f'{_to_date(start)} 時点の株価がありません',
@@ -222,6 +301,7 @@ def simulate_monthly(history, start, end, amount, interval_months=1, day_of_mont
     どのモードでも**積み立てた総額を分母にする**。端数を勘定から外すと、
     切り捨てを選んだときだけ成績が良く見えてしまうため。
     """
+    history = prepare(history)
     series, grain = pick_series(history, start, end)
     lookback = 40 if grain == 'monthly' else MAX_LOOKBACK_DAYS
     if not series:
@@ -237,7 +317,7 @@ def simulate_monthly(history, start, end, amount, interval_months=1, day_of_mont
     deposits = 0         # 積み立てた回数（買えた回数とは別）
     skipped = 0
     for d in purchase_dates(start, end, interval_months, day_of_month):
-        p = price_on(series, d, lookback)
+        p = series.price_on(d, lookback)
         if not p:
             skipped += 1
             continue
@@ -0,0 +1,109 @@
+"""同じキーの処理を同時に1本だけ走らせ、後から来た呼び出しに結果を分ける。
+
+背景:
+  決算発表の直後は、人気銘柄を何人もがほぼ同時に開く。/api/stock/analyze は
+  リクエストごとに StockAnalyzer.analyze を丸ごと走らせるので、同じ銘柄の
+  同じ分析が gunicorn の8スレッドと Yahoo の枠を取り合う。いちばん枠が
+  欲しい瞬間に、同じ結果を何回も作っていた。
+
+方針:
+  - キー（銘柄・期間・スキップ指定）ごとに実行中の処理を1本だけ持つ
+  - 最初に来た呼び出し（リーダー）が実際に処理し、実行中に来た呼び出しは
+    その完了を待って同じ結果を受け取る。例外も同じものを受け取る
+  - 結果は呼び出し側で書き足される（score_breakdown / gc_date など）ので、
+    全員に deepcopy を渡す。元の結果は誰にも触らせない
+  - 終わったキーはすぐ消す。キャッシュではないので、次の呼び出しは改めて処理する
+  - 実行中の件数と、相乗りで省けた回数を監視用に出す
+"""
+
+import copy
+import threading
+import time
+
+
+class _Flight:
+    """実行中の1本。完了したら event を立てる"""
+
+    def __init__(self, started_at):
+        self.event = threading.Event()
+        self.started_at = started_at
+        self.waiters = 0
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """キーごとに処理を1本に束ねる。スレッドから同時に使ってよい。"""
+
+    def __init__(self, name='single_flight', clock=time.monotonic):
+        self.name = name
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, timeout=None):
+        """key の処理を1本だけ走らせ、その結果の複製を返す。
+
+        Args:
+            fn: 引数なしで結果を返す関数。リーダーの呼び出しスレッドで実行する
+            timeout: 相乗りした側が待つ上限（秒）。None なら完了まで待つ
+
+        Returns:
+            (結果の deepcopy, 相乗りしたかどうか)
+
+        Raises:
+            fn が投げた例外（相乗りした側にも同じ例外を投げる）
+            TimeoutError: 相乗りした側が timeout までに結果を受け取れなかった
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(self._clock())
+                self._flights[key] = flight
+                self.executed += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if leader:
+            try:
+                flight.value = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.event.set()
+        elif not flight.event.wait(timeout):
+            raise TimeoutError(f'{self.name}: {key} の完了を{timeout}秒待ちましたが終わりません')
+
+        if flight.error is not None:
+            raise flight.error
+        return copy.deepcopy(flight.value), not leader
+
+    def in_flight(self):
+        """いま実行中のキーの数"""
+        with self._lock:
+            return len(self._flights)
+
+    def snapshot(self):
+        """監視用。実行中のキーと経過秒・待っている呼び出し数、累計の回数"""
+        with self._lock:
+            now = self._clock()
+            flights = [
+                {
+                    'key': list(key) if isinstance(key, tuple) else key,
+                    'elapsed_seconds': round(now - flight.started_at, 1),
+                    'waiters': flight.waiters,
+                }
+                for key, flight in self._flights.items()
+            ]
+            return {
+                'in_flight': len(flights),
+                'flights': flights,
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+            }
@@ -0,0 +1,134 @@
+"""1銘柄の分析中に yfinance から読む決算書・指標を1回だけ取得して共有する。
+
+背景:
+  StockAnalyzer の各ヘルパー（_get_financial_data / _get_five_year_financial_data /
+  _fill_missing_eps / _build_bps_series / _calculate_roe_roa など）は、それぞれが
+  ticker.financials / balance_sheet / cashflow を読みにいく。yfinance 側の
+  キャッシュは取得が終わった後にしか効かないので、analyze の工程を並行に
+  走らせると同じ決算書を同時に取りに行ってしまう。バッチのコメントにある
+  「1銘柄あたり約10リクエスト」を減らすには、まずこの重複を無くす必要がある。
+
+方針:
+  - Ticker と同じ属性名で読めるラッパーにして、ヘルパー側は書き換えない
+  - 属性ごとに最初の1回だけ上流へ取りに行く。同時に来た呼び出しはロックで待たせ、
+    取得結果（失敗した場合は例外）をそのまま共有する
+  - 四半期の決算書は読まれたときだけ取りに行く
+  - 株価履歴(history)は再試行のある呼び出し元があるので覚えず、回数だけ数える
+  - 上流へ取りに行った回数を数え、analyze の source_status['upstream_calls'] に出す
+  - 取りに行く直前に upstream_limiter の yfinance バケットから1トークン取る。
+    待ってよい上限（max_wait）は呼び出し元が決める。バッチは制限が解けるまで待つ
+    （None）。上限で諦めると、その工程の値が欠けたまま保存されてしまうため
+"""
+
+import threading
+
+import upstream_limiter
+from yfinance_guard import is_rate_limit_error
+
+# 1回の取得で上流へリクエストが飛ぶ属性。ここに無い属性は Ticker へ素通しする。
+FETCHED_ATTRIBUTES = (
+    'info',
+    'fast_info',
+    'financials',
+    'balance_sheet',
+    'cashflow',
+    'dividends',
+    'quarterly_financials',
+    'quarterly_balance_sheet',
+    'quarterly_cashflow',
+)
+
+
+def _limited(fetch, max_wait=upstream_limiter.DEFAULT_MAX_WAIT):
+    """yfinance のバケットから1トークン取ってから取得し、制限に当たったら知らせる"""
+    upstream_limiter.acquire('yfinance', max_wait=max_wait)
+    try:
+        value = fetch()
+    except Exception as e:
+        if is_rate_limit_error(e):
+            upstream_limiter.penalize('yfinance')
+        raise
+    upstream_limiter.record_success('yfinance')
+    return value
+
+
+class _Failure:
+    """取得時の例外を覚えておき、2回目以降の呼び出しにも同じ例外を返す"""
+
+    def __init__(self, error):
+        self.error = error
+
+
+class StatementBundle:
+    """yf.Ticker を包み、決算書・指標を分析1回につき1度だけ取得する。
+
+    使い方:
+
+        ticker = StatementBundle(yf.Ticker('7203.T'))
+        ticker.financials      # 初回だけ上流へ
+        ticker.financials      # 2回目以降は同じ DataFrame
+        ticker.upstream_calls  # => 1
+
+    max_wait はトークン待ちの上限（秒）。None なら制限が解けるまで待つ。
+    """
+
+    def __init__(self, ticker, max_wait=upstream_limiter.DEFAULT_MAX_WAIT):
+        self._ticker = ticker
+        self._max_wait = max_wait
+        self._values = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+        self._calls = {}
+
+    def _lock_for(self, key):
+        with self._guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _load(self, key, fetch):
+        with self._lock_for(key):
+            if key not in self._values:
+                with self._guard:
+                    self._calls[key] = self._calls.get(key, 0) + 1
+                try:
+                    self._values[key] = _limited(fetch, self._max_wait)
+                except Exception as e:
+                    self._values[key] = _Failure(e)
+            value = self._values[key]
+        if isinstance(value, _Failure):
+            raise value.error
+        return value
+
+    def __getattr__(self, name):
+        # __init__ 前（copy等）に呼ばれても再帰しないようにする
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in FETCHED_ATTRIBUTES:
+            return self._load(name, lambda: getattr(self._ticker, name))
+        return getattr(self._ticker, name)
+
+    def history(self, *args, **kwargs):
+        """株価履歴は覚えずに毎回取りに行く（回数だけ数える）。
+
+        チャート作成は空・失敗のときに待って再試行するので、
+        結果を覚えると再試行が意味を失う。
+        """
+        with self._guard:
+            self._calls['history'] = self._calls.get('history', 0) + 1
+        return _limited(lambda: self._ticker.history(*args, **kwargs), self._max_wait)
+
+    @property
+    def upstream_calls(self) -> int:
+        """上流へ取りに行った回数"""
+        with self._guard:
+            return sum(self._calls.values())
+
+    def call_summary(self) -> dict:
+        """source_status に載せる取得回数の内訳"""
+        with self._guard:
+            by_item = dict(self._calls)
+        return {
+            'status': 'success',
+            'source': 'Yahoo Finance (yfinance)',
+            'total': sum(by_item.values()),
+            'by_item': by_item,
+        }
@@ -0,0 +1,154 @@
+"""yfinance の年次決算書(DataFrame)から5年推移の系列を表引きで取り出す。
+
+背景:
+  _get_five_year_financial_data は「列(決算期) × 候補の行ラベル」を二重ループで
+  回し、pandas のスカラーアクセスで1セルずつ読んでいた。売上・営業利益は
+  既存の日付と重ならないかを `any(d['date'] == date_str ...)` で毎回全件なめる。
+  全銘柄(約3,900)のバックフィルではこの部分のCPUが無視できず、
+  新しい科目を足すたびに同じループをコピーする必要もあった。
+
+方針:
+  - 出力系列ごとに「優先順の行ラベル」を表として持つ（科目の追加は表に1行足すだけ）
+  - 決算書を1回だけ numpy 配列にし、全系列をそこから行番号で取り出す
+  - 各決算期で、優先順に見て最初に値が入っている行を採る（旧実装と同じ規則）
+  - 既存の日付との重複確認は set で行う
+"""
+
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# 取り出す決算期の数（新しい順）
+YEARS = 5
+
+# 損益計算書。経常利益は Income Before Tax が近い
+INCOME_SERIES: Tuple[Tuple[str, Sequence[str]], ...] = (
+    ('revenue', ('Total Revenue', 'Revenue')),
+    ('op_income', ('Operating Income', 'EBIT')),
+    ('ordinary_income', ('Income Before Tax', 'Pretax Income')),
+    ('net_income', ('Net Income', 'Net Income Common Stockholders')),
+    ('eps', ('Basic EPS', 'Diluted EPS')),
+)
+
+# _get_financial_data が最新期を先に入れていることがあるので、日付が重なったら足さない
+DEDUPE_SERIES = frozenset({'revenue', 'op_income'})
+
+# キャッシュフロー計算書
+CASHFLOW_SERIES: Tuple[Tuple[str, Sequence[str]], ...] = (
+    ('operating_cf', ('Operating Cash Flow', 'Total Cash From Operating Activities')),
+    ('investing_cf', ('Investing Cash Flow', 'Total Cash From Investing Activities')),
+    ('financing_cf', ('Financing Cash Flow', 'Total Cash From Financing Activities')),
+)
+
+# 貸借対照表
+BALANCE_SERIES: Tuple[Tuple[str, Sequence[str]], ...] = (
+    ('cash', ('Cash And Cash Equivalents', 'Cash', 'Cash And Short Term Investments')),
+    ('current_assets_list', ('Total Current Assets', 'Current Assets')),
+    ('current_liabilities_list', ('Total Current Liabilities', 'Current Liabilities')),
+)
+
+# 自己資本比率の材料。表記ゆれ（Stockholder/Stockholders、空白無し、Total無し）も拾う
+EQUITY_LABELS = ('Total Stockholder Equity', 'Total Stockholders Equity',
+                 'Total Equity', "Total shareholders' equity", 'Stockholder Equity')
+ASSETS_LABELS = ('Total Assets', 'Total Asset')
+LIABILITIES_LABELS = ('Total Liabilities', 'Total Liab', 'Total Debt')
+
+
+def label_variations(labels: Iterable[str]) -> List[str]:
+    """行ラベルの表記ゆれを優先順を保ったまま展開する"""
+    expanded = []
+    for name in labels:
+        for variant in (name,
+                        name.replace('Stockholder', 'Stockholders'),
+                        name.replace('Stockholders', 'Stockholder'),
+                        name.replace(' ', ''),
+                        name.replace('Total ', '')):
+            if variant not in expanded:
+                expanded.append(variant)
+    return expanded
+
+
+_EQUITY_VARIANTS = label_variations(EQUITY_LABELS)
+_ASSETS_VARIANTS = label_variations(ASSETS_LABELS)
+_LIABILITIES_VARIANTS = label_variations(LIABILITIES_LABELS)
+
+
+def _prepare(frame: pd.DataFrame, years: int):
+    """先頭 years 列を数値配列にし、行ラベル→行番号の対応と日付文字列を返す"""
+    block = frame.iloc[:, :years]
+    try:
+        values = block.to_numpy(dtype=float)
+    except (TypeError, ValueError):
+        # 数値にできないセルが混ざっているときだけ、セル単位で欠損扱いにする
+        values = block.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    rows = {}
+    for i, label in enumerate(block.index):
+        rows.setdefault(label, i)   # 同じラベルが2行あれば上の行を採る
+    dates = [col.strftime('%Y-%m-%d') for col in block.columns]
+    return values, rows, dates
+
+
+def _first_valid(values: np.ndarray, rows: Dict[str, int], labels: Sequence[str]):
+    """各列について、優先順で最初に値が入っている行の値を返す（無ければNaN）"""
+    index = [rows[label] for label in labels if label in rows]
+    if not index:
+        return np.full(values.shape[1], np.nan)
+    candidates = values[index]
+    present = ~np.isnan(candidates)
+    first = present.argmax(axis=0)
+    picked = candidates[first, np.arange(candidates.shape[1])]
+    picked[~present.any(axis=0)] = np.nan
+    return picked
+
+
+def extract_series(frame: pd.DataFrame, table, years: int = YEARS,
+                   existing: Dict[str, List[dict]] = None,
+                   dedupe: Iterable[str] = ()) -> Dict[str, List[dict]]:
+    """表に従って決算書から系列を取り出す。
+
+    Args:
+        frame: yfinance の年次決算書（行=科目、列=決算期）
+        table: (出力名, 優先順の行ラベル) の並び
+        existing: 既に入っている系列。dedupe に含まれる系列は、ここと同じ日付を足さない
+        dedupe: 日付の重複を避ける出力名
+
+    Returns:
+        {出力名: [{'date': 'YYYY-MM-DD', 'value': float}, ...]}（決算書の列順）
+    """
+    out = {name: [] for name, _ in table}
+    if frame is None or frame.empty:
+        return out
+    values, rows, dates = _prepare(frame, years)
+    dedupe = set(dedupe)
+    existing = existing or {}
+
+    for name, labels in table:
+        picked = _first_valid(values, rows, labels)
+        seen = ({item['date'] for item in existing.get(name) or []}
+                if name in dedupe else ())
+        out[name] = [{'date': date, 'value': float(value)}
+                     for date, value in zip(dates, picked)
+                     if not np.isnan(value) and date not in seen]
+    return out
+
+
+def extract_equity_ratio(balance_sheet: pd.DataFrame, years: int = YEARS) -> List[dict]:
+    """自己資本比率（自己資本 / 総資産 × 100）を決算期ごとに出す。
+
+    総資産が無い期は 自己資本 + 負債 で補う。自己資本が0・総資産が0の期は出さない。
+    """
+    if balance_sheet is None or balance_sheet.empty:
+        return []
+    values, rows, dates = _prepare(balance_sheet, years)
+    equity = _first_valid(values, rows, _EQUITY_VARIANTS)
+    assets = _first_valid(values, rows, _ASSETS_VARIANTS)
+    liabilities = _first_valid(values, rows, _LIABILITIES_VARIANTS)
+
+    assets = np.where(np.isnan(assets), equity + liabilities, assets)
+    ratios = []
+    for date, e, a in zip(dates, equity, assets):
+        if np.isnan(e) or np.isnan(a) or e == 0 or a == 0:
+            continue
+        ratios.append({'date': date, 'value': round((float(e) / float(a)) * 100, 2)})
+    return ratios
@@ -1,6 +1,6 @@
 """
 株式データ取得・分析モジュール
-Yahoo Finance APIを使用して株式情報を取得し、JSONとチャート画像を出力
+Yahoo Finance APIを使用して株式情報を取得し、JSONとチャートの入力を出力
 """
 
 import json
@@ -11,19 +11,21 @@ from typing import Dict, Any, Optional, List
 import time
 
 import pandas as pd
-import numpy as np
 import yfinance as yf
 import yahooquery as yq
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-from matplotlib import rcParams
 
-
-# 日本語フォント設定
-rcParams['font.sans-serif'] = ['Yu Gothic', 'Meiryo', 'Hiragino Sans', 'MS Gothic']
-rcParams['axes.unicode_minus'] = False
+from analysis_stages import Stage, run_stages
+from batch_runner import BATCH_WORKERS, run_batch
+import upstream_limiter
+from chart_renderer import chart_url, renderer as chart_renderer
+from price_history import frame_to_rows
+from result_sinks import NullSink, default_sink
+from statement_bundle import StatementBundle
+from trend_stats import trend_stats
+from statement_extract import (
+    BALANCE_SERIES, CASHFLOW_SERIES, DEDUPE_SERIES, INCOME_SERIES,
+    extract_equity_ratio, extract_series,
+)
 
 
 # ================================
@@ -419,16 +421,53 @@ class StockAnalyzer:
     MAX_PER = 300.0             # 倍。これ以上は分母がほぼゼロで指標にならない
     MAX_PBR = 50.0              # 倍
 
-    def __init__(self):
-        """初期化"""
+    # analyzeの各取得ステージの締め切り（秒）。超えた工程は部分結果のまま進む。
+    # 工程の中の通信の上限（CHART_FETCH_TIMEOUT など）はこの中に収める。
+    # 最も長い依存の連鎖（業種→日本語ラベル→概要→公式開示→EDINET）でも
+    # 10 + 7 + 20 + 3 + 8 = 48秒。ANALYZE_TIMEOUT(60秒) より十分短くしてある。
+    STAGE_DEADLINES = {
+        'basic_metrics': 15,
+        'financial_data': 10,
+        'five_year': 12,
+        'multiples': 5,
+        'forward_dividend': 8,
+        'roe_roa': 15,
+        'industry_sector': 10,
+        'jp_labels': 7,
+        'chart': 20,
+        'forecast': 15,
+        'holders_officers': 15,
+        'business_summary': 20,
+        'margin_trading': 15,
+        'official_profile': 3,
+        'edinet_db': 8,
+    }
+
+    # チャートの足の取得。2回（間に CHART_RETRY_SLEEP）でも chart の締め切りに収まる
+    CHART_FETCH_TIMEOUT = 8
+    CHART_RETRY_SLEEP = 2
+    # 日本語ラベル（Yahoo日本版）の取得。jp_labels の締め切りに収まる
+    JP_LABELS_FETCH_TIMEOUT = 5
+
+    def __init__(self, sink=None, max_wait=upstream_limiter.DEFAULT_MAX_WAIT):
+        """初期化
+
+        Args:
+            sink: 分析結果の書き出し先（result_sinks）。省略時はアプリ既定。
+                バッチは NullSink を渡してディスクに書かない
+            max_wait: yfinance のトークン待ちの上限（秒）。画面からの分析は既定で諦め、
+                バッチは None（制限が解けるまで待つ）を渡す。None のときは、制限中に
+                工程が欠けた分析を UpstreamThrottled にする（run_batch がやり直し、
+                決算書が欠けたまま保存されない）
+        """
+        self.sink = sink if sink is not None else default_sink()
+        self.max_wait = max_wait
         self.output_dir = "output"
-        self.charts_dir = "charts"
         self._create_directories()
         
     def _create_directories(self):
         """出力ディレクトリの作成"""
         os.makedirs(self.output_dir, exist_ok=True)
-        os.makedirs(self.charts_dir, exist_ok=True)
         
     def analyze(self, symbol: str, period: str = "1y", skip_chart: bool = False,
                 skip_extras: bool = False, safe_sources_only: bool = False) -> Dict[str, Any]:
@@ -497,7 +536,7 @@ class StockAnalyzer:
             "market_jp": None,
             "price_history": [],  # 株価履歴（OHLC）
             "trend": None,
-            "chart_png": None,
+            "chart_url": None,
             "source": "Yahoo Finance (yfinance/yahooquery)",
             "source_status": {},
             "timestamp": datetime.now().isoformat()
@@ -515,112 +554,32 @@ class StockAnalyzer:
             }
         
         try:
-            # yfinanceのTickerオブジェクト作成
-            ticker = yf.Ticker(symbol)
-            
-            # 基本的な株価・指標データ取得
-            self._get_basic_metrics(ticker, result)
-
-            # 財務データ取得
-            self._get_financial_data(ticker, result)
-            
-            # 5年分の詳細財務データ取得
-            self._get_five_year_financial_data(ticker, result)
-
-            # EPS・BPSが揃った後にPER/PBRを補う。
-            # Yahooのinfoが返さなかった銘柄でも、割り算で出せる場合がある。
-            self._fill_missing_multiples(result)
-
-            # 予想配当利回り。5年分の配当が揃ってから計算する
-            # （確定した決算年度の配当と桁が合うかを検証に使うため）。
-            self._fill_forward_dividend(ticker, result)
-
-            # ROE/ROA計算（正確な計算）
-            self._calculate_roe_roa(ticker, result)
-            
-            # 業種・セクター情報取得
-            self._get_industry_sector(
-                symbol, ticker, result, allow_yahoo_jp=not safe_sources_only)
-            
-            # トレンド分析とチャート作成
-            if not skip_chart:
-                self._analyze_trend_and_create_chart(ticker, symbol, result, period)
-            
-            # 日本語会社名・業種取得
-            self._get_jp_labels(
-                symbol, result, allow_yahoo_jp=not safe_sources_only)
-
-            # 業績予想データ取得（日本株、バッチでも常に取得）
-            if symbol.endswith('.T'):
-                if safe_sources_only:
-                    result['source_status']['forecast'] = {
-                        'status': 'skipped',
-                        'source': '業績予想取得',
-                        'reason': '無料・低負荷更新ではYahoo日本版HTMLとEDINET DBを使用しません',
-                    }
-                else:
-                    self._get_forecast_data(symbol, result)
-
-            if not skip_extras:
-                # 主要株主・役員情報取得
-                self._get_holders_and_officers(symbol, result)
-
-                # 会社概要・事業説明取得
-                self._get_business_summary(symbol, ticker, result)
-
-                # Yahoo Japanで日本語概要が取れず、英語概要だけ取れた場合は
-                # EDINET DBを消費する前にGPTで日本語化する。
-                if (symbol.endswith('.T') and not result.get('business_summary_jp')
-                        and result.get('business_summary')):
-                    from summary_translation import translate_summary_to_jp
-                    translated = translate_summary_to_jp(result['business_summary'])
-                    if translated:
-                        result['business_summary_jp'] = translated
-                        result.setdefault('source_status', {})['business_summary'] = {
-                            'status': 'success',
-                            'source': 'Yahoo Finance英語概要 + OpenAI日本語要約',
-                            'language': 'ja',
-                            'translated_from': 'en',
-                        }
-
-                # 信用倍率取得（日本株のみ）
-                if symbol.endswith('.T'):
-                    self._get_margin_trading_data(symbol, result)
+            # yfinanceのTickerオブジェクト作成。決算書・info は工程をまたいで
+            # 1回だけ取得するよう StatementBundle で包む
+            ticker = StatementBundle(yf.Ticker(symbol), max_wait=self.max_wait)
+
+            if symbol.endswith('.T') and safe_sources_only:
+                result['source_status']['forecast'] = {
+                    'status': 'skipped',
+                    'source': '業績予想取得',
+                    'reason': '無料・低負荷更新ではYahoo日本版HTMLとEDINET DBを使用しません',
+                }
 
-            # 外部サイトが未収録・遮断中でも、確認済みの公式開示キャッシュは
-            # ローカル参照なのでEDINET DBより先に補完する。バッチのskip_extras時にも適用する。
-            if symbol.endswith('.T'):
-                from official_company_profiles import apply_official_profile_fallback
-                official_filled = apply_official_profile_fallback(symbol, result)
-                if 'business_summary_jp' in official_filled:
-                    result['source_status']['business_summary'] = {
-                        'status': 'success',
-                        'source': 'JPX/会社公式開示（確認済みキャッシュ）',
-                        'language': 'ja',
-                    }
-                if ('major_shareholders_jp' in official_filled
-                        or 'company_officers' in official_filled):
-                    result['source_status']['holders_officers'] = {
-                        'status': 'success',
-                        'source': '会社公式開示（確認済みキャッシュ）',
-                    }
-
-            # Yahoo系・無料補助ソース・確認済み公式キャッシュを試した後も
-            # 欠けている項目だけをEDINET DBで補完する。
-            # Free枠は100回/日のため、高速バッチ(skip_extras=True)では呼ばない。
-            if symbol.endswith('.T') and not skip_extras:
-                try:
-                    from edinet_db_client import apply_edinet_db_fallback
-                    edinet_filled = apply_edinet_db_fallback(symbol, result)
-                    if edinet_filled:
-                        print(f"EDINET DB補完成功: {', '.join(edinet_filled)}")
-                except Exception as e:
-                    print(f"EDINET DB補完エラー: {e}")
-                    result.setdefault('source_status', {})['edinet_db'] = {
-                        'status': _classify_source_error(e),
-                        'source': 'EDINET DB API',
-                        'error': str(e),
-                    }
+            # 取得工程は互いに独立なものが多い（Yahoo日本版HTML・JPX信用残・
+            # yfinanceの決算書）。依存関係だけ宣言して並行に走らせ、
+            # 締め切りを過ぎた工程は待たずに部分結果で返す。
+            yfinance_bucket = upstream_limiter.bucket('yfinance')
+            since = yfinance_bucket.now()
+            stages = run_stages(self._build_stages(symbol, ticker, period, skip_chart,
+                                                   skip_extras, safe_sources_only), result)
+            result['source_status']['upstream_calls'] = ticker.call_summary()
+            # バッチ（max_wait=None）はトークンを制限明けまで待つが、工程の締め切りは
+            # それより短い。制限中に欠けた結果は保存させず、run_batch にやり直させる
+            if (self.max_wait is None and stages['status'] == 'partial'
+                    and yfinance_bucket.blocked_since(since)):
+                raise upstream_limiter.UpstreamThrottled(
+                    f'rate limit: yfinance の制限中に工程が欠けました '
+                    f'({", ".join(stages["timed_out"] + stages["failed"])})')
 
             has_financials = bool(result.get('revenue') or result.get('op_income'))
             result['source_status'].setdefault('financials', {
@@ -641,19 +600,159 @@ class StockAnalyzer:
                     'reason': '高速バッチのskip_extras',
                 })
 
-            # JSON保存
-            output_file = os.path.join(self.output_dir, f"snapshot_{symbol.replace('.', '_')}.json")
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=2, default=str)
-            
-            print(f"分析完了: {output_file}")
+            # 結果の書き出し（バッチでは NullSink なので何もしない）。
+            # 書けなくても分析自体は成功として返す
+            output_file = None
+            try:
+                output_file = self.sink.write(symbol, result)
+            except Exception as e:
+                print(f"分析結果の書き出しエラー ({symbol}): {e}")
+            print(f"分析完了: {output_file or symbol}")
             
+        except upstream_limiter.UpstreamThrottled:
+            raise
         except Exception as e:
             print(f"エラー: {symbol}の分析中にエラーが発生しました: {str(e)}")
             result["error"] = str(e)
             
         return result
     
+    def _build_stages(self, symbol: str, ticker, period: str, skip_chart: bool,
+                      skip_extras: bool, safe_sources_only: bool) -> List[Stage]:
+        """analyzeの取得工程を依存関係つきのステージとして組み立てる"""
+        deadline = self.STAGE_DEADLINES.get
+        is_jp = symbol.endswith('.T')
+        allow_yahoo_jp = not safe_sources_only
+
+        stages = [
+            Stage('basic_metrics', lambda r: self._get_basic_metrics(ticker, r),
+                  deadline=deadline('basic_metrics')),
+            Stage('financial_data', lambda r: self._get_financial_data(ticker, r),
+                  deadline=deadline('financial_data')),
+            # 売上・営業利益は financial_data も書くので、後から上書きさせる
+            Stage('five_year', lambda r: self._get_five_year_financial_data(ticker, r),
+                  after=('financial_data',), deadline=deadline('five_year'),
+                  status_key='financials', source='Yahoo Finance (yfinance)'),
+            # EPS・BPSが揃った後にPER/PBRを補う。
+            # Yahooのinfoが返さなかった銘柄でも、割り算で出せる場合がある。
+            Stage('multiples', self._fill_missing_multiples,
+                  after=('basic_metrics', 'five_year'), deadline=deadline('multiples')),
+            # 予想配当利回り。5年分の配当が揃ってから計算する
+            # （確定した決算年度の配当と桁が合うかを検証に使うため）。
+            Stage('forward_dividend', lambda r: self._fill_forward_dividend(ticker, r),
+                  after=('basic_metrics', 'five_year'),
+                  deadline=deadline('forward_dividend')),
+            Stage('roe_roa', lambda r: self._calculate_roe_roa(ticker, r),
+                  deadline=deadline('roe_roa')),
+            Stage('industry_sector',
+                  lambda r: self._get_industry_sector(
+                      symbol, ticker, r, allow_yahoo_jp=allow_yahoo_jp),
+                  deadline=deadline('industry_sector')),
+            # 英語の業種から日本語業種を引くので業種取得の後
+            Stage('jp_labels',
+                  lambda r: self._get_jp_labels(symbol, r, allow_yahoo_jp=allow_yahoo_jp),
+                  after=('industry_sector',), deadline=deadline('jp_labels')),
+        ]
+
+        if not skip_chart:
+            stages.append(Stage(
+                'chart', lambda r: self._analyze_trend_and_create_chart(ticker, symbol, r, period),
+                deadline=deadline('chart')))
+
+        # 業績予想データ取得（日本株、バッチでも常に取得）
+        if is_jp and not safe_sources_only:
+            stages.append(Stage(
+                'forecast', lambda r: self._get_forecast_data(symbol, r),
+                deadline=deadline('forecast'), status_key='forecast', source='業績予想取得'))
+
+        if not skip_extras:
+            stages.append(Stage(
+                'holders_officers', lambda r: self._get_holders_and_officers(symbol, r),
+                deadline=deadline('holders_officers'),
+                status_key='holders_officers', source='主要株主・役員取得'))
+            # 役員一覧と日本語業種は概要取得でも書くので、両方の後に回す
+            stages.append(Stage(
+                'business_summary', lambda r: self._get_business_summary_with_translation(
+                    symbol, ticker, r),
+                after=('holders_officers', 'jp_labels'),
+                deadline=deadline('business_summary'),
+                status_key='business_summary', source='事業概要取得'))
+            # 信用倍率取得（日本株のみ）
+            if is_jp:
+                stages.append(Stage(
+                    'margin_trading', lambda r: self._get_margin_trading_data(symbol, r),
+                    deadline=deadline('margin_trading'),
+                    status_key='margin_trading', source='信用残取得'))
+
+        if is_jp:
+            # 外部サイトが未収録・遮断中でも、確認済みの公式開示キャッシュは
+            # ローカル参照なのでEDINET DBより先に補完する。バッチのskip_extras時にも適用する。
+            fetched = [stage.name for stage in stages]
+            stages.append(Stage(
+                'official_profile', lambda r: self._apply_official_profile(symbol, r),
+                after=fetched, deadline=deadline('official_profile')))
+            # Yahoo系・無料補助ソース・確認済み公式キャッシュを試した後も
+            # 欠けている項目だけをEDINET DBで補完する。
+            # Free枠は100回/日のため、高速バッチ(skip_extras=True)では呼ばない。
+            if not skip_extras:
+                stages.append(Stage(
+                    'edinet_db', lambda r: self._apply_edinet_fallback(symbol, r),
+                    after=fetched + ['official_profile'], deadline=deadline('edinet_db'),
+                    status_key='edinet_db', source='EDINET DB API'))
+
+        return stages
+
+    def _get_business_summary_with_translation(self, symbol: str, ticker, result: Dict[str, Any]):
+        """会社概要・事業説明取得と、英語概要しか無いときの日本語化"""
+        self._get_business_summary(symbol, ticker, result)
+
+        # Yahoo Japanで日本語概要が取れず、英語概要だけ取れた場合は
+        # EDINET DBを消費する前にGPTで日本語化する。
+        if (symbol.endswith('.T') and not result.get('business_summary_jp')
+                and result.get('business_summary')):
+            from summary_translation import translate_summary_to_jp
+            translated = translate_summary_to_jp(result['business_summary'])
+            if translated:
+                result['business_summary_jp'] = translated
+                result.setdefault('source_status', {})['business_summary'] = {
+                    'status': 'success',
+                    'source': 'Yahoo Finance英語概要 + OpenAI日本語要約',
+                    'language': 'ja',
+                    'translated_from': 'en',
+                }
+
+    def _apply_official_profile(self, symbol: str, result: Dict[str, Any]):
+        """確認済みの公式開示キャッシュで欠けている項目を補う"""
+        from official_company_profiles import apply_official_profile_fallback
+        official_filled = apply_official_profile_fallback(symbol, result)
+        if 'business_summary_jp' in official_filled:
+            result['source_status']['business_summary'] = {
+                'status': 'success',
+                'source': 'JPX/会社公式開示（確認済みキャッシュ）',
+                'language': 'ja',
+            }
+        if ('major_shareholders_jp' in official_filled
+                or 'company_officers' in official_filled):
+            result['source_status']['holders_officers'] = {
+                'status': 'success',
+                'source': '会社公式開示（確認済みキャッシュ）',
+            }
+
+    def _apply_edinet_fallback(self, symbol: str, result: Dict[str, Any]):
+        """最後まで欠けている項目だけをEDINET DBで補完する"""
+        try:
+            from edinet_db_client import apply_edinet_db_fallback
+            edinet_filled = apply_edinet_db_fallback(symbol, result)
+            if edinet_filled:
+                print(f"EDINET DB補完成功: {', '.join(edinet_filled)}")
+        except Exception as e:
+            print(f"EDINET DB補完エラー: {e}")
+            result.setdefault('source_status', {})['edinet_db'] = {
+                'status': _classify_source_error(e),
+                'source': 'EDINET DB API',
+                'error': str(e),
+            }
+
     def _get_basic_metrics(self, ticker: yf.Ticker, result: Dict[str, Any]):
         """基本的な株価・指標データを取得"""
         try:
@@ -1185,75 +1284,13 @@ class StockAnalyzer:
         """5年分の詳細財務データを取得"""
         errors = []
         try:
-            # 損益計算書（年次）- 最大5年分
+            # 損益計算書（年次）- 最大5年分。科目と候補ラベルの対応は statement_extract の表
             financials = ticker.financials
             if not financials.empty:
-                # 最大5年分取得
-                years_to_get = min(5, len(financials.columns))
-                
-                for i in range(years_to_get):
-                    col = financials.columns[i]
-                    date_str = col.strftime('%Y-%m-%d')
-                    
-                    # 売上高（既存）
-                    revenue_keys = ['Total Revenue', 'Revenue']
-                    for key in revenue_keys:
-                        if key in financials.index:
-                            value = financials.loc[key, col]
-                            if pd.notna(value) and not any(d['date'] == date_str for d in result["revenue"]):
-                                result["revenue"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # 営業利益（既存）
-                    op_income_keys = ['Operating Income', 'EBIT']
-                    for key in op_income_keys:
-                        if key in financials.index:
-                            value = financials.loc[key, col]
-                            if pd.notna(value) and not any(d['date'] == date_str for d in result["op_income"]):
-                                result["op_income"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # 経常利益（Income Before Tax が近い）
-                    ordinary_keys = ['Income Before Tax', 'Pretax Income']
-                    for key in ordinary_keys:
-                        if key in financials.index:
-                            value = financials.loc[key, col]
-                            if pd.notna(value):
-                                result["ordinary_income"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # 純利益
-                    net_income_keys = ['Net Income', 'Net Income Common Stockholders']
-                    for key in net_income_keys:
-                        if key in financials.index:
-                            value = financials.loc[key, col]
-                            if pd.notna(value):
-                                result["net_income"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # EPS（Basic EPS）
-                    eps_keys = ['Basic EPS', 'Diluted EPS']
-                    for key in eps_keys:
-                        if key in financials.index:
-                            value = financials.loc[key, col]
-                            if pd.notna(value):
-                                result["eps"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
+                extracted = extract_series(financials, INCOME_SERIES, existing=result,
+                                           dedupe=DEDUPE_SERIES)
+                for key, items in extracted.items():
+                    result[key].extend(items)
 
                 # Yahooは最新決算期のBasic/Diluted EPSを空で返すことがある。
                 # 売上・純利益は入っているのにEPSだけ欠ける形なので、画面では
@@ -1273,48 +1310,9 @@ class StockAnalyzer:
             # キャッシュフロー計算書（年次）
             cashflow = ticker.cashflow
             if not cashflow.empty:
-                years_to_get = min(5, len(cashflow.columns))
-                
-                for i in range(years_to_get):
-                    col = cashflow.columns[i]
-                    date_str = col.strftime('%Y-%m-%d')
-                    
-                    # 営業CF
-                    cf_keys = ['Operating Cash Flow', 'Total Cash From Operating Activities']
-                    for key in cf_keys:
-                        if key in cashflow.index:
-                            value = cashflow.loc[key, col]
-                            if pd.notna(value):
-                                result["operating_cf"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # 投資CF
-                    invest_keys = ['Investing Cash Flow', 'Total Cash From Investing Activities']
-                    for key in invest_keys:
-                        if key in cashflow.index:
-                            value = cashflow.loc[key, col]
-                            if pd.notna(value):
-                                result["investing_cf"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # 財務CF
-                    finance_keys = ['Financing Cash Flow', 'Total Cash From Financing Activities']
-                    for key in finance_keys:
-                        if key in cashflow.index:
-                            value = cashflow.loc[key, col]
-                            if pd.notna(value):
-                                result["financing_cf"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                                
+                for key, items in extract_series(cashflow, CASHFLOW_SERIES).items():
+                    result[key].extend(items)
+
         except Exception as e:
             print(f"キャッシュフローデータ取得エラー: {str(e)}")
             errors.append(e)
@@ -1323,114 +1321,12 @@ class StockAnalyzer:
             # 貸借対照表（年次）
             balance_sheet = ticker.balance_sheet
             if not balance_sheet.empty:
-                years_to_get = min(5, len(balance_sheet.columns))
-                
-                for i in range(years_to_get):
-                    col = balance_sheet.columns[i]
-                    date_str = col.strftime('%Y-%m-%d')
-                    
-                    # 現金及び現金同等物
-                    cash_keys = ['Cash And Cash Equivalents', 'Cash', 'Cash And Short Term Investments']
-                    for key in cash_keys:
-                        if key in balance_sheet.index:
-                            value = balance_sheet.loc[key, col]
-                            if pd.notna(value):
-                                result["cash"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # 流動資産
-                    current_assets_keys = ['Total Current Assets', 'Current Assets']
-                    for key in current_assets_keys:
-                        if key in balance_sheet.index:
-                            value = balance_sheet.loc[key, col]
-                            if pd.notna(value):
-                                result["current_assets_list"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # 流動負債
-                    current_liab_keys = ['Total Current Liabilities', 'Current Liabilities']
-                    for key in current_liab_keys:
-                        if key in balance_sheet.index:
-                            value = balance_sheet.loc[key, col]
-                            if pd.notna(value):
-                                result["current_liabilities_list"].append({
-                                    "date": date_str,
-                                    "value": float(value)
-                                })
-                                break
-                    
-                    # ROE, ROA, 自己資本比率計算用のデータ
-                    equity_keys = ['Total Equity', 'Total Stockholder Equity', 
-                                  'Total Stockholders Equity', "Total shareholders' equity"]
-                    assets_keys = ['Total Assets']
-                    
-                    total_equity = None
-                    total_assets = None
-                    
-                    for key in equity_keys:
-                        if key in balance_sheet.index:
-                            total_equity = balance_sheet.loc[key, col]
-                            break
-                    
-                    for key in assets_keys:
-                        if key in balance_sheet.index:
-                            total_assets = balance_sheet.loc[key, col]
-                            break
-                    
-                    # 自己資本比率（自己資本 / 総資産 * 100）- 強化版
-                    def _get_bs_value(row_names, data_frame, col):
-                        """貸借対照表から値を取得するヘルパー関数（5年分用）"""
-                        for name in row_names:
-                            variations = [
-                                name,
-                                name.replace("Stockholder", "Stockholders"),
-                                name.replace("Stockholders", "Stockholder"),
-                                name.replace(" ", ""),
-                                name.replace("Total ", "")
-                            ]
-                            for variant in variations:
-                                if variant in data_frame.index:
-                                    value = data_frame.loc[variant, col]
-                                    if pd.notna(value):
-                                        return float(value)
-                        return None
-                    
-                    equity_keys_5y = ['Total Stockholder Equity', 'Total Stockholders Equity', 
-                                     'Total Equity', "Total shareholders' equity", 'Stockholder Equity']
-                    assets_keys_5y = ['Total Assets', 'Total Asset']
-                    liab_keys_5y = ['Total Liabilities', 'Total Liab', 'Total Debt']
-                    
-                    equity_5y = _get_bs_value(equity_keys_5y, balance_sheet, col)
-                    assets_5y = _get_bs_value(assets_keys_5y, balance_sheet, col)
-                    liab_5y = _get_bs_value(liab_keys_5y, balance_sheet, col)
-                    
-                    # フォールバック：Total Assets = Total Equity + Total Liabilities
-                    if assets_5y is None and equity_5y is not None and liab_5y is not None:
-                        assets_5y = equity_5y + liab_5y
-                    
-                    if equity_5y and assets_5y and assets_5y != 0:
-                        equity_ratio = round((equity_5y / assets_5y) * 100, 2)
-                        result["equity_ratio_list"].append({
-                            "date": date_str,
-                            "value": equity_ratio
-                        })
-                    
-                    # 対応する純利益を探す
-                    net_income_for_date = None
-                    for ni in result["net_income"]:
-                        if ni["date"] == date_str:
-                            net_income_for_date = ni["value"]
-                            break
-                    
-                    # ROE/ROA計算は別途専用関数で処理（より正確な計算のため）
-                    # ここでは個別年度の処理のみ継続
-                        
+                for key, items in extract_series(balance_sheet, BALANCE_SERIES).items():
+                    result[key].extend(items)
+
+                # 自己資本比率（自己資本 / 総資産 * 100）。ROE/ROAは _calculate_roe_roa で計算する
+                result["equity_ratio_list"].extend(extract_equity_ratio(balance_sheet))
+
         except Exception as e:
             print(f"貸借対照表データ取得エラー: {str(e)}")
             errors.append(e)
@@ -1669,28 +1565,23 @@ class StockAnalyzer:
                 pass
                 
     def _analyze_trend_and_create_chart(self, ticker: yf.Ticker, symbol: str, result: Dict[str, Any], period: str = "1y"):
-        """トレンド分析とチャート作成"""
+        """トレンド分析とチャート入力の登録（描画は /api/stock/chart/<key>.png で行う）"""
         try:
-            # 1D/1Wは取得が不安定なことがあるのでフォールバック込み
-            try_periods = [period, "1y"] if period in ("1d", "5d") else [period]
+            # 取得は最大2回。1D/1Wは取得が不安定なことがあるので、2回目は1年分にする
+            attempts = [period, "1y"] if period in ("1d", "5d") else [period, period]
             hist = None
-            for p in try_periods:
-                # 最大2回試行（初回失敗時に2秒待ってリトライ）
-                for attempt in range(2):
-                    try:
-                        print(f"データ取得試行: {symbol}, 期間: {p}, 試行{attempt+1}/2")
-                        hist = ticker.history(period=p, timeout=10)
-                        if not hist.empty:
-                            print(f"データ取得成功: {len(hist)} 行")
-                            break
-                        else:
-                            print(f"データが空: 期間 {p}, 試行{attempt+1}")
-                    except Exception as e:
-                        print(f"データ取得失敗 ({p}, 試行{attempt+1}): {str(e)}")
-                    if attempt == 0:
-                        time.sleep(2)
-                if hist is not None and not hist.empty:
-                    break
+            for attempt, p in enumerate(attempts, 1):
+                if attempt > 1:
+                    time.sleep(self.CHART_RETRY_SLEEP)
+                try:
+                    print(f"データ取得試行: {symbol}, 期間: {p}, 試行{attempt}/2")
+                    hist = ticker.history(period=p, timeout=self.CHART_FETCH_TIMEOUT)
+                    if not hist.empty:
+                        print(f"データ取得成功: {len(hist)} 行")
+                        break
+                    print(f"データが空: 期間 {p}, 試行{attempt}")
+                except Exception as e:
+                    print(f"データ取得失敗 ({p}, 試行{attempt}): {str(e)}")
 
             if hist is None or hist.empty:
                 return
@@ -1698,107 +1589,37 @@ class StockAnalyzer:
             # 終値データ
             close_prices = hist['Close']
             
-            # トレンド分析（最小二乗回帰）
-            x = np.arange(len(close_prices))
-            y = close_prices.values
-            
-            # NaN除去
-            mask = ~np.isnan(y)
-            x = x[mask]
-            y = y[mask]
-            
-            if len(x) > 2:  # 最低3点は必要
-                try:
-                    # 線形回帰
-                    z = np.polyfit(x, y, 1)
-                    slope = z[0]
-                    
-                    # R²計算
-                    p = np.poly1d(z)
-                    yhat = p(x)
-                    ybar = np.mean(y)
-                    ssreg = np.sum((yhat - ybar) ** 2)
-                    sstot = np.sum((y - ybar) ** 2)
-                    r2 = ssreg / sstot if sstot != 0 else 0
-                    
-                    # トレンドラベル判定
-                    if slope < -0.1:
-                        label = "Down"
-                    elif slope > 0.1:
-                        label = "Up"
-                    else:
-                        label = "Flat"
-                        
-                    result["trend"] = {
-                        "slope": float(slope),
-                        "r2": float(r2),
-                        "label": label
-                    }
-                except Exception as e:
-                    print(f"トレンド計算エラー: {str(e)}")
-                    result["trend"] = None
+            # トレンド分析（最小二乗回帰。閉じた式で1回だけ）
+            stats = trend_stats(close_prices.to_numpy(dtype=float))
+            if stats:
+                result["trend"] = {
+                    "slope": stats["slope"],
+                    "r2": stats["r2"],
+                    "label": stats["label"],
+                    "intercept": stats["intercept"],
+                    "resid_std": stats["resid_std"],
+                    # 実際に使った期間（1d/5d はフォールバックで1y になることがある）
+                    "period": p,
+                }
             else:
-                print(f"トレンド計算: データ点不足 ({len(x)}点)")
+                print(f"トレンド計算: データ点不足 ({int(close_prices.notna().sum())}点)")
                 result["trend"] = None
 
-            # OHLCデータを結果に格納（Lightweight Charts用）
-            price_history = []
-            for idx, row in hist.iterrows():
-                # Lightweight Chartsはtime（UNIX秒）を期待
-                timestamp = int(idx.timestamp())
-                price_history.append({
-                    "time": timestamp,
-                    "open": float(row['Open']) if pd.notna(row['Open']) else None,
-                    "high": float(row['High']) if pd.notna(row['High']) else None,
-                    "low": float(row['Low']) if pd.notna(row['Low']) else None,
-                    "close": float(row['Close']) if pd.notna(row['Close']) else None,
-                    "volume": int(row['Volume']) if pd.notna(row.get('Volume', None)) else None
-                })
+            # OHLCデータを結果に格納（Lightweight Charts用。time は UNIX秒）
+            price_history = frame_to_rows(hist, keep_missing_close=True, volume=True)
             result["price_history"] = price_history
             print(f"株価履歴データ: {len(price_history)}件")
 
-            # チャート作成
-            fig, ax = plt.subplots(figsize=(12, 6))
-            
-            # 株価プロット
-            ax.plot(hist.index, close_prices, label='終値', color='#1f77b4', linewidth=1.5)
-            
-            # トレンドライン
-            if result.get("trend"):
-                dates_numeric = mdates.date2num(hist.index[mask])
-                z_dates = np.polyfit(dates_numeric, y, 1)
-                p_dates = np.poly1d(z_dates)
-                ax.plot(hist.index[mask], p_dates(dates_numeric), 
-                       label=f'トレンド ({result["trend"]["label"]})', 
-                       color='red', linestyle='--', alpha=0.6)
-                
-            # グラフ装飾
-            ax.set_title(f'{symbol} - {period}の株価推移', fontsize=14, fontweight='bold')
-            ax.set_xlabel('日付', fontsize=11)
-            ax.set_ylabel('株価', fontsize=11)
-            ax.grid(True, alpha=0.3)
-            ax.legend(loc='best')
-            
-            # X軸の日付フォーマット
-            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-            ax.xaxis.set_major_locator(mdates.MonthLocator(interval=3))
-            plt.xticks(rotation=45)
-            
-            plt.tight_layout()
-            
-            # チャート保存
-            chart_file = os.path.join(self.charts_dir, f"chart_{symbol.replace('.', '_')}_{period}.png")
-            try:
-                plt.savefig(chart_file, dpi=100, bbox_inches='tight', facecolor='white')
-                plt.close()
-                print(f"チャート保存成功: {chart_file}")
-            except Exception as e:
-                print(f"チャート保存エラー: {str(e)}")
-                plt.close()
-                return
-            
-            result["chart_png"] = chart_file
-            print(f"チャート作成: {chart_file}")
+            # チャート（PNG）はここでは描かない。入力を預けて URL だけ返し、
+            # 読まれたときに chart_renderer が描く
+            trend = result.get("trend")
+            key = chart_renderer.register(
+                symbol, period,
+                [bar["time"] for bar in price_history],
+                [bar["close"] for bar in price_history],
+                trend["label"] if trend else None)
+            result["chart_key"] = key
+            result["chart_url"] = chart_url(key)
             
         except Exception as e:
             print(f"チャート作成エラー: {str(e)}")
@@ -1813,7 +1634,8 @@ class StockAnalyzer:
             # 無料・低負荷更新ではYahoo日本版HTMLを読まず、下のJPXローカル一覧と
             # 英語分類の変換だけを使う。
             name_jp, industry_jp = ((None, None) if not allow_yahoo_jp
-                                    else fetch_jp_labels(symbol))
+                                    else fetch_jp_labels(
+                                        symbol, timeout=self.JP_LABELS_FETCH_TIMEOUT))
             result["name_jp"] = name_jp or None
             result["industry_jp"] = industry_jp or None
 
@@ -2145,28 +1967,36 @@ class StockAnalyzer:
                 print(f"yfinance事業概要取得エラー: {e}")
 
 
-def batch_analyze(symbols: List[str], sleep_time: float = 0.35, skip_chart: bool = False, skip_extras: bool = False):
+def batch_analyze(symbols: List[str], sleep_time: float = 0.35, skip_chart: bool = False,
+                  skip_extras: bool = False, workers: Optional[int] = None):
     """
     複数銘柄をバッチ分析
 
     Args:
         symbols: 銘柄コードのリスト
-        sleep_time: リクエスト間のスリープ時間（秒）
+        sleep_time: workers=1 のときだけ使う銘柄間のスリープ時間（秒）。
+            並列時の送信間隔は upstream_limiter のホスト別バケットが決める
         skip_chart: チャート生成をスキップするか
         skip_extras: 株主・事業概要・信用倍率・業績予想をスキップするか
+        workers: 同時に分析する銘柄数（既定は batch_runner.BATCH_WORKERS）
+
+    Returns:
+        入力順の分析結果リスト
     """
-    analyzer = StockAnalyzer()
-    results = []
+    analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
+    workers = workers or BATCH_WORKERS
+    total = len(symbols)
+    progress = {'done': 0}
 
-    for i, symbol in enumerate(symbols):
-        print(f"\n[{i+1}/{len(symbols)}] {symbol}を分析中...")
+    def _analyze_one(symbol):
+        print(f"\n[{progress['done'] + 1}/{total}] {symbol}を分析中...")
         result = analyzer.analyze(symbol, skip_chart=skip_chart, skip_extras=skip_extras)
-        results.append(result)
-        
-        # 最後の銘柄以外はスリープ
-        if i < len(symbols) - 1:
+        if workers == 1 and progress['done'] + 1 < total:
             time.sleep(sleep_time)
-            
+        return result
+
+    results, _ = run_batch(symbols, _analyze_one, workers=workers, status=progress,
+                           label='バッチ分析')
     return results
 
 
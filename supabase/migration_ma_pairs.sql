@@ -0,0 +1,65 @@
+-- =============================================
+-- 移動平均の組ごとのGC/DC（5/25日・25/75日・13/26週）
+--
+-- 背景:
+--   ma_crosses は 5日線/25日線 の1組しか持っていなかった。
+--   ma_cross.MA_PAIRS の組を夜間にまとめて計算し（日足の decode は銘柄ごとに1回、
+--   窓の合計も日数が同じなら使い回す）、組のキーごとに保存する。
+--   従来の列（latest_gc_date など）には引き続き 5/25 の結果を入れる。
+--
+-- ma_crosses.pairs:
+--   {"d5_25":  {"latest_gc_date", "latest_dc_date", "cross_count", "crosses"},
+--    "d25_75": {...}, "w13_26": {...}}
+--   キーは d=日足・w=週足 ＋ 日数（週数）。週足は日足1年分から集約する。
+--
+-- screened_latest.ma_pairs（スクリーナーの絞り込み用）:
+--   {"d25_75": {"state": "gc"|"dc"|null, "gc_date", "dc_date"}, ...}
+--   state は直近の交差の種類。/api/stocks/screen の
+--   cross=gc|dc ・ cross_pair=<キー> ・ cross_days=N で絞り込む。
+--   銘柄数が約4,000と少ないため索引は付けない。
+-- =============================================
+
+ALTER TABLE ma_crosses
+    ADD COLUMN IF NOT EXISTS pairs JSONB;
+
+ALTER TABLE screened_latest
+    ADD COLUMN IF NOT EXISTS ma_pairs JSONB;
+
+COMMENT ON COLUMN ma_crosses.pairs IS
+    '移動平均の組ごとの交差（キーは ma_cross.MA_PAIRS）';
+COMMENT ON COLUMN screened_latest.ma_pairs IS
+    '組ごとの直近の交差の種類と日付（ma_crossesから同期）。スクリーナーの絞り込み用';
+
+-- sync_gc_dates（migration_sync_gc_dates.sql）を ma_pairs も書くものに置き換える。
+-- ma_pairs を渡さない行（backfill_gc_dates.py など）は、今の値を残す。
+CREATE OR REPLACE FUNCTION sync_gc_dates(p_rows JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_matched INTEGER;
+    v_changed INTEGER;
+BEGIN
+    SELECT COUNT(*) INTO v_matched
+    FROM screened_latest s
+    JOIN jsonb_to_recordset(p_rows) AS p(company_code VARCHAR, gc_date DATE, dc_date DATE,
+                                         ma_pairs JSONB)
+      ON s.company_code = p.company_code;
+
+    UPDATE screened_latest s
+    SET gc_date = p.gc_date,
+        dc_date = p.dc_date,
+        ma_pairs = COALESCE(p.ma_pairs, s.ma_pairs)
+    FROM jsonb_to_recordset(p_rows) AS p(company_code VARCHAR, gc_date DATE, dc_date DATE,
+                                         ma_pairs JSONB)
+    WHERE s.company_code = p.company_code
+      AND (s.gc_date IS DISTINCT FROM p.gc_date
+           OR s.dc_date IS DISTINCT FROM p.dc_date
+           OR (p.ma_pairs IS NOT NULL AND s.ma_pairs IS DISTINCT FROM p.ma_pairs));
+    GET DIAGNOSTICS v_changed = ROW_COUNT;
+
+    RETURN jsonb_build_object('matched', v_matched, 'changed', v_changed);
+END;
+$$;
+
+REVOKE ALL ON FUNCTION sync_gc_dates(JSONB) FROM PUBLIC, anon, authenticated;
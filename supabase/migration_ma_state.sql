@@ -0,0 +1,22 @@
+-- GC/DC を日足1本ずつ進めるための途中状態を、銘柄ごとに ma_crosses に持つ。
+--
+-- 背景:
+--   夜間の再計算（ma_cross.calculate_for_all）は、増えた足が1本でも
+--   日足1年分を頭から計算し直していた。移動平均は窓の合計と窓に入っている
+--   終値さえあれば1本ずつ進められるので、その状態を残して次は増えた分だけ進める。
+--   場中の株価更新（scheduled_update_stock_prices）のあとにも、この状態から
+--   その日の足を仮に足してGC/DCを見直す。
+--
+-- 中身（ma_cross.new_state）:
+--   {"v": 1, "short_window": 5, "long_window": 25,
+--    "last_time": UNIX秒, "count": 本数, "tail": [直近 long_window 本の終値],
+--    "short_sum": 短期の窓の合計, "long_sum": 長期の窓の合計,
+--    "prev_sign": 直前の 短期線−長期線 の符号 (1/-1/0),
+--    "crosses": [{"date", "type"}], "pending": [最後の1本のUNIX秒, 終値]}
+--   最後の1本は場中の値のことがあるため状態には含めず pending に置く。
+--   日足が書き換わった（状態の最後の足と終値が合わない）銘柄は作り直す。
+ALTER TABLE ma_crosses
+    ADD COLUMN IF NOT EXISTS ma_state JSONB;
+
+COMMENT ON COLUMN ma_crosses.ma_state IS
+    '移動平均の途中状態。ma_cross.py が日足を1本ずつ進めるのに使う';
@@ -0,0 +1,47 @@
+-- =============================================
+-- GC/DC日を screened_latest へまとめて同期する関数
+--
+-- 背景:
+--   ma_cross.sync_gc_to_screened は、銘柄ごとに
+--   update screened_latest ... eq(company_code) を1回ずつ投げていた。
+--   約4,000銘柄で4,000往復になり、夜間の再計算はこの同期待ちがほとんどを
+--   占めていた（計算そのものは数秒）。
+--
+--   [{company_code, gc_date, dc_date}] の配列を受け取り、1回の UPDATE ... FROM で
+--   反映する。値が同じ行は書かない（IS DISTINCT FROM）。
+--
+-- 戻り値: {"matched": screened_latest にあった銘柄数, "changed": 書き換えた銘柄数}
+--   Python 側（ma_cross.sync_gc_to_screened）が changed / unchanged / missing に直す。
+--   関数が無い間は、Python 側が差分だけを1件ずつ更新する従来の道に戻る。
+-- =============================================
+
+CREATE OR REPLACE FUNCTION sync_gc_dates(p_rows JSONB)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_matched INTEGER;
+    v_changed INTEGER;
+BEGIN
+    SELECT COUNT(*) INTO v_matched
+    FROM screened_latest s
+    JOIN jsonb_to_recordset(p_rows) AS p(company_code VARCHAR, gc_date DATE, dc_date DATE)
+      ON s.company_code = p.company_code;
+
+    UPDATE screened_latest s
+    SET gc_date = p.gc_date,
+        dc_date = p.dc_date
+    FROM jsonb_to_recordset(p_rows) AS p(company_code VARCHAR, gc_date DATE, dc_date DATE)
+    WHERE s.company_code = p.company_code
+      AND (s.gc_date IS DISTINCT FROM p.gc_date OR s.dc_date IS DISTINCT FROM p.dc_date);
+    GET DIAGNOSTICS v_changed = ROW_COUNT;
+
+    RETURN jsonb_build_object('matched', v_matched, 'changed', v_changed);
+END;
+$$;
+
+COMMENT ON FUNCTION sync_gc_dates(JSONB) IS
+    'ma_crosses のGC/DC日を screened_latest にまとめて反映する（ma_cross.sync_gc_to_screened）';
+
+-- アクセスは全てFlask経由（サービスロールキー）。anon からは呼ばせない。
+REVOKE ALL ON FUNCTION sync_gc_dates(JSONB) FROM PUBLIC, anon, authenticated;
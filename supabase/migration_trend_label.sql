@@ -0,0 +1,29 @@
+-- 株価トレンド（直近1年の日足の回帰直線）を銘柄ごとに持つ。
+--
+-- 背景:
+--   トレンドは分析のたびに yfinance から株価を取り、np.polyfit で出していた。
+--   スクリーナーで「上昇トレンドの銘柄だけ」と絞るには全銘柄分の分析が要り、
+--   取得とチャート生成が付いてくる。
+--   stock_price_history.daily_1y に日足があるので、trend_stats.calculate_for_all が
+--   外部にアクセスせず全銘柄を計算してここへ入れる（日足更新の夜間バッチの最後）。
+--
+-- 値: 'Up' / 'Down' / 'Flat'。足1本あたりの傾きが ±0.1 を超えるかで判定
+--     （分析画面のトレンド表示と同じ基準）。
+ALTER TABLE screened_latest
+    ADD COLUMN IF NOT EXISTS trend_label VARCHAR(8),
+    ADD COLUMN IF NOT EXISTS trend_calculated_at TIMESTAMPTZ;
+
+ALTER TABLE screened_latest
+    DROP CONSTRAINT IF EXISTS screened_latest_trend_label_check;
+ALTER TABLE screened_latest
+    ADD CONSTRAINT screened_latest_trend_label_check
+    CHECK (trend_label IS NULL OR trend_label IN ('Up', 'Down', 'Flat'));
+
+-- スクリーナーの絞り込み（trend=up など）で使う
+CREATE INDEX IF NOT EXISTS idx_screened_latest_trend_label
+    ON screened_latest (trend_label);
+
+COMMENT ON COLUMN screened_latest.trend_label IS
+    '直近1年の日足の回帰トレンド(Up/Down/Flat)。trend_stats.py が日足から計算';
+COMMENT ON COLUMN screened_latest.trend_calculated_at IS
+    'trend_label を計算した日時';
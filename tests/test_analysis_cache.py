@@ -0,0 +1,99 @@
+"""分析結果キャッシュ（古い結果を返して裏で取り直す）のリグレッション。"""
+
+import threading
+import unittest
+
+from analysis_cache import FRESH, MISS, STALE, AnalysisCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+KEY = ('7203.T', '1y', False, False, False)
+
+
+class AnalysisCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = AnalysisCache(price_ttl=60, stale_limit=3600, clock=self.clock)
+
+    def test_states_follow_price_ttl_and_stale_limit(self):
+        self.assertEqual(MISS, self.cache.get(KEY)[1])
+        self.cache.put(KEY, {'symbol': '7203.T', 'last_price': 3000})
+
+        value, state, _ = self.cache.get(KEY)
+        self.assertEqual((FRESH, 3000), (state, value['last_price']))
+
+        self.clock.now += 120
+        self.assertEqual(STALE, self.cache.get(KEY)[1])
+
+        self.clock.now += 3600
+        self.assertEqual(MISS, self.cache.get(KEY)[1])
+
+    def test_returned_value_is_a_copy(self):
+        self.cache.put(KEY, {'source_status': {}})
+        value, _, _ = self.cache.get(KEY)
+        value['source_status']['analysis_cache'] = {'status': FRESH}
+        self.assertEqual({}, self.cache.get(KEY)[0]['source_status'])
+
+    def test_error_results_are_not_stored(self):
+        self.cache.put(KEY, {'error': 'Too Many Requests'})
+        self.assertEqual(MISS, self.cache.get(KEY)[1])
+
+    def test_earnings_announcement_drops_every_option_of_the_symbol(self):
+        """発表を検知したら、期間違いも含めてその銘柄の結果を全部捨てる。"""
+        other_period = ('7203.T', '5y', False, False, False)
+        other_symbol = ('6758.T', '1y', False, False, False)
+        for key in (KEY, other_period, other_symbol):
+            self.cache.put(key, {'symbol': key[0]})
+
+        self.assertEqual(2, self.cache.invalidate('7203'))
+        self.assertEqual(MISS, self.cache.get(KEY)[1])
+        self.assertEqual(MISS, self.cache.get(other_period)[1])
+        self.assertEqual(FRESH, self.cache.get(other_symbol)[1])
+
+    def test_analysis_started_before_invalidation_is_not_stored(self):
+        started_at = self.cache.now()
+        self.clock.now += 1
+        self.cache.invalidate('7203')
+        self.cache.put(KEY, {'symbol': '7203.T'}, started_at=started_at)
+        self.assertEqual(MISS, self.cache.get(KEY)[1])
+
+        self.clock.now += 1
+        self.cache.put(KEY, {'symbol': '7203.T'}, started_at=self.cache.now())
+        self.assertEqual(FRESH, self.cache.get(KEY)[1])
+
+    def test_oldest_entries_are_evicted(self):
+        cache = AnalysisCache(max_entries=2, clock=self.clock)
+        for code in ('1301.T', '1332.T', '1333.T'):
+            cache.put((code, '1y'), {'symbol': code})
+        self.assertEqual(MISS, cache.get(('1301.T', '1y'))[1])
+        self.assertEqual(2, cache.snapshot()['entries'])
+
+    def test_background_refresh_runs_once_per_key(self):
+        release = threading.Event()
+        finished = threading.Event()
+        calls = []
+
+        def _refresh():
+            calls.append(1)
+            release.wait(1)
+            self.cache.put(KEY, {'symbol': '7203.T', 'last_price': 3100})
+            finished.set()
+
+        self.assertTrue(self.cache.refresh_in_background(KEY, _refresh))
+        self.assertFalse(self.cache.refresh_in_background(KEY, _refresh))
+        release.set()
+        finished.wait(1)
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(3100, self.cache.get(KEY)[0]['last_price'])
+
+
+if __name__ == '__main__':
+    unittest.main()
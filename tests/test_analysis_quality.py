@@ -15,13 +15,14 @@ from analysis_quality import (
 )
 from official_company_profiles import apply_official_profile_fallback
 from report_builder import build_from_screened
+from result_sinks import NullSink
 from stock_analyzer import StockAnalyzer, extract_yahoo_forecast_data
 from supabase_client import attach_score_quality, merge_source_status, score_breakdown
 
 
 class AnalysisQualityTest(unittest.TestCase):
     def test_safe_sources_mode_skips_limited_and_html_sources(self):
-        analyzer = StockAnalyzer()
+        analyzer = StockAnalyzer(sink=NullSink())
         with patch('stock_analyzer.yf.Ticker', return_value=Mock()), \
                 patch.object(analyzer, '_get_basic_metrics'), \
                 patch.object(analyzer, '_get_financial_data'), \
@@ -0,0 +1,196 @@
+"""analyze の取得ステージ並行実行のリグレッション。
+
+通信の代わりに短い sleep を入れたステージで、依存順・並行度・締め切り・
+部分結果の記録を確かめる。
+"""
+
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+from analysis_stages import Stage, run_stages
+from result_sinks import NullSink
+from stock_analyzer import StockAnalyzer
+
+
+def _sleeping(key, value, seconds=0.0, log=None):
+    def _run(result):
+        if log is not None:
+            log.append(('start', key))
+        time.sleep(seconds)
+        result[key] = value
+        if log is not None:
+            log.append(('end', key))
+    return _run
+
+
+class RunStagesTest(unittest.TestCase):
+    def test_independent_stages_overlap(self):
+        """3本の0.2秒待ちが直列の0.6秒ではなく、ほぼ1本分で終わる。"""
+        stages = [Stage(name, _sleeping(name, 1, 0.2)) for name in ('a', 'b', 'c')]
+        result = {'source_status': {}}
+
+        began = time.monotonic()
+        summary = run_stages(stages, result, max_workers=3)
+        elapsed = time.monotonic() - began
+
+        self.assertLess(elapsed, 0.45)
+        self.assertEqual((1, 1, 1), (result['a'], result['b'], result['c']))
+        self.assertEqual('success', summary['status'])
+
+    def test_dependent_stage_sees_upstream_result(self):
+        log = []
+
+        def _derive(result):
+            log.append(('start', 'derived'))
+            result['derived'] = result['base'] * 2
+
+        stages = [
+            Stage('derived', _derive, after=('base',)),
+            Stage('base', _sleeping('base', 21, 0.05, log)),
+        ]
+        result = {'source_status': {}}
+
+        run_stages(stages, result)
+
+        self.assertEqual(42, result['derived'])
+        self.assertLess(log.index(('end', 'base')), log.index(('start', 'derived')))
+
+    def test_pool_bound_is_respected(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def _busy(result):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+
+        stages = [Stage(f's{i}', _busy) for i in range(6)]
+        run_stages(stages, {'source_status': {}}, max_workers=2)
+
+        self.assertLessEqual(max(peak), 2)
+
+    def test_timed_out_stage_is_dropped_and_recorded(self):
+        """締め切りを過ぎたステージは待たず、後から書いた値も混ぜない。"""
+        stages = [
+            Stage('slow', _sleeping('late_value', 'x', 0.5), deadline=0.1,
+                  status_key='margin_trading', source='信用残取得'),
+            Stage('fast', _sleeping('fast_value', 'y')),
+        ]
+        result = {'source_status': {}}
+
+        began = time.monotonic()
+        summary = run_stages(stages, result)
+        self.assertLess(time.monotonic() - began, 0.4)
+        time.sleep(0.5)
+
+        self.assertNotIn('late_value', result)
+        self.assertEqual('y', result['fast_value'])
+        self.assertEqual('partial', summary['status'])
+        self.assertEqual(['slow'], summary['timed_out'])
+        self.assertEqual('timeout', result['source_status']['margin_trading']['status'])
+        self.assertIs(summary, result['source_status']['analysis_stages'])
+
+    def test_failed_stage_does_not_stop_dependents(self):
+        def _boom(result):
+            raise RuntimeError('blocked')
+
+        stages = [
+            Stage('broken', _boom, status_key='forecast'),
+            Stage('after', _sleeping('after', True), after=('broken',)),
+        ]
+        result = {'source_status': {}}
+
+        summary = run_stages(stages, result)
+
+        self.assertTrue(result['after'])
+        self.assertEqual(['broken'], summary['failed'])
+        self.assertEqual('error', result['source_status']['forecast']['status'])
+
+    def test_parallel_source_status_entries_are_merged_per_key(self):
+        def _status(key):
+            def _run(result):
+                result['source_status'][key] = {'status': 'success'}
+            return _run
+
+        result = {'source_status': {'existing': {'status': 'success'}}}
+        run_stages([Stage('a', _status('forecast')), Stage('b', _status('margin_trading'))],
+                   result)
+
+        for key in ('existing', 'forecast', 'margin_trading'):
+            self.assertEqual('success', result['source_status'][key]['status'])
+
+
+class AnalyzeStagesTest(unittest.TestCase):
+    def test_analyze_overlaps_network_stages(self):
+        """ネットワーク待ちの工程が重なり、直列合計の半分未満で終わる。"""
+        analyzer = StockAnalyzer(sink=NullSink())   # テストで output/ に書かない
+
+        def _slow(seconds):
+            return lambda *args, **kwargs: time.sleep(seconds)
+
+        with patch('stock_analyzer.yf.Ticker', return_value=Mock()), \
+                patch.object(analyzer, '_get_basic_metrics', side_effect=_slow(0.15)), \
+                patch.object(analyzer, '_get_financial_data', side_effect=_slow(0.15)), \
+                patch.object(analyzer, '_get_five_year_financial_data'), \
+                patch.object(analyzer, '_fill_forward_dividend'), \
+                patch.object(analyzer, '_calculate_roe_roa', side_effect=_slow(0.15)), \
+                patch.object(analyzer, '_get_industry_sector', side_effect=_slow(0.15)), \
+                patch.object(analyzer, '_get_jp_labels'), \
+                patch.object(analyzer, '_get_forecast_data', side_effect=_slow(0.15)), \
+                patch.object(analyzer, '_get_margin_trading_data', side_effect=_slow(0.15)), \
+                patch.object(analyzer, '_get_holders_and_officers', side_effect=_slow(0.15)), \
+                patch.object(analyzer, '_get_business_summary'), \
+                patch.object(analyzer, '_apply_edinet_fallback'):
+            began = time.monotonic()
+            result = analyzer.analyze('7203.T', skip_chart=True)
+            elapsed = time.monotonic() - began
+
+        self.assertNotIn('error', result)
+        self.assertLess(elapsed, 0.15 * 7 / 2)
+        stages = result['source_status']['analysis_stages']
+        self.assertEqual('success', stages['status'])
+        self.assertIn('margin_trading', stages['stages'])
+
+    def test_deadlines_fit_the_helpers_and_the_request(self):
+        """工程の中の取得が締め切りに収まり、最長の連鎖も ANALYZE_TIMEOUT(60秒) より十分短い。"""
+        analyzer = StockAnalyzer(sink=NullSink())
+        stages = {stage.name: stage for stage in analyzer._build_stages(
+            '7203.T', Mock(), '1y', skip_chart=False, skip_extras=False,
+            safe_sources_only=False)}
+
+        finish = {}
+
+        def _finish(name):
+            if name not in finish:
+                stage = stages[name]
+                finish[name] = stage.deadline + max(
+                    (_finish(dep) for dep in stage.after), default=0)
+            return finish[name]
+
+        self.assertLessEqual(max(_finish(name) for name in stages), 50)
+        self.assertLessEqual(
+            2 * StockAnalyzer.CHART_FETCH_TIMEOUT + StockAnalyzer.CHART_RETRY_SLEEP,
+            stages['chart'].deadline)
+        self.assertLess(StockAnalyzer.JP_LABELS_FETCH_TIMEOUT, stages['jp_labels'].deadline)
+
+    def test_chart_fetches_at_most_twice(self):
+        analyzer = StockAnalyzer(sink=NullSink())
+        ticker = Mock()
+        ticker.history.side_effect = RuntimeError('timeout')
+
+        with patch('stock_analyzer.time.sleep') as sleep, patch('builtins.print'):
+            analyzer._analyze_trend_and_create_chart(ticker, '7203.T', {}, '1d')
+
+        self.assertEqual(['1d', '1y'],
+                         [call.kwargs['period'] for call in ticker.history.call_args_list])
+        sleep.assert_called_once_with(StockAnalyzer.CHART_RETRY_SLEEP)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+"""ホスト別トークンバケットと並列バッチ実行のリグレッション。
+
+バケットは時計と sleep を差し替えて、実際には待たずに待ち時間だけを検証する。
+"""
+
+import threading
+import time
+import unittest
+
+import upstream_limiter
+from batch_runner import run_batch
+from upstream_limiter import TokenBucket, UpstreamThrottled
+from yfinance_guard import INITIAL_BACKOFF_SECONDS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class FakeRateLimitError(Exception):
+    pass
+
+
+FakeRateLimitError.__name__ = 'YFRateLimitError'
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.bucket = TokenBucket('yfinance', rate=2.0, burst=2,
+                                  clock=self.clock, sleep_fn=self.clock.sleep)
+
+    def test_burst_then_paced_by_rate(self):
+        for _ in range(4):
+            self.bucket.acquire()
+        # 2本は溜まっていた分。残り2本は 0.5秒ずつ補充を待つ
+        self.assertEqual([0.5, 0.5], self.clock.slept)
+
+    def test_penalty_stops_every_caller(self):
+        self.bucket.penalize()
+        self.bucket.acquire(max_wait=None)
+
+        self.assertGreaterEqual(self.clock.slept[0], INITIAL_BACKOFF_SECONDS)
+        self.assertLess(self.bucket.rate, self.bucket.base_rate)
+
+    def test_gives_up_beyond_max_wait(self):
+        self.bucket.penalize()
+        with self.assertRaises(UpstreamThrottled) as raised:
+            self.bucket.acquire(max_wait=5)
+        # 分析側ではレート制限として分類される
+        self.assertIn('rate limit', str(raised.exception))
+
+    def test_simultaneous_hits_do_not_stack_backoff(self):
+        """同じ波で複数スレッドが当たっても、待ち時間は1回分。"""
+        self.bucket.penalize()
+        self.bucket.penalize()
+        self.assertEqual(1, self.bucket.rate_limit_hits)
+
+    def test_success_restores_rate_gradually(self):
+        self.bucket.penalize()
+        slowed = self.bucket.rate
+        self.bucket.record_success()
+        self.assertGreater(self.bucket.rate, slowed)
+        for _ in range(50):
+            self.bucket.record_success()
+        self.assertEqual(self.bucket.base_rate, self.bucket.rate)
+
+
+class RunBatchTest(unittest.TestCase):
+    def setUp(self):
+        upstream_limiter.reset()
+        self.addCleanup(upstream_limiter.reset)
+
+    def test_workers_overlap_waits_and_keep_input_order(self):
+        def _slow(code):
+            time.sleep(0.1)
+            return {'code': code}
+
+        status = {}
+        began = time.monotonic()
+        results, summary = run_batch(list('abcdefgh'), _slow, workers=4, status=status)
+
+        self.assertLess(time.monotonic() - began, 0.5)   # 直列なら0.8秒
+        self.assertEqual(list('abcdefgh'), [r['code'] for r in results])
+        self.assertEqual(8, status['done'])
+        self.assertEqual(0, status['errors'])
+        self.assertGreater(summary['per_minute'], 0)
+
+    def test_failures_and_falsy_results_count_as_errors(self):
+        def _process(code):
+            if code == 'x':
+                raise RuntimeError('boom')
+            return None if code == 'y' else True
+
+        status = {}
+        run_batch(['x', 'y', 'z'], _process, workers=2, status=status)
+
+        self.assertEqual(3, status['done'])
+        self.assertEqual(2, status['errors'])
+
+    def test_stop_request_prevents_new_items(self):
+        status = {'stop_requested': False}
+        seen = []
+        lock = threading.Lock()
+
+        def _process(code):
+            with lock:
+                seen.append(code)
+            status['stop_requested'] = True
+            return True
+
+        run_batch(range(20), _process, workers=2, status=status,
+                  should_stop=lambda: status['stop_requested'])
+
+        self.assertLessEqual(len(seen), 2)
+
+    def test_rate_limited_item_is_retried_after_penalty(self):
+        """制限に当たった銘柄は捨てず、バケットを止めてから同じ銘柄をやり直す。"""
+        calls = []
+        clock = FakeClock()
+        bucket = upstream_limiter.bucket('yfinance')
+        bucket._clock = clock
+        bucket._sleep = clock.sleep
+
+        def _flaky(code):
+            calls.append(code)
+            if len(calls) == 1:
+                raise FakeRateLimitError('Too Many Requests')
+            return True
+
+        results, summary = run_batch(['7203'], _flaky, workers=1)
+
+        self.assertEqual(['7203', '7203'], calls)
+        self.assertEqual([True], results)
+        self.assertEqual(1, summary['retried'])
+        self.assertEqual([INITIAL_BACKOFF_SECONDS], clock.slept)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""分析から切り離したチャート描画（chart_renderer）のリグレッション。"""
+
+import threading
+import unittest
+
+from chart_renderer import ChartRenderer, chart_key
+
+DAY = 86400
+TIMES = [1767571200 + i * DAY for i in range(30)]
+CLOSES = [3000.0 + i * 5 for i in range(30)]
+
+
+class ChartRendererTest(unittest.TestCase):
+    def setUp(self):
+        self.renderer = ChartRenderer(pool_size=1)
+
+    def test_key_depends_only_on_input(self):
+        first = self.renderer.register('7203.T', '1y', TIMES, CLOSES, 'Up')
+        again = self.renderer.register('7203.T', '1y', TIMES, CLOSES, 'Up')
+        moved = self.renderer.register('7203.T', '1y', TIMES, CLOSES[:-1] + [9999.0], 'Up')
+
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, moved)
+        self.assertEqual(first, chart_key('7203.T', '1y', TIMES, CLOSES, 'Up'))
+
+    def test_register_does_not_render(self):
+        """分析側は入力を預けるだけで、描画を待たない。"""
+        self.renderer.register('7203.T', '1y', TIMES, CLOSES, 'Up')
+        self.assertEqual(0, self.renderer.snapshot()['rendered'])
+
+    def test_png_is_rendered_once_and_reused(self):
+        key = self.renderer.register('7203.T', '1y', TIMES, CLOSES, 'Up')
+
+        first = self.renderer.png(key)
+        second = self.renderer.png(key)
+
+        self.assertTrue(first.startswith(b'\x89PNG'))
+        self.assertEqual(first, second)
+        self.assertEqual({'rendered': 1, 'hits': 1},
+                         {k: self.renderer.snapshot()[k] for k in ('rendered', 'hits')})
+
+    def test_missing_closes_are_drawn_as_gaps(self):
+        closes = list(CLOSES)
+        closes[3] = None
+        key = self.renderer.register('7203.T', '1y', TIMES, closes, None)
+        self.assertTrue(self.renderer.png(key).startswith(b'\x89PNG'))
+
+    def test_unknown_key_returns_none(self):
+        self.assertIsNone(self.renderer.png('0' * 24))
+
+    def test_concurrent_requests_render_once(self):
+        key = self.renderer.register('7203.T', '1y', TIMES, CLOSES, 'Up')
+        outputs = []
+        threads = [threading.Thread(target=lambda: outputs.append(self.renderer.png(key)))
+                   for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(4, len(outputs))
+        self.assertEqual(1, len(set(outputs)))
+        self.assertEqual(1, self.renderer.snapshot()['rendered'])
+
+
+if __name__ == '__main__':
+    unittest.main()
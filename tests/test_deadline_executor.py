@@ -0,0 +1,114 @@
+"""上限時間つきの処理の置き場（deadline_executor）のリグレッション。
+
+時間切れで置き去りになった処理を相手ごとに数え、溜まっている相手への
+新しい処理は待たずに断ること。
+"""
+
+import threading
+import time
+import unittest
+
+from deadline_executor import (
+    ORPHAN_LIMITS, REQUEST_THREADS, DeadlineExceeded, DeadlineExecutor, DeadlineRejected,
+)
+
+
+class DeadlineExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.executor = DeadlineExecutor(max_workers=4, orphan_limits={'slow': 2})
+
+    def _stuck(self):
+        self.release.wait(5)
+        return 'late'
+
+    def test_returns_value_and_propagates_errors(self):
+        self.assertEqual('ok', self.executor.run(lambda: 'ok', 1))
+        with self.assertRaises(ZeroDivisionError):
+            self.executor.run(lambda: 1 / 0, 1)
+
+    def test_orphans_are_tracked_and_limit_new_work(self):
+        for _ in range(2):
+            with self.assertRaises(DeadlineExceeded):
+                self.executor.run(self._stuck, 0.05, upstream='slow')
+
+        snap = self.executor.snapshot()
+        self.assertEqual(2, snap['orphans']['slow']['count'])
+
+        started = time.monotonic()
+        with self.assertRaises(DeadlineRejected):
+            self.executor.run(lambda: 'never', 5, upstream='slow')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual({'slow': 1}, self.executor.snapshot()['rejected'])
+
+        # 別の相手は止めない
+        self.assertEqual('ok', self.executor.run(lambda: 'ok', 1, upstream='other'))
+
+        # 置き去りが終われば、また受け付ける
+        self.release.set()
+        deadline = time.monotonic() + 2
+        while self.executor.orphan_count('slow') and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual('ok', self.executor.run(lambda: 'ok', 1, upstream='slow'))
+
+    def test_work_that_never_started_is_cancelled(self):
+        executor = DeadlineExecutor(max_workers=1, orphan_limits={'slow': 5})
+        with self.assertRaises(DeadlineExceeded):
+            executor.run(self._stuck, 0.05, upstream='slow')
+        ran = []
+        with self.assertRaises(DeadlineExceeded):
+            executor.run(lambda: ran.append(1), 0.05, upstream='slow')
+
+        self.release.set()
+        time.sleep(0.1)
+        self.assertEqual([], ran)
+        self.assertEqual(1, executor.snapshot()['cancelled'])
+
+    def test_time_waiting_for_a_thread_is_not_counted(self):
+        """置き場の空き待ちで上限を食われ、走れば間に合う処理が時間切れにならない。"""
+        executor = DeadlineExecutor(max_workers=1)
+        busy = threading.Thread(target=executor.run, args=(lambda: time.sleep(0.15), 1))
+        busy.start()
+        time.sleep(0.02)
+
+        self.assertEqual('ok', executor.run(lambda: time.sleep(0.2) or 'ok', 0.3))
+        busy.join()
+        snap = executor.snapshot()
+        self.assertEqual((0, 0, 2), (snap['cancelled'], snap['timed_out'], snap['completed']))
+
+    def test_every_request_thread_gets_a_worker_when_orphans_are_full(self):
+        """置き去りが全ての相手で上限まで溜まっていても、全リクエストが同時に走れる。"""
+        executor = DeadlineExecutor()
+        for upstream, limit in ORPHAN_LIMITS.items():
+            for _ in range(limit):
+                with self.assertRaises(DeadlineExceeded):
+                    executor.run(self._stuck, 0.01, upstream=upstream)
+
+        barrier = threading.Barrier(REQUEST_THREADS, timeout=2)
+        results = []
+
+        def _request():
+            # 全員が同時にスレッドを持っていないと揃わない
+            results.append(executor.run(lambda: barrier.wait() >= 0, 1, upstream='other'))
+
+        threads = [threading.Thread(target=_request) for _ in range(REQUEST_THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([True] * REQUEST_THREADS, results)
+        self.assertEqual(0, executor.snapshot()['cancelled'])
+
+    def test_reuses_one_pool(self):
+        for _ in range(20):
+            self.executor.run(lambda: None, 1)
+        pool = self.executor._pool
+        self.executor.run(lambda: None, 1)
+        self.assertIs(pool, self.executor._pool)
+        self.assertLessEqual(len(pool._threads), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""yfinance の DataFrame → 行の変換（frame_to_rows / batch_frame_to_rows）のリグレッション。
+
+iterrows の旧実装と同じ行を返すこと（値・型・None の位置・キーの並び）。
+"""
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from price_history import batch_frame_to_rows, frame_to_rows
+
+INDEX = pd.date_range('2025-01-06', periods=6, freq='B', tz='Asia/Tokyo', name='Date')
+
+
+def _frame(offset=0.0):
+    frame = pd.DataFrame({
+        'Open': [100.0, np.nan, 102.0, 103.0, 104.0, 105.0],
+        'High': [101.0, 102.0, 103.0, np.nan, 105.0, 106.0],
+        'Low': [99.0, 100.0, 101.0, 102.0, 103.0, 104.0],
+        'Close': [100.5, 101.5, np.nan, 103.5, 104.5, 105.5],
+        'Volume': [1000.0, 2000.0, 3000.0, np.nan, 5000.0, 6000.0],
+    }, index=INDEX)
+    return frame + offset
+
+
+def _legacy(frame, keep_missing_close=False, volume=False):
+    rows = []
+    for idx, row in frame.iterrows():
+        if pd.isna(row.get('Close')) and not keep_missing_close:
+            continue
+        bar = {
+            'time': int(idx.timestamp()),
+            'open': float(row['Open']) if pd.notna(row['Open']) else None,
+            'high': float(row['High']) if pd.notna(row['High']) else None,
+            'low': float(row['Low']) if pd.notna(row['Low']) else None,
+            'close': float(row['Close']) if pd.notna(row['Close']) else None,
+        }
+        if volume:
+            bar['volume'] = int(row['Volume']) if pd.notna(row.get('Volume', None)) else None
+        rows.append(bar)
+    return rows
+
+
+class FrameToRowsTest(unittest.TestCase):
+    def test_matches_iterrows(self):
+        rows = frame_to_rows(_frame())
+        self.assertEqual(_legacy(_frame()), rows)
+        self.assertEqual(['time', 'open', 'high', 'low', 'close'], list(rows[0]))
+        self.assertIsInstance(rows[0]['time'], int)
+        self.assertIsInstance(rows[0]['close'], float)
+
+    def test_analyzer_mode_keeps_missing_close_and_volume(self):
+        rows = frame_to_rows(_frame(), keep_missing_close=True, volume=True)
+        self.assertEqual(_legacy(_frame(), keep_missing_close=True, volume=True), rows)
+        self.assertIsInstance(rows[0]['volume'], int)
+
+    def test_empty(self):
+        self.assertEqual([], frame_to_rows(None))
+        self.assertEqual([], frame_to_rows(pd.DataFrame()))
+
+
+class BatchFrameToRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.symbols = ['7203.T', '6758.T', '9999.T']
+        nothing = _frame() * np.nan   # 何も返らなかった銘柄
+        self.frames = {'7203.T': _frame(), '6758.T': _frame(50.0), '9999.T': nothing}
+
+    def test_ticker_grouped_frame(self):
+        df = pd.concat(self.frames, axis=1)   # (銘柄, 列名)
+
+        result = batch_frame_to_rows(df, self.symbols)
+
+        self.assertEqual({'7203.T', '6758.T'}, set(result))
+        self.assertEqual(_legacy(self.frames['6758.T']), result['6758.T'])
+
+    def test_field_grouped_frame(self):
+        df = pd.concat(self.frames, axis=1).swaplevel(axis=1)   # (列名, 銘柄)
+        self.assertEqual(_legacy(self.frames['7203.T']),
+                         batch_frame_to_rows(df, self.symbols)['7203.T'])
+
+    def test_single_symbol_flat_columns(self):
+        self.assertEqual({'7203.T': _legacy(_frame())},
+                         batch_frame_to_rows(_frame(), ['7203.T']))
+
+    def test_symbol_missing_from_frame(self):
+        df = pd.concat({'7203.T': _frame()}, axis=1)
+        self.assertEqual({'7203.T'}, set(batch_frame_to_rows(df, ['7203.T', '6758.T'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
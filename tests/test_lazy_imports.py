@@ -0,0 +1,43 @@
+"""重い依存を初めて使うときに読み込む lazy_imports のリグレッション。"""
+
+import os
+import subprocess
+import sys
+import unittest
+
+from lazy_imports import LazyModule, is_loaded, lazy_attr
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+class LazyModuleTest(unittest.TestCase):
+    def test_module_is_imported_on_first_attribute(self):
+        loaded = []
+        module = LazyModule('colorsys', on_load=loaded.append)
+        self.assertFalse(is_loaded(module))
+
+        self.assertEqual((0.0, 0.0, 1.0), module.rgb_to_hsv(1.0, 1.0, 1.0))
+        module.rgb_to_hls
+        self.assertTrue(is_loaded(module))
+        self.assertEqual(1, len(loaded))   # on_load は1回だけ
+
+    def test_attr_proxy_calls_through(self):
+        dumps = lazy_attr('json', 'dumps')
+        self.assertFalse(is_loaded(dumps))
+        self.assertEqual('[1]', dumps([1]))
+        self.assertTrue(is_loaded(dumps))
+
+    def test_app_boot_does_not_load_analytics_stack(self):
+        """app を import しただけでは pandas / yfinance / matplotlib / openai を読まない。"""
+        code = ('import sys, app; '
+                'print("loaded:" + ",".join(m for m in ("pandas", "yfinance", "matplotlib", "openai", '
+                '"stock_analyzer") if m in sys.modules))')
+        env = dict(os.environ, ENABLE_SCHEDULER='false')
+        proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                              capture_output=True, text=True, timeout=120)
+        self.assertEqual(0, proc.returncode, proc.stderr[-2000:])
+        self.assertIn('loaded:\n', proc.stdout + '\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""長期足（週足・月足）の先回り作成（pregenerate_long_term）のリグレッション。
+
+長期足が無い銘柄から先に取り、保存した銘柄は次の晩の対象から外れること
+（途中で止まっても続きから進む）。
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import price_history as ph
+import price_store
+from price_store import PriceStore
+
+
+def _iso(days_ago):
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).isoformat()
+
+
+class _Client:
+    """stock_price_history の long_term_updated_at だけを覚えている Supabase の代役"""
+
+    def __init__(self, stamps):
+        self.stamps = dict(stamps)
+        self.upserts = []
+
+    def table(self, name):
+        client = self
+
+        class _Query:
+            def select(self, columns):
+                return self
+
+            def in_(self, column, codes):
+                self.codes = list(codes)
+                return self
+
+            def upsert(self, payload):
+                client.upserts.append(payload)
+                for p in payload:
+                    client.stamps[p['company_code']] = p['long_term_updated_at']
+                return self
+
+            def execute(self):
+                data = [{'company_code': c, 'long_term_updated_at': client.stamps[c]}
+                        for c in getattr(self, 'codes', []) if c in client.stamps]
+                return mock.Mock(data=data)
+
+        return _Query()
+
+
+def _download(symbols_text, **kwargs):
+    """10年分の日足。9999.T だけは何も返らない"""
+    index = pd.date_range('2016-01-04', periods=600, freq='B', tz='Asia/Tokyo', name='Date')
+    frames = {}
+    for sym in symbols_text.split():
+        close = np.linspace(100, 200, len(index))
+        if sym == '9999.T':
+            close = close * np.nan
+        frames[sym] = pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1,
+                                    'Close': close, 'Volume': 1000.0}, index=index)
+    return pd.concat(frames, axis=1)
+
+
+class LongTermTargetsTest(unittest.TestCase):
+    def test_missing_first_then_oldest_and_skip_fresh(self):
+        client = _Client({'1001': _iso(30), '1002': _iso(1), '1003': _iso(10), '1004': None})
+        codes = ['1001', '1002', '1003', '1004', '1005']
+
+        targets, missing = ph.long_term_targets(client, codes)
+
+        self.assertEqual(['1004', '1005', '1001', '1003'], targets)
+        self.assertEqual(2, missing)
+        self.assertEqual(['1004', '1005'], ph.long_term_targets(client, codes, limit=2)[0])
+
+
+class PregenerateLongTermTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.store = PriceStore(self.dir)
+        for patcher in (mock.patch.object(price_store, '_default', self.store),
+                        mock.patch('yfinance.download', side_effect=_download),
+                        mock.patch.object(ph, 'LONG_TERM_CHUNK', 2)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_saves_weekly_and_monthly(self):
+        client = _Client({})
+
+        counts = ph.pregenerate_long_term(client, ['1001', '9999', '1002'])
+
+        self.assertEqual({'targets': 3, 'missing_before': 3, 'saved': 2, 'no_data': 1,
+                          'bars_fetched': 1200}, counts)
+        saved = {p['company_code']: p for batch in client.upserts for p in batch}
+        weekly = ph.decode_ohlc(saved['1001']['weekly_10y'])
+        self.assertEqual(120, len(weekly['time']))   # 600営業日 = 120週
+        self.assertEqual(200.0, ph.decode_ohlc(saved['1001']['monthly_10y'])['close'][-1])
+        self.assertNotIn('weekly_10y', saved['9999'])
+        self.assertIsNotNone(self.store.get('1002', 'monthly_10y'))
+
+    def test_resumes_where_it_stopped(self):
+        client = _Client({})
+        codes = ['1001', '1002', '1003', '1004']
+        stops = iter([False, True])
+
+        first = ph.pregenerate_long_term(client, codes, should_stop=lambda: next(stops))
+        second = ph.pregenerate_long_term(client, codes)
+
+        self.assertEqual(2, first['saved'])
+        self.assertEqual({'targets': 2, 'missing_before': 2, 'saved': 2}, {
+            k: second[k] for k in ('targets', 'missing_before', 'saved')})
+        self.assertEqual(set(codes), set(client.stamps))
+
+    def test_failed_download_marks_nothing(self):
+        client = _Client({})
+        with mock.patch('yfinance.download', side_effect=RuntimeError('Too Many Requests')):
+            counts = ph.pregenerate_long_term(client, ['1001', '1002'])
+
+        self.assertEqual(0, counts['saved'])
+        self.assertEqual([], client.upserts)
+
+
+if __name__ == '__main__':
+    unittest.main()
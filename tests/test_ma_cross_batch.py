@@ -0,0 +1,73 @@
+"""全銘柄まとめての交差検出のリグレッション。
+
+calculate_for_all が通る道（build_pair_states で行列にまとめて状態を作り、
+pair_results で結果を出す）が、1銘柄ずつの detect_crosses と同じ結果を返すこと。
+本数の違う銘柄・短すぎる銘柄・欠損・値の動かない銘柄を混ぜて確かめる。
+"""
+
+import unittest
+
+import numpy as np
+
+import ma_cross
+import price_history as ph
+
+DAY = 86400
+START = 1735776000
+
+
+def _rows(closes):
+    return [{'time': START + i * DAY, 'close': c} for i, c in enumerate(closes)]
+
+
+def _universe(seed=11):
+    rng = np.random.default_rng(seed)
+    series = []
+    for i in range(60):
+        n = int(rng.integers(20, 260))
+        closes = np.round(1000 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 1).tolist()
+        if i % 7 == 0:
+            for j in rng.integers(0, n, 5):
+                closes[j] = None
+        series.append(_rows(closes))
+    series.append(_rows([500.0] * 120))                        # 値が動かない
+    series.append(_rows([100.0] * 40 + [101.0] * 40 + [99.0] * 40))
+    series.append(None)
+    series.append([])
+    return series
+
+
+EMPTY = {'crosses': [], 'latest_gc_date': None, 'latest_dc_date': None, 'cross_count': 0}
+
+
+def _batch(series, short=5, long=25):
+    """全銘柄まとめて組 (short, long) の結果を出す（日足が無い銘柄は空）"""
+    pairs = (('x', 'daily', short, long),)
+    return [ma_cross.pair_results(states, pairs=pairs)['x'] if states else EMPTY
+            for states in ma_cross.build_pair_states(series, pairs)]
+
+
+class BatchMatchesDetectCrossesTest(unittest.TestCase):
+    def test_matches_detect_crosses(self):
+        series = _universe()
+        batch = _batch(series)
+
+        self.assertEqual(len(series), len(batch))
+        for i, rows in enumerate(series):
+            self.assertEqual(ma_cross.detect_crosses(rows), batch[i], i)
+        self.assertTrue(sum(r['cross_count'] for r in batch))
+
+    def test_columnar_input_and_other_windows(self):
+        series = _universe(seed=3)
+        encoded = [ph.encode_ohlc(rows) if rows else rows for rows in series]
+        for short, long in ((5, 25), (13, 26)):
+            batch = _batch(encoded, short, long)
+            for i, rows in enumerate(series):
+                self.assertEqual(ma_cross.detect_crosses(rows, short, long), batch[i])
+
+    def test_all_too_short(self):
+        self.assertEqual([EMPTY], _batch([_rows([1.0] * 10)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+"""全銘柄のGC/DC計算をページごとに流す処理のリグレッション。
+
+price_history.iter_pages が company_code の順に上限なく読み、次のページを
+先に頼んでおくこと。ma_cross.calculate_for_all がページごとに保存・同期し、
+進み具合もページごとに報告すること。
+"""
+
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import ma_cross
+import price_history as ph
+
+DAY = 86400
+START = 1735776000
+
+
+def _daily(seed):
+    rng = np.random.default_rng(seed)
+    closes = np.round(1000 * np.exp(np.cumsum(rng.normal(0, 0.03, 120))), 1).tolist()
+    return ph.encode_ohlc([{'time': START + i * DAY, 'close': c} for i, c in enumerate(closes)])
+
+
+class _Result:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _FakeClient:
+    """stock_price_history（keyset で読む）と ma_crosses を持つ Supabase の代役"""
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda r: r['company_code'])
+        self.page_queries = []
+        self.upserts = []
+        self.rpc_rows = []
+        self.on_page_query = None
+
+    def rpc(self, name, params):
+        self.rpc_rows.extend(params['p_rows'])
+        n = len(params['p_rows'])
+        return mock.Mock(execute=lambda: _Result({'matched': n, 'changed': n}))
+
+    def table(self, name):
+        client = self
+
+        class _Query:
+            after = None
+            size = None
+            codes = None
+            counting = False
+            payload = None
+
+            def select(self, columns, count=None):
+                self.counting = count == 'exact'
+                return self
+
+            def order(self, column):
+                return self
+
+            def gt(self, column, value):
+                self.after = value
+                return self
+
+            def limit(self, size):
+                self.size = size
+                return self
+
+            def in_(self, column, codes):
+                self.codes = codes
+                return self
+
+            def upsert(self, payload):
+                self.payload = payload
+                return self
+
+            def execute(self):
+                if self.payload is not None:
+                    client.upserts.append([p['company_code'] for p in self.payload])
+                    return _Result([])
+                if name == 'ma_crosses':
+                    return _Result([])
+                if self.counting:
+                    return _Result([], count=len(client.rows))
+                client.page_queries.append(self.after)
+                if client.on_page_query:
+                    client.on_page_query(self.after)
+                rows = [r for r in client.rows
+                        if self.after is None or r['company_code'] > self.after]
+                return _Result(rows[:self.size])
+
+        return _Query()
+
+
+class IterPagesTest(unittest.TestCase):
+    def test_keyset_without_page_cap(self):
+        client = _FakeClient([{'company_code': f'{i:04d}'} for i in range(2500)])
+
+        pages = list(ph.iter_pages(client, page_size=100))
+
+        self.assertEqual(25, len(pages))   # 旧実装の20ページ上限を超えても読む
+        codes = [r['company_code'] for page in pages for r in page]
+        self.assertEqual([r['company_code'] for r in client.rows], codes)
+        self.assertEqual([None, '0099', '0199'], client.page_queries[:3])
+
+    def test_next_page_is_fetched_while_processing(self):
+        client = _FakeClient([{'company_code': f'{i:04d}'} for i in range(250)])
+        second_requested = threading.Event()
+        client.on_page_query = lambda after: after == '0099' and second_requested.set()
+
+        pages = ph.iter_pages(client, page_size=100, prepare=len)
+        rows, prepared = next(pages)
+
+        # 1ページ目を処理している間に、2ページ目が頼まれている
+        self.assertTrue(second_requested.wait(5))
+        self.assertEqual(100, prepared)
+        self.assertEqual([100, 50], [len(r) for r, _ in pages])
+
+    def test_close_in_the_middle(self):
+        client = _FakeClient([{'company_code': f'{i:04d}'} for i in range(1000)])
+        pages = ph.iter_pages(client, page_size=100)
+        next(pages)
+        pages.close()
+        self.assertLessEqual(len(client.page_queries), 2)
+
+
+class CalculateForAllPagesTest(unittest.TestCase):
+    def setUp(self):
+        for patcher in (mock.patch.object(ma_cross, 'BATCH_SIZE', 3),
+                        mock.patch.object(ma_cross, '_missing_columns', set()),
+                        mock.patch.object(ma_cross, '_sync_function_missing', False)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _client(self):
+        rows = [{'company_code': f'{1000 + i}', 'daily_1y': _daily(i)} for i in range(7)]
+        rows.append({'company_code': '2000', 'daily_1y': None})
+        return _FakeClient(rows)
+
+    def test_saves_and_reports_per_page(self):
+        client = self._client()
+        reports = []
+
+        result = ma_cross.calculate_for_all(progress=lambda **kw: reports.append(kw),
+                                            client=client)
+
+        self.assertEqual([{'done': 3, 'total': 8, 'saved': 3},
+                          {'done': 6, 'total': 8, 'saved': 6},
+                          {'done': 8, 'total': 8, 'saved': 7}], reports)
+        self.assertEqual([['1000', '1001', '1002'], ['1003', '1004', '1005'], ['1006']],
+                         client.upserts)
+        self.assertEqual({'total': 8, 'saved': 7, 'skipped': 1, 'rebuilt': 8},
+                         {k: result[k] for k in ('total', 'saved', 'skipped', 'rebuilt')})
+        self.assertEqual(7, result['sync']['changed'])
+        self.assertEqual(7, len(client.rpc_rows))
+
+    def test_stop_between_pages(self):
+        client = self._client()
+        stops = iter([False, True])
+
+        result = ma_cross.calculate_for_all(should_stop=lambda: next(stops), client=client)
+
+        self.assertEqual(3, result['total'])
+        self.assertEqual([['1000', '1001', '1002']], client.upserts)
+
+
+if __name__ == '__main__':
+    unittest.main()
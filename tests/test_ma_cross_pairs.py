@@ -0,0 +1,107 @@
+"""移動平均の組（ma_cross.MA_PAIRS）をまとめて計算する処理のリグレッション。
+
+組ごとの状態が、日足・週足それぞれで1組ずつ作った状態と一致すること。
+窓の合計を日数ごとに1回しか作らないこと。週足の組では、場中の株価を
+その週の足として扱うこと。
+"""
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import ma_cross
+import price_history as ph
+
+DAY = 86400
+START = 1735776000   # 2025-01-02（木）
+
+
+def _daily(n=245, seed=8):
+    rng = np.random.default_rng(seed)
+    closes = np.round(1000 * np.exp(np.cumsum(rng.normal(0, 0.03, n))), 1)
+    # 土日を飛ばした営業日
+    days = [d for d in range(n * 2) if (d + 3) % 7 < 5][:n]
+    return {'time': START + np.array(days, dtype=np.int64) * DAY, 'close': closes}
+
+
+def _weekly(daily):
+    """price_history.resample_ohlc で作った週足（比べる相手）"""
+    c = daily['close']
+    return ph.resample_ohlc({'time': daily['time'], 'open': c, 'high': c, 'low': c,
+                             'close': c}, 'weekly')
+
+
+def _bar_by_bar(bars, short, long):
+    """1本ずつ進めて作った状態（比べる相手）"""
+    t, c = ma_cross._closes_of(bars)
+    return ma_cross._state_from(t.tolist(), c.tolist(), short, long)
+
+
+class PairStatesTest(unittest.TestCase):
+    def test_each_pair_matches_single_pair_build(self):
+        series = [_daily(), _daily(90, seed=1), _daily(3, seed=2), None]
+        built = ma_cross.build_pair_states(series)
+
+        for daily, states in zip(series, built):
+            if daily is None:
+                self.assertIsNone(states)
+                continue
+            self.assertEqual({key for key, _, _, _ in ma_cross.MA_PAIRS}, set(states))
+            for key, kind, short, long in ma_cross.MA_PAIRS:
+                bars = _weekly(daily) if kind == 'weekly' else daily
+                self.assertEqual(_bar_by_bar(bars, short, long), states[key], key)
+
+        results = ma_cross.pair_results(built[0])
+        self.assertEqual(ma_cross.detect_crosses(_weekly(series[0]), 13, 26), results['w13_26'])
+        self.assertEqual(ma_cross.detect_crosses(series[0], 25, 75), results['d25_75'])
+
+    def test_window_sums_are_shared(self):
+        real = ma_cross._window_means
+        with mock.patch.object(ma_cross, '_window_means', side_effect=real) as means:
+            ma_cross.build_pair_states([_daily()])
+        # 日足 5・25・75 と週足 13・26。25 は 5/25 と 25/75 で使い回す
+        self.assertEqual([5, 25, 75, 13, 26], [c.args[1] for c in means.call_args_list])
+
+    def test_advance_day_by_day(self):
+        daily = _daily()
+        head = {k: v[:120] for k, v in daily.items()}
+        states = ma_cross.build_pair_states([head])[0]
+        for n in range(121, len(daily['time']) + 1):
+            states, rebuilt = ma_cross.sync_pair_states(
+                states, {k: v[:n] for k, v in daily.items()})
+            self.assertFalse(rebuilt, n)
+        self.assertEqual(ma_cross.build_pair_states([daily])[0], states)
+
+    def test_new_pair_rebuilds(self):
+        daily = _daily()
+        legacy = _bar_by_bar(daily, 5, 25)   # 組が1つだった頃の ma_state
+
+        stored = ma_cross.stored_pair_states(legacy)
+        self.assertEqual({'d5_25': legacy}, stored)
+        self.assertIsNone(ma_cross.advance_pair_states(stored, daily))
+        self.assertEqual((ma_cross.build_pair_states([daily])[0], True),
+                         ma_cross.sync_pair_states(stored, daily))
+
+    def test_quote_in_the_same_week(self):
+        daily = _daily()
+        states = ma_cross.build_pair_states([daily])[0]
+        t, c = int(daily['time'][-1]), float(daily['close'][-1])
+
+        moved = dict(daily, close=daily['close'].copy())
+        moved['close'][-1] = c * 1.8
+        results = ma_cross.pair_results(states, (t, c * 1.8))
+        expected = ma_cross.pair_results(ma_cross.build_pair_states([moved])[0])
+        self.assertEqual(expected, results)
+
+    def test_summary(self):
+        results = ma_cross.pair_results(ma_cross.build_pair_states([_daily()])[0])
+        summary = ma_cross.pair_summary(results)
+        for key, r in results.items():
+            last = r['crosses'][-1]['type'] if r['crosses'] else None
+            self.assertEqual({'state': last, 'gc_date': r['latest_gc_date'],
+                              'dc_date': r['latest_dc_date']}, summary[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
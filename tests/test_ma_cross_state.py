@@ -0,0 +1,224 @@
+"""GC/DCの途中状態（ma_cross.ma_state）を1本ずつ進める処理のリグレッション。
+
+増えた足の分だけ進めた状態が、頭から作った状態・detect_crosses と一致すること。
+日足が書き換わったときだけ作り直すこと。場中の株価を仮の足として判定できること。
+"""
+
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import ma_cross
+
+DAY = 86400
+START = 1735776000
+
+
+def _daily(n=220, seed=4):
+    rng = np.random.default_rng(seed)
+    closes = np.round(1000 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 1)
+    return {'time': START + np.arange(n, dtype=np.int64) * DAY, 'close': closes}
+
+
+def _head(daily, n):
+    return {'time': daily['time'][:n], 'close': daily['close'][:n]}
+
+
+# 5/25日の組だけを計算する（組の作り方は test_ma_cross_pairs で見る）
+PAIR = (('d5_25', 'daily', 5, 25),)
+
+
+def _build(daily, pairs=PAIR):
+    """calculate_for_all と同じ build_pair_states で、頭から状態を作る"""
+    return ma_cross.build_pair_states([daily], pairs)[0]
+
+
+def _bar_by_bar(daily, short=5, long=25):
+    """1本ずつ進めて作った状態（行列でまとめて作る build_pair_states と比べる相手）"""
+    if daily is None:
+        return None
+    t, c = ma_cross._closes_of(daily)
+    return {'d5_25': ma_cross._state_from(t.tolist(), c.tolist(), short, long)}
+
+
+class StateTest(unittest.TestCase):
+    def setUp(self):
+        self.daily = _daily()
+
+    def test_advancing_bar_by_bar_matches_full_build(self):
+        states = _build(_head(self.daily, 30))
+        for n in range(31, len(self.daily['time']) + 1):
+            # 保存して読み直した状態（JSONB）からでも進められる
+            states = json.loads(json.dumps(states))
+            states, rebuilt = ma_cross.sync_pair_states(states, _head(self.daily, n), PAIR)
+            self.assertFalse(rebuilt, n)
+
+        self.assertEqual(_build(self.daily), states)
+        result = ma_cross.pair_results(states, pairs=PAIR)['d5_25']
+        self.assertEqual(ma_cross.detect_crosses(self.daily), result)
+        self.assertTrue(result['cross_count'])
+
+    def test_batch_build_matches_bar_by_bar(self):
+        series = [_daily(n, seed) for seed, n in enumerate((220, 60, 27, 26, 5, 1))]
+        series.append(None)
+        series[1]['close'][10] = np.nan
+
+        built = ma_cross.build_pair_states(series, PAIR)
+
+        for daily, states in zip(series, built):
+            self.assertEqual(_bar_by_bar(daily), states)
+        self.assertEqual(ma_cross.detect_crosses(series[0]),
+                         ma_cross.pair_results(built[0], pairs=PAIR)['d5_25'])
+
+    def test_rewritten_bars_rebuild(self):
+        states = _build(_head(self.daily, 200))
+        adjusted = {'time': self.daily['time'], 'close': self.daily['close'] / 2}   # 分割の調整
+
+        synced, rebuilt = ma_cross.sync_pair_states(states, adjusted, PAIR)
+
+        self.assertTrue(rebuilt)
+        self.assertEqual(_build(adjusted), synced)
+
+    def test_other_windows_rebuild(self):
+        other = (('d5_25', 'daily', 13, 26),)
+        states = _build(self.daily, other)
+        _, rebuilt = ma_cross.sync_pair_states(states, self.daily, PAIR)
+        self.assertTrue(rebuilt)
+        self.assertFalse(ma_cross.sync_pair_states(states, self.daily, other)[1])
+
+    def test_quote_as_todays_bar(self):
+        state = _build(_head(self.daily, 150))['d5_25']
+        t, c = int(self.daily['time'][149]), float(self.daily['close'][149])
+
+        # 保存済みの最後の足と同じ日 → その足を株価で置き換える
+        self.assertEqual(ma_cross.state_result(state), ma_cross.state_result(state, (t, c)))
+        moved = dict(self.daily, close=self.daily['close'].copy())
+        moved['close'][149] = c * 1.5
+        self.assertEqual(ma_cross.detect_crosses(_head(moved, 150)),
+                         ma_cross.state_result(state, (t, c * 1.5)))
+
+        # 翌日の株価 → 最後の足に続けて足す
+        nxt = (t + DAY, float(self.daily['close'][150]))
+        self.assertEqual(ma_cross.detect_crosses(_head(self.daily, 151)),
+                         ma_cross.state_result(state, nxt))
+        # 保存済みより古い株価は使わない
+        self.assertEqual(ma_cross.state_result(state),
+                         ma_cross.state_result(state, (t - DAY, c * 3)))
+
+    def test_quote_matches_bar_by_date(self):
+        """日足が JST 0時（fetch_ohlc）・株価が UTC 0時（fetch_prices_batch）でも、
+        同じ日の株価はその日の足の置き換えとして扱う（逆の組み合わせも）。"""
+        jst = {'time': self.daily['time'] - 9 * 3600, 'close': self.daily['close']}
+        for bars, offset in ((jst, 9 * 3600), (self.daily, -9 * 3600)):
+            state = _build(_head(bars, 150))['d5_25']
+            t = int(bars['time'][149]) + offset
+            c = float(bars['close'][149])
+
+            self.assertEqual(ma_cross.state_result(state), ma_cross.state_result(state, (t, c)))
+            moved = dict(bars, close=bars['close'].copy())
+            moved['close'][149] = c * 1.5
+            self.assertEqual(ma_cross.detect_crosses(_head(moved, 150)),
+                             ma_cross.state_result(state, (t, c * 1.5)))
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.payload = None
+        self.codes = []
+
+    def select(self, columns):
+        if 'ma_state' in columns and self.client.no_state_column:
+            raise Exception('column ma_crosses.ma_state does not exist')
+        return self
+
+    def in_(self, _column, codes):
+        self.client.requested.extend(codes)
+        self.codes = codes
+        return self
+
+    def upsert(self, payload):
+        self.payload = ('upsert', payload)
+        return self
+
+    def execute(self):
+        if self.payload and self.payload[0] == 'upsert':
+            self.client.upserts.extend(self.payload[1])
+        if self.payload is not None:
+            return _Result([])
+        return _Result([r for r in self.client.rows if r['company_code'] in self.codes])
+
+
+class _FakeClient:
+    def __init__(self, rows, no_state_column=False):
+        self.rows = rows
+        self.no_state_column = no_state_column
+        self.upserts = []
+        self.requested = []
+
+    def table(self, name):
+        return _Query(self, name)
+
+
+class RefreshIntradayTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ma_cross, '_missing_columns', set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _row(self, code, daily):
+        """夜間に保存したときの行（load_states が読む形）"""
+        states = ma_cross.build_pair_states([daily])[0]
+        results = ma_cross.pair_results(states)
+        row = {'company_code': code, 'ma_state': states,
+               'latest_gc_date': results['d5_25']['latest_gc_date'],
+               'latest_dc_date': results['d5_25']['latest_dc_date']}
+        for key, result in results.items():
+            row[f'{key}_gc'] = result['latest_gc_date']
+            row[f'{key}_dc'] = result['latest_dc_date']
+        return row
+
+    def test_writes_only_changed_stocks(self):
+        daily = _daily()
+        # 最後の足に向けて下げ続け、5日線が25日線の下にいる銘柄
+        falling = {'time': daily['time'][:60],
+                   'close': np.concatenate([np.full(30, 1000.0), np.linspace(1000, 700, 30)])}
+        client = _FakeClient([self._row('1001', falling), self._row('1002', daily)])
+        t = int(falling['time'][-1])
+
+        with mock.patch.object(ma_cross, 'sync_gc_to_screened') as sync:
+            counts = ma_cross.refresh_intraday(client, {
+                '1001': (t + DAY, 2000.0),                                   # 急騰でGC
+                '1002': (int(daily['time'][-1]), float(daily['close'][-1])),  # 変化なし
+                '9999': (t, 100.0),                                          # 状態が無い
+            })
+
+        self.assertEqual(2, counts['checked'])
+        self.assertEqual(1, counts['changed'])
+        self.assertEqual(['1001'], [p['company_code'] for p in client.upserts])
+        self.assertEqual(ma_cross._to_date(t + DAY), client.upserts[0]['latest_gc_date'])
+        self.assertNotIn('ma_state', client.upserts[0])   # 状態は夜間に確定した足で進める
+        self.assertEqual(ma_cross._to_date(t + DAY),
+                         client.upserts[0]['pairs']['d5_25']['latest_gc_date'])
+        self.assertEqual(client.upserts, sync.call_args[0][1])
+        # 状態は株価のある銘柄の分だけ読む
+        self.assertEqual(['1001', '1002', '9999'], sorted(client.requested))
+
+    def test_missing_state_column(self):
+        client = _FakeClient([], no_state_column=True)
+        with mock.patch('builtins.print'):
+            counts = ma_cross.refresh_intraday(client, {'1001': (START, 1.0)})
+        self.assertEqual(0, counts['checked'])
+        self.assertIn('ma_state', ma_cross._missing_columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+"""GC/DC日の screened_latest への同期（ma_cross.sync_gc_to_screened）のリグレッション。
+
+sync_gc_dates（Postgres 関数）があれば SYNC_CHUNK 件ずつまとめて渡すこと。
+関数が無ければ、今の値を読んで変わった銘柄だけを1件ずつ更新すること。
+"""
+
+import unittest
+from unittest import mock
+
+import ma_cross
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _FakeClient:
+    """screened_latest の gc_date / dc_date だけを持つ Supabase の代役"""
+
+    def __init__(self, rows, has_function=True, broken=()):
+        self.rows = {r['company_code']: dict(r) for r in rows}
+        self.has_function = has_function
+        self.broken = set(broken)
+        self.rpc_calls = []
+        self.updates = []
+
+    def rpc(self, name, params):
+        client = self
+
+        class _Call:
+            def execute(self):
+                if not client.has_function:
+                    raise Exception(f'Could not find the function public.{name}(p_rows)')
+                client.rpc_calls.append(params['p_rows'])
+                matched = changed = 0
+                for p in params['p_rows']:
+                    row = client.rows.get(p['company_code'])
+                    if row is None:
+                        continue
+                    matched += 1
+                    if (row['gc_date'], row['dc_date']) != (p['gc_date'], p['dc_date']):
+                        row.update(gc_date=p['gc_date'], dc_date=p['dc_date'])
+                        changed += 1
+                return _Result({'matched': matched, 'changed': changed})
+
+        return _Call()
+
+    def table(self, name):
+        client = self
+
+        class _Query:
+            payload = None
+
+            def select(self, columns):
+                return self
+
+            def in_(self, column, codes):
+                self.codes = codes
+                return self
+
+            def update(self, payload):
+                self.payload = payload
+                return self
+
+            def eq(self, column, code):
+                self.code = code
+                return self
+
+            def execute(self):
+                if self.payload is None:
+                    return _Result([client.rows[c] for c in self.codes if c in client.rows])
+                if self.code in client.broken:
+                    raise Exception('timeout')
+                client.updates.append(self.code)
+                client.rows[self.code].update(self.payload)
+                return _Result([])
+
+        return _Query()
+
+
+def _screened():
+    return [{'company_code': '1001', 'gc_date': '2026-05-01', 'dc_date': None},
+            {'company_code': '1002', 'gc_date': '2026-04-01', 'dc_date': '2026-03-01'},
+            {'company_code': '1003', 'gc_date': None, 'dc_date': None}]
+
+
+def _payloads():
+    return [{'company_code': '1001', 'latest_gc_date': '2026-05-01', 'latest_dc_date': None},
+            {'company_code': '1002', 'latest_gc_date': '2026-04-01',
+             'latest_dc_date': '2026-06-02'},
+            {'company_code': '1003', 'latest_gc_date': '2026-06-01T00:00:00',
+             'latest_dc_date': None},
+            {'company_code': '9999', 'latest_gc_date': '2026-06-01', 'latest_dc_date': None}]
+
+
+class SyncGcToScreenedTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(ma_cross, '_sync_function_missing', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_function_in_chunks(self):
+        client = _FakeClient(_screened())
+        with mock.patch.object(ma_cross, 'SYNC_CHUNK', 3):
+            counts = ma_cross.sync_gc_to_screened(client, _payloads())
+
+        self.assertEqual({'changed': 2, 'unchanged': 1, 'failed': 0, 'missing': 1}, counts)
+        self.assertEqual([3, 1], [len(c) for c in client.rpc_calls])
+        self.assertEqual([], client.updates)
+        self.assertEqual('2026-06-01', client.rows['1003']['gc_date'])
+
+    def test_falls_back_to_changed_rows_only(self):
+        client = _FakeClient(_screened(), has_function=False, broken={'1003'})
+        with mock.patch('builtins.print'):
+            counts = ma_cross.sync_gc_to_screened(client, _payloads())
+            again = ma_cross.sync_gc_to_screened(client, _payloads()[:2])
+
+        self.assertEqual({'changed': 1, 'unchanged': 1, 'failed': 1, 'missing': 1}, counts)
+        self.assertEqual(['1002'], client.updates)
+        self.assertEqual('2026-06-02', client.rows['1002']['dc_date'])
+        # 関数が無いと分かったら、次からは呼ばない
+        self.assertTrue(ma_cross._sync_function_missing)
+        self.assertEqual({'changed': 0, 'unchanged': 2, 'failed': 0, 'missing': 0}, again)
+
+    def test_pair_summary_goes_to_ma_pairs(self):
+        client = _FakeClient(_screened())
+        result = {'latest_gc_date': '2026-06-01', 'latest_dc_date': None, 'cross_count': 1,
+                  'crosses': [{'date': '2026-06-01', 'type': 'gc'}]}
+        payload = dict(_payloads()[2], pairs={'d5_25': result, 'd25_75': result})
+
+        ma_cross.sync_gc_to_screened(client, [payload, _payloads()[0]])
+
+        sent = {r['company_code']: r for r in client.rpc_calls[0]}
+        self.assertEqual({'state': 'gc', 'gc_date': '2026-06-01', 'dc_date': None},
+                         sent['1003']['ma_pairs']['d25_75'])
+        self.assertNotIn('ma_pairs', sent['1001'])   # 組の結果が無い行は今の値を残す
+
+    def test_nothing_to_sync(self):
+        client = _FakeClient([])
+        self.assertEqual({'changed': 0, 'unchanged': 0, 'failed': 0, 'missing': 0},
+                         ma_cross.sync_gc_to_screened(client, []))
+        self.assertEqual([], client.rpc_calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
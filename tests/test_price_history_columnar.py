@@ -0,0 +1,98 @@
+"""株価履歴の列ごとの保存形式（encode_ohlc / decode_ohlc）のリグレッション。
+
+移行中は行の配列と列の形が混ざるので、読む側はどちらでも同じ結果になること。
+"""
+
+import json
+import math
+import unittest
+
+import numpy as np
+
+import ma_cross
+import price_history as ph
+import simulator
+from trend_stats import trend_from_daily
+
+DAY = 86400
+START = 1735776000   # 2025-01-02 00:00 UTC
+
+
+def _rows(n=60):
+    rows = []
+    for i in range(n):
+        close = round(1000 + 40 * math.sin(i / 6), 1)   # 東証の呼値に近い桁
+        rows.append({'time': START + i * DAY, 'open': close - 3, 'high': close + 5,
+                     'low': close - 7, 'close': close})
+    return rows
+
+
+class EncodeDecodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        rows = _rows()
+        encoded = ph.encode_ohlc(rows)
+
+        self.assertEqual(ph.OHLC_FORMAT_VERSION, encoded['v'])
+        self.assertEqual(rows, ph.to_rows(encoded))
+        self.assertEqual(rows, ph.to_rows(json.dumps(encoded)))
+        # 保存するのは JSON なので、ひと回りしても変わらない
+        self.assertEqual(encoded, json.loads(json.dumps(encoded)))
+
+    def test_smaller_than_rows(self):
+        rows = _rows(244)
+        self.assertLess(len(json.dumps(ph.encode_ohlc(rows))), len(json.dumps(rows)) * 0.6)
+
+    def test_decode_reads_both_formats(self):
+        rows = _rows()
+        legacy = ph.decode_ohlc(rows)
+        columnar = ph.decode_ohlc(ph.encode_ohlc(rows))
+
+        self.assertEqual(np.int64, columnar['time'].dtype)
+        for name in ('time', 'open', 'high', 'low', 'close'):
+            np.testing.assert_array_equal(legacy[name], columnar[name])
+
+    def test_missing_values_become_nan_and_order_is_fixed(self):
+        rows = _rows(5)
+        rows[2]['open'] = None
+        rows.reverse()
+
+        decoded = ph.decode_ohlc(ph.encode_ohlc(rows))
+
+        self.assertTrue(np.all(np.diff(decoded['time']) > 0))
+        self.assertTrue(math.isnan(decoded['open'][2]))
+        self.assertIsNone(ph.to_rows(ph.encode_ohlc(rows))[2]['open'])
+
+    def test_unsorted_legacy_rows_are_sorted(self):
+        decoded = ph.decode_ohlc(list(reversed(_rows(5))))
+        self.assertTrue(np.all(np.diff(decoded['time']) > 0))
+
+    def test_empty_and_broken(self):
+        for value in (None, [], 'not json', {}):
+            self.assertEqual(0, len(ph.decode_ohlc(value)['time']))
+        self.assertEqual([], ph.to_rows(None))
+
+    def test_encode_is_idempotent(self):
+        encoded = ph.encode_ohlc(_rows())
+        self.assertIs(encoded, ph.encode_ohlc(encoded))
+
+
+class ReadersAcceptBothFormatsTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = _rows()
+        self.encoded = ph.encode_ohlc(self.rows)
+
+    def test_ma_cross(self):
+        self.assertEqual(ma_cross.detect_crosses(self.rows),
+                         ma_cross.detect_crosses(self.encoded))
+        self.assertTrue(ma_cross.detect_crosses(self.encoded)['cross_count'])
+
+    def test_simulator(self):
+        self.assertEqual(simulator.normalize_series(self.rows),
+                         simulator.normalize_series(self.encoded))
+
+    def test_trend(self):
+        self.assertEqual(trend_from_daily(self.rows), trend_from_daily(self.encoded))
+
+
+if __name__ == '__main__':
+    unittest.main()
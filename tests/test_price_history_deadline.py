@@ -89,7 +89,7 @@ class TestRefreshInBackground(unittest.TestCase):
         ph._refresh_in_background('test:err', boom)
         time.sleep(0.2)
         # ここまで例外が漏れてこなければよい
-        self.assertNotIn('test:err', ph._refreshing)
+        self.assertNotIn('test:err', ph._refresher.active)
 
 
 if __name__ == '__main__':
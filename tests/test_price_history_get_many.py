@@ -0,0 +1,108 @@
+"""株価履歴の列を選んだ読み出し（get_series / get_many）のリグレッション。"""
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import price_history as ph
+import price_store
+from price_store import PriceStore
+
+DAY = 86400
+START = 1735776000
+
+
+def _rows(n, base=1000.0):
+    return [{'time': START + i * DAY, 'open': base + i, 'high': base + i + 5,
+             'low': base + i - 5, 'close': base + i + 1} for i in range(n)]
+
+
+class _Client:
+    """in_ / eq に渡された銘柄の行だけを返す Supabase の代役"""
+
+    def __init__(self, rows):
+        self.rows = {r['company_code']: r for r in rows}
+        self.queries = []
+
+    def table(self, name):
+        client = self
+
+        class _Query:
+            def select(self, columns):
+                self.columns = [c.strip() for c in columns.split(',')]
+                return self
+
+            def in_(self, column, codes):
+                self.codes = list(codes)
+                return self
+
+            def execute(self):
+                client.queries.append((self.columns, self.codes))
+                data = [{c: client.rows[code].get(c) for c in self.columns}
+                        for code in self.codes if code in client.rows]
+                return mock.Mock(data=data)
+
+        return _Query()
+
+
+class GetManyTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = PriceStore(self.dir)
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.client = _Client([
+            {'company_code': str(1300 + i), 'daily_1y': ph.encode_ohlc(_rows(5, 100.0 * i)),
+             'weekly_10y': ph.encode_ohlc(_rows(3)), 'monthly_10y': None,
+             'daily_updated_at': '2026-10-01T00:00:00+00:00',
+             'long_term_updated_at': None}
+            for i in range(7)])
+        for patcher in (mock.patch.object(price_store, '_default', self.store),
+                        mock.patch('supabase_client.get_supabase_client',
+                                   return_value=self.client),
+                        mock.patch.object(self.store, 'rebuild_in_background')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reads_only_the_requested_series_in_chunks(self):
+        codes = [str(1300 + i) for i in range(7)] + ['9999']
+
+        found = ph.get_many(codes, 'daily_1y', chunk_size=3)
+
+        self.assertEqual(3, len(self.client.queries))
+        for columns, chunk in self.client.queries:
+            self.assertEqual(['company_code', 'daily_1y', 'daily_updated_at'], columns)
+            self.assertLessEqual(len(chunk), 3)
+        self.assertEqual(set(codes) - {'9999'}, set(found))
+        columns, updated_at = found['1302']
+        self.assertEqual(_rows(5, 200.0), ph.columns_to_rows(columns))
+        self.assertEqual('2026-10-01T00:00:00+00:00', updated_at)
+
+    def test_second_read_is_served_locally(self):
+        ph.get_many(['1300', '1301'], 'daily_1y')
+        found = ph.get_many(['1300', '1301', '1302'], 'daily_1y')
+
+        self.assertEqual(['1302'], self.client.queries[-1][1])
+        self.assertEqual(3, len(found))
+
+    def test_null_series_is_empty_columns(self):
+        columns, updated_at = ph.get_series('1300', 'monthly_10y')
+
+        self.assertEqual(0, len(columns['time']))
+        self.assertIsNone(updated_at)
+        self.assertIsNone(ph.get_series('9999', 'monthly_10y'))
+
+    def test_get_daily_uses_only_the_daily_column(self):
+        with mock.patch.object(ph, '_refresh_in_background'):
+            rows = ph.get_daily('1301')
+
+        self.assertEqual(_rows(5, 100.0), rows)
+        self.assertNotIn('weekly_10y', self.client.queries[0][0])
+
+    def test_unknown_series(self):
+        with self.assertRaises(ValueError):
+            ph.get_many(['1300'], 'hourly')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+"""日足の差分更新（price_history.merge_daily / refresh_daily_chunk）のリグレッション。
+
+Yahoo には触らない。fetch_ohlc_batch を差し替えて、どの期間で何を取りに
+行ったかと、継ぎ足した結果だけを見る。
+"""
+
+import unittest
+from unittest import mock
+
+import price_history as ph
+
+DAY = 86400
+START = 1735776000   # 2025-01-02 00:00 UTC
+
+
+def _bars(first, n, close=1000.0, step=1.0):
+    return [{'time': START + (first + i) * DAY, 'open': close + step * (first + i),
+             'high': close + step * (first + i) + 5, 'low': close + step * (first + i) - 5,
+             'close': close + step * (first + i)} for i in range(n)]
+
+
+class MergeDailyTest(unittest.TestCase):
+    def test_appends_after_overlap(self):
+        stored = ph.encode_ohlc(_bars(0, 100))
+        fresh = _bars(98, 5)   # 最後から2本目から後ろ
+
+        merged = ph.merge_daily(stored, fresh)
+
+        self.assertEqual(_bars(0, 103), merged)
+
+    def test_last_stored_bar_is_overwritten(self):
+        """場中に保存された最後の1本は、確認に使わず新しい値で置き換える。"""
+        stored_rows = _bars(0, 10)
+        stored_rows[-1] = dict(stored_rows[-1], close=1.0)
+        fresh = _bars(8, 3)
+
+        merged = ph.merge_daily(stored_rows, fresh)
+
+        self.assertEqual(fresh[1]['close'], merged[9]['close'])
+
+    def test_adjusted_history_is_rejected(self):
+        """分割で過去の終値が変わっていたら継ぎ足さない。"""
+        stored = ph.encode_ohlc(_bars(0, 10))
+        fresh = _bars(8, 3, close=500.0, step=0.5)
+
+        self.assertIsNone(ph.merge_daily(stored, fresh))
+
+    def test_missing_overlap_is_rejected(self):
+        stored = ph.encode_ohlc(_bars(0, 10))
+        self.assertIsNone(ph.merge_daily(stored, _bars(20, 3)))
+        self.assertIsNone(ph.merge_daily(stored, []))
+        self.assertIsNone(ph.merge_daily(_bars(0, 1), _bars(0, 3)))
+
+    def test_overlap_is_matched_by_date(self):
+        """画面から取った日足（JST 0時）にも、夜間の足（UTC 0時）を継ぎ足せる。"""
+        stored = [dict(r, time=r['time'] - 9 * 3600) for r in _bars(0, 100)]
+        fresh = _bars(98, 5)
+
+        merged = ph.merge_daily(ph.encode_ohlc(stored), fresh)
+
+        self.assertEqual(stored[:98] + fresh, merged)
+
+    def test_trimmed_to_window(self):
+        stored = _bars(0, 366)
+        merged = ph.merge_daily(stored, _bars(364, 10))
+
+        self.assertEqual(START + 373 * DAY, merged[-1]['time'])
+        self.assertGreater(merged[0]['time'], merged[-1]['time'] - ph.DAILY_WINDOW_SECONDS)
+
+
+class IncrementalPeriodTest(unittest.TestCase):
+    def test_shortest_period_that_covers_gap(self):
+        now = START + 100 * DAY
+        self.assertEqual('5d', ph.incremental_period(now - 2 * DAY, now))
+        self.assertEqual('1mo', ph.incremental_period(now - 10 * DAY, now))
+        self.assertEqual('6mo', ph.incremental_period(now - 150 * DAY, now))
+        self.assertIsNone(ph.incremental_period(now - 200 * DAY, now))
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Table:
+    def __init__(self, client):
+        self.client = client
+        self._payload = None
+
+    def select(self, *_args):
+        return self
+
+    def in_(self, _column, _codes):
+        return self
+
+    def upsert(self, payload):
+        self._payload = payload
+        return self
+
+    def execute(self):
+        if self._payload is not None:
+            self.client.saved.extend(self._payload)
+            return _Result([])
+        return _Result([{'company_code': c, 'daily_1y': v} for c, v in self.client.stored.items()])
+
+
+class _Client:
+    def __init__(self, stored):
+        self.stored = stored
+        self.saved = []
+
+    def table(self, _name):
+        return _Table(self)
+
+
+class RefreshDailyChunkTest(unittest.TestCase):
+    def setUp(self):
+        self.now = START + 101 * DAY
+        self.client = _Client({
+            '7203': ph.encode_ohlc(_bars(0, 100)),
+            '6758': ph.encode_ohlc(_bars(0, 100)),   # 分割があった銘柄
+        })
+        self.calls = []
+
+    def _fake_batch(self, codes, period='1y', chunk_size=100):
+        self.calls.append((period, sorted(codes)))
+        out = {}
+        for code in codes:
+            if period == '1y':
+                out[code] = _bars(0, 102)
+            elif code == '6758':
+                out[code] = _bars(98, 4, close=500.0, step=0.5)
+            else:
+                out[code] = _bars(98, 4)
+        return out
+
+    def test_fetches_tail_and_falls_back_per_stock(self):
+        with mock.patch.object(ph, 'fetch_ohlc_batch', side_effect=self._fake_batch):
+            counts = ph.refresh_daily_chunk(self.client, ['7203', '6758', '9984'],
+                                            now_ts=self.now)
+
+        self.assertEqual([('5d', ['6758', '7203']), ('1y', ['9984']), ('1y', ['6758'])],
+                         self.calls)
+        self.assertEqual({'saved': 3, 'incremental': 1, 'full': 2}, {
+            k: counts[k] for k in ('saved', 'incremental', 'full')})
+        saved = {p['company_code']: ph.to_rows(p['daily_1y']) for p in self.client.saved}
+        self.assertEqual(_bars(0, 102), saved['7203'])
+        self.assertEqual(_bars(0, 102), saved['6758'])
+
+    def test_stored_rows_of_other_origin_stay_incremental(self):
+        self.client.stored['7203'] = ph.encode_ohlc(
+            [dict(r, time=r['time'] - 9 * 3600) for r in _bars(0, 100)])
+        with mock.patch.object(ph, 'fetch_ohlc_batch', side_effect=self._fake_batch):
+            counts = ph.refresh_daily_chunk(self.client, ['7203'], now_ts=self.now)
+
+        self.assertEqual([('5d', ['7203'])], self.calls)
+        self.assertEqual(1, counts['incremental'])
+        saved = ph.to_rows(self.client.saved[0]['daily_1y'])
+        self.assertEqual(102, len(saved))
+        self.assertEqual(_bars(98, 4), saved[-4:])
+
+    def test_full_mode_skips_stored_rows(self):
+        with mock.patch.object(ph, 'fetch_ohlc_batch', side_effect=self._fake_batch):
+            counts = ph.refresh_daily_chunk(self.client, ['7203'], incremental=False,
+                                            now_ts=self.now)
+        self.assertEqual([('1y', ['7203'])], self.calls)
+        self.assertEqual(1, counts['full'])
+
+
+if __name__ == '__main__':
+    unittest.main()
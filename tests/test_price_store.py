@@ -0,0 +1,109 @@
+"""株価履歴のローカル置き場（price_store）のリグレッション。"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import price_history as ph
+import price_store
+from price_store import PriceStore
+
+DAY = 86400
+START = 1735776000
+
+
+def _rows(n, base=1000.0):
+    return [{'time': START + i * DAY, 'open': base + i, 'high': base + i + 5,
+             'low': base + i - 5, 'close': base + i + 1} for i in range(n)]
+
+
+def _row(code, daily, weekly=None, monthly=None):
+    return {'company_code': code, 'daily_1y': ph.encode_ohlc(daily),
+            'weekly_10y': ph.encode_ohlc(weekly) if weekly else None,
+            'monthly_10y': ph.encode_ohlc(monthly) if monthly else None,
+            'daily_updated_at': '2026-10-01T00:00:00+00:00',
+            'long_term_updated_at': '2026-09-01T00:00:00+00:00' if weekly else None}
+
+
+class PriceStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = PriceStore(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_pending_rows_are_readable_before_flush(self):
+        self.store.put_row(_row('7203', _rows(10)))
+
+        columns, updated_at = self.store.get('7203', 'daily_1y')
+
+        self.assertEqual(_rows(10), ph.to_rows(columns))
+        self.assertEqual('2026-10-01T00:00:00+00:00', updated_at)
+        # 保存済みだが空の系列は、列が空になる
+        self.assertEqual([], ph.to_rows(self.store.get('7203', 'weekly_10y')[0]))
+
+    def test_flush_writes_files_read_by_a_new_process(self):
+        self.store.put_row(_row('7203', _rows(10), _rows(3, 500.0), _rows(2, 100.0)))
+        self.store.put_row(_row('6758', _rows(5, 2000.0)))
+        self.assertEqual(2 * 3, self.store.flush())
+
+        fresh = PriceStore(self.dir)   # 再起動後のつもり
+        daily, _ = fresh.get('7203', 'daily_1y')
+        monthly, long_term_updated_at = fresh.get('7203', 'monthly_10y')
+
+        self.assertEqual(_rows(10), ph.to_rows(daily))
+        self.assertEqual(_rows(2, 100.0), ph.to_rows(monthly))
+        self.assertEqual('2026-09-01T00:00:00+00:00', long_term_updated_at)
+        self.assertEqual(_rows(5, 2000.0), ph.to_rows(fresh.get('6758', 'daily_1y')[0]))
+        # ファイルの切り出しで、コピーしていない
+        self.assertIsInstance(daily['close'].base, np.memmap)
+
+    def test_later_flush_merges_with_existing_file(self):
+        self.store.put_row(_row('7203', _rows(10)))
+        self.store.put_row(_row('6758', _rows(5)))
+        self.store.flush()
+
+        self.store.put('7203', 'daily_1y', _rows(12, 3000.0), '2026-10-02T00:00:00+00:00')
+        self.store.flush()
+
+        fresh = PriceStore(self.dir)
+        self.assertEqual(_rows(12, 3000.0), ph.to_rows(fresh.get('7203', 'daily_1y')[0]))
+        self.assertEqual(_rows(5), ph.to_rows(fresh.get('6758', 'daily_1y')[0]))
+        # 古い世代のファイルは残さない
+        self.assertEqual(2, len([n for n in os.listdir(self.dir) if n.startswith('daily_1y.')
+                                 and not n.endswith('.json')]))
+
+    def test_unknown_series_is_a_miss(self):
+        """日足しか知らない銘柄の長期足は、Supabase に取りに行かせるために None。"""
+        self.store.put('7203', 'daily_1y', _rows(10))
+        self.assertIsNone(self.store.get('7203', 'weekly_10y'))
+        self.assertIsNone(self.store.get('9999', 'daily_1y'))
+
+    def test_broken_index_is_a_miss(self):
+        self.store.put_row(_row('7203', _rows(10)))
+        self.store.flush()
+        with open(os.path.join(self.dir, 'daily_1y.json'), 'w') as f:
+            f.write('{broken')
+
+        self.assertIsNone(PriceStore(self.dir).get('7203', 'daily_1y'))
+
+    def test_rebuild_reads_every_page(self):
+        rows = [_row(str(1300 + i), _rows(3)) for i in range(5)]
+        client = mock.MagicMock()
+        (client.table.return_value.select.return_value.order.return_value
+         .range.return_value.execute.return_value.data) = rows
+
+        with mock.patch.object(price_store, 'REBUILD_PAGE_SIZE', 10):
+            self.assertEqual(5, self.store.rebuild(client))
+
+        self.assertFalse(self.store.is_empty())
+        self.assertEqual(5, PriceStore(self.dir).snapshot()['stocks']['daily_1y'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""裏の取り直しの実行器（refresh_executor）のリグレッション。
+
+クローラーが銘柄ページを順に開いても、取り直しが決まった本数を超えて
+同時に走らないこと。溢れた分は捨て、人の分をクローラーより先に回すこと。
+"""
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from refresh_executor import (
+    PRIORITY_CRAWLER, PRIORITY_USER, RefreshExecutor, priority_for_user_agent,
+)
+
+
+def _wait_until(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class RefreshExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def _blocker(self, log, name):
+        def work():
+            log.append(name)
+            self.release.wait(2)
+        return work
+
+    def test_concurrency_is_bounded(self):
+        executor = RefreshExecutor(max_workers=2, max_queue=100)
+        log = []
+        for i in range(20):
+            executor.submit(f'k{i}', self._blocker(log, i), PRIORITY_CRAWLER)
+
+        self.assertTrue(_wait_until(lambda: len(log) == 2))
+        time.sleep(0.1)
+        self.assertEqual(2, len(log))
+        self.assertEqual(18, executor.snapshot()['queued'])
+
+        self.release.set()
+        self.assertTrue(_wait_until(lambda: executor.snapshot()['completed'] == 20))
+
+    def test_burst_while_a_worker_is_idle(self):
+        """空きが1本あるところへまとめて積まれても、本数の上限まで並べて走らせる。"""
+        executor = RefreshExecutor(max_workers=3, max_queue=100)
+        executor.submit('warm', lambda: None)
+        self.assertTrue(_wait_until(lambda: executor._idle == 1))
+
+        log = []
+        # 空いているスレッドが起きる前に3件が積まれる状況を作る
+        with executor._cond:
+            for i in range(3):
+                executor.submit(f'k{i}', self._blocker(log, i))
+
+        self.assertTrue(_wait_until(lambda: len(log) == 3))
+        self.assertEqual(3, executor.snapshot()['running'])
+
+    def test_user_views_run_before_crawler(self):
+        executor = RefreshExecutor(max_workers=1, max_queue=100)
+        log = []
+        executor.submit('first', self._blocker(log, 'first'))
+        self.assertTrue(_wait_until(lambda: log == ['first']))
+        for i in range(3):
+            executor.submit(f'bot{i}', lambda i=i: log.append(f'bot{i}'), PRIORITY_CRAWLER)
+        executor.submit('user', lambda: log.append('user'), PRIORITY_USER)
+
+        self.release.set()
+        self.assertTrue(_wait_until(lambda: len(log) == 5))
+        self.assertEqual(['first', 'user', 'bot0', 'bot1', 'bot2'], log)
+
+    def test_full_queue_sheds_lowest_priority(self):
+        executor = RefreshExecutor(max_workers=1, max_queue=2)
+        log = []
+        executor.submit('running', self._blocker(log, 'running'))
+        self.assertTrue(_wait_until(lambda: log == ['running']))
+
+        self.assertEqual('queued', executor.submit('bot0', lambda: None, PRIORITY_CRAWLER))
+        self.assertEqual('queued', executor.submit('bot1', lambda: None, PRIORITY_CRAWLER))
+        self.assertEqual('dropped', executor.submit('bot2', lambda: None, PRIORITY_CRAWLER))
+        # 人の分は、いちばん後回しのクローラーの分を押し出して入る
+        self.assertEqual('queued', executor.submit('user', lambda: None, PRIORITY_USER))
+
+        snap = executor.snapshot()
+        self.assertEqual({'user': 1, 'crawler': 1}, snap['queued_by_priority'])
+        self.assertEqual({'user': 0, 'crawler': 2}, snap['dropped'])
+        self.assertNotIn('bot1', executor.active)
+        # 押し出された分は、また積める
+        self.assertEqual('dropped', executor.submit('bot1', lambda: None, PRIORITY_CRAWLER))
+
+    def test_duplicate_key_and_failure(self):
+        executor = RefreshExecutor(max_workers=1, max_queue=10)
+        log = []
+        executor.submit('same', self._blocker(log, 'same'))
+        self.assertEqual('duplicate', executor.submit('same', lambda: None))
+        self.release.set()
+
+        executor.submit('boom', lambda: 1 / 0)
+        self.assertTrue(_wait_until(lambda: executor.snapshot()['failed'] == 1))
+        self.assertTrue(_wait_until(lambda: not executor.active))
+
+    def test_thread_lost_to_base_exception_is_replaced(self):
+        """Exception 以外で抜けたスレッドの分も本数に戻し、次の取り直しが走る。"""
+        executor = RefreshExecutor(max_workers=1, max_queue=10, name='exiting')
+
+        def _exit():
+            raise SystemExit
+
+        with patch('threading.excepthook'):
+            executor.submit('exit', _exit)
+            self.assertTrue(_wait_until(lambda: executor._workers == 0))
+            self.assertTrue(_wait_until(lambda: not any(
+                t.name == 'exiting-1' for t in threading.enumerate())))
+        self.assertEqual(1, executor.snapshot()['failed'])
+
+        done = threading.Event()
+        executor.submit('next', done.set)
+        self.assertTrue(done.wait(2))
+
+
+class PriorityForUserAgentTest(unittest.TestCase):
+    def test_crawlers(self):
+        for ua in ('Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)',
+                   'facebookexternalhit/1.1', 'python-requests/2.32', '', None):
+            self.assertEqual(PRIORITY_CRAWLER, priority_for_user_agent(ua), ua)
+
+    def test_browser(self):
+        ua = ('Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+              '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1')
+        self.assertEqual(PRIORITY_USER, priority_for_user_agent(ua))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+"""日足の集約（price_history.resample_ohlc / downsample）のリグレッション。
+
+週足・月足は置き換え前の Python の実装（datetime で ISO 週・月に分ける）と
+同じ足になること。
+"""
+
+import unittest
+from datetime import datetime, timezone
+
+import numpy as np
+
+import price_history as ph
+
+DAY = 86400
+START = 1104505200   # 2005-01-01 00:00 JST（取引所ローカル0時の UNIX 秒）
+
+
+def _daily(n=2500, seed=3):
+    rng = np.random.default_rng(seed)
+    rows, t, close = [], START, 1000.0
+    while len(rows) < n:
+        t += DAY
+        if datetime.fromtimestamp(t + ph._LOCAL_DATE_OFFSET, tz=timezone.utc).weekday() >= 5:
+            continue
+        close *= 1 + rng.normal(0, 0.02)
+        rows.append({'time': t, 'open': round(close * 0.99, 1), 'high': round(close * 1.02, 1),
+                     'low': round(close * 0.97, 1), 'close': round(close, 1)})
+    for i in rng.integers(0, n, 40):
+        rows[i]['high'] = None
+    for i in rng.integers(0, n, 40):
+        rows[i]['open'] = None
+    return rows
+
+
+def _legacy_downsample(rows, granularity):
+    buckets, order = {}, []
+    for r in rows:
+        d = datetime.fromtimestamp(r['time'] + ph._LOCAL_DATE_OFFSET, tz=timezone.utc)
+        key = tuple(d.isocalendar()[:2]) if granularity == 'weekly' else (d.year, d.month)
+        if key not in buckets:
+            buckets[key] = dict(r)
+            order.append(key)
+            continue
+        b = buckets[key]
+        if r['high'] is not None:
+            b['high'] = r['high'] if b['high'] is None else max(b['high'], r['high'])
+        if r['low'] is not None:
+            b['low'] = r['low'] if b['low'] is None else min(b['low'], r['low'])
+        b['close'] = r['close']
+    return [buckets[k] for k in order]
+
+
+class ResampleTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = _daily()
+
+    def test_weekly_and_monthly_match_legacy(self):
+        for granularity in ('weekly', 'monthly'):
+            with self.subTest(granularity):
+                self.assertEqual(_legacy_downsample(self.rows, granularity),
+                                 ph.downsample(self.rows, granularity))
+
+    def test_reads_columnar_storage(self):
+        self.assertEqual(ph.downsample(self.rows, 'monthly'),
+                         ph.columns_to_rows(ph.resample_ohlc(ph.encode_ohlc(self.rows),
+                                                             'monthly')))
+
+    def test_columns_encode_like_rows(self):
+        """集約した列は、行を経由せずに保存形式へ詰めても同じになる。"""
+        self.assertEqual(ph.encode_ohlc(ph.downsample(self.rows, 'weekly')),
+                         ph.encode_ohlc(ph.resample_ohlc(self.rows, 'weekly')))
+
+    def test_quarterly(self):
+        quarters = ph.columns_to_rows(ph.resample_ohlc(self.rows, 'quarterly'))
+        monthly = ph.downsample(self.rows, 'monthly')
+
+        self.assertEqual(len(monthly[::3]), len(quarters))
+        self.assertEqual(monthly[0]['time'], quarters[0]['time'])
+        self.assertEqual(monthly[2]['close'], quarters[0]['close'])
+        self.assertEqual(max(m['high'] for m in monthly[:3] if m['high'] is not None),
+                         quarters[0]['high'])
+
+    def test_n_day_bars_count_calendar_days_from_first_bar(self):
+        bars = ph.resample_ohlc(self.rows, '14d')
+        days = (bars['time'] - bars['time'][0]) // DAY
+        self.assertTrue(np.all(np.diff(days // 14) == 1))
+
+    def test_volume_is_summed(self):
+        rows = [dict(r, volume=100) for r in self.rows[:10]]
+        rows[3]['volume'] = None
+        weekly = ph.downsample(rows, 'weekly')
+
+        self.assertEqual(sum(100 for r in rows if r['volume'] is not None),
+                         sum(w['volume'] for w in weekly))
+        self.assertIsInstance(weekly[0]['volume'], int)
+
+    def test_daily_and_empty_pass_through(self):
+        self.assertIs(self.rows, ph.downsample(self.rows, 'daily'))
+        self.assertEqual([], ph.downsample([], 'weekly'))
+
+    def test_unknown_rule(self):
+        with self.assertRaises(ValueError):
+            ph.resample_ohlc(self.rows, 'hourly')
+
+
+if __name__ == '__main__':
+    unittest.main()
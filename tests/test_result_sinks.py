@@ -0,0 +1,64 @@
+"""分析結果の書き出し先（result_sinks）のリグレッション。"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from result_sinks import CompactSink, NullSink, RotatingSink, make_sink
+
+
+RESULT = {
+    'symbol': '7203.T',
+    'name': 'トヨタ自動車',
+    'price_history': [{'date': '2026-01-05', 'close': 3000.0}],
+}
+
+
+class ResultSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = self.tmp.name
+
+    def test_null_sink_writes_nothing(self):
+        sink = NullSink()
+        self.assertIsNone(sink.write('7203.T', RESULT))
+        self.assertIsNone(sink.read('7203.T'))
+
+    def test_compact_sink_round_trips_without_indent(self):
+        sink = CompactSink(self.dir)
+        path = sink.write('7203.T', RESULT)
+
+        self.assertEqual(RESULT, sink.read('7203.T'))
+        self.assertTrue(path.endswith('snapshot_7203_T.json.gz'))
+        self.assertEqual(['snapshot_7203_T.json.gz'], os.listdir(self.dir))
+
+    def test_reads_legacy_indented_snapshot(self):
+        """切り替え前に書かれた output/snapshot_*.json も読める。"""
+        with open(os.path.join(self.dir, 'snapshot_7203_T.json'), 'w', encoding='utf-8') as f:
+            json.dump(RESULT, f, ensure_ascii=False, indent=2)
+        self.assertEqual(RESULT, CompactSink(self.dir).read('7203.T'))
+
+    def test_missing_symbol_reads_none(self):
+        self.assertIsNone(CompactSink(self.dir).read('9999.T'))
+
+    def test_rotating_sink_keeps_newest_files(self):
+        sink = RotatingSink(self.dir, max_files=2)
+        for i, code in enumerate(('1301.T', '1332.T', '1333.T')):
+            path = sink.write(code, {'symbol': code})
+            os.utime(path, (time.time() + i, time.time() + i))
+            sink._rotate()
+
+        self.assertIsNone(sink.read('1301.T'))
+        self.assertEqual({'symbol': '1333.T'}, sink.read('1333.T'))
+        self.assertEqual(2, len(os.listdir(self.dir)))
+
+    def test_unknown_kind_falls_back_to_rotating(self):
+        self.assertIsInstance(make_sink('null'), NullSink)
+        self.assertIsInstance(make_sink('nonsense'), RotatingSink)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""積立シミュレーションの系列の前処理（PreparedSeries / prepare）のリグレッション。
+
+二分探索の price_on が、頭から舐めていた旧実装と同じ足を返すこと。
+"""
+
+import unittest
+from datetime import date, timedelta
+
+import numpy as np
+
+import price_history as ph
+import simulator as sim
+
+DAY = 86400
+START = 1577836800   # 2020-01-01 00:00 UTC
+
+
+def _bars(n=600, seed=5):
+    rng = np.random.default_rng(seed)
+    times = START + np.cumsum(rng.integers(1, 4, n)) * DAY
+    closes = np.round(1000 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 1)
+    rows = [{'time': int(t), 'open': float(c), 'high': float(c), 'low': float(c),
+             'close': float(c)} for t, c in zip(times, closes)]
+    rows[10]['close'] = None
+    rows[20]['close'] = 0
+    return rows[::-1]   # 逆順で渡しても並べ替える
+
+
+def _legacy_price_on(pairs, target, max_lookback_days):
+    best = None
+    for d, close in pairs:
+        if d > target:
+            break
+        best = (d, close)
+    if not best or (target - best[0]).days > max_lookback_days:
+        return None
+    return best
+
+
+class PreparedSeriesTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = _bars()
+        self.series = sim.normalize_series(self.rows)
+
+    def test_matches_linear_scan(self):
+        pairs = list(self.series)
+        day = date(2019, 12, 1)
+        while day < date(2025, 1, 1):
+            for lookback in (3, 14):
+                self.assertEqual(_legacy_price_on(pairs, day, lookback),
+                                 self.series.price_on(day, lookback), (day, lookback))
+            day += timedelta(days=5)
+
+    def test_columnar_and_decoded_match_rows(self):
+        for value in (ph.encode_ohlc(self.rows), ph.decode_ohlc(self.rows)):
+            prepared = sim.normalize_series(value)
+            self.assertEqual(list(self.series), list(prepared))
+
+    def test_list_like(self):
+        self.assertEqual(len(self.rows) - 2, len(self.series))
+        self.assertEqual(list(self.series)[-1], self.series[-1])
+        self.assertFalse(sim.normalize_series(None))
+
+    def test_prepare_normalizes_each_series_once(self):
+        history = sim.prepare({'daily_1y': self.rows})
+        self.assertIs(history.series('daily_1y'), history.series('daily_1y'))
+        self.assertIs(history, sim.prepare(history))
+
+        lump = sim.simulate_lump(history, '2021-01-04', '2022-06-01', 100000)
+        monthly = sim.simulate_monthly(history, '2021-01-04', '2022-06-01', 10000)
+        self.assertEqual(sim.simulate_lump({'daily_1y': self.rows}, '2021-01-04',
+                                           '2022-06-01', 100000), lump)
+        self.assertEqual(sim.simulate_monthly({'daily_1y': self.rows}, '2021-01-04',
+                                              '2022-06-01', 10000), monthly)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+"""同じ分析を同時に1本へまとめる SingleFlight のリグレッション。"""
+
+import threading
+import time
+import unittest
+
+from single_flight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flights = SingleFlight('test')
+
+    def _run_concurrently(self, key, fn, count):
+        outcomes = [None] * count
+
+        def _call(i):
+            try:
+                outcomes[i] = self.flights.do(key, fn)
+            except Exception as e:
+                outcomes[i] = e
+
+        threads = [threading.Thread(target=_call, args=(i,)) for i in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return outcomes
+
+    def test_concurrent_callers_share_one_execution(self):
+        calls = []
+        release = threading.Event()
+
+        def _analyze():
+            calls.append(1)
+            release.wait(1)
+            return {'symbol': '7203.T'}
+
+        threading.Timer(0.1, release.set).start()
+        outcomes = self._run_concurrently(('7203.T', '1y'), _analyze, 5)
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual([False, True, True, True, True],
+                         sorted(shared for _, shared in outcomes))
+        self.assertEqual(4, self.flights.coalesced)
+        self.assertEqual(0, self.flights.in_flight())
+
+    def test_each_caller_gets_its_own_copy(self):
+        """呼び出し側が書き足しても、他の呼び出しの結果は変わらない。"""
+        release = threading.Event()
+
+        def _analyze():
+            release.wait(1)
+            return {'metrics': {'per': 10.0}}
+
+        threading.Timer(0.1, release.set).start()
+        outcomes = self._run_concurrently('k', _analyze, 3)
+
+        outcomes[0][0]['metrics']['per'] = 99.0
+        self.assertEqual(10.0, outcomes[1][0]['metrics']['per'])
+        self.assertIsNot(outcomes[1][0], outcomes[2][0])
+
+    def test_error_is_shared_with_waiters(self):
+        release = threading.Event()
+
+        def _fail():
+            release.wait(1)
+            raise RuntimeError('Too Many Requests')
+
+        threading.Timer(0.1, release.set).start()
+        outcomes = self._run_concurrently('k', _fail, 3)
+
+        self.assertTrue(all(isinstance(o, RuntimeError) for o in outcomes))
+        self.assertEqual(1, self.flights.executed)
+
+    def test_finished_key_runs_again(self):
+        """キャッシュではない。終わった後の呼び出しは改めて処理する。"""
+        calls = []
+        self.flights.do('k', lambda: calls.append(1))
+        self.flights.do('k', lambda: calls.append(1))
+        self.assertEqual(2, len(calls))
+
+    def test_different_keys_do_not_wait_for_each_other(self):
+        slow_started = threading.Event()
+        release = threading.Event()
+
+        def _slow():
+            slow_started.set()
+            release.wait(1)
+            return 'slow'
+
+        thread = threading.Thread(target=self.flights.do, args=('a', _slow))
+        thread.start()
+        slow_started.wait(1)
+
+        began = time.monotonic()
+        value, shared = self.flights.do('b', lambda: 'fast')
+        self.assertEqual(('fast', False), (value, shared))
+        self.assertLess(time.monotonic() - began, 0.5)
+        self.assertEqual(1, self.flights.snapshot()['in_flight'])
+
+        release.set()
+        thread.join()
+
+    def test_waiter_gives_up_after_timeout(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def _slow():
+            started.set()
+            release.wait(1)
+
+        thread = threading.Thread(target=self.flights.do, args=('k', _slow))
+        thread.start()
+        started.wait(1)
+
+        with self.assertRaises(TimeoutError):
+            self.flights.do('k', lambda: None, timeout=0.05)
+        self.assertEqual(1, self.flights.snapshot()['flights'][0]['waiters'])
+
+        release.set()
+        thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
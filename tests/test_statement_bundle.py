@@ -0,0 +1,218 @@
+"""決算書を分析1回につき1度だけ取得する StatementBundle のリグレッション。"""
+
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import pandas as pd
+
+import upstream_limiter
+
+from batch_runner import run_batch
+from result_sinks import NullSink
+from statement_bundle import StatementBundle
+from stock_analyzer import StockAnalyzer
+
+
+class CountingTicker:
+    """属性を読むたびに上流アクセスとして数える yf.Ticker の代役"""
+
+    def __init__(self, delay=0.0):
+        self.reads = {}
+        self.delay = delay
+        self.ticker = '7203.T'
+
+    def _read(self, name, value):
+        self.reads[name] = self.reads.get(name, 0) + 1
+        time.sleep(self.delay)
+        return value
+
+    @property
+    def financials(self):
+        return self._read('financials', pd.DataFrame({'2025-03-31': [100.0]},
+                                                     index=['Total Revenue']))
+
+    @property
+    def balance_sheet(self):
+        return self._read('balance_sheet', pd.DataFrame())
+
+    @property
+    def quarterly_financials(self):
+        return self._read('quarterly_financials', pd.DataFrame())
+
+    @property
+    def info(self):
+        self._read('info', None)
+        raise RuntimeError('Too Many Requests')
+
+
+class StatementBundleTest(unittest.TestCase):
+    def setUp(self):
+        upstream_limiter.reset()
+        self.addCleanup(upstream_limiter.reset)
+
+    def test_statement_is_fetched_once(self):
+        raw = CountingTicker()
+        bundle = StatementBundle(raw)
+
+        first = bundle.financials
+        second = bundle.financials
+
+        self.assertIs(first, second)
+        self.assertEqual(1, raw.reads['financials'])
+        self.assertEqual(1, bundle.upstream_calls)
+
+    def test_concurrent_readers_share_one_fetch(self):
+        """並行ステージが同時に読んでも上流へは1回しか行かない。"""
+        raw = CountingTicker(delay=0.05)
+        bundle = StatementBundle(raw)
+
+        threads = [threading.Thread(target=lambda: bundle.balance_sheet) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, raw.reads['balance_sheet'])
+
+    def test_failure_is_shared_instead_of_retried(self):
+        """制限に当たった取得を同じ分析の中で何度も叩き直さない。"""
+        raw = CountingTicker()
+        bundle = StatementBundle(raw)
+
+        for _ in range(3):
+            with self.assertRaises(RuntimeError):
+                bundle.info
+
+        self.assertEqual(1, raw.reads['info'])
+
+    def test_quarterly_frames_are_fetched_only_when_read(self):
+        raw = CountingTicker()
+        bundle = StatementBundle(raw)
+
+        bundle.financials
+        self.assertNotIn('quarterly_financials', raw.reads)
+
+        bundle.quarterly_financials
+        self.assertEqual({'financials': 1, 'quarterly_financials': 1},
+                         bundle.call_summary()['by_item'])
+
+    def test_batch_waits_out_the_block_instead_of_giving_up(self):
+        """制限中（止める時間 > 既定の max_wait）でも、max_wait=None なら待って取る。"""
+        bucket = upstream_limiter.bucket('yfinance')
+        slept = []
+        bucket._sleep = slept.append
+        with patch('builtins.print'):
+            bucket.penalize()
+
+        with self.assertRaises(upstream_limiter.UpstreamThrottled):
+            StatementBundle(CountingTicker()).financials
+
+        raw = CountingTicker()
+        self.assertFalse(StatementBundle(raw, max_wait=None).financials.empty)
+        self.assertEqual(1, raw.reads['financials'])
+        self.assertGreater(slept[0], upstream_limiter.DEFAULT_MAX_WAIT)
+
+    def test_other_attributes_pass_through(self):
+        self.assertEqual('7203.T', StatementBundle(CountingTicker()).ticker)
+
+
+class AnalyzeUpstreamCallsTest(unittest.TestCase):
+    def test_helpers_share_statements_and_calls_are_reported(self):
+        raw = Mock()
+        raw.financials = pd.DataFrame()
+        analyzer = StockAnalyzer(sink=NullSink())
+
+        def _reads_financials(ticker, result):
+            ticker.financials
+            ticker.financials
+
+        with patch('stock_analyzer.yf.Ticker', return_value=raw), \
+                patch.object(analyzer, '_get_basic_metrics'), \
+                patch.object(analyzer, '_get_financial_data', side_effect=_reads_financials), \
+                patch.object(analyzer, '_get_five_year_financial_data',
+                             side_effect=_reads_financials), \
+                patch.object(analyzer, '_calculate_roe_roa', side_effect=_reads_financials), \
+                patch.object(analyzer, '_fill_forward_dividend'), \
+                patch.object(analyzer, '_get_industry_sector'), \
+                patch.object(analyzer, '_get_jp_labels'):
+            result = analyzer.analyze('AAPL', skip_chart=True, skip_extras=True)
+
+        calls = result['source_status']['upstream_calls']
+        self.assertEqual({'financials': 1}, calls['by_item'])
+        self.assertEqual(1, calls['total'])
+
+
+class AnalyzeUnderThrottleTest(unittest.TestCase):
+    """制限中に工程が締め切りで欠けた分析を、バッチで保存させないこと。"""
+
+    def setUp(self):
+        upstream_limiter.reset()
+        self.addCleanup(upstream_limiter.reset)
+        self.now = [0.0]
+
+        def _sleep(seconds):
+            # 制限明けまでの待ちは工程の締め切りより長い（実時間は 1/100 に縮める）
+            self.now[0] += seconds
+            time.sleep(seconds / 100)
+
+        self.bucket = upstream_limiter.TokenBucket(
+            'yfinance', 4.0, 8, clock=lambda: self.now[0], sleep_fn=_sleep)
+        upstream_limiter._buckets['yfinance'] = self.bucket
+        self.analyses = 0
+
+    def _analyze(self, analyzer):
+        self.analyses += 1
+        first = self.analyses == 1
+
+        def _reads_financials(ticker, result):
+            if first:
+                # 1回目の分析の途中で、別のワーカーが制限に当たった
+                self.bucket.penalize()
+            ticker.financials
+            result['revenue'] = [100.0]
+
+        with patch('stock_analyzer.yf.Ticker', return_value=CountingTicker()), \
+                patch.dict(StockAnalyzer.STAGE_DEADLINES, {'financial_data': 0.3}), \
+                patch.object(analyzer, '_get_basic_metrics'), \
+                patch.object(analyzer, '_get_financial_data', side_effect=_reads_financials), \
+                patch.object(analyzer, '_get_five_year_financial_data'), \
+                patch.object(analyzer, '_calculate_roe_roa'), \
+                patch.object(analyzer, '_fill_forward_dividend'), \
+                patch.object(analyzer, '_get_industry_sector'), \
+                patch.object(analyzer, '_get_jp_labels'), \
+                patch('builtins.print'):
+            return analyzer.analyze('AAPL', skip_chart=True, skip_extras=True)
+
+    def test_batch_analysis_raises_instead_of_returning_partial(self):
+        analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
+
+        with self.assertRaises(upstream_limiter.UpstreamThrottled) as caught:
+            self._analyze(analyzer)
+
+        self.assertIn('financial_data', str(caught.exception))
+
+    def test_screen_analysis_still_returns_partial_result(self):
+        """画面からの分析（max_wait あり）は、欠けたまま返して画面に出す。"""
+        result = self._analyze(StockAnalyzer(sink=NullSink()))
+
+        self.assertEqual('partial', result['source_status']['analysis_stages']['status'])
+        self.assertEqual([], result['revenue'])
+
+    def test_run_batch_retries_after_the_block(self):
+        analyzer = StockAnalyzer(sink=NullSink(), max_wait=None)
+
+        with patch('builtins.print'):
+            results, summary = run_batch(['AAPL'], lambda code: self._analyze(analyzer),
+                                         workers=1)
+
+        self.assertEqual([100.0], results[0]['revenue'])
+        self.assertEqual(1, summary['retried'])
+        self.assertEqual(0, summary['errors'])
+        # 諦めた分析で止める時間を延ばしていない
+        self.assertEqual(1, self.bucket.rate_limit_hits)
+
+
+if __name__ == '__main__':
+    unittest.main()
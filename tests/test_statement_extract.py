@@ -0,0 +1,107 @@
+"""5年推移の表引き抽出が旧ループ実装と同じ結果を出すことのリグレッション。
+
+tests/fixtures/statements_7203.json は yfinance が返す年次決算書の形
+（行ラベル・新しい順の列・最新期だけEPSが欠ける等）を再現したもので、
+expected は表引き化する前の _get_five_year_financial_data の出力を保存したもの。
+"""
+
+import json
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+
+from statement_extract import (
+    BALANCE_SERIES, INCOME_SERIES, extract_equity_ratio, extract_series,
+    label_variations,
+)
+from stock_analyzer import StockAnalyzer
+
+FIXTURE = Path(__file__).parent / 'fixtures' / 'statements_7203.json'
+
+
+def load_fixture():
+    raw = json.loads(FIXTURE.read_text(encoding='utf-8'))
+    frames = {
+        name: pd.DataFrame(raw[name]['data'], index=raw[name]['index'],
+                           columns=pd.to_datetime(raw[name]['columns']), dtype=float)
+        for name in ('financials', 'balance_sheet', 'cashflow')
+    }
+    return frames, raw['expected']
+
+
+class FixtureTicker:
+    def __init__(self, frames):
+        self.financials = frames['financials']
+        self.balance_sheet = frames['balance_sheet']
+        self.cashflow = frames['cashflow']
+        self.dividends = pd.Series(dtype=float)
+
+
+class FiveYearParityTest(unittest.TestCase):
+    def test_matches_recorded_output_of_loop_implementation(self):
+        frames, expected = load_fixture()
+        result = {key: [] for key in expected}
+        result.update({'dps': [], 'payout_ratio': [], 'source_status': {}})
+        # _get_financial_data が最新期の売上を先に入れている状態
+        result['revenue'] = [{'date': '2025-03-31', 'value': 1.0}]
+
+        analyzer = StockAnalyzer()
+        with patch.object(analyzer, '_fill_missing_eps'), \
+                patch.object(analyzer, '_build_bps_series'):
+            analyzer._get_five_year_financial_data(FixtureTicker(frames), result)
+
+        for key, items in expected.items():
+            self.assertEqual(items, result[key], key)
+        self.assertEqual('success', result['source_status']['financials']['status'])
+
+
+class ExtractSeriesTest(unittest.TestCase):
+    def test_falls_back_to_next_label_per_period(self):
+        """最新期の営業利益が欠けても、その期だけ EBIT で補う。"""
+        frame = pd.DataFrame(
+            {pd.Timestamp('2025-03-31'): [None, 90.0],
+             pd.Timestamp('2024-03-31'): [80.0, 70.0]},
+            index=['Operating Income', 'EBIT'])
+
+        out = extract_series(frame, INCOME_SERIES)
+
+        self.assertEqual([{'date': '2025-03-31', 'value': 90.0},
+                          {'date': '2024-03-31', 'value': 80.0}], out['op_income'])
+        self.assertEqual([], out['revenue'])
+
+    def test_takes_only_latest_five_periods(self):
+        columns = pd.date_range('2015-03-31', periods=8, freq='12ME')[::-1]
+        frame = pd.DataFrame([range(8)], index=['Total Revenue'], columns=columns,
+                             dtype=float)
+
+        out = extract_series(frame, INCOME_SERIES)
+
+        self.assertEqual(5, len(out['revenue']))
+        self.assertEqual(columns[0].strftime('%Y-%m-%d'), out['revenue'][0]['date'])
+
+    def test_duplicate_row_labels_use_first_row(self):
+        frame = pd.DataFrame({pd.Timestamp('2025-03-31'): [1.0, 2.0]},
+                             index=['Current Assets', 'Current Assets'])
+
+        out = extract_series(frame, BALANCE_SERIES)
+
+        self.assertEqual(1.0, out['current_assets_list'][0]['value'])
+
+    def test_equity_ratio_fills_assets_from_equity_plus_liabilities(self):
+        frame = pd.DataFrame({pd.Timestamp('2025-03-31'): [40.0, 60.0]},
+                             index=['Stockholders Equity', 'Total Liabilities'])
+
+        self.assertEqual([{'date': '2025-03-31', 'value': 40.0}],
+                         extract_equity_ratio(frame))
+
+    def test_label_variations_keep_priority_order(self):
+        self.assertEqual(
+            ['Total Stockholder Equity', 'Total Stockholders Equity',
+             'TotalStockholderEquity', 'Stockholder Equity'],
+            label_variations(['Total Stockholder Equity'])[:4])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+"""閉じた式でトレンドを出す trend_stats のリグレッション。"""
+
+import functools
+import math
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import price_history as ph
+from trend_stats import (TrendAccumulator, calculate_for_all, trend_from_daily,
+                         trend_label, trend_stats)
+
+DAY = 86400
+
+
+def _polyfit_reference(y):
+    """置き換え前の計算（np.polyfit ＋ poly1d で R²）"""
+    x = np.arange(len(y))
+    slope, intercept = np.polyfit(x, y, 1)
+    fitted = np.poly1d([slope, intercept])(x)
+    r2 = 1 - np.sum((y - fitted) ** 2) / np.sum((y - np.mean(y)) ** 2)
+    return slope, intercept, r2
+
+
+class TrendStatsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.closes = 3000 + np.cumsum(rng.normal(0.5, 20, 250))
+
+    def test_matches_polyfit(self):
+        stats = trend_stats(self.closes)
+        slope, intercept, r2 = _polyfit_reference(self.closes)
+
+        self.assertAlmostEqual(slope, stats['slope'], places=9)
+        self.assertAlmostEqual(intercept, stats['intercept'], places=6)
+        self.assertAlmostEqual(r2, stats['r2'], places=9)
+        self.assertEqual(250, stats['n'])
+
+    def test_streaming_matches_vectorized(self):
+        acc = TrendAccumulator()
+        for i, close in enumerate(self.closes):
+            acc.add(float(i), float(close))
+        streamed, vectorized = acc.result(), trend_stats(self.closes)
+
+        for key in ('slope', 'intercept', 'r2', 'resid_std'):
+            self.assertTrue(math.isclose(streamed[key], vectorized[key], rel_tol=1e-9),
+                            key)
+        self.assertEqual(vectorized['label'], streamed['label'])
+
+    def test_missing_points_keep_their_position(self):
+        """欠損はその点だけ除き、後ろの点の横軸はずらさない。"""
+        closes = [100.0 + 2 * i for i in range(10)]
+        closes[4] = None
+        stats = trend_stats(closes)
+
+        self.assertAlmostEqual(2.0, stats['slope'])
+        self.assertAlmostEqual(100.0, stats['intercept'])
+        self.assertEqual(9, stats['n'])
+        self.assertLess(stats['resid_std'], 1e-6)   # 一直線なので残差は丸め誤差だけ
+
+    def test_too_few_points(self):
+        self.assertIsNone(trend_stats([1.0, 2.0]))
+        self.assertIsNone(trend_stats([1.0, None, float('nan'), 2.0]))
+        self.assertIsNone(TrendAccumulator().result())
+
+    def test_flat_series_has_zero_r2(self):
+        stats = trend_stats([500.0] * 5)
+        self.assertEqual(0.0, stats['slope'])
+        self.assertEqual(0.0, stats['r2'])
+        self.assertEqual('Flat', stats['label'])
+
+    def test_labels(self):
+        self.assertEqual('Up', trend_label(0.2))
+        self.assertEqual('Down', trend_label(-0.2))
+        self.assertEqual('Flat', trend_label(0.1))
+        self.assertEqual('Flat', trend_label(-0.05))
+
+
+class TrendFromDailyTest(unittest.TestCase):
+    def test_reads_both_row_shapes_in_time_order(self):
+        closes = [1000.0 - 3 * i for i in range(20)]
+        long_rows = [{'time': 1767571200 + i * DAY, 'close': c} for i, c in enumerate(closes)]
+        short_rows = [{'t': 1767571200 + i * DAY, 'c': c} for i, c in enumerate(closes)]
+
+        expected = trend_stats(closes)
+        for rows in (long_rows, list(reversed(short_rows))):
+            stats = trend_from_daily(rows)
+            self.assertAlmostEqual(expected['slope'], stats['slope'])
+            self.assertEqual('Down', stats['label'])
+
+    def test_broken_payload(self):
+        self.assertIsNone(trend_from_daily(None))
+        self.assertIsNone(trend_from_daily('not json'))
+        self.assertIsNone(trend_from_daily([]))
+
+
+class _Result:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _Query:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.payload = None
+        self.codes = None
+        self.after = None
+        self.size = None
+
+    def select(self, *_args, **_kwargs):
+        return self
+
+    def order(self, _column):
+        return self
+
+    def gt(self, _column, value):
+        self.after = value
+        return self
+
+    def limit(self, size):
+        self.size = size
+        return self
+
+    def update(self, payload):
+        self.payload = payload
+        return self
+
+    def in_(self, _column, codes):
+        self.codes = codes
+        return self
+
+    def execute(self):
+        if self.payload is not None:
+            self.client.updates.append((self.payload['trend_label'], list(self.codes)))
+            return _Result([])
+        rows = sorted(self.client.rows, key=lambda r: r['company_code'])
+        rows = [r for r in rows if self.after is None or r['company_code'] > self.after]
+        return _Result(rows[:self.size], count=len(self.client.rows))
+
+
+class _FakeClient:
+    def __init__(self, rows):
+        self.rows = rows
+        self.updates = []
+
+    def table(self, name):
+        return _Query(self, name)
+
+
+class CalculateForAllTest(unittest.TestCase):
+    def _daily(self, step):
+        return [{'t': 1767571200 + i * DAY, 'c': 1000.0 + step * i} for i in range(30)]
+
+    def test_updates_once_per_label(self):
+        client = _FakeClient([
+            {'company_code': '7203', 'daily_1y': self._daily(5)},
+            {'company_code': '6758', 'daily_1y': self._daily(4)},
+            {'company_code': '9984', 'daily_1y': self._daily(-5)},
+            {'company_code': '8306', 'daily_1y': self._daily(0)},
+            {'company_code': '1301', 'daily_1y': self._daily(1)[:2]},
+        ])
+
+        result = calculate_for_all(client=client)
+
+        self.assertEqual({'Up': 2, 'Down': 1, 'Flat': 1}, result['by_label'])
+        self.assertEqual(1, result['skipped'])
+        self.assertEqual(4, result['saved'])
+        self.assertEqual(sorted([('Up', ['6758', '7203']), ('Down', ['9984']),
+                                 ('Flat', ['8306'])]),
+                         sorted(client.updates))
+
+    def test_reads_every_page(self):
+        """1ページずつ読み、ページ数の上限で切り捨てない。"""
+        client = _FakeClient([{'company_code': f'{1000 + i}', 'daily_1y': self._daily(5)}
+                              for i in range(45)])
+        reports = []
+        small_pages = functools.partial(ph.iter_pages, page_size=2)
+
+        with mock.patch.object(ph, 'iter_pages', small_pages):
+            result = calculate_for_all(progress=lambda **kw: reports.append(kw), client=client)
+
+        self.assertEqual(45, result['total'])
+        self.assertEqual({'Up': 45, 'Down': 0, 'Flat': 0}, result['by_label'])
+        # 読んでいる間はページごとに報告する
+        read = [kw['done'] for kw in reports if not kw['saved']]
+        self.assertEqual(list(range(2, 45, 2)) + [45], read)
+
+
+class ScreenTrendLabelTest(unittest.TestCase):
+    def test_only_one_year_trend_is_saved(self):
+        """screened_latest.trend_label は1年の日足のトレンドだけ（夜間の計算と同じ意味）。"""
+        from app import _screen_trend_label
+
+        self.assertEqual('Up', _screen_trend_label({'trend': {'label': 'Up', 'period': '1y'}}))
+        self.assertIsNone(_screen_trend_label({'trend': {'label': 'Up', 'period': '5y'}}))
+        self.assertIsNone(_screen_trend_label({'trend': None}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+"""株価のトレンド（回帰直線の傾き・切片・R²・残差の標準偏差）を閉じた式で出す。
+
+背景:
+  分析のトレンドは終値に np.polyfit をかけ、np.poly1d で当てはめ値を作って
+  R² を出していた。チャートのトレンド線でも日付軸に対してもう一度 polyfit する。
+  どちらも yfinance から DataFrame を取ってきた後の処理で、トレンドの判定だけを
+  全銘柄分やろうとすると、銘柄ごとに取得とチャート生成が付いてきた。
+
+方針:
+  - 最小二乗の直線は、平均と偏差の積和（Sxx, Sxy, Syy）だけで決まる。
+    TrendAccumulator は1点ずつ足していく1パスの形（Welford と同じ更新式で、
+    値が大きくても桁落ちしにくい）。trend_stats は配列をまとめて同じ量を出す
+  - ラベルの基準は従来どおり、足1本あたりの傾きが ±0.1 を超えるかどうか
+  - 保存済みの日足（stock_price_history.daily_1y）から計算するので、
+    全銘柄の一括計算（calculate_for_all）は外部にアクセスしない。
+    結果は screened_latest.trend_label に入れ、スクリーナーで絞り込める
+"""
+
+import json
+import math
+from datetime import datetime, timezone
+
+# 足1本あたりの傾きがこれを超えたら Up / 下回ったら Down
+SLOPE_THRESHOLD = 0.1
+
+# 直線を引くのに要る最低の点数
+MIN_POINTS = 3
+
+LABELS = ('Up', 'Down', 'Flat')
+
+
+def trend_label(slope, threshold=SLOPE_THRESHOLD):
+    if slope < -threshold:
+        return 'Down'
+    if slope > threshold:
+        return 'Up'
+    return 'Flat'
+
+
+class TrendAccumulator:
+    """(x, y) を1点ずつ受け取り、回帰直線の統計を保つ"""
+
+    __slots__ = ('n', 'mean_x', 'mean_y', 'sxx', 'sxy', 'syy')
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.sxx = 0.0
+        self.sxy = 0.0
+        self.syy = 0.0
+
+    def add(self, x, y):
+        self.n += 1
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        self.mean_x += dx / self.n
+        self.mean_y += dy / self.n
+        # 更新後の平均との偏差を掛ける（Welford の共分散の更新式）
+        self.sxx += dx * (x - self.mean_x)
+        self.sxy += dx * (y - self.mean_y)
+        self.syy += dy * (y - self.mean_y)
+
+    def result(self):
+        return _finish(self.n, self.mean_x, self.mean_y, self.sxx, self.sxy, self.syy)
+
+
+def _finish(n, mean_x, mean_y, sxx, sxy, syy):
+    """積和から統計を出す。点が足りない・x が1点に集まっているときは None"""
+    if n < MIN_POINTS or sxx <= 0:
+        return None
+    slope = sxy / sxx
+    intercept = mean_y - slope * mean_x
+    # 残差平方和 = Syy - Sxy²/Sxx（丸め誤差で負にならないよう0で止める）
+    sse = max(syy - slope * sxy, 0.0)
+    r2 = 1.0 - sse / syy if syy > 0 else 0.0
+    return {
+        'slope': float(slope),
+        'intercept': float(intercept),
+        'r2': float(min(max(r2, 0.0), 1.0)),
+        'resid_std': float(math.sqrt(sse / (n - 2))),
+        'n': int(n),
+        'label': trend_label(slope),
+    }
+
+
+def trend_stats(y, x=None):
+    """終値の並びから回帰直線の統計を出す。
+
+    Args:
+        y: 終値（欠損は None / NaN。その点は x ごと除く）
+        x: 横軸。省略時は足の番号 0, 1, 2, ...（分析のトレンドと同じ）
+
+    Returns:
+        {'slope', 'intercept', 'r2', 'resid_std', 'n', 'label'}。点が足りなければ None
+    """
+    import numpy as np
+
+    y = np.asarray(y, dtype=float)   # None は NaN になる
+    x = np.arange(len(y), dtype=float) if x is None else np.asarray(x, dtype=float)
+    mask = ~np.isnan(y)
+    x, y = x[mask], y[mask]
+    n = len(y)
+    if n < MIN_POINTS:
+        return None
+    mean_x = x.mean()
+    mean_y = y.mean()
+    dx = x - mean_x
+    dy = y - mean_y
+    return _finish(n, mean_x, mean_y, float(dx @ dx), float(dx @ dy), float(dy @ dy))
+
+
+def _daily_closes(daily):
+    """保存済みの日足（古い順）から終値の並びを取り出す。
+
+    列の形（price_history.encode_ohlc）・行の配列（time/t・close/c）のどちらも読む
+    """
+    from price_history import is_columnar
+
+    if isinstance(daily, str):
+        try:
+            daily = json.loads(daily)
+        except ValueError:
+            return []
+    if is_columnar(daily):
+        return list(daily.get('c') or [])   # 保存時に古い順へ並べてある
+    if not isinstance(daily, list):
+        return []
+    bars = [r for r in daily if isinstance(r, dict)]
+    bars.sort(key=lambda r: r.get('time', r.get('t')) or 0)
+    return [r.get('close', r.get('c')) for r in bars]
+
+
+def trend_from_daily(daily):
+    """保存済みの日足から統計を出す（横軸は足の番号）。
+
+    DataFrame も配列も作らず、足を1本ずつ TrendAccumulator に足す。
+    終値の無い足は番号だけ進める（trend_stats の NaN の扱いと同じ）。
+    """
+    acc = TrendAccumulator()
+    for i, close in enumerate(_daily_closes(daily)):
+        if close is not None:
+            acc.add(float(i), float(close))
+    return acc.result()
+
+
+def calculate_for_all(progress=None, should_stop=None, client=None):
+    """保存済みの日足から全銘柄のトレンドを計算し、screened_latest.trend_label に入れる。
+
+    ネットワークアクセスは DB だけ（yfinance もチャート生成も使わない）。
+    日足は price_history.iter_pages で1ページずつ読み、手元にはラベルごとの
+    銘柄コードだけを残す。ラベルは3種類しか無いので、同じラベルの銘柄を
+    まとめて1回で更新する。
+
+    Args:
+        progress: done, total, saved を受け取るコールバック（ページごと）
+        should_stop: True を返すと中断する
+    """
+    import price_history as ph
+
+    if client is None:
+        from supabase_client import get_supabase_client
+        client = get_supabase_client()
+
+    total = ph.count_rows(client)
+    done = 0
+    by_label = {label: [] for label in LABELS}
+    skipped = 0
+    pages = ph.iter_pages(client)
+    try:
+        for rows in pages:
+            if should_stop and should_stop():
+                break
+            for r in rows:
+                stats = trend_from_daily(r.get('daily_1y'))
+                if stats is None:
+                    skipped += 1
+                else:
+                    by_label[stats['label']].append(r['company_code'])
+            done += len(rows)
+            if progress:
+                progress(done=done, total=max(total or 0, done), saved=0)
+    finally:
+        pages.close()
+    total = done
+
+    now = datetime.now(timezone.utc).isoformat()
+    saved = 0
+    first_error = None
+    for label, codes in by_label.items():
+        for i in range(0, len(codes), 500):
+            batch = codes[i:i + 500]
+            try:
+                (client.table('screened_latest')
+                 .update({'trend_label': label, 'trend_calculated_at': now})
+                 .in_('company_code', batch)
+                 .execute())
+                saved += len(batch)
+            except Exception as e:
+                print(f'トレンドの保存エラー ({label}): {e}')
+                if first_error is None:
+                    first_error = str(e)
+        if progress:
+            progress(done=total, total=total, saved=saved)
+
+    calculated = sum(len(codes) for codes in by_label.values())
+    if calculated and saved == 0:
+        raise RuntimeError(
+            f'計算は{calculated}件成功しましたが、保存が1件も通りませんでした。'
+            f'migration_trend_label.sql を適用済みか確認してください。原因: {first_error}')
+
+    return {
+        'total': total,
+        'saved': saved,
+        'skipped': skipped,
+        'by_label': {label: len(codes) for label, codes in by_label.items()},
+    }
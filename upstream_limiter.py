@@ -0,0 +1,193 @@
+"""上流ホストごとのトークンバケット。並列に動く取得処理が同じ枠を分け合う。
+
+背景:
+  batch_analyze や app.py の _analyze_*_background は1銘柄ずつ処理し、
+  銘柄の間に time.sleep(0.35) を挟んでいた。待ちのほとんどは通信なので、
+  実際の上限（Yahooが429を返し始める速さ）よりずっと手前で頭打ちになる。
+  かといってスレッドを増やすだけだと、各スレッドが勝手に叩いて制限に当たる。
+
+方針:
+  - ホスト（yfinance / yahoo_jp / kabutan / strainer / jlic）ごとにバケットを1つ持ち、
+    リクエストの直前に1トークン取る。スレッドがいくつあっても合計の速さは
+    バケットの補充速度で決まる
+  - 制限に当たったら yfinance_guard.RateLimitGuard と同じ考え方で、
+    そのホストへのリクエストを全スレッドまとめて指数的に止め、補充速度も落とす
+  - 通ったら止める時間は戻し、補充速度も少しずつ元へ戻す
+  - 画面から呼ばれる分析が制限中に延々と待たないよう、待ってよい上限を持つ。
+    超えたら UpstreamThrottled（レート制限扱い）で諦める
+"""
+
+import threading
+import time
+
+from yfinance_guard import (
+    INITIAL_BACKOFF_SECONDS, MAX_BACKOFF_SECONDS, SLEEP_MULTIPLIER_ON_LIMIT,
+)
+
+# ホストごとの (1秒あたりの補充数, 溜められる上限)。
+# yfinance は1銘柄あたり約10リクエストなので、4/秒で約24銘柄/分が上限になる。
+HOST_LIMITS = {
+    'yfinance': (4.0, 8),
+    'yahoo_jp': (2.0, 4),
+    'kabutan': (0.5, 2),
+    'strainer': (1.0, 2),
+    'jlic': (1.0, 2),
+}
+DEFAULT_LIMIT = (1.0, 2)
+
+# 制限に当たった後、補充速度をどこまで落とすか（元の速度に対する割合）
+MIN_RATE_RATIO = 0.2
+
+# トークン待ちの既定の上限（秒）。これを超える待ちなら取らずに諦める
+DEFAULT_MAX_WAIT = 30.0
+
+
+class UpstreamThrottled(Exception):
+    """待ってよい上限までにトークンが取れなかった（レート制限中）"""
+
+
+class TokenBucket:
+    """1ホスト分のトークンバケット。スレッドから同時に使ってよい。"""
+
+    def __init__(self, name, rate, burst, clock=time.monotonic, sleep_fn=time.sleep):
+        self.name = name
+        self.base_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._clock = clock
+        self._sleep = sleep_fn
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = clock()
+        self._blocked_until = 0.0
+        self._backoff = INITIAL_BACKOFF_SECONDS
+        self.acquired = 0
+        self.rate_limit_hits = 0
+        self.total_waited = 0.0
+
+    def _refill(self, now):
+        # 止めている間は補充しない
+        start = max(self._last, self._blocked_until)
+        if now > start:
+            self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+        self._last = max(self._last, now)
+
+    def _reserve(self, max_wait):
+        """1トークン予約して、使えるまでの秒数を返す。上限超えなら None。"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            ready_at = max(now, self._blocked_until)
+            deficit = max(0.0, 1.0 - self._tokens)
+            wait = (ready_at - now) + deficit / self.rate
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._tokens -= 1.0
+            self.acquired += 1
+            self.total_waited += wait
+            return wait
+
+    def acquire(self, max_wait=DEFAULT_MAX_WAIT):
+        """1トークン取る。必要なら待つ。max_wait=None なら解けるまで待つ。
+
+        Raises:
+            UpstreamThrottled: max_wait 以内に取れない
+        """
+        wait = self._reserve(max_wait)
+        if wait is None:
+            raise UpstreamThrottled(
+                f'rate limit: {self.name} への送信を制限中です（{max_wait:g}秒以内に枠が空きません）')
+        if wait > 0:
+            self._sleep(wait)
+
+    def wait_until_open(self):
+        """制限で止めている間は待つ（トークンは取らない）。バッチの銘柄の切れ目で使う。"""
+        while True:
+            with self._lock:
+                remain = self._blocked_until - self._clock()
+            if remain <= 0:
+                return
+            self._sleep(remain)
+
+    def now(self):
+        """このバケットの時計（blocked_since に渡す目印）"""
+        return self._clock()
+
+    def blocked_since(self, since):
+        """since（now() の値）以降に、制限で止めていた時間があったか"""
+        with self._lock:
+            return self._blocked_until > since
+
+    def penalize(self):
+        """制限に当たった。全スレッド分まとめて止め、補充速度を落とす。"""
+        with self._lock:
+            now = self._clock()
+            if now < self._blocked_until:
+                # 同じ波で複数スレッドが当たっただけ。待ち時間を重ねて延ばさない
+                return
+            self.rate_limit_hits += 1
+            wait = min(self._backoff, MAX_BACKOFF_SECONDS)
+            self._blocked_until = max(self._blocked_until, now + wait)
+            self._tokens = min(self._tokens, 0.0)
+            self._backoff = min(self._backoff * 2, MAX_BACKOFF_SECONDS)
+            self.rate = max(self.base_rate * MIN_RATE_RATIO,
+                            self.rate / SLEEP_MULTIPLIER_ON_LIMIT)
+        print(f'[{self.name}] レート制限を検知。{wait / 60:.1f}分止めて、'
+              f'以後 {self.rate:.2f}件/秒に落とします')
+
+    def record_success(self):
+        """通った。止める時間を戻し、落とした速度を少しずつ戻す。"""
+        with self._lock:
+            self._backoff = INITIAL_BACKOFF_SECONDS
+            if self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate / 0.9)
+
+    def snapshot(self):
+        with self._lock:
+            now = self._clock()
+            return {
+                'rate_per_second': round(self.rate, 3),
+                'base_rate_per_second': self.base_rate,
+                'acquired': self.acquired,
+                'rate_limit_hits': self.rate_limit_hits,
+                'blocked_for_seconds': max(0, round(self._blocked_until - now, 1)),
+                'total_waited_seconds': round(self.total_waited, 1),
+            }
+
+
+_buckets = {}
+_registry_lock = threading.Lock()
+
+
+def bucket(host) -> TokenBucket:
+    """ホストのバケット（プロセスで1つ）"""
+    with _registry_lock:
+        if host not in _buckets:
+            rate, burst = HOST_LIMITS.get(host, DEFAULT_LIMIT)
+            _buckets[host] = TokenBucket(host, rate, burst)
+        return _buckets[host]
+
+
+def acquire(host, max_wait=DEFAULT_MAX_WAIT):
+    bucket(host).acquire(max_wait=max_wait)
+
+
+def penalize(host):
+    bucket(host).penalize()
+
+
+def record_success(host):
+    bucket(host).record_success()
+
+
+def reset():
+    """全ホストのバケットを作り直す（テスト・手動復旧用）"""
+    with _registry_lock:
+        _buckets.clear()
+
+
+def status_snapshot():
+    """全ホストの状態。管理画面・バッチの進捗表示用"""
+    with _registry_lock:
+        hosts = list(_buckets.items())
+    return {name: b.snapshot() for name, b in hosts}
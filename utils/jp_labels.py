@@ -5,10 +5,11 @@ from bs4 import BeautifulSoup
 
 UA = {"User-Agent": "Mozilla/5.0 (compatible; stock-report-bot/1.0)"}
 
-def fetch_jp_labels(symbol: str):
+def fetch_jp_labels(symbol: str, timeout: float = 15):
     """
     日本株(.T)のときに Yahoo!ファイナンス日本版から
     会社名（日本語）と業種（日本語）を取得。
+    timeout: Yahoo日本版への1回の取得の上限（秒）
     戻り値: (name_jp, industry_jp) どちらか取れなければ None
     """
     if not symbol.endswith(".T"):
@@ -21,7 +22,7 @@ def fetch_jp_labels(symbol: str):
         from yahoo_jp_guard import fetch as yahoo_fetch
 
         url = f"https://finance.yahoo.co.jp/quote/{symbol}"
-        html = yahoo_fetch(url)
+        html = yahoo_fetch(url, timeout=timeout)
         if not html:
             return None, None
         soup = BeautifulSoup(html, "html.parser")
@@ -25,6 +25,8 @@ import threading
 import time
 import requests
 
+import upstream_limiter
+
 HEADERS = {
     'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
                    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'),
@@ -179,6 +181,8 @@ def fetch_result(url, timeout=15):
                 'error': None, 'url': url}
 
     try:
+        # 並列のバッチ・分析ステージ全体で送信の速さを揃える（upstream_limiter）
+        upstream_limiter.acquire('yahoo_jp')
         response = requests.get(url, headers=HEADERS, timeout=timeout)
         status = response.status_code
 
@@ -201,6 +205,10 @@ def fetch_result(url, timeout=15):
         record_success()
         return {'html': response.text, 'status': 'success', 'http_status': 200,
                 'error': None, 'url': url}
+    except upstream_limiter.UpstreamThrottled as e:
+        # こちら側で送信を控えただけなので、ブレーカーの失敗には数えない
+        return {'html': None, 'status': 'rate_limited', 'http_status': None,
+                'error': str(e), 'url': url}
     except requests.exceptions.Timeout as e:
         print(f'[YahooJP] タイムアウト {url}: {e}')
         record_failure()